@@ -17,11 +17,23 @@ from cosinnus.models import MEMBERSHIP_ADMIN, CosinnusPortal, UserOnlineOnDay
 from cosinnus.models.bbb_room import BBBRoomVisitStatistics
 from cosinnus.models.group import CosinnusGroup, CosinnusGroupMembership
 from cosinnus.models.group_extra import CosinnusConference, CosinnusProject, CosinnusSociety
+from cosinnus.models.statistics import StatisticsRollup
 from cosinnus.templatetags.cosinnus_tags import cosinnus_footer_v2, cosinnus_menu_v2
 from cosinnus.utils.dates import daterange
 from cosinnus.utils.permissions import IsAdminUser, IsCosinnusAdminUser
 from cosinnus.utils.settings import get_obfuscated_settings_strings
-from cosinnus.utils.user import filter_active_users, get_user_id_hash, get_user_tos_accepted_date
+from cosinnus.utils.statistics import (
+    STATISTICS_METRIC_ACTIVE_USERS,
+    StatisticsMetric,
+    get_daily_values,
+    get_statistics_metrics,
+)
+from cosinnus.utils.user import (
+    filter_active_users,
+    get_portal_member_ids_query,
+    get_user_id_hash,
+    get_user_tos_accepted_date,
+)
 from cosinnus.views.housekeeping import _get_group_storage_space_mb
 
 
@@ -31,7 +43,7 @@ class StatisticsView(APIView):
     """
 
     def get_user_qs(self):
-        return get_user_model().objects.filter(id__in=CosinnusPortal.get_current().members)
+        return get_user_model().objects.filter(id__in=get_portal_member_ids_query())
 
     def get_society_qs(self):
         return CosinnusSociety.objects.all_in_portal()
@@ -484,12 +496,18 @@ class SimpleStatisticsUserActivityTimelineView(APIView):
     def get_user_timeline_stats(self):
         rows = []
         all_days = UserOnlineOnDay.objects.all().order_by('date')
-        for single_date in daterange(all_days.first().date, all_days.last().date, include_end_date=True):
+        first_date, last_date = all_days.first().date, all_days.last().date
+        # the daily counts are read from the statistics rollups, and only counted for the days not rolled up yet
+        active_users = get_daily_values(get_statistics_metrics()[STATISTICS_METRIC_ACTIVE_USERS], first_date, last_date)
+        created_accounts = StatisticsMetric(
+            'users-accounts-created', get_user_model().objects.all(), 'pk', 'date_joined'
+        ).get_counts_by_period(StatisticsRollup.PERIOD_DAY, first_date, last_date)
+        for single_date in daterange(first_date, last_date, include_end_date=True):
             # row: 'date', 'users-active-online', 'users-accounts-created',
             row = [
                 single_date.strftime('%Y-%m-%d'),
-                UserOnlineOnDay.objects.filter(date=single_date).count(),
-                get_user_model().objects.filter(date_joined__date=single_date).count(),
+                active_users.get(single_date, 0),
+                created_accounts.get(single_date, 0),
             ]
             rows.append(row)
         return rows
@@ -544,7 +562,7 @@ if cosinnus_settings.COSINNUS_ENABLE_ADMIN_USER_DOMAIN_INFO_CSV_DOWNLOADS:
             """
             portal_users = (
                 get_user_model()
-                .objects.filter(id__in=CosinnusPortal.get_current().members)
+                .objects.filter(id__in=get_portal_member_ids_query())
                 .prefetch_related('cosinnus_profile')
             )
             active_portal_users = filter_active_users(portal_users)
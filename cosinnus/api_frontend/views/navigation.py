@@ -41,6 +41,11 @@ from cosinnus.utils.permissions import (
     check_user_can_create_groups,
     check_user_portal_manager,
 )
+from cosinnus.utils.unread_counts import (
+    UNREAD_ALERTS_USER_CACHE_KEY,
+    UNREAD_ALERTS_USER_CACHE_TIMEOUT,
+    push_unread_count_deltas,
+)
 from cosinnus.utils.urls import group_aware_reverse
 from cosinnus.utils.user import get_unread_message_count_for_user
 from cosinnus.utils.version_history import get_version_history_for_user, mark_version_history_as_read
@@ -50,10 +55,6 @@ from cosinnus_notifications.models import NotificationAlert, SerializedNotificat
 logger = logging.getLogger('cosinnus')
 
 
-UNREAD_ALERTS_USER_CACHE_KEY = 'cosinnus/core/portal/%d/user_unread_alerts/%s/'
-UNREAD_ALERTS_USER_CACHE_TIMEOUT = 55
-
-
 class FilterBlacklistedItemsMixin(object):
     """Mixin that adds filter capabilities for views returning `DashboardItem` and `MenuItem` for filtering the
     returned items so that only those are kept whose URLs are not blacklisted for the current user.
@@ -808,9 +809,11 @@ class AlertsView(APIView):
 
             # mark as read
             if self.mark_as_read:
+                unseen_count = len([alert for alert in alerts if not alert.seen])
                 for alert in alerts:
                     alert.seen = True
                 NotificationAlert.objects.bulk_update(alerts, ['seen'])
+                push_unread_count_deltas([request.user.id], alerts=-unseen_count)
 
                 unread_alerts_cache_key = UNREAD_ALERTS_USER_CACHE_KEY % (
                     CosinnusPortal.get_current().id,
@@ -957,6 +960,7 @@ class AlertsMarkAllReadView(APIView):
             queryset = self.get_queryset()
             # mark alerts as read
             marked_as_read = queryset.update(seen=True)
+            push_unread_count_deltas([request.user.id], alerts=-marked_as_read)
 
             # delete cache for user's alerts
             unread_alerts_cache_key = UNREAD_ALERTS_USER_CACHE_KEY % (
@@ -606,6 +606,14 @@ class PortalSettingsView(APIView):
             'cosinnusIsSSOLoginEnabled': settings.COSINNUS_IS_OAUTH_CLIENT,
             'cosinnusSSOProvider': settings.COSINNUS_V3_SSO_PROVIDER,
             'cosinnusV3FrontendEverywhereEnabled': settings.COSINNUS_V3_FRONTEND_EVERYWHERE_ENABLED,
+            'unreadCountsWebsocketEnabled': settings.COSINNUS_UNREAD_COUNTS_WEBSOCKET_ENABLED,
+            'unreadCountsWebsocketPath': settings.COSINNUS_UNREAD_COUNTS_WEBSOCKET_PATH,
+            'unreadCountsFallbackPollingInterval': settings.COSINNUS_UNREAD_COUNTS_FALLBACK_POLLING_INTERVAL,
+            'unreadMessagesPollingInterval': (
+                settings.COSINNUS_UNREAD_COUNTS_ROCKET_CHAT_POLLING_INTERVAL
+                if settings.COSINNUS_ROCKET_ENABLED
+                else settings.COSINNUS_UNREAD_COUNTS_FALLBACK_POLLING_INTERVAL
+            ),
             # 'setup': {'additionalSteps': ... }},  # set manually
             # 'theme': {...},  # set manually. example:
             # "theme": {"color": "blue", "loginImage": {"variant": "contained"}},
@@ -1,8 +1,13 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import atexit
 import logging
 import smtplib
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from threading import Thread
 
 import dkim
@@ -11,10 +16,13 @@ from django.contrib.auth import get_user_model
 from django.contrib.auth.backends import ModelBackend
 from django.core.mail.backends.smtp import EmailBackend
 from django.core.mail.message import sanitize_address
+from django.db import close_old_connections
 from django.utils.encoding import force_str
 from django.utils.translation import gettext_lazy as _
 from elasticsearch.exceptions import TransportError
+from elasticsearch.helpers import bulk
 from haystack.backends.elasticsearch7_backend import Elasticsearch7SearchBackend, Elasticsearch7SearchEngine
+from haystack.utils import get_identifier
 from urllib3.exceptions import ConnectionError, ProtocolError
 
 from cosinnus.conf import settings
@@ -134,6 +142,27 @@ class elastic_threading_disabled:
         _threading_state.local_threading_disabled = False
 
 
+def execute_and_catch_elastic_error(func, *args, **kwargs):
+    """Runs the given elasticsearch function and catches and logs all errors"""
+    try:
+        return func(*args, **kwargs)
+    except (TransportError, ProtocolError, ConnectionError) as e:
+        logger.error(
+            (
+                'Could not connect to the ElasticSearch backend for indexing! The search function will not '
+                'work and saving objects on the site will be terribly slow! Exception in extra.'
+            ),
+            extra={'exception': force_str(e)},
+        )
+    except Exception as e:
+        logger.error(
+            'An unknown error occured while indexing an object! Exception in extra.',
+            extra={'exception': force_str(e)},
+        )
+        if settings.DEBUG:
+            raise
+
+
 def threaded_execution_and_catch_error(f):
     """Will run in a thread and catch all errors"""
 
@@ -141,23 +170,7 @@ def threaded_execution_and_catch_error(f):
         my_self = self
 
         def do_execute():
-            try:
-                return f(my_self, *args, **kwargs)
-            except (TransportError, ProtocolError, ConnectionError) as e:
-                logger.error(
-                    (
-                        'Could not connect to the ElasticSearch backend for indexing! The search function will not '
-                        'work and saving objects on the site will be terribly slow! Exception in extra.'
-                    ),
-                    extra={'exception': force_str(e)},
-                )
-            except Exception as e:
-                logger.error(
-                    'An unknown error occured while indexing an object! Exception in extra.',
-                    extra={'exception': force_str(e)},
-                )
-                if settings.DEBUG:
-                    raise
+            return execute_and_catch_elastic_error(f, my_self, *args, **kwargs)
 
         if _threading_state.is_elastic_threaded():
 
@@ -172,6 +185,242 @@ def threaded_execution_and_catch_error(f):
     return error_wrapper
 
 
+class ElasticIndexUpdateQueue(object):
+    """An in-process queue for elasticsearch index updates and removals.
+
+    Instead of sending one request per indexed object right away, updates are collected for
+    `COSINNUS_ELASTIC_QUEUE_COALESCE_SECONDS`. Repeated updates of the same document within that window
+    are coalesced into a single one (the latest update or removal wins). The collected documents are then
+    sent as bulk requests of up to `COSINNUS_ELASTIC_QUEUE_BATCH_SIZE` documents by a fixed-size pool of
+    `COSINNUS_ELASTIC_QUEUE_WORKERS` worker threads. If `COSINNUS_ELASTIC_QUEUE_MAX_SIZE` documents are pending,
+    the thread enqueueing more documents sends the pending ones itself, so that the queue can not grow without
+    bounds while elasticsearch is slow.
+
+    A document is not sent while a previous batch containing it is still being processed by a worker, but kept
+    pending until that batch is done, so that e.g. an update and a later removal of a document are always
+    applied in order.
+    """
+
+    ACTION_UPDATE = 'update'
+    ACTION_REMOVE = 'remove'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        # (connection_alias, document_id) --> (action, backend, index, obj_or_string, enqueue_time)
+        self._pending = OrderedDict()
+        # the keys of the documents in batches that are currently being processed
+        self._in_flight_keys = set()
+        self._batch_done = threading.Condition(self._lock)
+        self._flusher = None
+        self._flusher_stopped = None
+        self._executor = None
+        self._stats = {
+            'enqueued': 0,
+            'coalesced': 0,
+            'flushed_documents': 0,
+            'bulk_requests': 0,
+            'errors': 0,
+            'backpressure_flushes': 0,
+            'in_flight': 0,
+            'last_latency_seconds': 0.0,
+            'max_latency_seconds': 0.0,
+            'total_latency_seconds': 0.0,
+        }
+
+    def _ensure_started(self):
+        """Lazily starts the flusher thread and the worker pool (called with the lock held)"""
+        if self._flusher is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=settings.COSINNUS_ELASTIC_QUEUE_WORKERS, thread_name_prefix='cosinnus-elastic'
+            )
+            self._flusher_stopped = threading.Event()
+            self._flusher = threading.Thread(
+                target=self._run_flusher, args=(self._flusher_stopped,), name='cosinnus-elastic-flusher', daemon=True
+            )
+            self._flusher.start()
+            atexit.register(self.close)
+
+    def close(self):
+        """Stops the flusher thread, sends all pending documents and shuts down the worker pool.
+        The queue is started again when documents are enqueued afterwards."""
+        with self._lock:
+            flusher, flusher_stopped, executor = self._flusher, self._flusher_stopped, self._executor
+        if flusher is None:
+            return
+        flusher_stopped.set()
+        self._wakeup.set()
+        flusher.join()
+        self.flush()
+        executor.shutdown(wait=True)
+        with self._lock:
+            if self._flusher is flusher:
+                self._flusher = self._flusher_stopped = self._executor = None
+        atexit.unregister(self.close)
+
+    def enqueue(self, action, backend, index, obj_or_string):
+        doc_id = get_identifier(obj_or_string)
+        key = (backend.connection_alias, doc_id)
+        queue_full = False
+        with self._lock:
+            self._ensure_started()
+            self._stats['enqueued'] += 1
+            enqueue_time = time.time()
+            if key in self._pending:
+                self._stats['coalesced'] += 1
+                # keep the time of the first enqueued update, so the latency reflects the oldest pending change
+                enqueue_time = self._pending.pop(key)[4]
+            self._pending[key] = (action, backend, index, obj_or_string, enqueue_time)
+            queue_full = len(self._pending) >= settings.COSINNUS_ELASTIC_QUEUE_MAX_SIZE
+        if queue_full:
+            # the workers can not keep up, so slow down the enqueueing thread by letting it send the documents
+            with self._lock:
+                self._stats['backpressure_flushes'] += 1
+            for batch in self._take_batches():
+                self._process_batch(*batch)
+
+    def enqueue_update(self, backend, index, iterable):
+        for obj in iterable:
+            self.enqueue(self.ACTION_UPDATE, backend, index, obj)
+
+    def enqueue_remove(self, backend, obj_or_string):
+        self.enqueue(self.ACTION_REMOVE, backend, None, obj_or_string)
+
+    def _run_flusher(self, stopped):
+        while not stopped.is_set():
+            self._wakeup.wait(settings.COSINNUS_ELASTIC_QUEUE_COALESCE_SECONDS)
+            self._wakeup.clear()
+            try:
+                self._submit_pending()
+            except Exception as e:
+                logger.error('Error in the elasticsearch index queue flusher.', extra={'exception': force_str(e)})
+
+    def _take_batches(self):
+        """Takes all pending documents that are not in flight and groups them into batches of the same backend,
+        action and index. The documents are in flight until their batch has been processed."""
+        with self._lock:
+            pending, deferred = OrderedDict(), OrderedDict()
+            for key, entry in self._pending.items():
+                if key in self._in_flight_keys:
+                    deferred[key] = entry
+                else:
+                    pending[key] = entry
+            self._pending = deferred
+            self._in_flight_keys.update(pending)
+            self._stats['in_flight'] += len(pending)
+        groups = OrderedDict()
+        for key, (action, backend, index, obj_or_string, enqueue_time) in pending.items():
+            group_key = (key[0], action, type(index) if index is not None else None)
+            groups.setdefault(group_key, (action, backend, index, []))[3].append((key, obj_or_string, enqueue_time))
+        batch_size = settings.COSINNUS_ELASTIC_QUEUE_BATCH_SIZE
+        batches = []
+        for action, backend, index, items in groups.values():
+            for i in range(0, len(items), batch_size):
+                batches.append((action, backend, index, items[i : i + batch_size]))
+        return batches
+
+    def _requeue_batches(self, batches):
+        """Puts the documents of batches that could not be processed back in front of the pending documents,
+        unless they have been enqueued again in the meantime"""
+        with self._lock:
+            requeued = OrderedDict()
+            for action, backend, index, items in batches:
+                keys = [key for key, __, __ in items]
+                self._in_flight_keys.difference_update(keys)
+                self._stats['in_flight'] -= len(items)
+                for key, obj_or_string, enqueue_time in items:
+                    if key not in self._pending:
+                        requeued[key] = (action, backend, index, obj_or_string, enqueue_time)
+            requeued.update(self._pending)
+            self._pending = requeued
+            self._batch_done.notify_all()
+
+    def _submit_pending(self):
+        batches = self._take_batches()
+        for i, batch in enumerate(batches):
+            try:
+                self._executor.submit(self._process_batch_in_worker, *batch)
+            except Exception:
+                # e.g. the worker pool has been shut down, keep the documents of this and all following batches
+                self._requeue_batches(batches[i:])
+                raise
+
+    def flush(self, timeout=None):
+        """Synchronously sends all pending documents to elasticsearch, and waits until the batches that are
+        being processed by the workers are done.
+        @param timeout: The seconds after which to stop flushing and waiting. Defaults to
+            `COSINNUS_ELASTIC_QUEUE_FLUSH_TIMEOUT`
+        @return: True if all documents were sent, False if the timeout was reached first"""
+        if timeout is None:
+            timeout = settings.COSINNUS_ELASTIC_QUEUE_FLUSH_TIMEOUT
+        deadline = time.time() + timeout
+        while True:
+            for batch in self._take_batches():
+                self._process_batch(*batch)
+            with self._lock:
+                if not self._pending and not self._in_flight_keys:
+                    return True
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    logger.warning(
+                        'Timed out while flushing the elasticsearch index queue.',
+                        extra={'queue_depth': len(self._pending), 'in_flight': len(self._in_flight_keys)},
+                    )
+                    return False
+                self._batch_done.wait(min(remaining, 1.0))
+
+    def _process_batch_in_worker(self, action, backend, index, items):
+        try:
+            self._process_batch(action, backend, index, items)
+        finally:
+            # worker threads are long-lived, so make sure they do not keep stale DB connections
+            close_old_connections()
+
+    def _process_batch(self, action, backend, index, items):
+        objs = [obj_or_string for __, obj_or_string, __ in items]
+        failed = True
+        try:
+            if action == self.ACTION_UPDATE:
+                result = execute_and_catch_elastic_error(backend._bulk_update, index, objs)
+            else:
+                result = execute_and_catch_elastic_error(backend._bulk_remove, objs)
+            failed = result is None
+        finally:
+            now_time = time.time()
+            with self._lock:
+                keys = [key for key, __, __ in items]
+                self._in_flight_keys.difference_update(keys)
+                self._batch_done.notify_all()
+                if any([key in self._pending for key in keys]):
+                    # send the documents that have been waiting for this batch
+                    self._wakeup.set()
+                self._stats['in_flight'] -= len(items)
+                self._stats['bulk_requests'] += 1
+                if failed:
+                    self._stats['errors'] += 1
+                else:
+                    self._stats['flushed_documents'] += len(items)
+                for __, __, enqueue_time in items:
+                    latency = now_time - enqueue_time
+                    self._stats['last_latency_seconds'] = latency
+                    self._stats['max_latency_seconds'] = max(self._stats['max_latency_seconds'], latency)
+                    self._stats['total_latency_seconds'] += latency
+
+    def get_stats(self):
+        """Returns the queue's counters: the current queue depth and in-flight documents, counts for
+        enqueued, coalesced and flushed documents, bulk requests and errors, and the latencies between
+        enqueueing and indexing of a document in seconds."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['queue_depth'] = len(self._pending)
+        processed = stats['flushed_documents'] + stats['errors']
+        stats['avg_latency_seconds'] = stats.pop('total_latency_seconds') / processed if processed else 0.0
+        return stats
+
+
+elastic_index_queue = ElasticIndexUpdateQueue()
+
+
 class RobustElasticSearchBackend(Elasticsearch7SearchBackend):
     """A robust backend that doesn't crash when no connection is available"""
 
@@ -234,13 +483,40 @@ class RobustElasticSearchBackend(Elasticsearch7SearchBackend):
                     field_mapping['properties'] = field_class.get_properties()
         return (content_field_name, mapping)
 
-    @threaded_execution_and_catch_error
-    def update(self, *args, **kwargs):
-        super(RobustElasticSearchBackend, self).update(*args, **kwargs)
+    def update(self, index, iterable, commit=True):
+        """Updates the documents through the coalescing index queue, or directly if threading is disabled"""
+        if _threading_state.is_elastic_threaded():
+            elastic_index_queue.enqueue_update(self, index, iterable)
+        else:
+            execute_and_catch_elastic_error(
+                super(RobustElasticSearchBackend, self).update, index, iterable, commit=commit
+            )
 
-    @threaded_execution_and_catch_error
-    def remove(self, *args, **kwargs):
-        super(RobustElasticSearchBackend, self).remove(*args, **kwargs)
+    def remove(self, obj_or_string, commit=True):
+        """Removes the document through the coalescing index queue, or directly if threading is disabled"""
+        if _threading_state.is_elastic_threaded():
+            elastic_index_queue.enqueue_remove(self, obj_or_string)
+        else:
+            execute_and_catch_elastic_error(
+                super(RobustElasticSearchBackend, self).remove, obj_or_string, commit=commit
+            )
+
+    def _bulk_update(self, index, objs):
+        """Indexes all given objects in a single bulk request. Used by the index queue."""
+        super(RobustElasticSearchBackend, self).update(index, objs, commit=True)
+        return len(objs)
+
+    def _bulk_remove(self, objs_or_strings):
+        """Removes all given documents in a single bulk request. Used by the index queue."""
+        if not self.setup_complete:
+            self.setup()
+        actions = [
+            {'_op_type': 'delete', '_index': self.index_name, '_id': get_identifier(obj_or_string)}
+            for obj_or_string in objs_or_strings
+        ]
+        bulk(self.conn, actions, raise_on_error=False)
+        self.conn.indices.refresh(index=self.index_name)
+        return len(actions)
 
     @threaded_execution_and_catch_error
     def clear(self, *args, **kwargs):
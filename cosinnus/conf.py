@@ -430,6 +430,24 @@ class CosinnusConf(AppConf):
     # (affects how fresh data is on reloads and multiple tabs)
     NOTIFICATION_ALERTS_CACHE_TIMEOUT = 30  # 30 seconds
 
+    # if True, changes of the unread alerts, membership alerts and messages counts of a user are pushed
+    # to the user's `cosinnus.consumers.UnreadCountsConsumer` websocket. requires django-channels with a
+    # channel layer, and the consumer routed at `UNREAD_COUNTS_WEBSOCKET_PATH` in the project's routing
+    UNREAD_COUNTS_WEBSOCKET_ENABLED = False
+
+    # the path of the unread counts websocket, exposed to the v3 frontend in the portal settings
+    UNREAD_COUNTS_WEBSOCKET_PATH = '/ws/unread_counts/'
+
+    # if the unread counts websocket is enabled, the interval in which the v3 frontend still polls
+    # the unread counts, to correct any drift, in seconds
+    UNREAD_COUNTS_FALLBACK_POLLING_INTERVAL = 10 * 60  # 10 minutes
+
+    # if the unread counts websocket is enabled together with Rocket.Chat, the interval in which the v3 frontend
+    # still polls the unread messages count, in seconds. Rocket.Chat messages never pass through the portal, so
+    # their count can not be pushed. a shorter interval shows new chat messages sooner, at the cost of more
+    # unread count requests to Rocket.Chat (which are cached for `NOTIFICATION_ALERTS_CACHE_TIMEOUT`)
+    UNREAD_COUNTS_ROCKET_CHAT_POLLING_INTERVAL = 60  # 1 minute
+
     # how long like and follow counts should be retained in cache
     LIKEFOLLOW_COUNT_CACHE_TIMEOUT = DEFAULT_OBJECT_CACHE_TIMEOUT
 
@@ -534,6 +552,24 @@ class CosinnusConf(AppConf):
     # this is the thumbnail size for small image previews
     IMAGE_THUMBNAIL_SIZE_SCALE = (80, 80)
 
+    # thumbnail sizes generated in the background when an avatar or icon image is uploaded,
+    # in addition to `USER_PROFILE_AVATAR_THUMBNAIL_SIZES`. see `cosinnus.utils.thumbnails`
+    IMAGE_PREGENERATED_ICON_THUMBNAIL_SIZES = (
+        (80, 80),
+        (144, 144),  # map results
+    )
+
+    # thumbnail sizes generated in the background when a background image (e.g. a group wallpaper)
+    # is uploaded, as shown in map results
+    IMAGE_PREGENERATED_BACKGROUND_THUMBNAIL_SIZES = (
+        (500, 275),
+        (1000, 350),
+    )
+
+    # if True, thumbnails of uploaded images are generated in a background task (celery or thread).
+    # otherwise, they are generated on their first display
+    THUMBNAIL_PREGENERATION_ENABLED = True
+
     # is the "Groups" menu visible in the navbar menu?
     NAVBAR_GROUP_MENU_VISIBLE = True
 
@@ -624,6 +660,12 @@ class CosinnusConf(AppConf):
     # shall each individual email be logged as a `CosinnusSentEmailLog`?
     LOG_SENT_EMAILS = True
 
+    # number of recipients of a queued mass mail that are rendered and sent over one SMTP connection
+    MASS_MAIL_BATCH_SIZE = 100
+    # maximum number of mass mails sent per minute, to stay within the mail server's limits.
+    # None for no limit
+    MASS_MAIL_SEND_RATE_PER_MINUTE = None
+
     # if set to anything but None, logged-in users will be redirected to this
     # URL if they try to visit the register or login pages
     LOGGED_IN_USERS_LOGIN_PAGE_REDIRECT_TARGET = '/dashboard/'
@@ -974,6 +1016,22 @@ class CosinnusConf(AppConf):
     # Debug: enable naive queryset picking for dashboard timeline
     V2_DASHBOARD_USE_NAIVE_FETCHING = False
 
+    # read the dashboard timeline from the materialized `TimelineEntry`s that are fanned out on write,
+    # instead of combining the filtered content querysets on each request.
+    # run the `rebuild_timeline` management command once after enabling this!
+    V2_DASHBOARD_USE_MATERIALIZED_TIMELINE = False
+
+    # cache the rendered HTML of dashboard timeline items, shared between all users that see the same rendering
+    TIMELINE_FRAGMENT_CACHE_ENABLED = True
+
+    # timeout for cached timeline item HTML. changes to objects and their comments invalidate the cache
+    # immediately, but changes to related data, like the creator's name and avatar, are shown only after this
+    TIMELINE_FRAGMENT_CACHE_TIMEOUT = 60 * 60
+
+    # number of already rolled-up days that are recomputed on each run of the statistics rollup cronjob,
+    # to pick up changes to the data after it was first rolled up (e.g. users logging in for the first time)
+    STATISTICS_ROLLUP_RECOMPUTE_DAYS = 7
+
     # should the dashboard show marketplace offers, both as widgets and in the timeline?
     V2_DASHBOARD_SHOW_MARKETPLACE = False
 
@@ -1205,6 +1263,10 @@ class CosinnusConf(AppConf):
     # (str classpath)
     USER_IMPORT_PROCESSOR_CLASS_DROPIN = None
 
+    # absolute filesystem path of the directory for private files like data exports, which must not be served by
+    # the web server. if None, a `private-media` directory next to MEDIA_ROOT is used
+    PRIVATE_FILES_ROOT = None
+
     # if True, the model export views will be shown
     # they require a per-portal implementation of the exporter class
     MODEL_EXPORT_ADMINISTRATION_VIEWS_ENABLED = False
@@ -1339,6 +1401,19 @@ class CosinnusConf(AppConf):
     # API Token used by NextCloud to access internal APIs (e.g. DeckEventsView)
     CLOUD_NEXTCLOUD_API_TOKEN = None
 
+    # number of worker threads processing the nextcloud sync job queue in each process
+    # (only used if COSINNUS_USE_CELERY is False, otherwise the queue is processed by celery tasks)
+    CLOUD_SYNC_QUEUE_WORKERS = 4
+    # maximum number of attempts for a nextcloud sync job before it is marked as failed
+    CLOUD_SYNC_QUEUE_MAX_ATTEMPTS = 8
+    # base delay in seconds for the exponential backoff of failed nextcloud sync jobs
+    CLOUD_SYNC_QUEUE_BACKOFF_BASE_SECONDS = 5
+    # maximum delay in seconds between two attempts of a failed nextcloud sync job
+    CLOUD_SYNC_QUEUE_BACKOFF_MAX_SECONDS = 60 * 60
+    # time in seconds after which a claimed, but unfinished job is considered abandoned
+    # (e.g. because its process was restarted) and will be picked up again
+    CLOUD_SYNC_QUEUE_CLAIM_TIMEOUT_SECONDS = 10 * 60
+
     # whether to enable the cosinnus deck app
     # Note: COSINNUS_CLOUD_ENABLED must also be set, as the deck app depends on the cloud integration.
     DECK_ENABLED = False
@@ -1564,6 +1639,19 @@ class CosinnusConf(AppConf):
     # if False, it will be triggered on requesting of the queue-URL (should happen less often)
     TRIGGER_BBB_ROOM_CREATION_IN_QUEUE = True
 
+    # if True, clients waiting in the BBB room queue are notified via the
+    # `cosinnus.consumers.BBBRoomQueueConsumer` websocket once the room has been created, instead of
+    # polling the queue API. requires django-channels with a channel layer, and the consumer routed at
+    # `BBB_QUEUE_WEBSOCKET_PATH` (with an int `mt_id` kwarg) in the project's routing
+    BBB_QUEUE_WEBSOCKET_ENABLED = False
+
+    # the path of the BBB queue websocket, formatted with the media tag id
+    BBB_QUEUE_WEBSOCKET_PATH = '/ws/bbb_queue/%(media_tag_id)s/'
+
+    # if the BBB queue websocket is enabled, the interval in which waiting clients still poll
+    # the queue API, in seconds
+    BBB_QUEUE_FALLBACK_POLLING_INTERVAL = 30
+
     # The BBB Server choice list for select fields,
     # indices correspond to an auth pair in `BBB_SERVER_AUTH_AND_SECRET_PAIRS`
     BBB_SERVER_CHOICES = ((0, '(None)'),)
@@ -1619,6 +1707,23 @@ class CosinnusConf(AppConf):
     # are tunrned on 'daily', 'weekly', or even on 'never'
     NOTIFICATIONS_GROUP_INVITATIONS_IGNORE_USER_SETTING = False
 
+    # how notification events are processed, one of:
+    # - 'pool': in a bounded pool of worker threads within the web process
+    # - 'celery': as celery tasks (requires `COSINNUS_USE_CELERY`). sessions that cannot be serialized
+    #             (e.g. with virtual users in the audience) are still processed in the worker pool
+    NOTIFICATIONS_DISPATCH_BACKEND = 'pool'
+
+    # maximum number of worker threads processing notification events in the 'pool' dispatch backend
+    NOTIFICATIONS_DISPATCH_POOL_SIZE = 4
+
+    # number of audience members for which notification preferences are evaluated at once
+    NOTIFICATIONS_AUDIENCE_CHUNK_SIZE = 500
+
+    # the number of seconds after which the claim of a digest run on a shard of users expires, if the run has
+    # not saved a checkpoint since. the shard can then be taken over and resumed by a new run, e.g. if the
+    # previous run has failed or hung
+    NOTIFICATIONS_DIGEST_SHARD_CLAIM_TIMEOUT = 60 * 30
+
     # determines which cosinnus_notification IDs should be pulled up from
     # the main digest body into its own category with a header
     # format: (
@@ -1675,6 +1780,24 @@ class CosinnusConf(AppConf):
     # determines if the elasticsearch backend should use threading on update/remove/clear writing actions
     ELASTIC_BACKEND_RUN_THREADED = True
 
+    # for threaded elasticsearch updates: the time window in seconds in which repeated updates of the
+    # same object are coalesced into one, before being sent as bulk requests
+    ELASTIC_QUEUE_COALESCE_SECONDS = 1.0
+
+    # maximum number of documents sent to elasticsearch in a single bulk request
+    ELASTIC_QUEUE_BATCH_SIZE = 200
+
+    # number of pending documents in the elasticsearch index queue after which the threads enqueueing more documents
+    # send the pending ones themselves, until the workers catch up
+    ELASTIC_QUEUE_MAX_SIZE = 5000
+
+    # maximum time in seconds to wait for the elasticsearch index queue to be sent when flushing it,
+    # e.g. on process exit
+    ELASTIC_QUEUE_FLUSH_TIMEOUT = 30
+
+    # number of worker threads sending bulk requests from the elasticsearch index queue
+    ELASTIC_QUEUE_WORKERS = 2
+
     # all groups, projects or / and conferences will be shown alphabetically by names
     # e.g.: ['projects', 'groups', 'conferences']
     ALPHABETICAL_ORDER_FOR_SEARCH_MODELS_WHEN_SINGLE = []
@@ -1713,6 +1836,22 @@ class CosinnusConf(AppConf):
     # if True, the User Match feature will be enabled
     ENABLE_USER_MATCH = False
 
+    # timeout of the precomputed user match feature index shared between processes in the cache.
+    # changes of profiles are applied to it incrementally, so this only limits how long a process keeps its copy
+    USER_MATCH_INDEX_CACHE_TIMEOUT = 60 * 60 * 24
+
+    # number of profile changes after which a process stores its updated user match index in the cache,
+    # so that other processes do not need to apply the same changes again
+    USER_MATCH_INDEX_PERSIST_CHANGES = 500
+
+    # if True, the user autocomplete select2 views search an in-memory index of the portal members' names
+    # instead of querying the user table on every keystroke
+    USER_AUTOCOMPLETE_INDEX_ENABLED = True
+
+    # time for which changes of users are kept for updating the user autocomplete index of each process.
+    # a process that has not searched for longer than this rebuilds its index
+    USER_AUTOCOMPLETE_INDEX_CHANGELOG_TIMEOUT = 60 * 60 * 24
+
     # if True, the User Block feature will be enabled
     ENABLE_USER_BLOCK = False
 
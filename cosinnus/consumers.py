@@ -2,6 +2,9 @@ from asgiref.sync import async_to_sync
 from channels.generic.websocket import JsonWebsocketConsumer
 from channels.layers import get_channel_layer
 
+from cosinnus.utils.bigbluebutton import get_bbb_queue_channel_group
+from cosinnus.utils.unread_counts import get_unread_counts_channel_group
+
 CHANNEL_GROUP_ALL = 'session_all'
 CHANNEL_GROUP_ROOM = 'session_%s'
 
@@ -63,6 +66,50 @@ class Consumer(ChatHandlerMixin, JsonWebsocketConsumer):
         pass
 
 
+class UnreadCountsConsumer(JsonWebsocketConsumer):
+    """
+    Pushes the changes of the logged-in user's unread counters for the navigation badges,
+    see `cosinnus.utils.unread_counts`. Requires the channels `AuthMiddlewareStack` in the project's routing.
+    Each message has the command "unread_counts" and a dict of counter deltas, e.g.
+    `{"command": "unread_counts", "deltas": {"alerts": 1, "messages": -2}}`.
+    """
+
+    user_channel_group = None
+
+    def connect(self):
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            self.close()
+            return
+        self.user_channel_group = get_unread_counts_channel_group(user.id)
+        async_to_sync(self.channel_layer.group_add)(self.user_channel_group, self.channel_name)
+        self.accept()
+
+    def disconnect(self, code):
+        if self.user_channel_group:
+            async_to_sync(self.channel_layer.group_discard)(self.user_channel_group, self.channel_name)
+
+
+class BBBRoomQueueConsumer(JsonWebsocketConsumer):
+    """
+    Notifies the clients waiting for the BBB room of a media tag once the room has been created,
+    see `BBBRoomMeetingQueueAPIView`. Expects the media tag id as `mt_id` kwarg in the project's routing.
+    The only message sent is `{"command": "bbb_room_ready"}`, after which the clients retrieve their
+    room URL from the queue API.
+    """
+
+    queue_channel_group = None
+
+    def connect(self):
+        self.queue_channel_group = get_bbb_queue_channel_group(self.scope['url_route']['kwargs']['mt_id'])
+        async_to_sync(self.channel_layer.group_add)(self.queue_channel_group, self.channel_name)
+        self.accept()
+
+    def disconnect(self, code):
+        if self.queue_channel_group:
+            async_to_sync(self.channel_layer.group_discard)(self.queue_channel_group, self.channel_name)
+
+
 def emit_socket_message(command: str, message: dict, channel_group: str = ''):
     """
     Sends message to all connected websockets within channel group
@@ -30,12 +30,7 @@ def send_mail(to, subject, template, data, from_email=None, bcc=None, is_html=Fa
     Note: ``template`` can be None, if so we are looking for a ``content`` key in ``data`` to fill the email message."""
 
     if from_email is None:
-        portal_name = force_str(_(settings.COSINNUS_BASE_PAGE_TITLE_TRANS))
-        # add from-email readable name (yes, this is how this works)
-        from_email = '%(portal_name)s <%(from_email)s>' % {
-            'portal_name': portal_name,
-            'from_email': settings.COSINNUS_DEFAULT_FROM_EMAIL,
-        }
+        from_email = get_default_from_email()
 
     if data and 'unsubscribe_url' in data:
         unsubscribe_url = data.get('unsubscribe_url')
@@ -87,23 +82,37 @@ def send_mail(to, subject, template, data, from_email=None, bcc=None, is_html=Fa
     return ret
 
 
-def deliver_mail(to, subject, message, from_email, bcc=None, is_html=False, headers=None):
-    """The actual delivery of the mail.
-    This may be called from inside a celery task as well!"""
+def get_default_from_email():
+    """Returns the portal's default from-email, including its readable name"""
+    portal_name = force_str(_(settings.COSINNUS_BASE_PAGE_TITLE_TRANS))
+    # add from-email readable name (yes, this is how this works)
+    return '%(portal_name)s <%(from_email)s>' % {
+        'portal_name': portal_name,
+        'from_email': settings.COSINNUS_DEFAULT_FROM_EMAIL,
+    }
+
+
+def build_mail(to, subject, message, from_email, bcc=None, is_html=False, headers=None, connection=None):
+    """Builds the mail message object to be sent over the given connection."""
     if headers is None:
         headers = {}
 
-    connection = get_connection()
     if is_html:
         text_message = convert_html_to_plaintext(message)
         mail = EmailMultiAlternatives(subject, text_message, from_email, [to], connection=connection, headers=headers)
         mail.attach_alternative(message, 'text/html')
-        ret = mail.send()
     else:
         mail = EmailMessage(subject, message, from_email, [to], bcc, connection=connection, headers=headers)
-        ret = mail.send()
+    return mail
 
-    return ret
+
+def deliver_mail(to, subject, message, from_email, bcc=None, is_html=False, headers=None):
+    """The actual delivery of the mail.
+    This may be called from inside a celery task as well!"""
+    mail = build_mail(
+        to, subject, message, from_email, bcc, is_html=is_html, headers=headers, connection=get_connection()
+    )
+    return mail.send()
 
 
 def convert_html_to_plaintext(html_message):
@@ -196,6 +205,26 @@ def send_html_mail_threaded(to_user, subject, html_content, topic_instead_of_sub
     send_html_mail(to_user, subject, html_content, topic_instead_of_subject=topic_instead_of_subject, threaded=True)
 
 
+def build_html_mail(to_user, subject, html_content, topic_instead_of_subject=None, connection=None):
+    """Builds the mail message object for an html mail, as it would be sent by `send_html_mail`,
+    so it can be delivered over a shared connection. See `send_html_mail` for the arguments."""
+    # remove newlines from header
+    subject = subject.replace('\n', ' ').replace('\r', ' ')
+    template = '/cosinnus/html_mail/notification.html'
+    data = get_html_mail_data(
+        to_user, topic_instead_of_subject if topic_instead_of_subject is not None else subject, html_content
+    )
+    unsubscribe_url = get_list_unsubscribe_url(to_user.email)
+    data['unsubscribe_url'] = unsubscribe_url
+    message = render_to_string(template, data)
+    headers = {
+        'List-Unsubscribe': '<%s>' % unsubscribe_url,
+    }
+    return build_mail(
+        to_user.email, subject, message, get_default_from_email(), is_html=True, headers=headers, connection=connection
+    )
+
+
 def render_html_mail(to_user, subject, html_content):
     """Renders the HTML that would be used to send an email given the content.
     Can be used for testing an email."""
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import logging
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.mail import get_connection
+from django.utils.encoding import force_str
+
+from cosinnus.conf import settings
+from cosinnus.core.mail import build_html_mail
+from cosinnus.models.feedback import CosinnusSentEmailLog
+from cosinnus.models.group import CosinnusPortal
+from cosinnus.templatetags.cosinnus_tags import textfield
+from cosinnus.utils.html import render_html_with_variables
+
+logger = logging.getLogger('cosinnus')
+
+
+class MassMailSender(object):
+    """Delivers a `QueuedMassMail` to all of its remaining recipients.
+
+    The remaining recipients are determined in SQL and processed in batches of `COSINNUS_MASS_MAIL_BATCH_SIZE`.
+    For each batch, the mails are rendered and sent over a single SMTP connection, and the sent state
+    and `CosinnusSentEmailLog`s are recorded in bulk. Sending is throttled to
+    `COSINNUS_MASS_MAIL_SEND_RATE_PER_MINUTE` if set.
+    Since the sent state is saved after each batch, an interrupted delivery can be resumed.
+    """
+
+    def __init__(self, queued_mail, batch_size=None, send_rate_per_minute=None):
+        self.queued_mail = queued_mail
+        self.batch_size = batch_size or settings.COSINNUS_MASS_MAIL_BATCH_SIZE
+        self.send_rate_per_minute = send_rate_per_minute or settings.COSINNUS_MASS_MAIL_SEND_RATE_PER_MINUTE
+        self.sent_count = 0
+        self.failed_count = 0
+        self._started = None
+
+    def get_remaining_recipients(self):
+        """Returns a QS of all recipients the mail was not yet sent to"""
+        return self.queued_mail.recipients.exclude(
+            id__in=self.queued_mail.recipients_sent.values('id'),
+        ).order_by('id')
+
+    def _throttle(self):
+        """Waits as long as necessary to keep the configured send rate"""
+        if not self.send_rate_per_minute:
+            return
+        expected_duration = (self.sent_count + self.failed_count) * 60.0 / self.send_rate_per_minute
+        wait = expected_duration - (time.monotonic() - self._started)
+        if wait > 0:
+            time.sleep(wait)
+
+    def _send_batch(self, recipients):
+        """Sends the mail to a batch of recipients over a single connection.
+        @return: The list of recipients the mail was sent to"""
+        queued_mail = self.queued_mail
+        sent = []
+        connection = get_connection()
+        connection.open()
+        try:
+            for recipient in recipients:
+                self._throttle()
+                try:
+                    html_content = textfield(render_html_with_variables(recipient, queued_mail.content))
+                    mail = build_html_mail(
+                        recipient,
+                        queued_mail.subject,
+                        html_content,
+                        connection=connection,
+                        **queued_mail.send_mail_kwargs,
+                    )
+                    mail.send()
+                    sent.append(recipient)
+                    self.sent_count += 1
+                except Exception as e:
+                    # fail silently for single recipients, as the mail would otherwise be retried for everyone
+                    self.failed_count += 1
+                    logger.warning(
+                        'Cosinnus.core.mass_mail: Failed to send mass mail!',
+                        extra={'to_user': recipient.email, 'subject': queued_mail.subject, 'exception': force_str(e)},
+                    )
+        finally:
+            connection.close()
+        return sent
+
+    def send(self):
+        """Sends the mail to all remaining recipients.
+        @return: The number of sent mails"""
+        queued_mail = self.queued_mail
+        self._started = time.monotonic()
+        portal = CosinnusPortal.get_current()
+        user_ids = list(self.get_remaining_recipients().values_list('id', flat=True))
+        for i in range(0, len(user_ids), self.batch_size):
+            batch_ids = user_ids[i : i + self.batch_size]
+            recipients = get_user_model().objects.filter(id__in=batch_ids).select_related('cosinnus_profile')
+            recipients = recipients.order_by('id')
+            sent = self._send_batch(recipients)
+            # failed recipients are marked as sent as well, so they are not retried endlessly
+            queued_mail.recipients_sent.add(*batch_ids)
+            if getattr(settings, 'COSINNUS_LOG_SENT_EMAILS', False) and sent:
+                CosinnusSentEmailLog.objects.bulk_create(
+                    [
+                        CosinnusSentEmailLog(email=recipient.email, title=queued_mail.subject, portal=portal)
+                        for recipient in sent
+                    ]
+                )
+        return self.sent_count
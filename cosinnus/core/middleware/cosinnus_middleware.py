@@ -36,6 +36,7 @@ from cosinnus.core.middleware.frontend_middleware import FrontendMiddleware
 from cosinnus.core.registries import app_registry
 from cosinnus.models import UserOnlineOnDay
 from cosinnus.utils.http import remove_url_param
+from cosinnus.utils.permission_context import activate_permission_context, deactivate_permission_context
 from cosinnus.utils.permissions import check_ug_admin, check_ug_membership, check_user_superuser
 from cosinnus.utils.urls import group_aware_reverse, redirect_next_or
 from cosinnus.views.user import send_user_email_to_verify
@@ -855,3 +856,19 @@ class ManagedTagBlockURLsMiddleware:
                     # otherwise render the error page in-place
                     return redirect_to_error_page(request, view=self)
         return self.get_response(request)
+
+
+class PermissionContextMiddleware:
+    """Activates a request-scoped `PermissionContext` for the requesting user, so that permission checks
+    for them are answered from data loaded once per request. Must be placed after the
+    `AuthenticationMiddleware`."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.permission_context = activate_permission_context(request.user)
+        try:
+            return self.get_response(request)
+        finally:
+            deactivate_permission_context()
@@ -2,6 +2,7 @@
 from __future__ import unicode_literals
 
 import logging
+import time
 from datetime import timedelta
 
 from django.contrib.auth import get_user_model
@@ -11,16 +12,15 @@ from django.utils.timezone import now
 from django_cron import CronJobBase, Schedule
 
 from cosinnus.conf import settings
-from cosinnus.core.mail import send_html_mail
+from cosinnus.core.mass_mail import MassMailSender
 from cosinnus.core.middleware.cosinnus_middleware import initialize_cosinnus_after_startup
 from cosinnus.models.feedback import CosinnusSentEmailLog
 from cosinnus.models.group import CosinnusPortal
 from cosinnus.models.mail import QueuedMassMail
 from cosinnus.models.profile import get_user_profile_model
 from cosinnus.models.storage import TemporaryData
-from cosinnus.templatetags.cosinnus_tags import textfield
 from cosinnus.utils.group import get_cosinnus_group_model
-from cosinnus.utils.html import render_html_with_variables
+from cosinnus.utils.statistics import rollup_statistics
 from cosinnus.views.profile import delete_userprofile
 from cosinnus_conference.utils import update_conference_premium_status
 from cosinnus_event.models import Event
@@ -48,37 +48,63 @@ class CosinnusCronJobBase(CronJobBase):
 
 class DeleteScheduledUserProfiles(CosinnusCronJobBase):
     """Triggers a profile delete on all user profiles whose `scheduled_for_deletion_at`
-    datetime is in the past."""
+    datetime is in the past.
+    Profiles are deleted in chunks until `TIME_BUDGET_SECONDS` have passed, remaining profiles are
+    deleted in the next runs."""
 
     RUN_EVERY_MINS = 60  # every 1 hour
     schedule = Schedule(run_every_mins=RUN_EVERY_MINS)
 
     cosinnus_code = 'cosinnus.delete_scheduled_user_profiles'
 
+    # number of profiles fetched at once
+    CHUNK_SIZE = 50
+    # no new profile deletions are started after this many seconds of a run
+    TIME_BUDGET_SECONDS = 30 * 60
+
     def do(self):
+        start_time = time.monotonic()
         profiles_to_delete = (
             get_user_profile_model()
             .objects.exclude(scheduled_for_deletion_at__exact=None)
             .filter(scheduled_for_deletion_at__lte=now())
+            .select_related('user')
+            .order_by('scheduled_for_deletion_at', 'id')
         )
-
-        for profile in profiles_to_delete:
-            try:
-                # sanity checks are done within this function, no need to do any here
-                user_id = profile.user.id
-                delete_userprofile(profile.user)
-                logger.info(
-                    'delete_userprofile() cronjob: profile was deleted completely after 30 days',
-                    extra={'user_id': user_id},
-                )
-            except Exception as e:
-                logger.error(
-                    (
-                        'delete_userprofile() cronjob: threw an exception during the DeleteScheduledUserProfiles '
-                        'cronjob! (in extra)'
-                    ),
-                    extra={'exception': force_str(e)},
-                )
+        # profiles that could not be deleted stay in the queryset, so they are skipped for the rest of the run
+        skipped_ids = []
+        deleted_count = 0
+        out_of_time = False
+        while not out_of_time:
+            chunk = list(profiles_to_delete.exclude(id__in=skipped_ids)[: self.CHUNK_SIZE])
+            if not chunk:
+                break
+            for profile in chunk:
+                if time.monotonic() - start_time > self.TIME_BUDGET_SECONDS:
+                    out_of_time = True
+                    break
+                try:
+                    # sanity checks are done within this function, no need to do any here
+                    user_id = profile.user.id
+                    delete_userprofile(profile.user)
+                    logger.info(
+                        'delete_userprofile() cronjob: profile was deleted completely after 30 days',
+                        extra={'user_id': user_id},
+                    )
+                    deleted_count += 1
+                except Exception as e:
+                    logger.error(
+                        (
+                            'delete_userprofile() cronjob: threw an exception during the DeleteScheduledUserProfiles '
+                            'cronjob! (in extra)'
+                        ),
+                        extra={'exception': force_str(e)},
+                    )
+                # deleted profiles no longer exist, this only has an effect if the deletion did not happen
+                skipped_ids.append(profile.id)
+        if out_of_time:
+            return f'Deleted {deleted_count} user profiles, stopped after the time budget. Continuing in the next run.'
+        return f'Deleted {deleted_count} user profiles.'
 
 
 class UpdateConferencePremiumStatus(CosinnusCronJobBase):
@@ -178,14 +204,8 @@ class SendQueuedMassMails(CosinnusCronJobBase):
                 # mark queued mail as being processed
                 queued_mail.sending_in_progress = True
                 queued_mail.save()
-                # get the remaining recipients in case the send process was terminated.
-                recipients = set(queued_mail.recipients.all()) - set(queued_mail.recipients_sent.all())
-                for recipient in recipients:
-                    # send html email to recipient
-                    html_content = textfield(render_html_with_variables(recipient, queued_mail.content))
-                    send_html_mail(recipient, queued_mail.subject, html_content, **queued_mail.send_mail_kwargs)
-                    queued_mail.recipients_sent.add(recipient)
-                    send_mail_count += 1
+                # sends to the remaining recipients only, in case the send process was terminated.
+                send_mail_count += MassMailSender(queued_mail).send()
                 queued_mail.delete()
                 queued_mails_count += 1
             except Exception as e:
@@ -234,3 +254,16 @@ class DeleteOldSentEmailLogs(CosinnusCronJobBase):
         count = queryset.count()
         queryset.delete()
         return f'Deleted {count} sent-email-logs older than {self.OLD_SENT_EMAIL_LOGS_THRESHOLD_DAYS} days.'
+
+
+class RollupStatistics(CosinnusCronJobBase):
+    """Rolls up the portal statistics metrics for the days since the last run, see `cosinnus.utils.statistics`."""
+
+    RUN_EVERY_MINS = 60 * 24  # every day
+    schedule = Schedule(run_every_mins=RUN_EVERY_MINS)
+
+    cosinnus_code = 'cosinnus.rollup_statistics'
+
+    def do(self):
+        count = rollup_statistics()
+        return f'Stored {count} statistics rollups.'
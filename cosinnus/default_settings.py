@@ -85,6 +85,9 @@ def define_cosinnus_base_settings(project_settings, project_base_path):
     # Absolute filesystem path to the directory that will hold user-uploaded files.
     # Example: "/home/media/media.lawrence.com/media/"
     MEDIA_ROOT = join(BASE_PATH, 'media')
+    # Absolute filesystem path to the directory that holds private files like data exports.
+    # It must not be served by the web server, its files are only served by views that check permissions.
+    COSINNUS_PRIVATE_FILES_ROOT = join(BASE_PATH, 'private-media')
     # this might be overridden in an out settings file to match the cosinnus Portal's static dir
     STATIC_ROOT = join(BASE_PATH, 'static-collected')
     # Additional locations of static files
@@ -167,6 +170,7 @@ def define_cosinnus_base_settings(project_settings, project_base_path):
         'cosinnus.core.middleware.cosinnus_middleware.StartupMiddleware',
         'cosinnus.core.middleware.cosinnus_middleware.ConditionalRedirectMiddleware',
         'cosinnus.core.middleware.cosinnus_middleware.ForceInactiveUserLogoutMiddleware',
+        'cosinnus.core.middleware.cosinnus_middleware.PermissionContextMiddleware',
         'cosinnus.core.middleware.cosinnus_middleware.UserOnlineStatisticsMiddleware',
         'cosinnus.core.middleware.cosinnus_middleware.AddRequestToModelSaveMiddleware',
         'cosinnus.core.middleware.cosinnus_middleware.GroupPermanentRedirectMiddleware',
@@ -683,7 +687,9 @@ def define_cosinnus_base_settings(project_settings, project_base_path):
         'cosinnus_message.cron.ProcessDirectReplyMails',
         'cosinnus_notifications.cron.DeleteOldNotificationAlerts',
         'cosinnus.cron.DeleteOldSentEmailLogs',
+        'cosinnus.cron.RollupStatistics',
         'cosinnus_exchange.cron.PullData',
+        'cosinnus_cloud.cron.ProcessNextcloudSyncJobs',
     ]
     # delete cronjob logs older than 30 days
     DJANGO_CRON_DELETE_LOGS_OLDER_THAN = 30
@@ -48,7 +48,12 @@ from cosinnus.utils.group import get_cosinnus_group_model
 from cosinnus.utils.lanugages import MultiLanguageFieldValidationFormMixin
 from cosinnus.utils.permissions import check_user_superuser
 from cosinnus.utils.urls import group_aware_reverse
-from cosinnus.utils.user import filter_active_users, get_group_select2_pills, get_user_select2_pills
+from cosinnus.utils.user import (
+    filter_active_users,
+    get_group_select2_pills,
+    get_portal_member_ids_query,
+    get_user_select2_pills,
+)
 from cosinnus.utils.validators import CleanFromToDateFieldsMixin, validate_file_infection
 from cosinnus.views.facebook_integration import FacebookIntegrationGroupFormMixin
 from cosinnus_organization.models import CosinnusOrganization
@@ -616,7 +621,7 @@ class MultiUserSelectForm(MultiSelectForm):
         super(MultiUserSelectForm, self).__init__(*args, **kwargs)
 
     def get_queryset(self):
-        include_uids = CosinnusPortal.get_current().members
+        include_uids = get_portal_member_ids_query()
         exclude_uids = self.group.members
         users = filter_active_users(get_user_model().objects.filter(id__in=include_uids).exclude(id__in=exclude_uids))
         # support for user blocking, filter out all audience members that have the sending user blocked
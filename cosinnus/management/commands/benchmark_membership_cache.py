@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import pickle
+import random
+import timeit
+from bisect import bisect_left
+
+from django.core.management.base import BaseCommand
+
+from cosinnus.models.membership import MEMBERSHIP_MEMBER, compact_user_ids
+
+
+def _contains_sorted(user_ids, user_id):
+    index = bisect_left(user_ids, user_id)
+    return index < len(user_ids) and user_ids[index] == user_id
+
+
+class Command(BaseCommand):
+    """
+    Compares the cached size and the membership check latency of the possible representations of a group's
+    membership cache, using synthetic user ids. Each check includes unpickling the cached value, as a
+    membership check does when reading it from the cache:
+    - `list`: a plain list of user ids (the former format)
+    - `array`: the sorted compact array of user ids used for the group membership caches
+    - `frozenset`: a frozenset of user ids
+    - `user index`: the per-user reverse index of a user with the given number of memberships,
+        used by the `is_member()`/`is_admin()` checks
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--members', type=int, default=100000, help='Number of members of the group or portal')
+        parser.add_argument('--user-memberships', type=int, default=20, help='Number of memberships of a user')
+        parser.add_argument('--checks', type=int, default=100, help='Number of timed membership checks')
+
+    def handle(self, *args, **options):
+        user_ids = random.sample(range(1, options['members'] * 4), options['members'])
+        user_index = {group_id: MEMBERSHIP_MEMBER for group_id in range(options['user_memberships'])}
+        representations = [
+            ('list', list(user_ids), lambda value, user_id: user_id in value),
+            ('array', compact_user_ids(user_ids), _contains_sorted),
+            ('frozenset', frozenset(user_ids), lambda value, user_id: user_id in value),
+            ('user index', user_index, lambda value, user_id: value.get(0, None) == MEMBERSHIP_MEMBER),
+        ]
+        self.stdout.write(f'Membership cache benchmark for {options["members"]} members:')
+        for name, value, contains in representations:
+            pickled = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            check_user_ids = [random.choice(user_ids) for __ in range(options['checks'])]
+
+            def check():
+                for user_id in check_user_ids:
+                    contains(pickle.loads(pickled), user_id)
+
+            seconds = min(timeit.repeat(check, number=1, repeat=3)) / options['checks']
+            self.stdout.write(f'{name:>12}: {len(pickled) / 1024:10.1f} KiB cached, {seconds * 1000000:10.1f} µs/check')
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from cosinnus.core.middleware.cosinnus_middleware import initialize_cosinnus_after_startup
+from cosinnus.models.group import CosinnusPortal, CosinnusPortalMembership
+from cosinnus.models.membership import MEMBERSHIP_MEMBER
+from cosinnus.utils.user import filter_portal_users, get_portal_member_ids_query
+
+BENCHMARK_USERNAME_PREFIX = '__benchmark_portal_member_filter__'
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    """
+    Compares filtering users for the current portal with the cached `portal.members` id list against the
+    `get_portal_member_ids_query()` subquery and the `filter_portal_users()` EXISTS filter.
+    With `--fixture-users`, the given number of portal members are created for the benchmark first.
+    All created data is rolled back afterwards.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fixture-users', type=int, default=0, help='Number of portal members to create first')
+        parser.add_argument('--repeat', type=int, default=5, help='Number of timed runs per variant')
+
+    def handle(self, *args, **options):
+        initialize_cosinnus_after_startup()
+        try:
+            with transaction.atomic():
+                self.run_benchmark(options['fixture_users'], options['repeat'])
+                raise _Rollback()
+        except _Rollback:
+            pass
+
+    def create_fixture(self, portal, count):
+        user_model = get_user_model()
+        batch_size = 5000
+        for offset in range(0, count, batch_size):
+            usernames = [f'{BENCHMARK_USERNAME_PREFIX}{i}' for i in range(offset, min(offset + batch_size, count))]
+            users = user_model.objects.bulk_create(
+                [user_model(username=username, email=f'{username}@example.com') for username in usernames]
+            )
+            CosinnusPortalMembership.objects.bulk_create(
+                [CosinnusPortalMembership(group=portal, user=user, status=MEMBERSHIP_MEMBER) for user in users]
+            )
+        CosinnusPortalMembership.clear_member_cache_for_group(portal)
+
+    def run_benchmark(self, fixture_users, repeat):
+        portal = CosinnusPortal.get_current()
+        if fixture_users:
+            self.stdout.write(f'Creating {fixture_users} portal members...')
+            self.create_fixture(portal, fixture_users)
+        users = get_user_model().objects.all()
+        variants = [
+            ('id__in=portal.members', lambda: users.filter(id__in=portal.members).count()),
+            ('id__in=subquery', lambda: users.filter(id__in=get_portal_member_ids_query(portal)).count()),
+            ('EXISTS', lambda: filter_portal_users(users, portal=portal).count()),
+        ]
+        for name, run in variants:
+            timings = []
+            for __ in range(repeat):
+                start = time.perf_counter()
+                count = run()
+                timings.append(time.perf_counter() - start)
+            self.stdout.write(f'{name:>24}: {count} users, best of {repeat}: {min(timings) * 1000:.1f} ms')
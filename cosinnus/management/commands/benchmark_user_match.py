@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import pickle
+import random
+import time
+import timeit
+
+from django.core.management.base import BaseCommand
+
+from cosinnus.utils.user_match import UserMatchFeatures, UserMatchIndex
+
+
+class Command(BaseCommand):
+    """
+    Measures the latency of scoring all user profiles of a portal for the user match, using a synthetic
+    `UserMatchIndex` (no database access):
+    - `python sets`: the former approach of intersecting the feature sets of each profile with the viewer's
+    - `index`: the vectorized scoring of the precomputed index, including ranking all profiles
+    - `update`: applying a batch of changed profiles to the index, as done for the changelog
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--profiles', type=int, default=50000, help='Number of user profiles')
+        parser.add_argument('--features', type=int, default=20, help='Average number of features of a profile')
+        parser.add_argument('--vocabulary', type=int, default=5000, help='Number of distinct features')
+        parser.add_argument('--changes', type=int, default=100, help='Number of changed profiles per update')
+        parser.add_argument('--repeat', type=int, default=5, help='Number of timed runs, the best is reported')
+
+    def _get_random_features(self, options):
+        count = random.randint(0, options['features'] * 2)
+        return set([f'feature:{random.randrange(options["vocabulary"])}' for __ in range(count)])
+
+    def _get_random_row(self, user_id, now, options):
+        last_login = now - random.randint(0, 60 * 60 * 24 * 500)
+        return UserMatchFeatures(user_id, random.randint(0, 8), last_login, self._get_random_features(options))
+
+    def handle(self, *args, **options):
+        now = time.time()
+        rows = [self._get_random_row(user_id, now, options) for user_id in range(1, options['profiles'] + 1)]
+        index = UserMatchIndex()
+        build_seconds = min(timeit.repeat(lambda: UserMatchIndex().set_rows(rows), number=1, repeat=options['repeat']))
+        index.set_rows(rows)
+        viewer_features = self._get_random_features(options)
+        feature_ids = index.get_feature_ids(viewer_features)
+        exclude_user_ids = set(random.sample(range(1, options['profiles'] + 1), min(100, options['profiles'])))
+
+        def score_python_sets():
+            scores = {}
+            for row in rows:
+                if row.user_id not in exclude_user_ids:
+                    scores[row.user_id] = row.static_score + len(row.features.intersection(viewer_features))
+            return sorted(scores.items(), key=lambda score: score[1], reverse=True)[:3]
+
+        def score_index():
+            return index.get_ranked_user_ids(feature_ids, exclude_user_ids=exclude_user_ids, at_time=now)[0][:3]
+
+        def update_index():
+            changed_user_ids = random.sample(range(1, options['profiles'] + 1), options['changes'])
+            index.set_rows([self._get_random_row(user_id, now, options) for user_id in changed_user_ids])
+
+        self.stdout.write(
+            f'User match benchmark for {options["profiles"]} profiles with {len(index.indices)} features '
+            f'({len(pickle.dumps(index, pickle.HIGHEST_PROTOCOL)) / 1024:.1f} KiB cached), '
+            f'built in {build_seconds * 1000:.1f} ms:'
+        )
+        for name, function in (
+            ('python sets', score_python_sets),
+            ('index', score_index),
+            (f'update {options["changes"]}', update_index),
+        ):
+            seconds = min(timeit.repeat(function, number=1, repeat=options['repeat']))
+            self.stdout.write(f'{name:>12}: {seconds * 1000:10.2f} ms')
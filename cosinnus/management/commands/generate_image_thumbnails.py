@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from concurrent.futures import ThreadPoolExecutor
+
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import F
+
+from cosinnus.core.middleware.cosinnus_middleware import initialize_cosinnus_after_startup
+from cosinnus.models.mixins.images import ThumbnailableImageMixin
+from cosinnus.utils.thumbnails import generate_thumbnails, needs_thumbnails
+
+
+def _generate_thumbnails(obj):
+    try:
+        generate_thumbnails(obj)
+    finally:
+        # each worker thread uses its own database connection
+        connection.close()
+
+
+class Command(BaseCommand):
+    """
+    Generates the thumbnails of all existing images, which are otherwise generated on their first display.
+    Images of `ThumbnailableImageMixin` models whose thumbnails have already been generated are skipped.
+    See `cosinnus.utils.thumbnails`.
+    """
+
+    # number of objects processed at once, to keep the number of loaded objects bounded
+    batch_size = 500
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='Number of parallel worker threads')
+
+    def get_models(self):
+        for model in apps.get_models():
+            if model._meta.proxy:
+                continue
+            if issubclass(model, ThumbnailableImageMixin) or any(
+                [hasattr(model, attr) for attr in ['get_image_field_for_icon', 'get_image_field_for_background']]
+            ):
+                yield model
+
+    def handle(self, *args, **options):
+        initialize_cosinnus_after_startup()
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            for model in self.get_models():
+                queryset = model._default_manager.all()
+                if issubclass(model, ThumbnailableImageMixin) and hasattr(model, 'image_thumbnails_source'):
+                    queryset = queryset.exclude(image_thumbnails_source=F(model.image_attr_name))
+                count = 0
+                batch = []
+                for obj in queryset.iterator():
+                    if needs_thumbnails(obj):
+                        batch.append(obj)
+                    if len(batch) >= self.batch_size:
+                        list(executor.map(_generate_thumbnails, batch))
+                        count += len(batch)
+                        batch = []
+                list(executor.map(_generate_thumbnails, batch))
+                count += len(batch)
+                self.stdout.write(f'Generated thumbnails for {count} {model._meta.verbose_name_plural}.')
+        self.stdout.write('Done.')
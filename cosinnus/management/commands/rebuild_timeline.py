@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from cosinnus.core.middleware.cosinnus_middleware import initialize_cosinnus_after_startup
+from cosinnus.utils.timeline import rebuild_timeline
+
+
+class Command(BaseCommand):
+    """
+    Deletes and recreates all materialized dashboard timeline entries for the current portal.
+    Needs to be run once after enabling `COSINNUS_V2_DASHBOARD_USE_MATERIALIZED_TIMELINE`.
+    """
+
+    def handle(self, *args, **options):
+        initialize_cosinnus_after_startup()
+        self.stdout.write('Rebuilding the dashboard timeline...')
+        count = rebuild_timeline()
+        self.stdout.write(f'Done. Created {count} timeline entries.')
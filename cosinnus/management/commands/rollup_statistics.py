@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from cosinnus.core.middleware.cosinnus_middleware import initialize_cosinnus_after_startup
+from cosinnus.utils.statistics import rollup_statistics
+
+
+class Command(BaseCommand):
+    """
+    Rolls up the statistics metrics of the current portal up to yesterday, like the `RollupStatistics` cronjob.
+    With `--recompute`, all existing rollups are discarded and computed again from the raw data.
+    """
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recompute', action='store_true', help='Recompute all rollups from the raw data')
+
+    def handle(self, *args, **options):
+        initialize_cosinnus_after_startup()
+        count = rollup_statistics(recompute=options['recompute'])
+        self.stdout.write(f'Stored {count} statistics rollups.')
@@ -0,0 +1,20 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('cosinnus', '0159_mitwirkomatsettings_add_dynamicfields'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='temporarydata',
+            name='data',
+            field=models.BinaryField(blank=True, default=b'', verbose_name='Data'),
+        ),
+        migrations.AddField(
+            model_name='temporarydata',
+            name='file',
+            field=models.FileField(blank=True, max_length=250, null=True, upload_to='', verbose_name='File'),
+        ),
+    ]
@@ -0,0 +1,81 @@
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('cosinnus', '0160_temporarydata_file'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField()),
+                ('last_action', models.DateTimeField(verbose_name='Last action date')),
+                (
+                    'is_forum',
+                    models.BooleanField(
+                        default=False,
+                        help_text='Whether the object is from a default user group (the Forum) or is an idea.',
+                    ),
+                ),
+                (
+                    'is_public',
+                    models.BooleanField(default=False, help_text='Whether the object is visible to everyone.'),
+                ),
+                (
+                    'content_type',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype'
+                    ),
+                ),
+                (
+                    'group',
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name='+',
+                        to=settings.COSINNUS_GROUP_OBJECT_MODEL,
+                        verbose_name='Group',
+                    ),
+                ),
+                (
+                    'portal',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name='+',
+                        to='cosinnus.cosinnusportal',
+                        verbose_name='Portal',
+                    ),
+                ),
+                (
+                    'user',
+                    models.ForeignKey(
+                        blank=True,
+                        help_text='The user in whose timeline the object appears. Empty for portal-wide entries.',
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name='+',
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name='User',
+                    ),
+                ),
+            ],
+            options={
+                'verbose_name': 'Timeline entry',
+                'verbose_name_plural': 'Timeline entries',
+                'ordering': ('-last_action',),
+                'indexes': [
+                    models.Index(fields=['portal', 'user', '-last_action'], name='cosinnus_ti_portal__030916_idx'),
+                    models.Index(fields=['content_type', 'object_id'], name='cosinnus_ti_content_a698aa_idx'),
+                    models.Index(fields=['user', 'group'], name='cosinnus_ti_user_id_3080ca_idx'),
+                ],
+            },
+        ),
+    ]
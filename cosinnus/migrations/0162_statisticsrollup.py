@@ -0,0 +1,43 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('cosinnus', '0161_timelineentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatisticsRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metric', models.CharField(max_length=50, verbose_name='Metric')),
+                (
+                    'period',
+                    models.CharField(
+                        choices=[('day', 'Day'), ('week', 'Week'), ('month', 'Month'), ('year', 'Year')],
+                        max_length=5,
+                        verbose_name='Period',
+                    ),
+                ),
+                ('period_start', models.DateField(verbose_name='Period start')),
+                ('value', models.PositiveIntegerField(default=0, verbose_name='Value')),
+                (
+                    'portal',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name='statistics_rollups',
+                        to='cosinnus.cosinnusportal',
+                        verbose_name='Portal',
+                    ),
+                ),
+            ],
+            options={
+                'verbose_name': 'Statistics rollup',
+                'verbose_name_plural': 'Statistics rollups',
+                'ordering': ['portal', 'metric', 'period', 'period_start'],
+                'unique_together': {('portal', 'metric', 'period', 'period_start')},
+            },
+        ),
+    ]
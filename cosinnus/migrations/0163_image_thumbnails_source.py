@@ -0,0 +1,20 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('cosinnus', '0162_statisticsrollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cosinnusgroupgalleryimage',
+            name='image_thumbnails_source',
+            field=models.CharField(blank=True, default='', editable=False, max_length=250),
+        ),
+        migrations.AddField(
+            model_name='userdashboardannouncement',
+            name='image_thumbnails_source',
+            field=models.CharField(blank=True, default='', editable=False, max_length=250),
+        ),
+    ]
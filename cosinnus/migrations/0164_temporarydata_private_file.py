@@ -0,0 +1,24 @@
+from django.db import migrations, models
+
+import cosinnus.utils.files
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('cosinnus', '0163_image_thumbnails_source'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='temporarydata',
+            name='file',
+            field=models.FileField(
+                blank=True,
+                max_length=250,
+                null=True,
+                storage=cosinnus.utils.files.get_private_file_storage,
+                upload_to='',
+                verbose_name='File',
+            ),
+        ),
+    ]
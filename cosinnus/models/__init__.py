@@ -13,3 +13,4 @@ from cosinnus.models.idea import *  # noqa
 from cosinnus.models.newsletter import *  # noqa
 from cosinnus.models.storage import *  # noqa
 from cosinnus.models.mail import *  # noqa
+from cosinnus.models.timeline import *  # noqa
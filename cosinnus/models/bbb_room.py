@@ -246,17 +246,25 @@ class BBBRoom(models.Model):
         :rtype: str
         """
         user_bbb_guest_token = getattr(user, self.BBB_USER_GUEST_TOKEN_ATTR, None)
-        if check_user_superuser(user) or user in self.moderators.all():
+        if check_user_superuser(user) or self.is_moderator(user):
             return self.moderator_password
         elif (
             (user_bbb_guest_token and user_bbb_guest_token == self.guest_token)
-            or user in self.attendees.all()
+            or self.is_attendee(user)
             or self.is_publicly_visible
         ):
             return self.attendee_password
         else:
             return ''
 
+    def is_attendee(self, user):
+        """Checks if the user is an attendee of this room, without loading all attendees"""
+        return bool(user.pk) and self.attendees.filter(id=user.pk).exists()
+
+    def is_moderator(self, user):
+        """Checks if the user is a moderator of this room, without loading all moderators"""
+        return bool(user.pk) and self.moderators.filter(id=user.pk).exists()
+
     def check_user_can_enter_room(self, user):
         """Checks if a user has the neccessary permissions to enter this room"""
         return bool(
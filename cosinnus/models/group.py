@@ -546,6 +546,26 @@ class CosinnusGroupMembership(BaseMembership):
         super(CosinnusGroupMembership, self).delete(*args, **kwargs)
         signals.user_left_group.send(sender=self.group, user=self.user, group=self.group)
 
+    @classmethod
+    def delete_all_for_user(cls, user, update_profile=True):
+        """Deletes all group memberships of a user in a single query, sending the same signals as `delete()`.
+        The membership caches of each affected group are cleared once by the post_delete hook, and instead of
+        saving the user's profile for each membership (see `BaseMembership.delete`), it is saved once at the end.
+        @param update_profile: If False, the profile is not saved, e.g. because it is about to be deleted
+        @return: The number of deleted memberships"""
+        memberships = list(cls.objects.filter(user=user).select_related('group'))
+        if not memberships:
+            return 0
+        for membership in memberships:
+            signals.group_membership_has_changed.send(sender=membership, instance=membership, deleted=True)
+        cls.objects.filter(id__in=[membership.id for membership in memberships]).delete()
+        for membership in memberships:
+            signals.user_left_group.send(sender=membership.group, user=user, group=membership.group)
+        if update_profile:
+            # run an empty save on the profile so its search index gets updated with the new memberships
+            user.cosinnus_profile.save()
+        return len(memberships)
+
 
 class CosinnusUnregisterdUserGroupInvite(BaseMembership):
     """A placeholder for a  group invite of person's who has been invited via email to join.
@@ -2391,6 +2411,8 @@ class CosinnusGroupGalleryImage(ThumbnailableImageMixin, models.Model):
     description = models.TextField(verbose_name=_('Description'), null=True, blank=True)
 
     image = models.ImageField(_('Group Image'), upload_to=get_group_gallery_image_filename, max_length=250)
+    # the image name for which all thumbnails have been generated, see `ThumbnailableImageMixin.generate_thumbnails`
+    image_thumbnails_source = models.CharField(max_length=250, blank=True, default='', editable=False)
 
     group = models.ForeignKey(
         settings.COSINNUS_GROUP_OBJECT_MODEL,
@@ -9,7 +9,7 @@ from django.contrib.auth import get_user_model
 from django.contrib.auth.signals import user_logged_in, user_logged_out
 from django.contrib.contenttypes.models import ContentType
 from django.db import transaction
-from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.db.models.signals import m2m_changed, post_delete, post_init, post_save, pre_delete, pre_save
 from django.dispatch import receiver
 from django.utils import timezone
 from django.utils.encoding import force_str
@@ -22,15 +22,40 @@ from cosinnus.core.registries.group_models import group_model_registry
 from cosinnus.models.conference import CosinnusConferencePremiumBlock
 from cosinnus.models.feedback import CosinnusFailedLoginRateLimitLog
 from cosinnus.models.group import CosinnusGroup, CosinnusGroupMembership, CosinnusPortal, CosinnusPortalMembership
+from cosinnus.models.idea import CosinnusIdea
 from cosinnus.models.mail import QueuedMassMail
 from cosinnus.models.managed_tags import CosinnusManagedTag, CosinnusManagedTagAssignment
-from cosinnus.models.membership import MEMBER_STATUS, MEMBERSHIP_ADMIN, MEMBERSHIP_MANAGER, MEMBERSHIP_MEMBER
-from cosinnus.models.profile import GlobalBlacklistedEmail, GlobalUserNotificationSetting, get_user_profile_model
-from cosinnus.models.tagged import LikeObject, ensure_container
+from cosinnus.models.membership import (
+    MEMBER_STATUS,
+    MEMBERSHIP_ADMIN,
+    MEMBERSHIP_INVITED_PENDING,
+    MEMBERSHIP_MANAGER,
+    MEMBERSHIP_MEMBER,
+    MEMBERSHIP_PENDING,
+)
+from cosinnus.models.profile import (
+    GlobalBlacklistedEmail,
+    GlobalUserNotificationSetting,
+    UserBlock,
+    get_user_profile_model,
+)
+from cosinnus.models.tagged import BaseTaggableObjectModel, LikeObject, ensure_container
 from cosinnus.models.widget import WidgetConfig
+from cosinnus.tasks import (
+    generate_thumbnails_task,
+    update_timeline_for_membership_task,
+    update_timeline_for_object_task,
+)
 from cosinnus.utils.dashboard import ensure_group_widget
 from cosinnus.utils.group import get_cosinnus_group_model
+from cosinnus.utils.permission_context import reset_permission_context
+from cosinnus.utils.thumbnails import needs_thumbnails, remember_image_names
+from cosinnus.utils.timeline import get_timeline_models, is_timeline_object, remove_timeline_for_object
+from cosinnus.utils.timeline_cache import timeline_fragment_cache
+from cosinnus.utils.unread_counts import push_unread_count_deltas
 from cosinnus.utils.user import assign_user_to_default_auth_group, ensure_user_to_default_portal_groups
+from cosinnus.utils.user_autocomplete import mark_user_autocomplete_changed
+from cosinnus.utils.user_match import mark_user_match_features_changed
 from cosinnus.views.profile import delete_guest_user
 from cosinnus_conference.utils import update_conference_premium_status
 
@@ -333,15 +358,134 @@ def managed_tag_cache_clear_triggers(sender, instance, created=False, **kwargs):
 
 @receiver(post_save, sender=CosinnusGroupMembership)
 @receiver(post_delete, sender=CosinnusGroupMembership)
+@receiver(post_save, sender=CosinnusPortalMembership)
+@receiver(post_delete, sender=CosinnusPortalMembership)
 def group_membership_cache_clear_triggers(sender, instance, created=False, **kwargs):
-    """Clears the cache for CosinnusGroupMembership when saved/deleted.
+    """Clears the cache for CosinnusGroupMembership and CosinnusPortalMembership when saved/deleted.
+    This also catches bulk deletes, which do not call BaseMembership.delete().
     TODO: this may be duplicating behaviour from BaseMembership.delete() and BaseMembership.save()!"""
     try:
-        CosinnusGroupMembership.clear_member_cache_for_group(instance.group)
+        sender.clear_member_cache_for_group(instance.group, user_ids=[instance.user_id])
     except Exception as e:
         logger.exception(e)
 
 
+@receiver(post_save, sender=CosinnusGroupMembership)
+@receiver(post_delete, sender=CosinnusGroupMembership)
+@receiver(post_save, sender=CosinnusPortalMembership)
+@receiver(post_delete, sender=CosinnusPortalMembership)
+@receiver(post_save, sender=UserBlock)
+@receiver(post_delete, sender=UserBlock)
+def reset_permission_context_on_membership_change(sender, instance, **kwargs):
+    """Makes the request-scoped permission context reload the user's roles after they changed during the request"""
+    reset_permission_context(instance.user_id)
+
+
+@receiver(post_save, sender=CosinnusGroupMembership)
+@receiver(post_delete, sender=CosinnusGroupMembership)
+def update_timeline_on_membership_change(sender, instance, created=False, **kwargs):
+    """Adds or removes a group's objects to/from the user's materialized timeline when they join or leave"""
+    if not settings.COSINNUS_V2_DASHBOARD_USE_MATERIALIZED_TIMELINE or kwargs.get('raw', False):
+        return
+    is_member = kwargs['signal'] is post_save and instance.status in MEMBER_STATUS
+    was_member = not created and instance._old_current_status in MEMBER_STATUS
+    if kwargs['signal'] is post_save and is_member == was_member:
+        return
+    update_timeline_for_membership_task.delay(instance.user_id, instance.group_id, is_member)
+
+
+@receiver(post_save, sender=CosinnusGroupMembership)
+@receiver(post_delete, sender=CosinnusGroupMembership)
+def push_membership_alert_counts_on_membership_change(sender, instance, created=False, **kwargs):
+    """Pushes the changed membership alert counts of the group's admins for membership requests,
+    and of the user for invitations"""
+    if not settings.COSINNUS_UNREAD_COUNTS_WEBSOCKET_ENABLED or kwargs.get('raw', False):
+        return
+    status = instance.status if kwargs['signal'] is post_save else None
+    old_status = None if created else instance._old_current_status
+    request_delta = int(status == MEMBERSHIP_PENDING) - int(old_status == MEMBERSHIP_PENDING)
+    if request_delta:
+        push_unread_count_deltas(instance.group.admins, membership_alerts=request_delta)
+    invitation_delta = int(status == MEMBERSHIP_INVITED_PENDING) - int(old_status == MEMBERSHIP_INVITED_PENDING)
+    if invitation_delta:
+        push_unread_count_deltas([instance.user_id], membership_alerts=invitation_delta)
+
+
+@receiver(post_save, sender='postman.Message')
+def push_unread_message_count_on_message_received(sender, instance, created=False, raw=False, **kwargs):
+    """Pushes the changed unread message count of the recipient of a new message.
+    Messages being read are pushed in `postman.views.DisplayMixin`, and messages being read, archived or deleted
+    in bulk in `cosinnus_message.views.UpdateMessageMixin`. With Rocket.Chat, postman messages are not counted."""
+    if not settings.COSINNUS_UNREAD_COUNTS_WEBSOCKET_ENABLED or settings.COSINNUS_ROCKET_ENABLED:
+        return
+    if not created or raw:
+        return
+    if instance.recipient_id and instance.is_accepted() and instance.read_at is None:
+        push_unread_count_deltas([instance.recipient_id], messages=1)
+
+
+@receiver(post_save)
+def update_timeline_on_object_save(sender, instance, created=False, raw=False, **kwargs):
+    """Fans out the materialized timeline entries of a timeline object when it is saved,
+    e.g. when its `last_action` is updated"""
+    if not settings.COSINNUS_V2_DASHBOARD_USE_MATERIALIZED_TIMELINE or raw:
+        return
+    if isinstance(instance, (BaseTaggableObjectModel, CosinnusIdea)) and is_timeline_object(instance):
+        content_type = ContentType.objects.get_for_model(instance.__class__)
+        update_timeline_for_object_task.delay(content_type.id, instance.pk)
+
+
+@receiver(post_save)
+@receiver(post_delete)
+def invalidate_timeline_fragments(sender, instance, raw=False, **kwargs):
+    """Invalidates the cached timeline item HTML of timeline objects when they or their comments change"""
+    if not settings.COSINNUS_TIMELINE_FRAGMENT_CACHE_ENABLED or raw:
+        return
+    timeline_fragment_cache.invalidate_for_instance(instance)
+
+
+@receiver(m2m_changed)
+def invalidate_timeline_fragments_on_m2m_change(sender, instance, action, reverse, model, pk_set, **kwargs):
+    """Invalidates the cached timeline item HTML of timeline objects when their attached objects, categories
+    or other many-to-many relations change"""
+    if not settings.COSINNUS_TIMELINE_FRAGMENT_CACHE_ENABLED or not action.startswith('post_'):
+        return
+    if not reverse:
+        if is_timeline_object(instance):
+            timeline_fragment_cache.invalidate(instance.__class__, instance.pk)
+    elif pk_set and model in get_timeline_models():
+        for pk in pk_set:
+            timeline_fragment_cache.invalidate(model, pk)
+
+
+@receiver(post_delete)
+def remove_timeline_on_object_delete(sender, instance, **kwargs):
+    if not settings.COSINNUS_V2_DASHBOARD_USE_MATERIALIZED_TIMELINE:
+        return
+    if isinstance(instance, (BaseTaggableObjectModel, CosinnusIdea)) and is_timeline_object(instance):
+        remove_timeline_for_object(instance)
+
+
+@receiver(post_init)
+def remember_image_names_on_init(sender, instance, **kwargs):
+    """Records the image names of loaded objects, so that thumbnails are only generated for changed images.
+    New objects are not recorded, so the thumbnails of their images are always generated."""
+    if settings.COSINNUS_THUMBNAIL_PREGENERATION_ENABLED and instance.pk is not None:
+        remember_image_names(instance)
+
+
+@receiver(post_save)
+def generate_thumbnails_on_image_save(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Generates the thumbnails of uploaded images in the background, see `cosinnus.utils.thumbnails`.
+    Partial saves are skipped, as they are not used for image uploads."""
+    if not settings.COSINNUS_THUMBNAIL_PREGENERATION_ENABLED or raw or update_fields:
+        return
+    if needs_thumbnails(instance, only_changed=True):
+        content_type = ContentType.objects.get_for_model(instance.__class__)
+        generate_thumbnails_task.delay(content_type.id, instance.pk)
+    remember_image_names(instance)
+
+
 @receiver(post_save, sender=CosinnusConferencePremiumBlock)
 def update_conference_premium_status_on_block_save(sender, instance, created=False, **kwargs):
     """Clears the cache for tags when saved/deleted"""
@@ -370,5 +514,66 @@ def handle_user_group_guest_access_logged_out(sender, user, **kwargs):
         delete_guest_user(user, deactivate_only=True)
 
 
+def _mark_user_match_features_changed(user_id):
+    if settings.COSINNUS_ENABLE_USER_MATCH and user_id:
+        transaction.on_commit(lambda: mark_user_match_features_changed(user_id))
+
+
+@receiver(post_save, sender=User)
+def user_match_user_changed(sender, instance, **kwargs):
+    """Updates the user match index when a user logs in or is (de-)activated"""
+    _mark_user_match_features_changed(instance.id)
+
+
+@receiver(post_save, sender=get_user_profile_model())
+def user_match_profile_changed(sender, instance, **kwargs):
+    """Updates the user match index when a profile is saved"""
+    _mark_user_match_features_changed(instance.user_id)
+
+
+@receiver(post_save, sender=LikeObject)
+@receiver(post_delete, sender=LikeObject)
+def user_match_like_changed(sender, instance, **kwargs):
+    """Updates the user match index when a user likes something or removes a like"""
+    _mark_user_match_features_changed(instance.user_id)
+
+
+@receiver(post_save, sender=CosinnusManagedTagAssignment)
+@receiver(post_delete, sender=CosinnusManagedTagAssignment)
+def user_match_managed_tag_changed(sender, instance, **kwargs):
+    """Updates the user match index when a managed tag is assigned to or removed from a profile"""
+    profile_model = get_user_profile_model()
+    if (
+        settings.COSINNUS_ENABLE_USER_MATCH
+        and instance.content_type_id == ContentType.objects.get_for_model(profile_model).id
+    ):
+        user_id = profile_model.objects.filter(id=instance.object_id).values_list('user_id', flat=True).first()
+        _mark_user_match_features_changed(user_id)
+
+
+def _mark_user_autocomplete_changed(user_id, portal=None):
+    if settings.COSINNUS_USER_AUTOCOMPLETE_INDEX_ENABLED and user_id:
+        transaction.on_commit(lambda: mark_user_autocomplete_changed(user_id, portal=portal))
+
+
+@receiver(post_save, sender=User)
+def user_autocomplete_user_changed(sender, instance, **kwargs):
+    """Updates the user autocomplete index when a user's name or active state changes"""
+    _mark_user_autocomplete_changed(instance.id)
+
+
+@receiver(post_save, sender=get_user_profile_model())
+def user_autocomplete_profile_changed(sender, instance, **kwargs):
+    """Updates the user autocomplete index when a profile is saved, e.g. when the ToS have been accepted"""
+    _mark_user_autocomplete_changed(instance.user_id)
+
+
+@receiver(post_save, sender=CosinnusPortalMembership)
+@receiver(post_delete, sender=CosinnusPortalMembership)
+def user_autocomplete_portal_membership_changed(sender, instance, **kwargs):
+    """Updates the user autocomplete index of the portal when a user joins or leaves it"""
+    _mark_user_autocomplete_changed(instance.user_id, portal=instance.group)
+
+
 from cosinnus.apis.cleverreach import *  # noqa
 from cosinnus.models.wagtail_models import *  # noqa
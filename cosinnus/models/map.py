@@ -3,9 +3,11 @@ from __future__ import unicode_literals
 
 import datetime
 import re
+from collections import defaultdict
 from copy import copy
 
 import pytz
+from django.contrib.contenttypes.models import ContentType
 from django.db.models import Q
 from django.template.defaultfilters import date as django_date_filter
 from django.template.defaultfilters import linebreaksbr
@@ -17,9 +19,10 @@ from haystack.query import SearchQuerySet
 
 from cosinnus.conf import settings
 from cosinnus.forms.search import filter_searchqueryset_for_read_access, get_visible_portal_ids
-from cosinnus.models.group import CosinnusPortal
+from cosinnus.models.group import CosinnusGroupMembership, CosinnusPortal
 from cosinnus.models.group_extra import CosinnusConference, CosinnusProject, CosinnusSociety
 from cosinnus.models.profile import get_user_profile_model
+from cosinnus.models.tagged import LikeableObjectMixin, LikeObject
 from cosinnus.templatetags.cosinnus_tags import textfield
 from cosinnus.utils.dates import HumanizedEventTimeObject
 from cosinnus.utils.group import message_group_admins_url
@@ -208,6 +211,8 @@ class BaseMapResult(DictResult):
         'content_count': -1,  # groups/projects: number of upcoming events
         'type': 'BaseResult',  # should be different for every class
         'liked': False,  # has the current user liked this?
+        'followed': False,  # is the current user following this?
+        'is_member': False,  # is the current user a member of this group/project/conference?
         'source': None,  # source platform if external content
         'dynamic_fields': None,
         'is_open_for_cooperation': None,
@@ -238,13 +243,21 @@ class HaystackMapResult(BaseMapResult):
             }
         )
 
-    def __init__(self, result, user=None, *args, **kwargs):
+    def __init__(self, result, user=None, *args, page_context=None, **kwargs):
+        """
+        @param page_context: A `MapResultPageContext` for the result page this result is part of. If given,
+            the per-user flags are taken from it instead of being left at their defaults
+        """
         if result.portals:
             # some results, like users, have multiple portals associated. we select one of those to show
             # the origin from
-            visible_portals = get_visible_portal_ids()
+            if page_context:
+                visible_portals = page_context.visible_portal_ids
+                current_portal_id = page_context.current_portal_id
+            else:
+                visible_portals = get_visible_portal_ids()
+                current_portal_id = CosinnusPortal.get_current().id
             displayable_portals = [port_id for port_id in result.portals if port_id in visible_portals]
-            current_portal_id = CosinnusPortal.get_current().id
             portal = (
                 current_portal_id
                 if ((not displayable_portals) or current_portal_id in displayable_portals)
@@ -284,6 +297,13 @@ class HaystackMapResult(BaseMapResult):
             'dynamic_fields': result.dynamic_fields,
             'is_open_for_cooperation': result.is_open_for_cooperation,
         }
+        if page_context:
+            fields.update(
+                {
+                    'followed': page_context.is_followed(result),
+                    'is_member': page_context.is_member(result),
+                }
+            )
         if getattr(result, 'from_date', None) and getattr(result, 'to_date', None):
             humanized_datetime_obj = HumanizedEventTimeObject(result.from_date, result.to_date)
             kwargs.update(
@@ -322,6 +342,80 @@ class HaystackMapResult(BaseMapResult):
         return super(HaystackMapResult, self).__init__(*args, **fields)
 
 
+class MapResultPageContext(object):
+    """Resolves all data the `HaystackMapResult`s of a single result page need from outside of the search index
+    in bulk, instead of once per result: the portal info, and the current user's following and membership
+    states for all results on the page."""
+
+    def __init__(self, results, user=None):
+        """
+        @param results: A list of haystack search results of the page
+        """
+        self.current_portal_id = CosinnusPortal.get_current().id
+        self.visible_portal_ids = get_visible_portal_ids()
+        self.user = user if user and user.is_authenticated else None
+        # set of (content_type_id, pk) of all followed objects on the page
+        self.followed = set()
+        self.content_types = {}
+        # set of all group ids on the page the user is a member of
+        self.member_group_ids = set()
+        if self.user:
+            internal_results = [result for result in results if self._is_internal(result)]
+            self._resolve_followed(internal_results)
+            self._resolve_memberships(internal_results)
+
+    def _resolve_followed(self, results):
+        """Gets the followed states of all likeable results with a single query"""
+        pks_by_model = defaultdict(set)
+        for result in results:
+            if result.model and issubclass(result.model, LikeableObjectMixin):
+                pks_by_model[result.model].add(int(result.pk))
+        if not pks_by_model:
+            return
+        # proxy models like projects and groups share the content type of their concrete model
+        self.content_types = ContentType.objects.get_for_models(*pks_by_model.keys())
+        pks_by_content_type = defaultdict(set)
+        for model, pks in pks_by_model.items():
+            pks_by_content_type[self.content_types[model].id].update(pks)
+        query = Q()
+        for content_type_id, pks in pks_by_content_type.items():
+            query |= Q(content_type_id=content_type_id, object_id__in=pks)
+        likes = LikeObject.objects.filter(query, user=self.user, followed=True)
+        self.followed = set(likes.values_list('content_type_id', 'object_id'))
+
+    def _resolve_memberships(self, results):
+        """Gets the user's memberships for all group results from the (bulk-filled) membership caches"""
+        group_ids = [int(result.pk) for result in results if result.model in MAP_GROUP_MODELS]
+        if not group_ids:
+            return
+        members = CosinnusGroupMembership.objects.get_members(groups=group_ids)
+        self.member_group_ids = set([group_id for group_id, user_ids in members.items() if self.user.id in user_ids])
+
+    def _is_internal(self, result):
+        """External results from the exchange have no DB objects and therefore no per-user data"""
+        return bool(result.pk) and result.portal != settings.COSINNUS_EXCHANGE_PORTAL_ID
+
+    def is_followed(self, result):
+        content_type = self.content_types.get(result.model, None)
+        if not self.user or content_type is None or not self._is_internal(result):
+            return False
+        return (content_type.id, int(result.pk)) in self.followed
+
+    def is_member(self, result):
+        if not self.user or result.model not in MAP_GROUP_MODELS or not self._is_internal(result):
+            return False
+        return int(result.pk) in self.member_group_ids
+
+
+def build_map_results(results, user=None):
+    """Wraps a page of haystack search results into `HaystackMapResult`s, resolving all data needed
+    from outside of the search index in bulk for the whole page.
+    @return: A list of `HaystackMapResult`"""
+    results = list(results)
+    page_context = MapResultPageContext(results, user=user)
+    return [HaystackMapResult(result, user=user, page_context=page_context) for result in results]
+
+
 class DetailedMapResult(HaystackMapResult):
     """Takes a Haystack Search Result and the actual Model Instance of that result and combines both of them"""
 
@@ -732,6 +826,9 @@ SEARCH_MODEL_NAMES = {
     CosinnusOrganization: 'organizations',
 }
 
+# search result models that are CosinnusGroups with memberships
+MAP_GROUP_MODELS = (CosinnusProject, CosinnusSociety, CosinnusConference)
+
 SHORT_MODEL_MAP = {
     1: CosinnusProject,
     2: CosinnusSociety,
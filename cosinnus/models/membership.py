@@ -1,3 +1,7 @@
+import time
+from array import array
+from collections import defaultdict
+
 import six
 from django.conf import settings
 from django.contrib.auth import get_user_model
@@ -52,6 +56,31 @@ _MEMBERSHIP_MEMBERS_KEY = 'cosinnus/core/membership/%s/members/%d'
 _MEMBERSHIP_PENDINGS_KEY = 'cosinnus/core/membership/%s/pendings/%d'
 _MEMBERSHIP_INVITED_PENDINGS_KEY = 'cosinnus/core/membership/%s/invited_pendings/%d'
 _MEMBERSHIP_MANAGERS_KEY = 'cosinnus/core/membership/%s/managers/%d'
+# user id --> (generation, {group id: status})
+_MEMBERSHIP_USER_INDEX_KEY = 'cosinnus/core/membership/%s/user_index/%d'
+_MEMBERSHIP_USER_INDEX_GENERATION_KEY = 'cosinnus/core/membership/%s/user_index_generation'
+
+#: All membership cache keys and the membership statuses whose user ids are stored under them
+_MEMBERSHIP_CACHE_KEYS_AND_STATUSES = (
+    (_MEMBERSHIP_MEMBERS_KEY, MEMBER_STATUS),
+    (_MEMBERSHIP_ADMINS_KEY, (MEMBERSHIP_ADMIN,)),
+    (_MEMBERSHIP_MANAGERS_KEY, (MEMBERSHIP_MANAGER,)),
+    (_MEMBERSHIP_PENDINGS_KEY, (MEMBERSHIP_PENDING,)),
+    (_MEMBERSHIP_INVITED_PENDINGS_KEY, (MEMBERSHIP_INVITED_PENDING,)),
+)
+
+#: Maximum number of group ids used in a single `group_id__in` query when batch-filling the membership caches
+MEMBERSHIP_CACHE_FILL_CHUNK_SIZE = 500
+
+#: Type code of the arrays the user ids of a group's membership caches are stored as. A sorted array of
+#: 32-bit ints is pickled as a single bytes object, which is a fraction of the size of a pickled list of ints
+#: and much faster to unpickle for large groups and portals.
+MEMBERSHIP_CACHE_ARRAY_TYPECODE = 'i'
+
+
+def compact_user_ids(user_ids):
+    """Returns the compact representation of a list of user ids stored in the membership caches"""
+    return array(MEMBERSHIP_CACHE_ARRAY_TYPECODE, sorted(user_ids))
 
 
 class CosinnusGroupMembershipQS(models.query.QuerySet):
@@ -61,14 +90,17 @@ class CosinnusGroupMembershipQS(models.query.QuerySet):
         return self.filter(status=status)
 
     def update(self, **kwargs):
+        # the updated memberships may no longer match the filters of this QS, so collect them beforehand
+        user_ids_by_group = defaultdict(set)
+        for group_id, user_id in self.values_list('group_id', 'user_id'):
+            user_ids_by_group[group_id].add(user_id)
         ret = super(CosinnusGroupMembershipQS, self).update(**kwargs)
-        groups = set()
-        for membership in self:
-            if membership.group.id in groups:
-                continue
-            membership._refresh_cache()
-            membership.group.update_index()
-            groups.add(membership.group.id)
+        if user_ids_by_group:
+            group_model = self.model._meta.get_field('group').related_model
+            for group in group_model._base_manager.filter(id__in=list(user_ids_by_group)):
+                self.model.clear_member_cache_for_group(group, user_ids=user_ids_by_group[group.id])
+                group.update_index()
+            self.model.objects._fill_caches_for_multiple_groups(list(user_ids_by_group))
         return ret
 
 
@@ -90,25 +122,96 @@ class BaseMembershipManager(models.Manager):
         uids = cache.get(key)
         if uids is None or clear_cache:
             query = self.filter(group_id=group_id).filter_membership_status(status)
-            uids = list(query.values_list('user_id', flat=True).all())
+            uids = compact_user_ids(query.values_list('user_id', flat=True).all())
             cache.set(key, uids, settings.COSINNUS_GROUP_MEMBERSHIP_CACHE_TIMEOUT)
             """
             TODO: FIXME: bc of some bug, this cache key is often reset/cleared and read in again on each query!!
                          The cache on this key seems not to get cleared from code, so no clue what's going on here.
             """
-        return uids
+        return list(uids)
+
+    def _fill_caches_for_multiple_groups(self, group_ids):
+        """Fetches the memberships of all given groups in as few queries as possible and fills
+        all status-keyed membership caches (members, admins, managers, pendings, invited pendings)
+        for these groups at once.
+        @return: A dict of all filled cache keys -> list of user ids"""
+        group_ids = list(set(group_ids))
+        filled = {}
+        for cache_key, __ in _MEMBERSHIP_CACHE_KEYS_AND_STATUSES:
+            for group_id in group_ids:
+                filled[cache_key % (self.model.CACHE_KEY_MODEL, group_id)] = []
+        for i in range(0, len(group_ids), MEMBERSHIP_CACHE_FILL_CHUNK_SIZE):
+            chunk = group_ids[i : i + MEMBERSHIP_CACHE_FILL_CHUNK_SIZE]
+            query = self.filter(group_id__in=chunk).values_list('group_id', 'user_id', 'status')
+            for group_id, user_id, status in query:
+                for cache_key, statuses in _MEMBERSHIP_CACHE_KEYS_AND_STATUSES:
+                    if status in statuses:
+                        filled[cache_key % (self.model.CACHE_KEY_MODEL, group_id)].append(user_id)
+        for uids in filled.values():
+            uids.sort()
+        if filled:
+            cache.set_many(
+                {key: compact_user_ids(uids) for key, uids in filled.items()},
+                settings.COSINNUS_GROUP_MEMBERSHIP_CACHE_TIMEOUT,
+            )
+        return filled
 
     def _get_users_for_multiple_groups(self, group_ids, cache_key, status):
         keys = [cache_key % (self.model.CACHE_KEY_MODEL, g) for g in group_ids]
         users = cache.get_many(keys)
         missing = list(map(int, (key.split('/')[-1] for key in keys if key not in users)))
         if missing:
-            _q = self.filter_membership_status(status).values_list('user_id', flat=True)
+            # fill the caches of all statuses for the missing groups, as they will likely be needed soon
+            filled = self._fill_caches_for_multiple_groups(missing)
             for group in missing:
-                uids = list(_q._clone().filter(group_id=group).all())
-                users[cache_key % (self.model.CACHE_KEY_MODEL, group)] = uids
-            cache.set_many(users, settings.COSINNUS_GROUP_MEMBERSHIP_CACHE_TIMEOUT)
-        return {int(k.split('/')[-1]): v for k, v in six.iteritems(users)}
+                key = cache_key % (self.model.CACHE_KEY_MODEL, group)
+                users[key] = filled[key]
+        return {int(k.split('/')[-1]): list(v) for k, v in six.iteritems(users)}
+
+    def prefetch_membership_caches(self, group_ids):
+        """Makes sure all membership caches (members, admins, managers, pendings, invited pendings)
+        are filled for the given groups, using a single query for all groups with missing caches.
+        Views listing many groups should call this up front, so that subsequent membership checks
+        on these groups don't cause one query per group and status.
+        @param group_ids: A list of group ids or group objects
+        @return: The number of groups whose caches had to be filled"""
+        gids = set([isinstance(g, int) and g or g.pk for g in group_ids])
+        if not gids:
+            return 0
+        keys = [
+            cache_key % (self.model.CACHE_KEY_MODEL, gid)
+            for cache_key, __ in _MEMBERSHIP_CACHE_KEYS_AND_STATUSES
+            for gid in gids
+        ]
+        cached = cache.get_many(keys)
+        missing = set([int(key.split('/')[-1]) for key in keys if key not in cached])
+        if missing:
+            self._fill_caches_for_multiple_groups(missing)
+        return len(missing)
+
+    def get_user_group_statuses(self, user_id):
+        """Returns the memberships of a single user from the per-user reverse index of the membership caches.
+        Checking a user's status in a group this way only needs to load the user's own memberships,
+        no matter how many members the group or portal has.
+        @return: A dict of group id --> membership status"""
+        if not user_id:
+            return {}
+        index_key = _MEMBERSHIP_USER_INDEX_KEY % (self.model.CACHE_KEY_MODEL, user_id)
+        generation_key = _MEMBERSHIP_USER_INDEX_GENERATION_KEY % self.model.CACHE_KEY_MODEL
+        cached = cache.get_many([index_key, generation_key])
+        generation = cached.get(generation_key, None)
+        if generation is None:
+            generation = self.model.clear_user_index_cache()
+        index = cached.get(index_key, None)
+        if index is not None and index[0] == generation:
+            return index[1]
+        statuses = dict(self.filter(user_id=user_id).values_list('group_id', 'status'))
+        cache.set(index_key, (generation, statuses), settings.COSINNUS_GROUP_MEMBERSHIP_CACHE_TIMEOUT)
+        return statuses
+
+    def get_user_group_status(self, user_id, group_id):
+        """Returns the membership status of a user in a group, or None if the user has no membership"""
+        return self.get_user_group_statuses(user_id).get(group_id, None)
 
     def get_admins(self, group=None, groups=None):
         """
@@ -237,28 +340,18 @@ class BaseMembership(models.Model):
         self._clear_cache()
 
     def _clear_cache(self):
-        self.clear_member_cache_for_group(self.group)
+        self.clear_member_cache_for_group(self.group, user_ids=[self.user_id])
 
     def _refresh_cache(self):
-        self.clear_member_cache_for_group(self.group)
-        type(self).objects._get_users_for_single_group(
-            self.group.id, _MEMBERSHIP_MEMBERS_KEY, MEMBER_STATUS, clear_cache=True
-        )
-        type(self).objects._get_users_for_single_group(
-            self.group.id, _MEMBERSHIP_ADMINS_KEY, MEMBERSHIP_ADMIN, clear_cache=True
-        )
-        type(self).objects._get_users_for_single_group(
-            self.group.id, _MEMBERSHIP_PENDINGS_KEY, MEMBERSHIP_PENDING, clear_cache=True
-        )
-        type(self).objects._get_users_for_single_group(
-            self.group.id, _MEMBERSHIP_INVITED_PENDINGS_KEY, MEMBERSHIP_INVITED_PENDING, clear_cache=True
-        )
-        type(self).objects._get_users_for_single_group(
-            self.group.id, _MEMBERSHIP_MANAGERS_KEY, MEMBERSHIP_MANAGER, clear_cache=True
-        )
+        self.clear_member_cache_for_group(self.group, user_ids=[self.user_id])
+        type(self).objects._fill_caches_for_multiple_groups([self.group.id])
 
     @classmethod
-    def clear_member_cache_for_group(cls, group):
+    def clear_member_cache_for_group(cls, group, user_ids=None):
+        """Clears the membership caches of a group.
+        @param user_ids: The ids of the users whose memberships in the group changed. If not given, the
+            reverse indexes of the group's current members and of the users in its cached membership lists
+            are invalidated."""
         keys = [
             _MEMBERSHIP_ADMINS_KEY % (cls.CACHE_KEY_MODEL, group.pk),
             _MEMBERSHIP_MEMBERS_KEY % (cls.CACHE_KEY_MODEL, group.pk),
@@ -266,9 +359,24 @@ class BaseMembership(models.Model):
             _MEMBERSHIP_INVITED_PENDINGS_KEY % (cls.CACHE_KEY_MODEL, group.pk),
             _MEMBERSHIP_MANAGERS_KEY % (cls.CACHE_KEY_MODEL, group.pk),
         ]
+        if user_ids is None:
+            # the cached lists also contain the users whose memberships have been removed since
+            user_ids = set(cls.objects.filter(group_id=group.pk).values_list('user_id', flat=True))
+            for cached_user_ids in cache.get_many(keys).values():
+                user_ids.update(cached_user_ids)
+        keys.extend([_MEMBERSHIP_USER_INDEX_KEY % (cls.CACHE_KEY_MODEL, user_id) for user_id in user_ids])
         cache.delete_many(keys)
         group.clear_cache()
 
+    @classmethod
+    def clear_user_index_cache(cls):
+        """Invalidates the per-user reverse indexes of all users by starting a new generation.
+        A timestamp-based generation never repeats a previous one, even if the generation key was evicted.
+        @return: The new generation"""
+        generation = int(time.time() * 1000)
+        cache.set(_MEMBERSHIP_USER_INDEX_GENERATION_KEY % cls.CACHE_KEY_MODEL, generation, None)
+        return generation
+
     def user_email(self):
         return self.user.email
 
@@ -280,6 +388,12 @@ class MembershipClassMixin(object):
 class MembersManagerMixin(object):
     membership_class = None
 
+    def get_membership_status(self, user):
+        """Returns the membership status of the given user or user id in this group, or None if
+        the user has no membership. Uses the per-user reverse index of the membership caches."""
+        uid = isinstance(user, int) and user or user.pk
+        return self.membership_class.objects.get_user_group_status(uid, self.pk)
+
     @property
     def admins(self):
         return self.membership_class.objects.get_admins(self.pk)
@@ -293,8 +407,7 @@ class MembersManagerMixin(object):
 
     def is_admin(self, user):
         """Checks whether the given user is an admin of this group"""
-        uid = isinstance(user, int) and user or user.pk
-        return uid in self.admins
+        return self.get_membership_status(user) == MEMBERSHIP_ADMIN
 
     @property
     def members(self):
@@ -331,8 +444,7 @@ class MembersManagerMixin(object):
 
     def is_member(self, user):
         """Checks whether the given user is a member of this group"""
-        uid = isinstance(user, int) and user or user.pk
-        return uid in self.members
+        return self.get_membership_status(user) in MEMBER_STATUS
 
     @property
     def pendings(self):
@@ -340,8 +452,7 @@ class MembersManagerMixin(object):
 
     def is_pending(self, user):
         """Checks whether the given user has a pending status on this group"""
-        uid = isinstance(user, int) and user or user.pk
-        return uid in self.pendings
+        return self.get_membership_status(user) == MEMBERSHIP_PENDING
 
     @property
     def actual_pendings(self):
@@ -359,8 +470,7 @@ class MembersManagerMixin(object):
 
     def is_invited_pending(self, user):
         """Checks whether the given user has a pending invitation status on this group"""
-        uid = isinstance(user, int) and user or user.pk
-        return uid in self.invited_pendings
+        return self.get_membership_status(user) == MEMBERSHIP_INVITED_PENDING
 
     @property
     def actual_invited_pendings(self):
@@ -385,8 +495,7 @@ class MembersManagerMixin(object):
 
     def is_manager(self, user):
         """Checks whether the given user is an admin of this group"""
-        uid = isinstance(user, int) and user or user.pk
-        return uid in self.managers
+        return self.get_membership_status(user) == MEMBERSHIP_MANAGER
 
     def clear_member_cache(self):
         self.membership_class.clear_member_cache_for_group(self)
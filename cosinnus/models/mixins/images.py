@@ -17,6 +17,12 @@ logger = logging.getLogger('cosinnus')
 
 
 class ThumbnailableImageMixin(object):
+    """Provides static, resized copies of an image field in the media folder.
+
+    Models using this mixin should define a field `image_thumbnails_source` (see `generate_thumbnails`),
+    in which the name of the image is recorded once all its copies have been generated, so that their
+    URLs can be returned without checking the media folder."""
+
     image_attr_name = None  # must be defined!
 
     def __init__(self, *args, **kwargs):
@@ -58,7 +64,8 @@ class ThumbnailableImageMixin(object):
 
         # if image is not in media dir yet, resize and copy it
         imagepath_local = join(settings.MEDIA_ROOT, media_image_path)
-        if not exists(imagepath_local):
+        if not self.has_generated_thumbnails and not exists(imagepath_local):
+            self._ensure_media_image_folder()
             try:
                 shutil.copy(getattr(self, self.image_attr_name).path, imagepath_local)
             except IOError:
@@ -89,7 +96,7 @@ class ThumbnailableImageMixin(object):
 
         # if image is not in media dir yet, resize and copy it
         imagepath_local = join(settings.MEDIA_ROOT, media_image_path)
-        if not exists(imagepath_local):
+        if not self.has_generated_thumbnails and not exists(imagepath_local):
             thumbnailer = get_thumbnailer(getattr(self, self.image_attr_name))
             try:
                 thumbnail = thumbnailer.get_thumbnail(
@@ -113,6 +120,7 @@ class ThumbnailableImageMixin(object):
 
             if not thumbnail:
                 return ''
+            self._ensure_media_image_folder()
             try:
                 shutil.copy(thumbnail.path, imagepath_local)
             except IOError:
@@ -125,12 +133,42 @@ class ThumbnailableImageMixin(object):
     def static_image_url_thumbnail(self):
         return self.static_image_url(settings.COSINNUS_IMAGE_THUMBNAIL_SIZE_SCALE, 'small')
 
+    def get_thumbnail_sizes(self):
+        """Returns all sizes in which the image is displayed, as list of (size, filename_modifier),
+        see `static_image_url`"""
+        return [
+            (None, None),
+            (settings.COSINNUS_IMAGE_THUMBNAIL_SIZE_SCALE, 'small'),
+        ]
+
+    @property
+    def has_generated_thumbnails(self):
+        """True if all copies of the current image have been generated by `generate_thumbnails`"""
+        image = getattr(self, self.image_attr_name)
+        return bool(image) and getattr(self, 'image_thumbnails_source', None) == image.name
+
+    def generate_thumbnails(self):
+        """Generates the original copy and all sizes of the image in the media folder, and records the image
+        name in the `image_thumbnails_source` field if the model has one.
+        @return: True if all copies could be generated"""
+        image = getattr(self, self.image_attr_name)
+        if not image or not self.is_image:
+            return False
+        self.static_image_original_url()
+        for size, filename_modifier in self.get_thumbnail_sizes():
+            if not self.static_image_url(size, filename_modifier):
+                return False
+        if hasattr(self, 'image_thumbnails_source') and self.pk:
+            self.image_thumbnails_source = image.name
+            self.__class__._default_manager.filter(pk=self.pk).update(image_thumbnails_source=image.name)
+        return True
+
+    def _ensure_media_image_folder(self):
+        os.makedirs(join(settings.MEDIA_ROOT, 'cosinnus_files', 'image_thumbnails'), exist_ok=True)
+
     def get_media_image_path(self, filename_modifier=None):
         """Gets the unique path for each image file in the media directory"""
         mediapath = join('cosinnus_files', 'image_thumbnails')
-        mediapath_local = join(settings.MEDIA_ROOT, mediapath)
-        if not exists(mediapath_local):
-            os.makedirs(mediapath_local)
         filename_modifier = '_' + filename_modifier if filename_modifier else ''
         image_filename = (
             getattr(self, self.image_attr_name).path.split(os.sep)[-1]
@@ -1,13 +1,20 @@
+import csv
 import datetime
 import logging
+import os
 import pickle
+import tempfile
+import uuid
 import zlib
 from abc import ABC, abstractmethod
 from threading import Thread
-from typing import Any, Dict, Iterable, List, Literal, Optional
+from typing import Any, Dict, Iterable, List, Literal, Optional, Tuple
 
+import xlsxwriter
 from django.contrib.auth import get_user_model
 from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist
+from django.core.files import File
 from django.db.models import Model, QuerySet
 from django.utils import timezone, translation
 from django.utils.timezone import now
@@ -17,6 +24,7 @@ from cosinnus.conf import settings
 from cosinnus.dynamic_fields import dynamic_fields
 from cosinnus.models.group import CosinnusPortal
 from cosinnus.models.storage import TemporaryData
+from cosinnus.utils.files import get_cosinnus_media_file_folder
 from cosinnus.utils.group import get_cosinnus_group_model
 
 
@@ -24,8 +32,15 @@ class ModelExportProcessor(ABC):
     """
     A threaded and extendable model export processor. Exports the data specified in CSV_EXPORT_COLUMNS_TO_FIELD_MAP as
     CSV. Keeping the export state in the cache. The exported CSV data is stored in a TemporaryData object.
+
+    With STREAMING_EXPORT enabled, the queryset is iterated in chunks and the CSV and XLSX files are written
+    row by row to files in storage, so the memory use does not grow with the number of exported objects.
     """
 
+    # Export file formats
+    FORMAT_CSV = 'csv'
+    FORMAT_XLSX = 'xlsx'
+
     # Export processor states
     STATE_EXPORT_READY = 'ready'
     STATE_EXPORT_RUNNING = 'running'
@@ -49,16 +64,24 @@ class ModelExportProcessor(ABC):
 
     CSV_EXPORT_COLUMNS_TO_FIELD_MAP: Dict[str, str] = {}
 
+    # If True, the export is streamed to CSV and XLSX files in storage instead of being kept in memory
+    STREAMING_EXPORT = True
+
+    # Number of objects fetched from the DB at once and number of rows between progress updates in streaming exports
+    EXPORT_CHUNK_SIZE = 2000
+
     # Timeout for the export data
     EXPORT_CACHE_TIMEOUT = 60 * 60 * 24  # 1 day
 
     _EXPORT_CACHE_KEY_FORMAT = 'cosinnus/core/portal/%d/export/%s/%s'
 
-    def _get_cache_key(self, cache_type: Literal['state', 'data_id', 'timestamp']) -> str:
+    def _get_cache_key(self, cache_type: Literal['state', 'data_id', 'timestamp', 'file_ids', 'progress']) -> str:
         """
         :param cache_type: state: Current export state,
                            data_id: TemporaryData instance id containing the latest finished csv export data,
                            timestamp: Timestamp of the latest finished csv export
+                           file_ids: Dict of file format to TemporaryData instance id of a streaming export file
+                           progress: Tuple of (exported rows, total rows) of the running streaming export
         :return: complete cache key for the current class
         """
         return self._EXPORT_CACHE_KEY_FORMAT % (CosinnusPortal.get_current().id, type(self).__name__, cache_type)
@@ -97,6 +120,39 @@ class ModelExportProcessor(ABC):
         else:
             return None
 
+    def set_current_export_files(self, file_paths: Dict[str, str]) -> None:
+        """
+        Moves the finished streaming export files to storage. Each file is referenced by a TemporaryData instance,
+        that deletes the file along with it. The instance ids are stored in the cache.
+        """
+        delete_data_after = now() + datetime.timedelta(seconds=self.EXPORT_CACHE_TIMEOUT)
+        file_ids = {}
+        for file_format, file_path in file_paths.items():
+            storage_name = os.path.join(
+                get_cosinnus_media_file_folder(), 'exports', f'{uuid.uuid4().hex}.{file_format}'
+            )
+            temporary_data = TemporaryData(deletion_after=delete_data_after, description='Export File')
+            with open(file_path, 'rb') as export_file:
+                temporary_data.file.save(storage_name, File(export_file), save=False)
+            temporary_data.save()
+            file_ids[file_format] = temporary_data.id
+        cache.set(self._get_cache_key('file_ids'), file_ids, self.EXPORT_CACHE_TIMEOUT)
+
+    def get_current_export_file(self, file_format: str):
+        """Returns the stored file of the latest finished streaming export for the given format, or None."""
+        file_ids = cache.get(self._get_cache_key('file_ids')) or {}
+        temporary_data = TemporaryData.objects.filter(id=file_ids.get(file_format)).first()
+        if temporary_data and temporary_data.file:
+            return temporary_data.file
+        return None
+
+    def set_current_export_progress(self, exported: int, total: int) -> None:
+        cache.set(self._get_cache_key('progress'), (exported, total), self.EXPORT_CACHE_TIMEOUT)
+
+    def get_current_export_progress(self) -> Optional[Tuple[int, int]]:
+        """Returns a tuple of (exported rows, total rows) for a running streaming export."""
+        return cache.get(self._get_cache_key('progress'))
+
     def set_current_export_timestamp(self, timestamp):
         cache.set(self._get_cache_key('timestamp'), timestamp, self.EXPORT_CACHE_TIMEOUT)
 
@@ -104,9 +160,16 @@ class ModelExportProcessor(ABC):
         return cache.get(self._get_cache_key('timestamp'))
 
     def delete_export_cache(self):
+        file_ids = cache.get(self._get_cache_key('file_ids'))
+        if file_ids:
+            # delete one-by-one so the files are removed from storage as well
+            for temporary_data in TemporaryData.objects.filter(id__in=file_ids.values()):
+                temporary_data.delete()
         cache.delete(self._get_cache_key('state'))
         cache.delete(self._get_cache_key('data_id'))
         cache.delete(self._get_cache_key('timestamp'))
+        cache.delete(self._get_cache_key('file_ids'))
+        cache.delete(self._get_cache_key('progress'))
 
     def get_state(self):
         """Returns the current processor state."""
@@ -119,6 +182,48 @@ class ModelExportProcessor(ABC):
         """Model queryset used for the export."""
         raise NotImplementedError()
 
+    def get_related_lookups_for_field(self, model, field: str, prefix: str = '') -> Tuple[List[str], List[str]]:
+        """
+        Returns the select_related and prefetch_related lookups needed to export the given field of the model
+        without additional queries per row.
+        """
+        try:
+            model_field = model._meta.get_field(field)
+        except FieldDoesNotExist:
+            return [], []
+        if not model_field.is_relation:
+            return [], []
+        if model_field.many_to_many or model_field.one_to_many or model_field.related_model is None:
+            # to-many relations and generic foreign keys can only be prefetched
+            return [], [prefix + field]
+        return [prefix + field], []
+
+    def get_related_lookups(self) -> Tuple[List[str], List[str]]:
+        """
+        Returns the select_related and prefetch_related lookups derived from the model fields in
+        CSV_EXPORT_COLUMNS_TO_FIELD_MAP. Custom processor functions are not considered, override this to add their
+        lookups.
+        """
+        model = self.get_model_queryset().model
+        select_related, prefetch_related = [], []
+        for field in self.CSV_EXPORT_COLUMNS_TO_FIELD_MAP.values():
+            if hasattr(self, field):
+                continue
+            field_select_related, field_prefetch_related = self.get_related_lookups_for_field(model, field)
+            select_related.extend(field_select_related)
+            prefetch_related.extend(field_prefetch_related)
+        return select_related, prefetch_related
+
+    def get_export_queryset(self) -> QuerySet:
+        """The model queryset including the related lookups needed for the export."""
+        qs = self.get_model_queryset()
+        select_related, prefetch_related = self.get_related_lookups()
+        if select_related:
+            qs = qs.select_related(*set(select_related))
+        if prefetch_related:
+            qs = qs.prefetch_related(*set(prefetch_related))
+        return qs
+
     def get_header(self) -> List[str]:
         """Returns the export CSV header. Default: CSV_EXPORT_COLUMNS_TO_FIELD_MAP keys."""
         return list(self.CSV_EXPORT_COLUMNS_TO_FIELD_MAP.keys())
@@ -183,19 +288,79 @@ class ModelExportProcessor(ABC):
             self.delete_export_cache()
             self.set_current_export_state(self.STATE_EXPORT_ERROR)
 
+    def _write_export_files(self, queryset: QuerySet, file_paths: Dict[str, str]) -> None:
+        """Iterates the queryset in chunks and writes each row to the CSV and XLSX files."""
+        total = queryset.count()
+        self.set_current_export_progress(0, total)
+        header = self.get_header()
+        with open(file_paths[self.FORMAT_CSV], 'w', newline='', encoding='utf-8') as csv_file:
+            # constant_memory makes xlsxwriter flush each row to disk once the next row is started
+            workbook = xlsxwriter.Workbook(
+                file_paths[self.FORMAT_XLSX],
+                {'constant_memory': True, 'strings_to_formulas': False, 'remove_timezone': True},
+            )
+            worksheet = workbook.add_worksheet()
+            csv_writer = csv.writer(csv_file)
+            csv_writer.writerow(header)
+            worksheet.write_row(0, 0, [str(item) for item in header])
+            exported = 0
+            # set translation language to server-default so exports are comparable
+            with translation.override(settings.LANGUAGE_CODE):
+                for obj in queryset.iterator(chunk_size=self.EXPORT_CHUNK_SIZE):
+                    export_row = self._export_single_model_row(obj)
+                    csv_writer.writerow(export_row)
+                    exported += 1
+                    worksheet.write_row(exported, 0, export_row)
+                    if exported % self.EXPORT_CHUNK_SIZE == 0:
+                        self.set_current_export_progress(exported, total)
+            workbook.close()
+        self.set_current_export_progress(exported, total)
+
+    def _start_streaming_export(self, queryset: QuerySet) -> None:
+        """
+        Main streaming export function that can be called in a thread. Writes the export data to temporary CSV and
+        XLSX files and moves them to storage when finished. Sets the state, progress and file cache values according
+        to the progress.
+        """
+        self.delete_export_cache()
+        self.set_current_export_state(self.STATE_EXPORT_RUNNING)
+        self.set_current_export_timestamp(now())
+        file_paths = {}
+        try:
+            for file_format in (self.FORMAT_CSV, self.FORMAT_XLSX):
+                file_descriptor, file_paths[file_format] = tempfile.mkstemp(suffix=f'.{file_format}')
+                os.close(file_descriptor)
+            self._write_export_files(queryset, file_paths)
+            self.set_current_export_files(file_paths)
+            self.set_current_export_state(self.STATE_EXPORT_FINISHED)
+        except Exception as e:
+            logging.exception(e)
+            self.delete_export_cache()
+            self.set_current_export_state(self.STATE_EXPORT_ERROR)
+        finally:
+            for file_path in file_paths.values():
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+
     def do_export(self, threaded=True) -> None:
         """Does a threaded data export. Threading can be disabled via the threaded parameter."""
-        objects = list(self.get_model_queryset())
+        if self.STREAMING_EXPORT:
+            queryset = self.get_export_queryset()
+            export_function = self._start_streaming_export
+            export_args = (queryset,)
+        else:
+            objects = list(self.get_model_queryset())
+            export_function = self._start_export
+            export_args = (objects,)
         if threaded:
-            my_self = self
 
             class CosinnusExportProcessThread(Thread):
                 def run(self):
-                    my_self._start_export(objects)
+                    export_function(*export_args)
 
             CosinnusExportProcessThread().start()
         else:
-            self._start_export(objects)
+            export_function(*export_args)
 
     def delete_export(self) -> None:
         """Deletes all export data."""
@@ -226,6 +391,21 @@ class UserExportProcessorBase(ModelExportProcessor):
             }
         )
 
+    def get_related_lookups(self) -> Tuple[List[str], List[str]]:
+        """Adds the lookups for related fields of the cosinnus_profile."""
+        select_related, prefetch_related = super().get_related_lookups()
+        user_model = get_user_model()
+        profile_model = user_model._meta.get_field('cosinnus_profile').related_model
+        for field in self.CSV_EXPORT_COLUMNS_TO_FIELD_MAP.values():
+            if hasattr(self, field) or hasattr(user_model, field):
+                continue
+            field_select_related, field_prefetch_related = self.get_related_lookups_for_field(
+                profile_model, field, prefix='cosinnus_profile__'
+            )
+            select_related.extend(field_select_related)
+            prefetch_related.extend(field_prefetch_related)
+        return select_related, prefetch_related
+
     def get_model_queryset(self) -> QuerySet:
         """User queryset used for the user export."""
         qs = get_user_model().objects.all()
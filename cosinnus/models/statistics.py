@@ -23,3 +23,43 @@ class UserOnlineOnDay(models.Model):
         verbose_name_plural = _('User Online on Day')
         ordering = ['-date']
         unique_together = (('date', 'user'),)
+
+
+class StatisticsRollup(models.Model):
+    """A precomputed value of a statistics metric for a single period of a portal, as shown in the
+    `SimpleStatisticsView`. Filled by the `RollupStatistics` cronjob and the `rollup_statistics` command.
+    Additive metrics (counts of created objects) are only stored per day. Metrics counting distinct
+    entries (like active users) are also stored for each completed week, month and year, as their
+    daily values can not be summed up."""
+
+    PERIOD_DAY = 'day'
+    PERIOD_WEEK = 'week'
+    PERIOD_MONTH = 'month'
+    PERIOD_YEAR = 'year'
+
+    PERIOD_CHOICES = (
+        (PERIOD_DAY, _('Day')),
+        (PERIOD_WEEK, _('Week')),
+        (PERIOD_MONTH, _('Month')),
+        (PERIOD_YEAR, _('Year')),
+    )
+
+    portal = models.ForeignKey(
+        'cosinnus.CosinnusPortal',
+        verbose_name=_('Portal'),
+        related_name='statistics_rollups',
+        on_delete=models.CASCADE,
+    )
+    metric = models.CharField(_('Metric'), max_length=50)
+    period = models.CharField(_('Period'), max_length=5, choices=PERIOD_CHOICES)
+    period_start = models.DateField(_('Period start'))
+    value = models.PositiveIntegerField(_('Value'), default=0)
+
+    class Meta:
+        verbose_name = _('Statistics rollup')
+        verbose_name_plural = _('Statistics rollups')
+        ordering = ['portal', 'metric', 'period', 'period_start']
+        unique_together = (('portal', 'metric', 'period', 'period_start'),)
+
+    def __str__(self):
+        return f'{self.metric} {self.period} {self.period_start}: {self.value}'
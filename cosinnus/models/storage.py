@@ -1,8 +1,12 @@
 import logging
 
 from django.db import models
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
 from django.utils.translation import gettext_lazy as _
 
+from cosinnus.utils.files import get_private_file_storage
+
 logger = logging.getLogger('cosinnus')
 
 
@@ -10,9 +14,24 @@ class TemporaryData(models.Model):
     created = models.DateTimeField(verbose_name=_('Created'), editable=False, auto_now_add=True)
     deletion_after = models.DateTimeField(verbose_name=_('Deletion after'))
     description = models.CharField(max_length=255, verbose_name=_('Description'))
-    data = models.BinaryField(verbose_name=_('Data'))
+    data = models.BinaryField(verbose_name=_('Data'), blank=True, default=b'')
+    # for large data, a file in the private storage can be used instead of `data`. it is deleted along with the
+    # instance. as it is not publicly accessible, it must be served by a view that checks permissions
+    file = models.FileField(
+        verbose_name=_('File'), blank=True, null=True, max_length=250, storage=get_private_file_storage
+    )
 
     class Meta:
         verbose_name = _('Temporary Data')
         verbose_name_plural = _('Temporary Data')
         ordering = ['-created']
+
+
+@receiver(post_delete, sender=TemporaryData)
+def delete_temporary_data_file(sender, instance, **kwargs):
+    """Removes the stored file of deleted TemporaryData instances"""
+    if instance.file:
+        try:
+            instance.file.delete(save=False)
+        except Exception as e:
+            logger.warning('Could not delete the file of a TemporaryData object.', extra={'exception': e})
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.contrib.contenttypes.fields import GenericForeignKey
+from django.contrib.contenttypes.models import ContentType
+from django.db import models
+from django.utils.translation import gettext_lazy as _
+
+from cosinnus.conf import settings
+
+
+class TimelineEntry(models.Model):
+    """
+    A materialized entry of the v2 dashboard timeline. Each entry marks an object as a candidate for a user's
+    timeline, sorted by the object's `last_action`, so that a timeline page can be read as a single indexed
+    range instead of combining several filtered querysets on each request.
+
+    Entries with a user are created for all members of the object's group. Entries without a user are
+    portal-wide entries for objects that every user may see in their timeline (public content and ideas).
+    Entries are only candidates: the items are still filtered for the user's permissions when the page is
+    rendered, so stale entries are harmless. See `cosinnus.utils.timeline`.
+    """
+
+    portal = models.ForeignKey(
+        'cosinnus.CosinnusPortal',
+        verbose_name=_('Portal'),
+        related_name='+',
+        on_delete=models.CASCADE,
+    )
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        verbose_name=_('User'),
+        related_name='+',
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        help_text='The user in whose timeline the object appears. Empty for portal-wide entries.',
+    )
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    target_object = GenericForeignKey('content_type', 'object_id')
+
+    group = models.ForeignKey(
+        settings.COSINNUS_GROUP_OBJECT_MODEL,
+        verbose_name=_('Group'),
+        related_name='+',
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+    )
+    last_action = models.DateTimeField(verbose_name='Last action date')
+    is_forum = models.BooleanField(
+        default=False, help_text='Whether the object is from a default user group (the Forum) or is an idea.'
+    )
+    is_public = models.BooleanField(default=False, help_text='Whether the object is visible to everyone.')
+
+    class Meta(object):
+        app_label = 'cosinnus'
+        ordering = ('-last_action',)
+        indexes = [
+            models.Index(fields=['portal', 'user', '-last_action']),
+            models.Index(fields=['content_type', 'object_id']),
+            models.Index(fields=['user', 'group']),
+        ]
+        verbose_name = _('Timeline entry')
+        verbose_name_plural = _('Timeline entries')
+
+    def __str__(self):
+        return '<timeline entry: %s::%s::%s>' % (self.content_type_id, self.object_id, self.user_id)
@@ -113,6 +113,8 @@ class UserDashboardAnnouncement(ThumbnailableImageMixin, models.Model):
         upload_to=get_user_dashboard_announcement_image_filename,
         max_length=250,
     )
+    # the image name for which all thumbnails have been generated, see `ThumbnailableImageMixin.generate_thumbnails`
+    image_thumbnails_source = models.CharField(max_length=250, blank=True, default='', editable=False)
 
     url = models.URLField(_('URL'), blank=True, null=True, help_text='For the "read more" button')
 
@@ -3,6 +3,7 @@ from __future__ import unicode_literals
 
 import locale
 import logging
+import time
 from builtins import object
 from threading import Thread
 
@@ -12,13 +13,18 @@ from django.core.cache import cache
 from django.core.exceptions import ValidationError
 from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import EmailValidator
-from django.db import models, transaction
+from django.db import models, router, transaction
+from django.db.models.functions import Lower
+from django.db.models.signals import post_save
 from django.template.loader import render_to_string
 from django.urls.base import reverse
 from django.utils.translation import gettext_lazy as _
 
 from cosinnus.conf import settings
+from cosinnus.core import signals
 from cosinnus.models.group import CosinnusPortal
+from cosinnus.models.profile import get_user_profile_model
+from cosinnus.models.tagged import get_tag_object_model
 from cosinnus.utils.functions import resolve_class
 
 logger = logging.getLogger('cosinnus')
@@ -490,6 +496,244 @@ class CosinnusUserImportProcessorBase(object):
         )
 
 
+class CosinnusUserBulkImportProcessor(CosinnusUserImportProcessorBase):
+    """A user import for large CSV files, that creates the same user accounts as the base import, but:
+    - validates all rows up front, checking all emails against existing accounts in a few queries
+    - creates users, profiles and auth group memberships with `bulk_create` in chunks of rows
+    - defers the signals of the user creation (external service integrations like RocketChat and Nextcloud,
+        search indexing, etc.) to a background task that runs after the import, see `process_imported_users`
+    - reports the throughput of the import
+    Like in the base import, the created users are collected in `created_users` and
+    `_import_second_round_relations` is run for both dry runs and real imports, so processors extending it
+    can add their relations here as well. In a dry run, the users are not saved.
+    Enable it by setting `COSINNUS_USER_IMPORT_PROCESSOR_CLASS_DROPIN` to this class.
+    Note: The per-row hooks `_do_single_user_import` and `_import_create_auth_user` are not used by this import,
+    so processors extending them must extend `CosinnusUserImportProcessorBase` instead."""
+
+    # number of rows that are created at once
+    BULK_IMPORT_CHUNK_SIZE = 1000
+
+    def _start_import(self, user_import_item, dry_run=True):
+        import_failed_overall = False
+        start_time = time.time()
+        item_data_list = user_import_item.import_data
+        total_items = len(item_data_list)
+
+        self.created_users = []
+
+        try:
+            user_import_item.set_import_progress_cache(f'0/{total_items}')
+            row_errors = self._validate_rows(item_data_list)
+            valid_items = [item_data for item_data, errors in zip(item_data_list, row_errors) if not errors]
+            failed_items = total_items - len(valid_items)
+            if failed_items:
+                import_failed_overall = True
+
+            if dry_run or not import_failed_overall:
+                try:
+                    # a dry run will raise to rollback the second round relations at the very end
+                    with transaction.atomic():
+                        if dry_run:
+                            self.created_users.extend(self._build_users(valid_items))
+                        else:
+                            for offset in range(0, len(valid_items), self.BULK_IMPORT_CHUNK_SIZE):
+                                chunk = valid_items[offset : offset + self.BULK_IMPORT_CHUNK_SIZE]
+                                self.created_users.extend(self._bulk_create_users(chunk))
+                                user_import_item.set_import_progress_cache(f'{offset + len(chunk)}/{total_items}')
+                        self._import_second_round_relations(item_data_list, user_import_item, dry_run=dry_run)
+                        if dry_run:
+                            raise DryRunFinishedException()
+                except DryRunFinishedException:
+                    pass
+            created_user_ids = [user.id for user in self.created_users if user.id]
+
+            for item_data, errors in zip(item_data_list, row_errors):
+                user_import_item.clear_user_report_items()
+                for error in errors:
+                    user_import_item.add_user_report_item(error, report_class='error')
+                if not errors:
+                    user_kwargs = {'email': self._get_email(item_data)}
+                    user_kwargs.update(self._get_name_kwargs(item_data))
+                    if not settings.COSINNUS_USER_FORM_SHOW_SEPARATE_LAST_NAME:
+                        user_kwargs['displayname'] = user_kwargs.pop('first_name')
+                    user_import_item.add_user_report_item(
+                        str(_('New user account: ') + str(user_kwargs)), report_class='info'
+                    )
+                user_import_item.generate_and_append_user_report(
+                    self.get_user_report_title(item_data), 'error' if errors else 'info'
+                )
+
+            duration = max(time.time() - start_time, 0.001)
+            summary_message = (
+                str(_('Total Items'))
+                + f': {total_items}, '
+                + str(_('Items for Import'))
+                + f': {total_items - failed_items}, '
+                + str(_('Ignored/Failed Items'))
+                + f': {failed_items}, '
+                + str(_('Duration'))
+                + f': {duration:.1f}s ({total_items / duration:.0f}/s)'
+            )
+            user_import_item.import_report_html = (
+                CosinnusUserImportReportItems(summary_message, 'info').to_string() + user_import_item.import_report_html
+            )
+            logger.info(
+                f'User Import: Bulk import (dry-run: {dry_run}) processed {total_items} rows in {duration:.1f}s.'
+            )
+            user_import_item.set_import_progress_cache(None)
+
+            if created_user_ids:
+                from cosinnus.tasks import process_imported_users_task
+
+                process_imported_users_task.delay(created_user_ids)
+
+        except Exception as e:
+            logger.error(
+                f'User Import: Critical failure during bulk import (dry-run: {dry_run})', extra={'exception': e}
+            )
+            import_failed_overall = True
+            user_import_item.import_report_html = (
+                CosinnusUserImportReportItems(
+                    _(
+                        'An unexpected system error has occured while processing the data. This should not have '
+                        'happened. Please contact the support! Technical Details follow:'
+                    ),
+                    'error',
+                ).to_string()
+                + CosinnusUserImportReportItems(str(e), 'error').to_string()
+                + user_import_item.import_report_html
+            )
+            if settings.DEBUG:
+                raise e
+
+        if import_failed_overall:
+            if dry_run:
+                user_import_item.state = CosinnusUserImport.STATE_DRY_RUN_FINISHED_INVALID
+            else:
+                user_import_item.state = CosinnusUserImport.STATE_IMPORT_FAILED
+        else:
+            if dry_run:
+                user_import_item.state = CosinnusUserImport.STATE_DRY_RUN_FINISHED_VALID
+            else:
+                user_import_item.state = CosinnusUserImport.STATE_IMPORT_FINISHED
+        user_import_item.save()
+
+    def _get_email(self, item_data):
+        return (item_data.get(self.field_name_map['email'], None) or '').strip().lower()
+
+    def _get_name_kwargs(self, item_data):
+        name_kwargs = {'first_name': item_data.get(self.field_name_map['first_name'], '')[:30]}
+        if settings.COSINNUS_USER_FORM_SHOW_SEPARATE_LAST_NAME:
+            last_name = item_data.get(self.field_name_map['last_name'], '')[:30]
+            if last_name:
+                name_kwargs['last_name'] = last_name
+        return name_kwargs
+
+    def _get_existing_emails(self, emails):
+        """Returns the set of the given lower-case emails that already have a user account"""
+        emails = list(emails)
+        existing = set()
+        for offset in range(0, len(emails), self.BULK_IMPORT_CHUNK_SIZE):
+            existing.update(
+                get_user_model()
+                .objects.annotate(email_lower=Lower('email'))
+                .filter(email_lower__in=emails[offset : offset + self.BULK_IMPORT_CHUNK_SIZE])
+                .values_list('email_lower', flat=True)
+            )
+        return existing
+
+    def _validate_rows(self, item_data_list):
+        """Validates all rows with the same checks as the base import.
+        @return: A list containing a list of error messages for each row"""
+        row_errors = [[] for __ in item_data_list]
+        emails = [self._get_email(item_data) for item_data in item_data_list]
+        existing_emails = self._get_existing_emails(set([email for email in emails if email]))
+        seen_emails = set()
+        for item_data, email, errors in zip(item_data_list, emails, row_errors):
+            missing_fields = [
+                self.field_name_map[req_field]
+                for req_field in self.REQUIRED_FIELDS_FOR_IMPORT
+                if not item_data.get(self.field_name_map[req_field], None)
+            ]
+            if missing_fields:
+                errors.append(
+                    _('CSV row did not contain data for required columns: "%(fields)s"')
+                    % {'fields': '", "'.join(missing_fields)}
+                )
+                continue
+            if email in existing_emails:
+                errors.append(_('The email-address already has an existing user account in the system!'))
+            if email in seen_emails:
+                errors.append(_('The email-address is duplicated and already contained in the CSV!'))
+            seen_emails.add(email)
+            if not errors and not validates(EmailValidator, email):
+                errors.append(_('The email address was not a valid email address!'))
+        return row_errors
+
+    def _build_users(self, item_data_list):
+        """Returns the unsaved user accounts for the given rows"""
+        user_model = get_user_model()
+        users = []
+        for item_data in item_data_list:
+            email = self._get_email(item_data)
+            # the username is set to the user id after creation, the unique email serves as placeholder
+            users.append(user_model(username=email, email=email, **self._get_name_kwargs(item_data)))
+        return users
+
+    def _bulk_create_users(self, item_data_list):
+        """Creates the user accounts with their profiles and default auth group memberships for the given rows.
+        No signals are sent for the created objects, see `process_imported_users`.
+        @return: The list of created users"""
+        user_model = get_user_model()
+        users = user_model.objects.bulk_create(self._build_users(item_data_list))
+        for user in users:
+            user.username = str(user.id)
+        user_model.objects.bulk_update(users, ['username'])
+
+        tag_model = get_tag_object_model()
+        media_tags = tag_model._default_manager.bulk_create([tag_model() for __ in users])
+        profile_model = get_user_profile_model()
+        profile_model._default_manager.bulk_create(
+            [profile_model(user=user, media_tag=media_tag) for user, media_tag in zip(users, media_tags)]
+        )
+
+        # see `assign_user_to_default_auth_group`
+        auth_group_model = user_model.groups.field.related_model
+        auth_group_ids = auth_group_model.objects.filter(
+            name__in=getattr(settings, 'NEWW_DEFAULT_USER_AUTH_GROUPS', [])
+        ).values_list('id', flat=True)
+        through_model = user_model.groups.through
+        through_model.objects.bulk_create(
+            [through_model(user_id=user.id, group_id=group_id) for user in users for group_id in auth_group_ids]
+        )
+        return users
+
+
+def process_imported_users(user_ids):
+    """Sends the signals for the creation of users created by `CosinnusUserBulkImportProcessor`, as the regular
+    creation would have, so that all receivers can process them. This includes the external service
+    integrations (RocketChat, Nextcloud, etc.) and the search index."""
+    user_model = get_user_model()
+    profile_model = get_user_profile_model()
+    using = router.db_for_write(profile_model)
+    for offset in range(0, len(user_ids), CosinnusUserBulkImportProcessor.BULK_IMPORT_CHUNK_SIZE):
+        chunk = user_ids[offset : offset + CosinnusUserBulkImportProcessor.BULK_IMPORT_CHUNK_SIZE]
+        for profile in profile_model._default_manager.filter(user_id__in=chunk).select_related('user'):
+            try:
+                post_save.send(
+                    sender=user_model, instance=profile.user, created=True, update_fields=None, raw=False, using=using
+                )
+                post_save.send(
+                    sender=profile_model, instance=profile, created=True, update_fields=None, raw=False, using=using
+                )
+                signals.userprofile_created.send(sender=profile, profile=profile)
+            except Exception as e:
+                logger.error(
+                    'User Import: Error while processing an imported user.',
+                    extra={'user_id': profile.user_id, 'exception': e},
+                )
+
+
 class DryRunFinishedException(Exception):
     """An exception that rolls back an atomic block for a dry run when it has finished successfully."""
 
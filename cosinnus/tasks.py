@@ -39,3 +39,56 @@ class CeleryThreadTask(celery.Task):
 @celery_app.task
 def deliver_mail_task(to, subject, message, from_email, bcc=None, is_html=False, headers=None):
     deliver_mail(to, subject, message, from_email, bcc, is_html, headers)
+
+
+@celery_app.task(base=CeleryThreadTask)
+def update_timeline_for_object_task(content_type_id, object_id):
+    """Fans out the timeline entries of a saved object to all of its group's members"""
+    from django.contrib.contenttypes.models import ContentType
+
+    from cosinnus.utils.timeline import update_timeline_for_object
+
+    model = ContentType.objects.get_for_id(content_type_id).model_class()
+    obj = model._default_manager.filter(pk=object_id).first()
+    if obj is not None:
+        update_timeline_for_object(obj)
+
+
+@celery_app.task(base=CeleryThreadTask)
+def update_timeline_for_membership_task(user_id, group_id, is_member):
+    """Adds or removes a group's objects to/from a user's timeline after a membership change"""
+    from cosinnus.utils.timeline import add_group_to_user_timeline, remove_group_from_user_timeline
+
+    if is_member:
+        add_group_to_user_timeline(user_id, group_id)
+    else:
+        remove_group_from_user_timeline(user_id, group_id)
+
+
+@celery_app.task(base=CeleryThreadTask)
+def generate_thumbnails_task(content_type_id, object_id):
+    """Generates all thumbnails of the images of an object after an upload"""
+    from django.contrib.contenttypes.models import ContentType
+
+    from cosinnus.utils.thumbnails import generate_thumbnails
+
+    model = ContentType.objects.get_for_id(content_type_id).model_class()
+    obj = model._default_manager.filter(pk=object_id).first()
+    if obj is not None:
+        generate_thumbnails(obj)
+
+
+@celery_app.task(base=CeleryThreadTask)
+def process_imported_users_task(user_ids):
+    """Processes the users created by a bulk user import, see `process_imported_users`"""
+    from cosinnus.models.user_import import process_imported_users
+
+    process_imported_users(user_ids)
+
+
+@celery_app.task(base=CeleryThreadTask)
+def rebuild_user_match_index_task():
+    """Rebuilds the user match index of the current portal and shares it with all processes via the cache"""
+    from cosinnus.utils.user_match import rebuild_user_match_index
+
+    rebuild_user_match_index()
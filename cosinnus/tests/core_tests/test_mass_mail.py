@@ -0,0 +1,40 @@
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.test import TestCase, override_settings
+
+from cosinnus.core.mass_mail import MassMailSender
+from cosinnus.core.middleware.cosinnus_middleware import initialize_cosinnus_after_startup
+from cosinnus.models.feedback import CosinnusSentEmailLog
+from cosinnus.models.mail import QueuedMassMail
+
+User = get_user_model()
+
+
+@override_settings(
+    EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend',
+    COSINNUS_LOG_SENT_EMAILS=True,
+    COSINNUS_MASS_MAIL_BATCH_SIZE=2,
+)
+class MassMailSenderTest(TestCase):
+    def setUp(self):
+        initialize_cosinnus_after_startup()
+        self.users = [
+            User.objects.create_user(f'user{i}', email=f'user{i}@example.com', first_name=f'User{i}') for i in range(5)
+        ]
+        self.queued_mail = QueuedMassMail.objects.create(subject='Newsletter', content='Hello [[user_first_name]]!')
+        self.queued_mail.recipients.set(self.users)
+
+    def test_send_to_all_recipients(self):
+        sent_count = MassMailSender(self.queued_mail).send()
+        self.assertEqual(sent_count, 5)
+        self.assertEqual(len(mail.outbox), 5)
+        self.assertEqual(sorted([message.to[0] for message in mail.outbox]), sorted([u.email for u in self.users]))
+        self.assertIn('Hello User0!', mail.outbox[0].alternatives[0][0])
+        self.assertEqual(self.queued_mail.recipients_sent.count(), 5)
+        self.assertEqual(CosinnusSentEmailLog.objects.filter(title='Newsletter').count(), 5)
+
+    def test_resume_sends_only_to_remaining_recipients(self):
+        self.queued_mail.recipients_sent.add(*self.users[:3])
+        sent_count = MassMailSender(self.queued_mail).send()
+        self.assertEqual(sent_count, 2)
+        self.assertEqual(sorted([message.to[0] for message in mail.outbox]), ['user3@example.com', 'user4@example.com'])
@@ -5,10 +5,16 @@ from builtins import range, zip
 
 from django.contrib.auth import get_user_model
 from django.core.cache import cache
+from django.db.models import QuerySet
 from django.test import TestCase
 
 from cosinnus.models.group import CosinnusGroup, CosinnusGroupManager, CosinnusGroupMembership
-from cosinnus.models.membership import MEMBERSHIP_MEMBER
+from cosinnus.models.membership import (
+    _MEMBERSHIP_MEMBERS_KEY,
+    MEMBERSHIP_ADMIN,
+    MEMBERSHIP_MEMBER,
+    MEMBERSHIP_PENDING,
+)
 
 _GROUP_CACHE_KEY = CosinnusGroupManager._GROUP_CACHE_KEY % (1, 'CosinnusGroupManager', '%s')
 _GROUPS_PK_CACHE_KEY = CosinnusGroupManager._GROUPS_PK_CACHE_KEY % (1, 'CosinnusGroupManager')
@@ -290,3 +296,114 @@ class MembershipCacheTest(TestCase):
         self.assertEqual(group.admins, [])
         self.assertEqual(group.members, [])
         self.assertEqual(group.pendings, [])
+
+    def test_prefetch_membership_caches(self):
+        groups, pks, slugs = create_multiple_groups()
+        admin = User.objects.create(username='admin1')
+        member = User.objects.create(username='member1')
+        pending = User.objects.create(username='pending1')
+        for group in groups:
+            CosinnusGroupMembership.objects.create(user=admin, group=group, status=MEMBERSHIP_ADMIN)
+            CosinnusGroupMembership.objects.create(user=member, group=group, status=MEMBERSHIP_MEMBER)
+            CosinnusGroupMembership.objects.create(user=pending, group=group, status=MEMBERSHIP_PENDING)
+        cache.clear()
+
+        with self.assertNumQueries(1):
+            self.assertEqual(CosinnusGroupMembership.objects.prefetch_membership_caches(pks), len(pks))
+        with self.assertNumQueries(0):
+            self.assertEqual(CosinnusGroupMembership.objects.prefetch_membership_caches(pks), 0)
+            members = CosinnusGroupMembership.objects.get_members(groups=pks)
+            admins = CosinnusGroupMembership.objects.get_admins(groups=pks)
+            pendings = CosinnusGroupMembership.objects.get_pendings(groups=pks)
+            invited_pendings = CosinnusGroupMembership.objects.get_invited_pendings(groups=pks)
+        for pk in pks:
+            self.assertEqual(sorted(members[pk]), sorted([admin.pk, member.pk]))
+            self.assertEqual(admins[pk], [admin.pk])
+            self.assertEqual(pendings[pk], [pending.pk])
+            self.assertEqual(invited_pendings[pk], [])
+
+    def test_get_members_for_multiple_groups_single_query(self):
+        groups, pks, slugs = create_multiple_groups()
+        user = User.objects.create(username='test1')
+        for group in groups:
+            CosinnusGroupMembership.objects.create(user=user, group=group, status=MEMBERSHIP_MEMBER)
+        cache.clear()
+
+        with self.assertNumQueries(1):
+            members = CosinnusGroupMembership.objects.get_members(groups=pks)
+        self.assertEqual(members, {pk: [user.pk] for pk in pks})
+        # the other status caches have been filled along with the members cache
+        with self.assertNumQueries(0):
+            self.assertEqual(CosinnusGroupMembership.objects.get_admins(groups=pks), {pk: [] for pk in pks})
+
+    def test_compact_cache_format(self):
+        group = CosinnusGroup.objects.create(name='testgroup1')
+        users = [User.objects.create(username='test%d' % i) for i in range(3)]
+        for user in reversed(users):
+            CosinnusGroupMembership.objects.create(user=user, group=group, status=MEMBERSHIP_MEMBER)
+        cache.clear()
+
+        self.assertEqual(group.members, [user.pk for user in users])
+        cached = cache.get(_MEMBERSHIP_MEMBERS_KEY % (CosinnusGroupMembership.CACHE_KEY_MODEL, group.pk))
+        self.assertEqual(cached.tolist(), [user.pk for user in users])
+
+    def test_user_index(self):
+        groups, pks, slugs = create_multiple_groups()
+        user = User.objects.create(username='test1')
+        CosinnusGroupMembership.objects.create(user=user, group=groups[0], status=MEMBERSHIP_ADMIN)
+        CosinnusGroupMembership.objects.create(user=user, group=groups[1], status=MEMBERSHIP_PENDING)
+        cache.clear()
+
+        with self.assertNumQueries(1):
+            self.assertEqual([group.is_member(user) for group in groups], [True] + [False] * 9)
+            self.assertEqual([group.is_admin(user) for group in groups], [True] + [False] * 9)
+            self.assertEqual([group.is_pending(user) for group in groups], [False, True] + [False] * 8)
+
+        membership = CosinnusGroupMembership.objects.get(user=user, group=groups[1])
+        membership.status = MEMBERSHIP_MEMBER
+        membership.save()
+        self.assertTrue(groups[1].is_member(user))
+        CosinnusGroupMembership.objects.filter(user=user).delete()
+        self.assertFalse(groups[0].is_member(user))
+        self.assertFalse(groups[1].is_member(user))
+
+    def test_clear_user_index_for_group(self):
+        group = CosinnusGroup.objects.create(name='testgroup1')
+        user = User.objects.create(username='test1')
+        membership = CosinnusGroupMembership.objects.create(user=user, group=group, status=MEMBERSHIP_MEMBER)
+        self.assertTrue(group.is_member(user))
+        # an update that bypasses the signals and is followed by clearing the whole group's caches
+        QuerySet.update(CosinnusGroupMembership.objects.filter(pk=membership.pk), status=MEMBERSHIP_PENDING)
+        CosinnusGroupMembership.clear_member_cache_for_group(group)
+        self.assertFalse(group.is_member(user))
+        self.assertTrue(group.is_pending(user))
+
+    def test_queryset_update_refreshes_all_users(self):
+        groups = [CosinnusGroup.objects.create(name='testgroup%d' % i) for i in range(2)]
+        users = [User.objects.create(username='test%d' % i) for i in range(2)]
+        for group in groups:
+            for user in users:
+                CosinnusGroupMembership.objects.create(user=user, group=group, status=MEMBERSHIP_MEMBER)
+        self.assertTrue(all([group.is_member(user) for group in groups for user in users]))
+
+        # the updated memberships no longer match the filter of the QS
+        CosinnusGroupMembership.objects.filter(status=MEMBERSHIP_MEMBER).update(status=MEMBERSHIP_PENDING)
+        for group in groups:
+            for user in users:
+                self.assertFalse(group.is_member(user))
+                self.assertTrue(group.is_pending(user))
+
+    def test_delete_all_memberships_for_user(self):
+        groups, pks, slugs = create_multiple_groups()
+        user = User.objects.create(username='test1')
+        other_user = User.objects.create(username='test2')
+        for group in groups:
+            CosinnusGroupMembership.objects.create(user=user, group=group, status=MEMBERSHIP_MEMBER)
+            CosinnusGroupMembership.objects.create(user=other_user, group=group, status=MEMBERSHIP_MEMBER)
+        self.assertTrue(all(group.is_member(user) for group in groups))
+
+        self.assertEqual(CosinnusGroupMembership.delete_all_for_user(user), len(groups))
+        self.assertFalse(CosinnusGroupMembership.objects.filter(user=user).exists())
+        self.assertFalse(any(group.is_member(user) for group in groups))
+        self.assertTrue(all(group.is_member(other_user) for group in groups))
+        self.assertEqual(CosinnusGroupMembership.delete_all_for_user(user), 0)
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+from unittest.mock import patch
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.files import File
+from django.test import TestCase, override_settings
+
+from cosinnus.models.group import CosinnusGroupGalleryImage
+from cosinnus.models.group_extra import CosinnusSociety
+from cosinnus.utils.thumbnails import needs_thumbnails
+
+TEST_IMAGE_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'util_tests', 'avatar.png')
+
+
+class ThumbnailableImageTest(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        group = CosinnusSociety.objects.create(name='Gallery Group')
+        self.image = CosinnusGroupGalleryImage(group=group)
+        with open(TEST_IMAGE_PATH, 'rb') as f:
+            self.image.image.save('avatar.png', File(f))
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def test_generate_thumbnails(self):
+        self.assertTrue(needs_thumbnails(self.image))
+        self.assertTrue(self.image.generate_thumbnails())
+        self.image.refresh_from_db()
+        self.assertEqual(self.image.image_thumbnails_source, self.image.image.name)
+        self.assertFalse(needs_thumbnails(self.image))
+        for size, filename_modifier in self.image.get_thumbnail_sizes():
+            media_image_path = self.image.get_media_image_path(filename_modifier=filename_modifier)
+            self.assertTrue(os.path.exists(os.path.join(self.media_root, media_image_path)))
+
+    def test_generated_thumbnail_urls_need_no_filesystem_access(self):
+        self.image.generate_thumbnails()
+        url = self.image.static_image_url()
+        with patch('cosinnus.models.mixins.images.exists') as exists:
+            self.assertEqual(self.image.static_image_url(), url)
+            self.assertTrue(self.image.static_image_url_thumbnail())
+            self.assertTrue(self.image.static_image_original_url())
+            exists.assert_not_called()
+
+    def test_changed_image_is_regenerated(self):
+        self.image.generate_thumbnails()
+        with open(TEST_IMAGE_PATH, 'rb') as f:
+            self.image.image.save('other.png', File(f))
+        self.assertFalse(self.image.has_generated_thumbnails)
+        self.assertTrue(needs_thumbnails(self.image))
+
+
+@override_settings(COSINNUS_THUMBNAIL_PREGENERATION_ENABLED=True)
+class ThumbnailPregenerationTest(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        self.settings_override.enable()
+        self.group = CosinnusSociety.objects.create(name='Avatar Group')
+        with open(TEST_IMAGE_PATH, 'rb') as f:
+            self.group.avatar.save('avatar.png', File(f))
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root)
+
+    def test_thumbnails_are_only_queued_for_changed_images(self):
+        group = CosinnusSociety.objects.get(pk=self.group.pk)
+        with patch('cosinnus.models.hooks.generate_thumbnails_task.delay') as delay:
+            group.name = 'Renamed Avatar Group'
+            group.save()
+            delay.assert_not_called()
+
+            with open(TEST_IMAGE_PATH, 'rb') as f:
+                group.avatar.save('other.png', File(f))
+            delay.assert_called_once_with(ContentType.objects.get_for_model(CosinnusSociety).id, group.pk)
+
+            group.save()
+            delay.assert_called_once()
+        # all images are still considered when generating the thumbnails of existing objects
+        self.assertTrue(needs_thumbnails(group))
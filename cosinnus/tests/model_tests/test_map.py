@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.test import TestCase
+from haystack.models import SearchResult
+
+from cosinnus.models.group import CosinnusGroupMembership, CosinnusPortal
+from cosinnus.models.group_extra import CosinnusProject
+from cosinnus.models.map import MapResultPageContext
+from cosinnus.models.membership import MEMBERSHIP_MEMBER, MEMBERSHIP_PENDING
+from cosinnus.models.tagged import LikeObject
+
+User = get_user_model()
+
+
+class MapResultPageContextTest(TestCase):
+    page_size = 100
+
+    def setUp(self):
+        self.portal = CosinnusPortal.get_current()
+        self.user = User.objects.create_user(username='mapuser', email='mapuser@example.com', password='secret')
+        self.projects = [CosinnusProject.objects.create(name='Project %d' % i) for i in range(self.page_size)]
+        self.results = [
+            SearchResult(
+                'cosinnus',
+                'cosinnusproject',
+                project.pk,
+                1.0,
+                portal=self.portal.id,
+                slug=project.slug,
+                title=project.name,
+            )
+            for project in self.projects
+        ]
+        self.member_project, self.pending_project, self.followed_project = self.projects[:3]
+        CosinnusGroupMembership.objects.create(group=self.member_project, user=self.user, status=MEMBERSHIP_MEMBER)
+        CosinnusGroupMembership.objects.create(group=self.pending_project, user=self.user, status=MEMBERSHIP_PENDING)
+        LikeObject.objects.create(
+            content_type=ContentType.objects.get_for_model(CosinnusProject),
+            object_id=self.followed_project.pk,
+            user=self.user,
+            liked=False,
+            followed=True,
+        )
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_page_states(self):
+        context = MapResultPageContext(self.results, user=self.user)
+        results = dict(zip(self.projects, self.results))
+        self.assertTrue(context.is_member(results[self.member_project]))
+        self.assertFalse(context.is_member(results[self.pending_project]))
+        self.assertFalse(context.is_member(results[self.followed_project]))
+        self.assertTrue(context.is_followed(results[self.followed_project]))
+        self.assertFalse(context.is_followed(results[self.member_project]))
+
+    def test_query_count_is_independent_of_page_size(self):
+        # warm up the caches that are shared across requests
+        CosinnusPortal.get_current()
+        ContentType.objects.get_for_models(CosinnusProject)
+        # one query to fill the membership caches and one for the followed states
+        with self.assertNumQueries(2):
+            MapResultPageContext(self.results, user=self.user)
+        # the membership caches are now filled
+        with self.assertNumQueries(1):
+            MapResultPageContext(self.results, user=self.user)
+
+    def test_anonymous_user(self):
+        CosinnusPortal.get_current()
+        with self.assertNumQueries(0):
+            context = MapResultPageContext(self.results, user=AnonymousUser())
+        self.assertFalse(context.is_member(self.results[0]))
+        self.assertFalse(context.is_followed(self.results[0]))
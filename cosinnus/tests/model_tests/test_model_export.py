@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import csv
+import io
+import os
+
+from django.core.cache import cache
+from django.test import TestCase
+
+from cosinnus.conf import settings
+from cosinnus.models.group_extra import CosinnusSociety
+from cosinnus.models.model_export import GroupExportProcessorBase
+from cosinnus.models.storage import TemporaryData
+
+
+class GroupTestExportProcessor(GroupExportProcessorBase):
+    CSV_EXPORT_COLUMNS_TO_FIELD_MAP = {
+        'id': 'id',
+        'name': 'name',
+        'public': 'public',
+    }
+    # export in several chunks
+    EXPORT_CHUNK_SIZE = 2
+
+
+class FailingGroupTestExportProcessor(GroupTestExportProcessor):
+    CSV_EXPORT_COLUMNS_TO_FIELD_MAP = {
+        'id': 'id',
+        'failing': 'get_failing',
+    }
+
+    def get_failing(self, group):
+        raise ValueError('Export failed')
+
+
+class StreamingExportTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        for i in range(5):
+            CosinnusSociety.objects.create(name='Export Group %d' % i, public=bool(i % 2))
+        self.processor = GroupTestExportProcessor()
+
+    def tearDown(self):
+        self.processor.delete_export()
+        cache.clear()
+
+    def test_export_files(self):
+        self.processor.do_export(threaded=False)
+        self.assertEqual(self.processor.get_state(), GroupTestExportProcessor.STATE_EXPORT_FINISHED)
+        groups = list(self.processor.get_model_queryset())
+        self.assertEqual(self.processor.get_current_export_progress(), (len(groups), len(groups)))
+
+        with self.processor.get_current_export_file(GroupTestExportProcessor.FORMAT_CSV).open('rb') as csv_file:
+            rows = list(csv.reader(io.StringIO(csv_file.read().decode('utf-8'))))
+        self.assertEqual(rows[0], ['id', 'name', 'public'])
+        self.assertEqual(
+            rows[1:],
+            [[str(group.id), group.name, 'Yes' if group.public else 'No'] for group in groups],
+        )
+        xlsx_file = self.processor.get_current_export_file(GroupTestExportProcessor.FORMAT_XLSX)
+        self.assertGreater(xlsx_file.size, 0)
+
+    def test_export_files_are_private(self):
+        self.processor.do_export(threaded=False)
+        file_path = self.processor.get_current_export_file(GroupTestExportProcessor.FORMAT_CSV).path
+        media_root = os.path.realpath(settings.MEDIA_ROOT)
+        self.assertNotEqual(os.path.commonpath([media_root, os.path.realpath(file_path)]), media_root)
+
+        # the files are deleted with the export
+        self.processor.delete_export()
+        self.assertFalse(os.path.exists(file_path))
+        self.assertFalse(TemporaryData.objects.exists())
+        self.assertIsNone(self.processor.get_current_export_file(GroupTestExportProcessor.FORMAT_CSV))
+
+    def test_failed_export(self):
+        processor = FailingGroupTestExportProcessor()
+        processor.do_export(threaded=False)
+        self.assertEqual(processor.get_state(), FailingGroupTestExportProcessor.STATE_EXPORT_ERROR)
+        self.assertIsNone(processor.get_current_export_file(FailingGroupTestExportProcessor.FORMAT_CSV))
+        self.assertFalse(TemporaryData.objects.exists())
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+
+from cosinnus.models.profile import get_user_profile_model
+from cosinnus.models.user_import import CosinnusUserBulkImportProcessor, CosinnusUserImport
+
+User = get_user_model()
+
+
+class SecondRoundRecordingImportProcessor(CosinnusUserBulkImportProcessor):
+    """Records the created users available to the second import round of each run"""
+
+    def __init__(self):
+        super().__init__()
+        self.second_rounds = []
+
+    def _import_second_round_relations(self, item_data_list, user_import_item, dry_run=True):
+        self.second_rounds.append((dry_run, [user.email for user in self.created_users]))
+
+
+class UserBulkImportTest(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user(username='admin', email='Existing@example.com', password='secret')
+        self.processor = CosinnusUserBulkImportProcessor()
+
+    def get_row(self, row_num, email, name='Name'):
+        field_name_map = self.processor.field_name_map
+        row = {'ROW_NUM': row_num, field_name_map['email']: email, field_name_map['first_name']: name}
+        if 'last_name' in field_name_map:
+            row[field_name_map['last_name']] = 'Last'
+        return row
+
+    def run_import(self, rows, dry_run):
+        user_import = CosinnusUserImport.objects.create(creator=self.admin, import_data=rows)
+        self.processor.do_import(user_import, dry_run=dry_run, threaded=False, import_creator=self.admin)
+        user_import.refresh_from_db()
+        return user_import
+
+    def test_dry_run_validation(self):
+        rows = [
+            self.get_row(0, 'new@example.com'),
+            self.get_row(1, 'existing@example.com'),
+            self.get_row(2, 'NEW@example.com'),
+            self.get_row(3, 'invalid'),
+            self.get_row(4, 'missing-name@example.com', name=''),
+        ]
+        row_errors = self.processor._validate_rows(rows)
+        self.assertEqual([bool(errors) for errors in row_errors], [False, True, True, True, True])
+
+        user_count = User.objects.count()
+        user_import = self.run_import(rows, dry_run=True)
+        self.assertEqual(user_import.state, CosinnusUserImport.STATE_DRY_RUN_FINISHED_INVALID)
+        self.assertEqual(User.objects.count(), user_count)
+
+    def test_bulk_import(self):
+        rows = [self.get_row(i, 'user%d@example.com' % i) for i in range(5)]
+        user_count = User.objects.count()
+        user_import = self.run_import(rows, dry_run=True)
+        self.assertEqual(user_import.state, CosinnusUserImport.STATE_DRY_RUN_FINISHED_VALID)
+        self.assertEqual(User.objects.count(), user_count)
+
+        user_import.clear_report()
+        self.processor.do_import(user_import, dry_run=False, threaded=False, import_creator=self.admin)
+        user_import.refresh_from_db()
+        self.assertEqual(user_import.state, CosinnusUserImport.STATE_IMPORT_FINISHED)
+        imported_users = User.objects.filter(email__in=['user%d@example.com' % i for i in range(5)])
+        self.assertEqual(imported_users.count(), 5)
+        for user in imported_users:
+            self.assertEqual(user.username, str(user.id))
+            self.assertTrue(get_user_profile_model().objects.filter(user=user, media_tag__isnull=False).exists())
+
+    def test_second_round_relations(self):
+        self.processor = SecondRoundRecordingImportProcessor()
+        rows = [self.get_row(i, 'user%d@example.com' % i) for i in range(3)]
+        emails = ['user%d@example.com' % i for i in range(3)]
+        user_import = self.run_import(rows, dry_run=True)
+        self.assertEqual(user_import.state, CosinnusUserImport.STATE_DRY_RUN_FINISHED_VALID)
+        self.assertTrue(all([user.pk is None for user in self.processor.created_users]))
+
+        self.processor.do_import(user_import, dry_run=False, threaded=False, import_creator=self.admin)
+        self.assertEqual(self.processor.second_rounds, [(True, emails), (False, emails)])
+        self.assertEqual(
+            sorted([user.id for user in self.processor.created_users]),
+            sorted(User.objects.filter(email__in=emails).values_list('id', flat=True)),
+        )
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from datetime import datetime, time, timedelta
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.utils import timezone
+
+from cosinnus.api.views.portal import SimpleStatisticsUserActivityTimelineView
+from cosinnus.models.group import CosinnusPortal, CosinnusPortalMembership
+from cosinnus.models.group_extra import CosinnusSociety
+from cosinnus.models.membership import MEMBERSHIP_MEMBER
+from cosinnus.models.statistics import StatisticsRollup, UserOnlineOnDay
+from cosinnus.utils.statistics import (
+    STATISTICS_METRIC_ACTIVE_USERS,
+    STATISTICS_METRIC_CREATED_GROUPS,
+    get_daily_values,
+    get_statistics_metrics,
+    rollup_statistics,
+)
+from cosinnus.views.statistics import _get_rollup_statistics_for_metric, _get_statistics_for_metric
+
+User = get_user_model()
+
+
+class StatisticsRollupTest(TestCase):
+    def setUp(self):
+        self.portal = CosinnusPortal.get_current()
+        self.today = timezone.localdate()
+        users = [
+            User.objects.create_user(username=f'user{i}', email=f'user{i}@example.com', password='secret')
+            for i in range(3)
+        ]
+        for i, user in enumerate(users):
+            # users may have been added to the portal on creation
+            CosinnusPortalMembership.objects.update_or_create(
+                group=self.portal, user=user, defaults={'status': MEMBERSHIP_MEMBER}
+            )
+            for days_ago in range(i, 60, i + 1):
+                UserOnlineOnDay.objects.create(user=user, date=self.today - timedelta(days=days_ago))
+        for days_ago in [0, 3, 3, 20, 45]:
+            group = CosinnusSociety.objects.create(name=f'Group {days_ago} {CosinnusSociety.objects.count()}')
+            created = timezone.make_aware(datetime.combine(self.today - timedelta(days=days_ago), time(12)))
+            CosinnusSociety.objects.filter(pk=group.pk).update(created=created)
+
+    def assert_rollup_matches_raw(self, days):
+        datetime_to = timezone.make_aware(datetime.combine(self.today, time.max))
+        datetime_from = timezone.make_aware(datetime.combine(self.today - timedelta(days=days), time.min))
+        for metric_name in [STATISTICS_METRIC_ACTIVE_USERS, STATISTICS_METRIC_CREATED_GROUPS]:
+            metric = get_statistics_metrics()[metric_name]
+            expected = _get_statistics_for_metric(
+                'title', metric.data, metric.unique_field, metric.date_field, datetime_from, datetime_to
+            )
+            self.assertEqual(_get_rollup_statistics_for_metric('title', metric, datetime_from, datetime_to), expected)
+
+    def test_rollup_matches_raw_statistics(self):
+        self.assertGreater(rollup_statistics(), 0)
+        # day, week and month intervals
+        for days in [7, 30, 59]:
+            self.assert_rollup_matches_raw(days)
+
+    def test_incremental_rollup(self):
+        rollup_statistics()
+        count = StatisticsRollup.objects.count()
+        # a second run only recomputes the recompute window and leaves the same rollups
+        rollup_statistics()
+        self.assertEqual(StatisticsRollup.objects.count(), count)
+        rollup_statistics(recompute=True)
+        self.assertEqual(StatisticsRollup.objects.count(), count)
+
+    def test_daily_values(self):
+        metric = get_statistics_metrics()[STATISTICS_METRIC_ACTIVE_USERS]
+        date_from = self.today - timedelta(days=59)
+        raw_values = metric.get_counts_by_period(StatisticsRollup.PERIOD_DAY, date_from, self.today)
+        self.assertEqual(get_daily_values(metric, date_from, self.today), raw_values)
+        rollup_statistics()
+        # today is counted from the raw data, all days before from the rollups
+        daily_values = get_daily_values(metric, date_from, self.today)
+        self.assertEqual(dict([(day, value) for day, value in daily_values.items() if value]), raw_values)
+
+    def test_user_timeline_stats(self):
+        rollup_statistics()
+        rows = SimpleStatisticsUserActivityTimelineView().get_user_timeline_stats()
+        self.assertEqual(len(rows), 60)
+        for row in rows:
+            day = datetime.strptime(row[0], '%Y-%m-%d').date()
+            self.assertEqual(row[1], UserOnlineOnDay.objects.filter(date=day).count())
+            self.assertEqual(row[2], User.objects.filter(date_joined__date=day).count())
@@ -4,10 +4,10 @@ from threading import Thread
 from uuid import uuid4
 
 from django.conf import settings
-from django.contrib.auth.models import User
+from django.contrib.auth.models import AnonymousUser, User
 from django.core.exceptions import ImproperlyConfigured, PermissionDenied
 from django.shortcuts import reverse
-from django.test import RequestFactory, TestCase
+from django.test import RequestFactory, TestCase, override_settings
 
 import cosinnus_event
 from cosinnus.apis.bigbluebutton import BigBlueButtonAPI
@@ -302,3 +302,33 @@ if settings.COSINNUS_CONFERENCES_ENABLED:
         def tearDown(self):
             for room in BBBRoom.objects.all():
                 room.end()
+
+
+class BBBRoomMembershipCheckTest(TestCase):
+    """Tests the membership checks of BBB rooms, which do not need a BBB server"""
+
+    def setUp(self):
+        self.room = BBBRoom.objects.create(name='Membership Check Test')
+        self.attendee = User.objects.create_user(username='attendee', email='attendee@example.org')
+        self.moderator = User.objects.create_user(username='moderator', email='moderator@example.org')
+        self.outsider = User.objects.create_user(username='outsider', email='outsider@example.org')
+        self.room.join_user(self.attendee)
+        self.room.join_user(self.moderator, as_moderator=True)
+
+    def test_is_attendee_and_is_moderator(self):
+        with self.assertNumQueries(1):
+            self.assertTrue(self.room.is_attendee(self.attendee))
+        with self.assertNumQueries(1):
+            self.assertTrue(self.room.is_moderator(self.moderator))
+        self.assertFalse(self.room.is_attendee(self.moderator))
+        self.assertFalse(self.room.is_moderator(self.attendee))
+        self.assertFalse(self.room.is_attendee(self.outsider))
+        with self.assertNumQueries(0):
+            self.assertFalse(self.room.is_attendee(AnonymousUser()))
+            self.assertFalse(self.room.is_moderator(AnonymousUser()))
+
+    def test_queue_websocket_path(self):
+        with override_settings(COSINNUS_BBB_QUEUE_WEBSOCKET_ENABLED=False):
+            self.assertIsNone(bbb_utils.get_bbb_queue_websocket_path(12))
+        with override_settings(COSINNUS_BBB_QUEUE_WEBSOCKET_ENABLED=True):
+            self.assertEqual(bbb_utils.get_bbb_queue_websocket_path(12), '/ws/bbb_queue/12/')
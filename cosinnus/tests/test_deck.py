@@ -14,11 +14,11 @@ from cosinnus_deck.deck import DeckConnection
 if getattr(settings, 'COSINNUS_DECK_ENABLED', False):
     initialize_cosinnus_after_startup()
 
-    # patch nextcloud hook threading
-    def blocking_nc_call(function, *args, **kwargs):
-        function(*args, **kwargs)
+    # patch nextcloud sync queue
+    def blocking_nc_call(operation, *args, **kwargs):
+        cosinnus_cloud.hooks.NEXTCLOUD_SYNC_OPERATIONS[operation](*args)
 
-    cosinnus_cloud.hooks.submit_with_retry = blocking_nc_call
+    cosinnus_cloud.hooks.enqueue_nextcloud_job = blocking_nc_call
 
     class DeckBaseTest(CeleryTaskTestMixin, TestCase):
         """Base setup for DeckTest providing a deck_connection."""
@@ -0,0 +1,136 @@
+import threading
+
+from django.test import SimpleTestCase, override_settings
+
+from cosinnus.backends import ElasticIndexUpdateQueue
+
+
+class FakeElasticBackend(object):
+    """Stands in for the elasticsearch backend, recording all bulk requests"""
+
+    connection_alias = 'default'
+
+    def __init__(self):
+        self.requests = []
+        self.release = threading.Event()
+        self.release.set()
+        self.started = threading.Event()
+        self.removed = threading.Event()
+
+    def _bulk_update(self, index, objs):
+        self.started.set()
+        self.release.wait(5)
+        self.requests.append(('update', list(objs)))
+        return len(objs)
+
+    def _bulk_remove(self, objs_or_strings):
+        self.requests.append(('remove', list(objs_or_strings)))
+        self.removed.set()
+        return len(objs_or_strings)
+
+
+class FakeIndex(object):
+    pass
+
+
+# the flusher thread never runs on its own during the tests
+@override_settings(
+    COSINNUS_ELASTIC_QUEUE_COALESCE_SECONDS=60,
+    COSINNUS_ELASTIC_QUEUE_BATCH_SIZE=2,
+    COSINNUS_ELASTIC_QUEUE_MAX_SIZE=100,
+    COSINNUS_ELASTIC_QUEUE_WORKERS=2,
+)
+class ElasticIndexUpdateQueueTest(SimpleTestCase):
+    def setUp(self):
+        self.queue = ElasticIndexUpdateQueue()
+        self.backend = FakeElasticBackend()
+        self.index = FakeIndex()
+
+    def tearDown(self):
+        self.backend.release.set()
+        self.queue.close()
+
+    def test_updates_are_coalesced(self):
+        for __ in range(3):
+            self.queue.enqueue_update(self.backend, self.index, ['cosinnus_note.note.1'])
+        self.queue.enqueue_update(self.backend, self.index, ['cosinnus_note.note.2'])
+        self.assertEqual(self.queue.get_stats()['queue_depth'], 2)
+        self.queue.flush()
+        self.assertEqual(self.backend.requests, [('update', ['cosinnus_note.note.1', 'cosinnus_note.note.2'])])
+        stats = self.queue.get_stats()
+        self.assertEqual((stats['enqueued'], stats['coalesced'], stats['flushed_documents']), (4, 2, 2))
+
+    def test_latest_action_wins(self):
+        self.queue.enqueue_update(self.backend, self.index, ['cosinnus_note.note.1'])
+        self.queue.enqueue_remove(self.backend, 'cosinnus_note.note.1')
+        self.queue.flush()
+        self.assertEqual(self.backend.requests, [('remove', ['cosinnus_note.note.1'])])
+
+    def test_flush_in_batches(self):
+        documents = ['cosinnus_note.note.%d' % i for i in range(5)]
+        self.queue.enqueue_update(self.backend, self.index, documents)
+        self.queue.flush()
+        self.assertEqual([objs for __, objs in self.backend.requests], [documents[:2], documents[2:4], documents[4:]])
+        self.assertEqual(self.queue.get_stats()['queue_depth'], 0)
+        self.assertEqual(self.queue.get_stats()['in_flight'], 0)
+
+    def test_document_in_flight_is_sent_in_order(self):
+        self.backend.release.clear()
+        self.queue.enqueue_update(self.backend, self.index, ['cosinnus_note.note.1'])
+        self.queue._submit_pending()
+        self.assertTrue(self.backend.started.wait(5))
+
+        # the removal must not overtake the update that is still being sent
+        self.queue.enqueue_remove(self.backend, 'cosinnus_note.note.1')
+        self.queue.enqueue_remove(self.backend, 'cosinnus_note.note.2')
+        self.queue._submit_pending()
+        self.assertTrue(self.backend.removed.wait(5))
+        self.assertEqual(self.queue.get_stats()['queue_depth'], 1)
+
+        self.backend.release.set()
+        self.queue.flush()
+        self.assertEqual(
+            self.backend.requests,
+            [
+                ('remove', ['cosinnus_note.note.2']),
+                ('update', ['cosinnus_note.note.1']),
+                ('remove', ['cosinnus_note.note.1']),
+            ],
+        )
+
+    def test_failed_submit_is_requeued(self):
+        self.queue.enqueue_update(self.backend, self.index, ['cosinnus_note.note.1'])
+        self.queue._executor.shutdown(wait=True)
+        with self.assertRaises(RuntimeError):
+            self.queue._submit_pending()
+        stats = self.queue.get_stats()
+        self.assertEqual((stats['queue_depth'], stats['in_flight']), (1, 0))
+        self.assertTrue(self.queue.flush())
+        self.assertEqual(self.backend.requests, [('update', ['cosinnus_note.note.1'])])
+
+    def test_flush_timeout(self):
+        self.backend.release.clear()
+        self.queue.enqueue_update(self.backend, self.index, ['cosinnus_note.note.1'])
+        self.queue._submit_pending()
+        self.assertTrue(self.backend.started.wait(5))
+        self.assertFalse(self.queue.flush(timeout=0.1))
+        self.backend.release.set()
+        self.assertTrue(self.queue.flush())
+
+    @override_settings(COSINNUS_ELASTIC_QUEUE_MAX_SIZE=3)
+    def test_full_queue_is_sent_by_enqueueing_thread(self):
+        documents = ['cosinnus_note.note.%d' % i for i in range(3)]
+        self.queue.enqueue_update(self.backend, self.index, documents)
+        self.assertEqual([objs for __, objs in self.backend.requests], [documents[:2], documents[2:]])
+        stats = self.queue.get_stats()
+        self.assertEqual((stats['queue_depth'], stats['backpressure_flushes']), (0, 1))
+
+    def test_close(self):
+        self.queue.enqueue_update(self.backend, self.index, ['cosinnus_note.note.1'])
+        flusher = self.queue._flusher
+        self.queue.close()
+        self.assertFalse(flusher.is_alive())
+        self.assertEqual(self.backend.requests, [('update', ['cosinnus_note.note.1'])])
+        # the queue is started again when needed
+        self.queue.enqueue_remove(self.backend, 'cosinnus_note.note.1')
+        self.assertTrue(self.queue._flusher.is_alive())
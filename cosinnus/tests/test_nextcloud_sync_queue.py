@@ -0,0 +1,102 @@
+from datetime import timedelta
+from unittest.mock import patch
+
+from django.test import TestCase, override_settings
+from django.utils.timezone import now
+
+from cosinnus.core.middleware.cosinnus_middleware import initialize_cosinnus_after_startup
+from cosinnus_cloud import sync_queue
+from cosinnus_cloud.models import NextcloudSyncJob
+from cosinnus_cloud.sync_queue import enqueue_nextcloud_job, process_nextcloud_sync_jobs
+
+
+class FakeNextcloud(object):
+    """Stands in for the Nextcloud API, recording all calls and failing on demand"""
+
+    def __init__(self):
+        self.calls = []
+        self.fail_times = 0
+
+    def make_operation(self, name):
+        def operation(*args):
+            if self.fail_times > 0:
+                self.fail_times -= 1
+                raise Exception('Nextcloud is unavailable')
+            self.calls.append((name, *args))
+
+        return operation
+
+    def get_operations(self):
+        names = ['update_user_name', 'add_user_to_group', 'remove_user_from_group']
+        return {name: self.make_operation(name) for name in names}
+
+
+@override_settings(COSINNUS_USE_CELERY=False)
+class NextcloudSyncQueueTest(TestCase):
+    def setUp(self):
+        initialize_cosinnus_after_startup()
+        self.nextcloud = FakeNextcloud()
+        operations_patcher = patch.object(
+            sync_queue, 'get_nextcloud_sync_operations', return_value=self.nextcloud.get_operations()
+        )
+        operations_patcher.start()
+        self.addCleanup(operations_patcher.stop)
+        # process the queue only explicitly in the tests
+        trigger_patcher = patch.object(sync_queue, 'trigger_nextcloud_sync_queue')
+        trigger_patcher.start()
+        self.addCleanup(trigger_patcher.stop)
+
+    def test_jobs_persist_until_processed(self):
+        enqueue_nextcloud_job('add_user_to_group', 'wechange-1', 'Group', ordering_key='user:1')
+        self.assertEqual(NextcloudSyncJob.objects.count(), 1)
+        self.assertEqual(process_nextcloud_sync_jobs(), (1, 0))
+        self.assertEqual(self.nextcloud.calls, [('add_user_to_group', 'wechange-1', 'Group')])
+        self.assertEqual(NextcloudSyncJob.objects.count(), 0)
+
+    def test_repeated_operations_are_coalesced(self):
+        for __ in range(5):
+            enqueue_nextcloud_job('update_user_name', 1, ordering_key='user:1')
+        self.assertEqual(NextcloudSyncJob.objects.count(), 1)
+        # a different operation in between must not be skipped
+        enqueue_nextcloud_job('add_user_to_group', 'wechange-1', 'Group', ordering_key='user:1')
+        enqueue_nextcloud_job('update_user_name', 1, ordering_key='user:1')
+        self.assertEqual(NextcloudSyncJob.objects.count(), 3)
+        process_nextcloud_sync_jobs()
+        self.assertEqual(
+            self.nextcloud.calls,
+            [('update_user_name', 1), ('add_user_to_group', 'wechange-1', 'Group'), ('update_user_name', 1)],
+        )
+
+    def test_failed_job_blocks_later_jobs_with_same_ordering_key(self):
+        enqueue_nextcloud_job('add_user_to_group', 'wechange-1', 'Group', ordering_key='user:1')
+        enqueue_nextcloud_job('remove_user_from_group', 'wechange-1', 'Group', ordering_key='user:1')
+        enqueue_nextcloud_job('add_user_to_group', 'wechange-2', 'Group', ordering_key='user:2')
+        self.nextcloud.fail_times = 1
+
+        self.assertEqual(process_nextcloud_sync_jobs(), (1, 1))
+        # the other user's job ran, the failed job was rescheduled with a backoff and blocks the remove
+        self.assertEqual(self.nextcloud.calls, [('add_user_to_group', 'wechange-2', 'Group')])
+        failed_job = NextcloudSyncJob.objects.get(operation='add_user_to_group')
+        self.assertEqual(failed_job.status, NextcloudSyncJob.STATUS_PENDING)
+        self.assertEqual(failed_job.attempts, 1)
+        self.assertGreater(failed_job.next_attempt_at, now())
+
+        NextcloudSyncJob.objects.update(next_attempt_at=now() - timedelta(seconds=1))
+        self.assertEqual(process_nextcloud_sync_jobs(), (2, 0))
+        self.assertEqual(
+            self.nextcloud.calls[1:],
+            [('add_user_to_group', 'wechange-1', 'Group'), ('remove_user_from_group', 'wechange-1', 'Group')],
+        )
+
+    @override_settings(COSINNUS_CLOUD_SYNC_QUEUE_MAX_ATTEMPTS=2)
+    def test_job_fails_after_max_attempts(self):
+        enqueue_nextcloud_job('update_user_name', 1, ordering_key='user:1')
+        enqueue_nextcloud_job('add_user_to_group', 'wechange-1', 'Group', ordering_key='user:1')
+        self.nextcloud.fail_times = 2
+        process_nextcloud_sync_jobs()
+        NextcloudSyncJob.objects.update(next_attempt_at=now() - timedelta(seconds=1))
+        process_nextcloud_sync_jobs()
+        job = NextcloudSyncJob.objects.get(operation='update_user_name')
+        self.assertEqual(job.status, NextcloudSyncJob.STATUS_FAILED)
+        # a failed job no longer blocks the following jobs
+        self.assertEqual(self.nextcloud.calls, [('add_user_to_group', 'wechange-1', 'Group')])
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.test import TestCase
+from django.utils.timezone import now
+
+from cosinnus.conf import settings
+from cosinnus.models.group import CosinnusPortal, CosinnusPortalMembership
+from cosinnus.models.group_extra import CosinnusSociety
+from cosinnus.models.membership import MEMBERSHIP_MEMBER
+from cosinnus.utils.user import filter_portal_users
+from cosinnus_notifications.digest import (
+    _get_last_digest_sent_time,
+    _get_or_create_digest_progress,
+    get_notification_event_ids_by_recipient,
+    send_digest_for_current_portal,
+)
+from cosinnus_notifications.models import (
+    NotificationDigestProgress,
+    NotificationEvent,
+    NotificationEventRecipient,
+    UserNotificationPreference,
+)
+
+User = get_user_model()
+
+DAILY = UserNotificationPreference.SETTING_DAILY
+
+
+class DigestShardTest(TestCase):
+    def setUp(self):
+        self.portal = CosinnusPortal.get_current()
+        for i in range(7):
+            user = User.objects.create(
+                username='digestuser%d' % i, email='digestuser%d@example.com' % i, last_login=now()
+            )
+            CosinnusPortalMembership.objects.get_or_create(
+                group=self.portal, user=user, defaults={'status': MEMBERSHIP_MEMBER}
+            )
+            profile = user.cosinnus_profile
+            profile.tos_accepted = True
+            profile.save()
+        self.user_ids = list(
+            filter_portal_users(User.objects.all(), portal=self.portal).order_by('id').values_list('id', flat=True)
+        )
+
+    def get_progress(self, shards, shard):
+        return NotificationDigestProgress.objects.get(
+            portal=self.portal, digest_setting=DAILY, shards=shards, shard=shard
+        )
+
+    def expire_claim(self, progress):
+        expired = now() - timedelta(seconds=settings.COSINNUS_NOTIFICATIONS_DIGEST_SHARD_CLAIM_TIMEOUT + 60)
+        NotificationDigestProgress.objects.filter(pk=progress.pk).update(last_checkpoint=expired)
+
+    def test_shard_assignment(self):
+        shards = 3
+        for shard in range(shards):
+            self.assertIsNone(_get_last_digest_sent_time(self.portal, DAILY))
+            send_digest_for_current_portal(DAILY, shards=shards, shard=shard)
+            progress = self.get_progress(shards, shard)
+            self.assertIsNotNone(progress.finished)
+            expected_user_ids = [user_id for user_id in self.user_ids if user_id % shards == shard]
+            self.assertEqual(progress.users_processed, len(expected_user_ids))
+            self.assertEqual(progress.last_user_id, expected_user_ids[-1])
+
+        # all shards have processed the same period, which has been marked as sent once all of them finished
+        progresses = NotificationDigestProgress.objects.filter(portal=self.portal, digest_setting=DAILY)
+        self.assertEqual(len(set(progresses.values_list('period_start', 'period_end'))), 1)
+        self.portal.refresh_from_db()
+        self.assertEqual(_get_last_digest_sent_time(self.portal, DAILY), progresses.first().period_end)
+
+    def test_failed_shard_is_resumed(self):
+        progress = _get_or_create_digest_progress(self.portal, DAILY, 1, 0)
+        self.assertTrue(progress.claim())
+        # the run fails after processing the first two users
+        for user in User.objects.filter(id__in=self.user_ids[:2]).order_by('id'):
+            self.assertTrue(progress.checkpoint(user, False))
+
+        # the shard is not taken over while the failed run's claim is valid
+        send_digest_for_current_portal(DAILY)
+        progress.refresh_from_db()
+        self.assertIsNone(progress.finished)
+        self.assertEqual(progress.users_processed, 2)
+
+        # once the claim has expired, the next run resumes after the last processed user
+        self.expire_claim(progress)
+        send_digest_for_current_portal(DAILY)
+        resumed_progress = self.get_progress(1, 0)
+        self.assertEqual(resumed_progress.pk, progress.pk)
+        self.assertIsNotNone(resumed_progress.finished)
+        self.assertEqual(resumed_progress.users_processed, len(self.user_ids))
+        self.assertEqual(resumed_progress.last_user_id, self.user_ids[-1])
+
+    def test_hung_run_stops_after_takeover(self):
+        progress = _get_or_create_digest_progress(self.portal, DAILY, 1, 0)
+        self.assertTrue(progress.claim())
+        self.assertFalse(NotificationDigestProgress.objects.get(pk=progress.pk).claim())
+        self.expire_claim(progress)
+        other_run_progress = NotificationDigestProgress.objects.get(pk=progress.pk)
+        self.assertTrue(other_run_progress.claim())
+
+        # the hung run can neither save checkpoints nor finish the shard
+        user = User.objects.get(id=self.user_ids[0])
+        self.assertFalse(progress.checkpoint(user, False))
+        self.assertFalse(progress.finish(1.0))
+        self.assertTrue(other_run_progress.checkpoint(user, False))
+        self.assertTrue(other_run_progress.finish(1.0))
+        progress.refresh_from_db()
+        self.assertEqual(progress.users_processed, 1)
+        self.assertIsNotNone(progress.finished)
+
+
+class NotificationEventRecipientTest(TestCase):
+    def setUp(self):
+        self.users = [
+            User.objects.create_user('recipient%d' % i, email='recipient%d@example.com' % i) for i in range(3)
+        ]
+        self.group = CosinnusSociety.objects.create(name='Recipient Group')
+
+    def create_event(self, audience):
+        return NotificationEvent.objects.create(
+            content_type=ContentType.objects.get_for_model(CosinnusSociety),
+            object_id=self.group.id,
+            group=self.group,
+            user=self.users[0],
+            notification_id='test_notification',
+            audience=',%s,' % ','.join([str(user_id) for user_id in audience]),
+        )
+
+    def assert_index_matches_audience(self):
+        event_ids_by_recipient = get_notification_event_ids_by_recipient(NotificationEvent.objects.all())
+        for user in self.users:
+            audience_event_ids = NotificationEvent.objects.filter(audience__contains=',%d,' % user.id)
+            self.assertEqual(
+                sorted(event_ids_by_recipient.get(user.id, [])), sorted(audience_event_ids.values_list('id', flat=True))
+            )
+
+    def test_event_ids_by_recipient(self):
+        events = [
+            self.create_event([self.users[0].id, self.users[1].id]),
+            self.create_event([self.users[1].id, self.users[2].id]),
+            self.create_event([self.users[1].id]),
+        ]
+        for event in events:
+            NotificationEventRecipient.create_for_event(event, event.audience.strip(',').split(','))
+        self.assert_index_matches_audience()
+
+        # only the given users and events are considered
+        event_ids_by_recipient = get_notification_event_ids_by_recipient(
+            NotificationEvent.objects.filter(id__in=[events[0].id, events[1].id]), user_ids=[self.users[1].id]
+        )
+        self.assertEqual(list(event_ids_by_recipient.keys()), [self.users[1].id])
+        self.assertEqual(sorted(event_ids_by_recipient[self.users[1].id]), [events[0].id, events[1].id])
+
+    def test_backfill(self):
+        self.create_event([self.users[0].id, self.users[2].id])
+        # deleted users are skipped
+        self.create_event([self.users[1].id, 999999])
+        self.assertEqual(NotificationEventRecipient.backfill_for_events(NotificationEvent.objects.all()), 3)
+        self.assert_index_matches_audience()
+
+        # existing entries are not duplicated
+        NotificationEventRecipient.backfill_for_events(NotificationEvent.objects.all())
+        self.assertEqual(NotificationEventRecipient.objects.count(), 3)
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase
+from django.utils import translation
+
+from cosinnus.core.middleware.cosinnus_middleware import initialize_cosinnus_after_startup
+from cosinnus.models.group import CosinnusPortal
+from cosinnus.models.group_extra import CosinnusSociety
+from cosinnus_notifications.dispatch import serialize_notification_thread
+from cosinnus_notifications.models import NotificationEvent
+from cosinnus_notifications.notifications import NotificationsThread, init_notifications, notifications
+from cosinnus_notifications.tasks import run_notification_session_task
+
+User = get_user_model()
+
+NOTIFICATION_ID = 'cosinnus__user_group_join_requested'
+
+
+class RequestSender(object):
+    """A signal sender with a request, like the views sending most notifications"""
+
+    def __init__(self, request):
+        self.request = request
+
+
+class SerializedNotificationSessionTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        initialize_cosinnus_after_startup()
+        if not notifications:
+            init_notifications()
+        self.user = User.objects.create_user('requester', email='requester@example.com', first_name='Requester')
+        self.receiver = User.objects.create_user('admin', email='admin@example.com', first_name='Admin')
+        self.group = CosinnusSociety.objects.create(name='Notification Group')
+        request = RequestFactory().get('/dashboard/')
+        request.user = self.user
+        self.sender = RequestSender(request)
+
+    def tearDown(self):
+        cache.clear()
+
+    def get_sent_mail(self, notification_thread):
+        """Sends the thread's notification to the receiver and returns the arguments of the sent mail"""
+        notification_thread.group = self.group
+        notification_event = NotificationEvent(user=self.user, notification_id=NOTIFICATION_ID)
+        with patch('cosinnus_notifications.notifications.send_mail_or_fail') as send_mail:
+            notification_thread.send_instant_notification(notification_event, self.receiver)
+        return send_mail.call_args
+
+    def get_deserialized_thread(self, notification_thread):
+        """Serializes the thread and runs it like the celery task would.
+        @return: The deserialized thread and the language active when it was run"""
+        with translation.override('de'):
+            frames = serialize_notification_thread(notification_thread)
+        self.assertIsNotNone(frames)
+        run_language = []
+        with patch.object(
+            NotificationsThread,
+            'run',
+            autospec=True,
+            side_effect=lambda thread: run_language.append(translation.get_language()),
+        ) as run:
+            run_notification_session_task(frames, language='de', portal_id=CosinnusPortal.get_current().id)
+        return run.call_args[0][0], run_language[0]
+
+    def assert_serialized_send_matches_direct_send(self):
+        notification_thread = NotificationsThread(
+            self.sender, self.user, self.group, [self.receiver], NOTIFICATION_ID, notifications[NOTIFICATION_ID]
+        )
+        deserialized_thread, run_language = self.get_deserialized_thread(notification_thread)
+        self.assertEqual(run_language, 'de')
+        self.assertEqual(deserialized_thread.user, self.user)
+        self.assertEqual(deserialized_thread.obj, self.group)
+        self.assertEqual(deserialized_thread.audience, [self.receiver])
+        self.assertEqual(deserialized_thread.sender.request.user, self.user)
+        self.assertEqual(deserialized_thread.sender.request.path, '/dashboard/')
+
+        with translation.override('de'):
+            direct_mail = self.get_sent_mail(notification_thread)
+            serialized_mail = self.get_sent_mail(deserialized_thread)
+        self.assertIsNotNone(direct_mail)
+        self.assertEqual(serialized_mail, direct_mail)
+
+    def test_html_notification(self):
+        self.assert_serialized_send_matches_direct_send()
+
+    def test_template_notification_with_request_context(self):
+        options = dict(notifications[NOTIFICATION_ID], is_html=False)
+        with patch.dict(notifications, {NOTIFICATION_ID: options}):
+            self.assert_serialized_send_matches_direct_send()
+
+    def test_other_portal_is_skipped(self):
+        notification_thread = NotificationsThread(
+            self.sender, self.user, self.group, [self.receiver], NOTIFICATION_ID, notifications[NOTIFICATION_ID]
+        )
+        frames = serialize_notification_thread(notification_thread)
+        with patch.object(NotificationsThread, 'run', autospec=True) as run:
+            run_notification_session_task(frames, portal_id=CosinnusPortal.get_current().id + 1)
+        run.assert_not_called()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+
+from cosinnus.models.group import CosinnusPortal
+from cosinnus.models.group_extra import CosinnusSociety
+from cosinnus.models.profile import GlobalUserNotificationSetting
+from cosinnus_notifications.models import UserMultiNotificationPreference, UserNotificationPreference
+from cosinnus_notifications.preferences import NotificationPreferenceSnapshot, iterate_users_with_preference_snapshots
+
+User = get_user_model()
+
+MULTI_NOTIFICATION_ID = 'MULTI_followed_object_notification'
+
+
+class NotificationPreferenceSnapshotTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.portal = CosinnusPortal.get_current()
+        self.users = [User.objects.create_user('prefuser%d' % i, email='prefuser%d@example.com' % i) for i in range(5)]
+        self.group = CosinnusSociety.objects.create(name='Preference Group')
+        self.other_group = CosinnusSociety.objects.create(name='Other Preference Group')
+        user = self.users[0]
+        GlobalUserNotificationSetting.objects.update_or_create(
+            user=user, portal=self.portal, defaults={'setting': GlobalUserNotificationSetting.SETTING_DAILY}
+        )
+        UserMultiNotificationPreference.objects.create(
+            user=user,
+            portal=self.portal,
+            multi_notification_id=MULTI_NOTIFICATION_ID,
+            setting=UserMultiNotificationPreference.SETTING_WEEKLY,
+        )
+        for group in (self.group, self.other_group):
+            UserNotificationPreference.objects.create(
+                user=user,
+                group=group,
+                notification_id='test_notification',
+                setting=UserNotificationPreference.SETTING_DAILY,
+            )
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_snapshot_matches_single_lookups(self):
+        snapshot = NotificationPreferenceSnapshot(self.users, group_ids=[self.group.id])
+        for user in self.users:
+            self.assertEqual(
+                snapshot.get_global_setting(user), GlobalUserNotificationSetting.objects.get_for_user(user)
+            )
+            self.assertEqual(
+                snapshot.get_multi_setting(user, MULTI_NOTIFICATION_ID),
+                UserMultiNotificationPreference.get_setting_for_user(user, MULTI_NOTIFICATION_ID, self.portal),
+            )
+            self.assertEqual(
+                snapshot.get_preference(user, self.group.id, 'test_notification'),
+                UserNotificationPreference.objects.filter(
+                    user=user, group=self.group, notification_id='test_notification'
+                ).first(),
+            )
+        self.assertEqual(
+            snapshot.get_multi_preference_ids(self.users[0], UserMultiNotificationPreference.SETTING_WEEKLY),
+            [MULTI_NOTIFICATION_ID],
+        )
+        # only the preferences of the given groups are loaded
+        self.assertEqual(
+            [pref.group_id for pref in snapshot.get_preferences(self.users[0])],
+            [self.group.id],
+        )
+
+    def test_snapshot_lookups_need_no_queries(self):
+        users = list(User.objects.filter(id__in=[user.id for user in self.users]))
+        snapshot = NotificationPreferenceSnapshot(users, group_ids=[self.group.id])
+        with self.assertNumQueries(0):
+            for user in users:
+                snapshot.get_global_setting(user)
+                snapshot.get_multi_setting(user, MULTI_NOTIFICATION_ID)
+                snapshot.get_preference(user, self.group.id, 'test_notification')
+                user.cosinnus_profile.settings
+
+    def test_users_outside_the_snapshot(self):
+        snapshot = NotificationPreferenceSnapshot(self.users[1:])
+        user = self.users[0]
+        self.assertEqual(snapshot.get_global_setting(user), GlobalUserNotificationSetting.SETTING_DAILY)
+        self.assertEqual(
+            snapshot.get_multi_setting(user, MULTI_NOTIFICATION_ID), UserMultiNotificationPreference.SETTING_WEEKLY
+        )
+        self.assertIsNotNone(snapshot.get_preference(user, self.group.id, 'test_notification'))
+
+    def test_iterate_users_in_chunks(self):
+        users = User.objects.filter(id__in=[user.id for user in self.users]).order_by('id')
+        results = list(iterate_users_with_preference_snapshots(users, chunk_size=2))
+        self.assertEqual([user.id for user, __ in results], [user.id for user in users])
+        # each chunk of users shares a snapshot containing just them
+        snapshots = []
+        for user, snapshot in results:
+            self.assertTrue(snapshot.has_user(user))
+            if snapshot not in snapshots:
+                snapshots.append(snapshot)
+        self.assertEqual([len(snapshot.user_ids) for snapshot in snapshots], [2, 2, 1])
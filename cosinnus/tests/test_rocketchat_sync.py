@@ -0,0 +1,186 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils.timezone import now
+
+from cosinnus.models.group import CosinnusPortal, CosinnusPortalMembership
+from cosinnus.models.membership import MEMBERSHIP_MEMBER
+from cosinnus.models.profile import (
+    PROFILE_SETTING_ROCKET_CHAT_ID,
+    PROFILE_SETTING_ROCKET_CHAT_SYNC_HASH,
+    PROFILE_SETTING_ROCKET_CHAT_USERNAME,
+)
+from cosinnus_message.rocket_chat import RocketChatConnection
+from cosinnus_message.rocket_chat_sync import RateLimiter, RocketChatSync
+
+User = get_user_model()
+
+
+class FakeRocketChat(object):
+    """The state of a fake Rocket.Chat server, implementing the API methods used by the user sync."""
+
+    def __init__(self):
+        self.users = {}
+        self.requests = []
+
+    def handle(self, method, data):
+        if method == 'login':
+            return {'status': 'success', 'data': {'authToken': 'token', 'userId': 'bot'}}, 200
+        if method == 'me':
+            return {'success': True, '_id': 'bot', 'username': 'bot'}, 200
+        self.requests.append(method)
+        if method == 'users.list':
+            offset, count = int(data.get('offset', 0)), int(data.get('count', 100))
+            users = list(self.users.values())[offset : offset + count]
+            return {
+                'success': True,
+                'count': len(users),
+                'offset': offset,
+                'total': len(self.users),
+                'users': users,
+            }, 200
+        if method == 'users.info':
+            for user in self.users.values():
+                if user['_id'] == data.get('userId') or user['username'] == data.get('username'):
+                    return {'success': True, 'user': user}, 200
+            return {'success': False, 'error': 'User not found.'}, 400
+        if method == 'users.update':
+            user = self.users[data['userId']]
+            user.update(dict([(key, data['data'][key]) for key in ('name', 'username') if key in data['data']]))
+            if 'email' in data['data']:
+                user['emails'] = [{'address': data['data']['email'], 'verified': True}]
+            return {'success': True, 'user': user}, 200
+        if method in ('users.setAvatar', 'users.resetAvatar'):
+            return {'success': True}, 200
+        return {'success': False, 'error': 'Unknown method'}, 404
+
+
+class FakeRocketChatHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _handle(self, data):
+        path = urlparse(self.path).path
+        method = path[len('/api/v1/') :] if path.startswith('/api/v1/') else path
+        response, status = self.server.rocket.handle(method, data)
+        body = json.dumps(response).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        self._handle(dict([(key, values[0]) for key, values in parse_qs(urlparse(self.path).query).items()]))
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8')
+        try:
+            data = json.loads(body)
+        except ValueError:
+            data = dict([(key, values[0]) for key, values in parse_qs(body).items()])
+        self._handle(data)
+
+
+@override_settings(COSINNUS_ROCKET_ENABLED=False)
+class RocketChatSyncTest(TestCase):
+    """Tests the change detection of the user sync against a local fake Rocket.Chat server."""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeRocketChatHandler)
+        cls.server.rocket = FakeRocketChat()
+        cls.server_thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.server_thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        cache.clear()
+        self.rocket = self.server.rocket
+        self.user = User.objects.create(
+            username='rocketsync',
+            email='rocketsync@example.com',
+            first_name='Rocket',
+            last_name='Sync',
+            last_login=now(),
+        )
+        CosinnusPortalMembership.objects.get_or_create(
+            group=CosinnusPortal.get_current(), user=self.user, defaults={'status': MEMBERSHIP_MEMBER}
+        )
+        profile = self.user.cosinnus_profile
+        profile.tos_accepted = True
+        profile.settings[PROFILE_SETTING_ROCKET_CHAT_ID] = 'rc-1'
+        profile.settings[PROFILE_SETTING_ROCKET_CHAT_USERNAME] = profile.get_new_rocket_username()
+        profile.save()
+        self.rocket.users = {
+            'rc-1': {
+                '_id': 'rc-1',
+                'username': profile.rocket_username,
+                'name': profile.get_external_full_name(),
+                'emails': [{'address': profile.rocket_user_email, 'verified': True}],
+                'active': True,
+            }
+        }
+        self.rocket.requests = []
+
+    def tearDown(self):
+        cache.clear()
+
+    def _users_sync(self):
+        server_url = 'http://127.0.0.1:%d' % self.server.server_address[1]
+        connection = RocketChatConnection(user='bot', password='password', url=server_url)
+        RocketChatSync(connection, workers=1, rate_limit=0).users_sync()
+
+    def test_unchanged_users_are_skipped(self):
+        self._users_sync()
+        self.assertIn('users.list', self.rocket.requests)
+        self.user.cosinnus_profile.refresh_from_db()
+        self.assertTrue(self.user.cosinnus_profile.settings.get(PROFILE_SETTING_ROCKET_CHAT_SYNC_HASH))
+
+        self.rocket.requests = []
+        self._users_sync()
+        self.assertEqual(self.rocket.requests, [])
+
+    def test_changed_users_are_updated(self):
+        self._users_sync()
+        self.user.first_name = 'Changed'
+        self.user.save()
+
+        self.rocket.requests = []
+        self._users_sync()
+        self.assertIn('users.update', self.rocket.requests)
+        profile = User.objects.get(pk=self.user.pk).cosinnus_profile
+        self.assertEqual(self.rocket.users['rc-1']['name'], profile.get_external_full_name())
+
+        self.rocket.requests = []
+        self._users_sync()
+        self.assertEqual(self.rocket.requests, [])
+
+
+class RateLimiterTest(SimpleTestCase):
+    def test_wait_spaces_out_calls(self):
+        rate_limiter = RateLimiter(100)
+        start = time.monotonic()
+        for __ in range(5):
+            rate_limiter.wait()
+        # the first call is not delayed
+        self.assertGreaterEqual(time.monotonic() - start, 0.039)
+
+    def test_disabled(self):
+        rate_limiter = RateLimiter(None)
+        start = time.monotonic()
+        for __ in range(100):
+            rate_limiter.wait()
+        self.assertLess(time.monotonic() - start, 0.1)
@@ -2,11 +2,15 @@
 from __future__ import unicode_literals
 
 import os
+import shutil
+import tempfile
+import zipfile
 from builtins import object
+from io import BytesIO
 
 from django.test import TestCase
 
-from cosinnus.utils.files import get_avatar_filename
+from cosinnus.utils.files import ZIP_STREAM_CHUNK_SIZE, get_avatar_filename, stream_zip_from_files
 
 
 class AvatarTest(TestCase):
@@ -25,3 +29,38 @@ class AvatarTest(TestCase):
         expected_filename_hash_length = 44
         self.assertEqual(len(avatar_file), expected_filename_hash_length)
         self.assertNotIn(filename, avatar_file)
+
+
+class StreamZipTest(TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.large_file = os.path.join(self.temp_dir, 'large.txt')
+        with open(self.large_file, 'wb') as f:
+            f.write(os.urandom(ZIP_STREAM_CHUNK_SIZE * 5))
+        self.image_file = os.path.join(self.temp_dir, 'image.png')
+        with open(self.image_file, 'wb') as f:
+            f.write(os.urandom(1000))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_stream_zip_from_files(self):
+        file_list = [
+            (self.large_file, 'large.txt'),
+            (self.image_file, 'sub/image.png'),
+            (b'URL=https://example.com', 'link.url'),
+            (os.path.join(self.temp_dir, 'missing.txt'), 'missing.txt'),
+        ]
+        chunks = list(stream_zip_from_files(file_list))
+        # the zip is emitted in chunks while reading the files
+        self.assertGreater(len(chunks), 5)
+        self.assertLess(max([len(chunk) for chunk in chunks]), ZIP_STREAM_CHUNK_SIZE * 2)
+
+        zip_file = zipfile.ZipFile(BytesIO(b''.join(chunks)))
+        self.assertIsNone(zip_file.testzip())
+        self.assertEqual(zip_file.namelist(), ['large.txt', 'sub/image.png', 'link.url'])
+        with open(self.large_file, 'rb') as f:
+            self.assertEqual(zip_file.read('large.txt'), f.read())
+        self.assertEqual(zip_file.read('link.url'), b'URL=https://example.com')
+        self.assertEqual(zip_file.getinfo('large.txt').compress_type, zipfile.ZIP_DEFLATED)
+        self.assertEqual(zip_file.getinfo('sub/image.png').compress_type, zipfile.ZIP_STORED)
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+
+from cosinnus.models.group import CosinnusGroupMembership
+from cosinnus.models.group_extra import CosinnusSociety
+from cosinnus.models.membership import MEMBERSHIP_ADMIN, MEMBERSHIP_MEMBER, MEMBERSHIP_PENDING
+from cosinnus.models.tagged import BaseTagObject
+from cosinnus.utils.permission_context import (
+    activate_permission_context,
+    deactivate_permission_context,
+    get_permission_context,
+)
+from cosinnus.utils.permissions import (
+    check_object_read_access,
+    check_ug_admin,
+    check_ug_membership,
+    check_ug_pending,
+    filter_readable,
+    filter_tagged_object_queryset_for_user,
+)
+from cosinnus_note.models import Note
+
+User = get_user_model()
+
+
+class PermissionContextTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='member', email='member@example.com', password='secret')
+        self.other_user = User.objects.create_user(username='other', email='other@example.com', password='secret')
+        self.group = CosinnusSociety.objects.create(name='Member Group')
+        self.admin_group = CosinnusSociety.objects.create(name='Admin Group')
+        self.pending_group = CosinnusSociety.objects.create(name='Pending Group')
+        self.other_group = CosinnusSociety.objects.create(name='Other Group')
+        CosinnusGroupMembership.objects.create(group=self.group, user=self.user, status=MEMBERSHIP_MEMBER)
+        CosinnusGroupMembership.objects.create(group=self.admin_group, user=self.user, status=MEMBERSHIP_ADMIN)
+        CosinnusGroupMembership.objects.create(group=self.pending_group, user=self.user, status=MEMBERSHIP_PENDING)
+        CosinnusGroupMembership.objects.create(group=self.other_group, user=self.other_user, status=MEMBERSHIP_MEMBER)
+        self.groups = [self.group, self.admin_group, self.pending_group, self.other_group]
+        self.notes = [
+            Note.objects.create(group=group, creator=self.other_user, title='Note %s' % group.name, text='Text')
+            for group in self.groups
+        ]
+        cache.clear()
+
+    def tearDown(self):
+        deactivate_permission_context()
+        cache.clear()
+
+    def get_checks(self):
+        user = self.user
+        return [
+            (check_ug_membership(user, group), check_ug_admin(user, group), check_ug_pending(user, group))
+            for group in self.groups
+        ]
+
+    def test_context_matches_uncached_checks(self):
+        expected = self.get_checks()
+        self.assertEqual(expected[0], (True, False, False))
+        self.assertEqual(expected[1], (True, True, False))
+        activate_permission_context(self.user)
+        checks = self.get_checks()
+        self.assertEqual(checks, expected)
+
+    def test_context_only_applies_to_its_user(self):
+        activate_permission_context(self.user)
+        self.assertIsNone(get_permission_context(self.other_user))
+        self.assertTrue(check_ug_membership(self.other_user, self.other_group))
+
+    def test_memberships_are_loaded_once(self):
+        activate_permission_context(self.user)
+        with self.assertNumQueries(1):
+            for group in self.groups:
+                check_ug_membership(self.user, group)
+                check_ug_admin(self.user, group)
+
+    def test_context_is_reset_on_membership_change(self):
+        activate_permission_context(self.user)
+        self.assertFalse(check_ug_membership(self.user, self.other_group))
+        CosinnusGroupMembership.objects.create(group=self.other_group, user=self.user, status=MEMBERSHIP_MEMBER)
+        self.assertTrue(check_ug_membership(self.user, self.other_group))
+
+    def test_filter_readable(self):
+        public_note = self.notes[-1]
+        public_note.media_tag.visibility = BaseTagObject.VISIBILITY_ALL
+        public_note.media_tag.save()
+        objects = self.groups + self.notes
+        expected = [obj for obj in objects if check_object_read_access(obj, self.user)]
+        self.assertEqual(filter_readable(objects, self.user), expected)
+        self.assertIn(public_note, expected)
+        self.assertNotIn(self.notes[2], expected)
+        # the temporary context is removed again
+        self.assertIsNone(get_permission_context())
+
+    def test_filter_queryset_excludes_inactive_groups(self):
+        for note in self.notes:
+            note.media_tag.visibility = BaseTagObject.VISIBILITY_GROUP
+            note.media_tag.save()
+        # the items of deactivated groups are hidden from their members
+        self.group.is_active = False
+        self.group.save()
+        expected = set(filter_tagged_object_queryset_for_user(Note.objects.all(), self.user))
+        self.assertEqual(expected, set([self.notes[1]]))
+        activate_permission_context(self.user)
+        self.assertEqual(set(filter_tagged_object_queryset_for_user(Note.objects.all(), self.user)), expected)
+        # the context only uses the user's active groups for the filter
+        context = get_permission_context(self.user)
+        self.assertNotIn(self.group.id, context.active_member_group_ids)
+        self.assertIn(self.group.id, context.member_group_ids)
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+
+from cosinnus.models.group import CosinnusPortal, CosinnusPortalMembership
+from cosinnus.models.membership import MEMBERSHIP_ADMIN, MEMBERSHIP_MEMBER, MEMBERSHIP_PENDING
+from cosinnus.utils.user import filter_portal_users, get_portal_member_ids_query
+
+User = get_user_model()
+
+
+class PortalUserFilterTest(TestCase):
+    def setUp(self):
+        self.portal = CosinnusPortal.get_current()
+        self.users = [User.objects.create(username='user%d' % i, email='user%d@example.com' % i) for i in range(4)]
+        # users may have been added to the portal on creation
+        CosinnusPortalMembership.objects.filter(user__in=self.users).delete()
+        for user, status in zip(self.users, [MEMBERSHIP_MEMBER, MEMBERSHIP_ADMIN, MEMBERSHIP_PENDING]):
+            CosinnusPortalMembership.objects.create(group=self.portal, user=user, status=status)
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_filter_portal_users_matches_portal_members(self):
+        users = User.objects.filter(id__in=[user.id for user in self.users])
+        expected = sorted(users.filter(id__in=self.portal.members).values_list('id', flat=True))
+        self.assertEqual(expected, [self.users[0].id, self.users[1].id])
+        self.assertEqual(sorted(filter_portal_users(users).values_list('id', flat=True)), expected)
+        self.assertEqual(
+            sorted(users.filter(id__in=get_portal_member_ids_query()).values_list('id', flat=True)), expected
+        )
+
+    def test_filter_portal_users_uses_subquery(self):
+        with self.assertNumQueries(1):
+            list(filter_portal_users(User.objects.all(), portal=self.portal))
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils.timezone import now
+
+from cosinnus.models.group import CosinnusPortal, CosinnusPortalMembership
+from cosinnus.models.membership import MEMBERSHIP_MEMBER
+from cosinnus.utils.user_autocomplete import (
+    UserAutocompleteIndex,
+    build_user_autocomplete_index,
+    update_user_autocomplete_index,
+)
+
+User = get_user_model()
+
+
+def create_active_portal_member(username, first_name, last_name):
+    user = User.objects.create(
+        username=username,
+        email='%s@example.com' % username,
+        first_name=first_name,
+        last_name=last_name,
+        last_login=now(),
+    )
+    CosinnusPortalMembership.objects.get_or_create(
+        group=CosinnusPortal.get_current(), user=user, defaults={'status': MEMBERSHIP_MEMBER}
+    )
+    profile = user.cosinnus_profile
+    profile.tos_accepted = True
+    profile.save()
+    return user
+
+
+class UserAutocompleteIndexTest(SimpleTestCase):
+    def setUp(self):
+        self.index = UserAutocompleteIndex()
+        self.index.set_user(1, ['José', 'Müller'])
+        self.index.set_user(2, ['Anna', 'Schmidt'])
+        self.index.set_user(3, ['Hans', 'Annaberg'])
+
+    def test_search_substring(self):
+        self.assertEqual(self.index.search(['ann']), {2, 3})
+        self.assertEqual(self.index.search(['nnab']), {3})
+        self.assertEqual(self.index.search(['jose']), {1})
+        self.assertEqual(self.index.search(['MÜLL']), {1})
+
+    def test_search_short_terms_match_word_beginnings(self):
+        self.assertEqual(self.index.search(['a']), {2, 3})
+        self.assertEqual(self.index.search(['nn']), set())
+
+    def test_search_all_terms(self):
+        self.assertEqual(self.index.search(['ann', 'sch']), {2})
+        self.assertEqual(self.index.search(['ann', 'xyz']), set())
+        self.assertEqual(self.index.search(['']), {1, 2, 3})
+
+    def test_get_sorted(self):
+        self.assertEqual(self.index.get_sorted({1, 2, 3}), [2, 3, 1])
+        self.assertEqual(self.index.get_sorted({1, 2, 3}, limit=2), [2, 3])
+
+    def test_update_and_remove(self):
+        self.index.set_user(2, ['Berta', 'Schmidt'])
+        self.assertEqual(self.index.search(['ann']), {3})
+        self.assertEqual(self.index.search(['ber']), {2, 3})
+        self.index.remove_user(3)
+        self.assertEqual(self.index.search(['ann']), set())
+        self.assertEqual(len(self.index), 2)
+        self.assertNotIn('ann', self.index.trigrams)
+
+    def test_copy(self):
+        index = self.index.copy()
+        index.set_user(2, ['Berta', 'Schmidt'])
+        index.remove_user(3)
+        index.set_user(4, ['Annika', 'Meier'])
+        self.assertEqual(index.search(['ann']), {4})
+        # the original index is unchanged
+        self.assertEqual(self.index.search(['ann']), {2, 3})
+        self.assertEqual(self.index.search(['ber']), {3})
+        self.assertEqual(len(self.index), 3)
+
+
+@override_settings(COSINNUS_USER_AUTOCOMPLETE_INDEX_ENABLED=True)
+class UserAutocompleteIndexUpdateTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.portal = CosinnusPortal.get_current()
+        self.user = create_active_portal_member('anna', 'Anna', 'Schmidt')
+
+    def tearDown(self):
+        cache.clear()
+
+    def test_changes_are_applied_to_a_copy(self):
+        index = build_user_autocomplete_index(portal=self.portal)
+        self.assertEqual(index.search(['anna']), {self.user.id})
+        self.assertIs(update_user_autocomplete_index(index, portal=self.portal), index)
+
+        self.user.first_name = 'Berta'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            other_user = create_active_portal_member('annika', 'Annika', 'Meier')
+        updated_index = update_user_autocomplete_index(index, portal=self.portal)
+        self.assertEqual(updated_index.search(['berta']), {self.user.id})
+        self.assertEqual(updated_index.search(['ann']), {other_user.id})
+        # searches still using the previous index are not affected
+        self.assertEqual(index.search(['ann']), {self.user.id})
+
+    def test_users_leaving_the_portal_are_removed(self):
+        index = build_user_autocomplete_index(portal=self.portal)
+        with self.captureOnCommitCallbacks(execute=True):
+            CosinnusPortalMembership.objects.filter(group=self.portal, user=self.user).delete()
+        updated_index = update_user_autocomplete_index(index, portal=self.portal)
+        self.assertEqual(updated_index.search(['anna']), set())
+
+    def test_incomplete_changelog(self):
+        index = build_user_autocomplete_index(portal=self.portal)
+        index.sequence += 1
+        self.assertIsNone(update_user_autocomplete_index(index, portal=self.portal))
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import time
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase
+
+from cosinnus.models.group import CosinnusPortal
+from cosinnus.utils import user_match
+from cosinnus.utils.user_match import (
+    USER_MATCH_INDEX_CHUNK_SIZE,
+    UserMatchFeatures,
+    UserMatchIndex,
+    UserMatchIndexStorageError,
+    dump_user_match_index,
+    get_user_match_index,
+    load_user_match_index,
+    rebuild_user_match_index,
+)
+
+DAY = 60 * 60 * 24
+
+
+class UserMatchIndexTest(SimpleTestCase):
+    def setUp(self):
+        self.now = time.time()
+        self.index = UserMatchIndex()
+        self.index.set_rows(
+            [
+                UserMatchFeatures(1, 2, self.now - 100 * DAY, {'tag:1', 'tag:2', 'topic:3'}),
+                UserMatchFeatures(2, 0, self.now - DAY, {'tag:1'}),
+                UserMatchFeatures(3, 5, self.now - 400 * DAY, {'tag:1', 'tag:2'}),
+                UserMatchFeatures(4, 1, self.now - 10 * DAY, set()),
+            ]
+        )
+
+    def _ranked(self, features, **kwargs):
+        feature_ids = self.index.get_feature_ids(features)
+        user_ids, scores = self.index.get_ranked_user_ids(feature_ids, at_time=self.now, **kwargs)
+        return list(zip(user_ids.tolist(), scores.tolist()))
+
+    def test_scores(self):
+        # static score + shared features + recent activity, users inactive for over a year are left out
+        self.assertEqual(self._ranked({'tag:1', 'topic:3', 'unknown:1'}), [(1, 4), (2, 2), (4, 2)])
+
+    def test_exclude(self):
+        self.assertEqual(self._ranked({'tag:2'}, exclude_user_ids={1, 4}), [(2, 1)])
+
+    def test_set_rows(self):
+        self.index.set_rows(
+            [
+                UserMatchFeatures(2, 0, self.now - DAY, {'tag:2', 'topic:3', 'location:berlin'}),
+                UserMatchFeatures(5, 0, self.now - 100 * DAY, {'location:berlin'}),
+            ],
+            removed_user_ids=[1],
+        )
+        self.assertEqual(len(self.index), 4)
+        self.assertEqual(self._ranked({'tag:2', 'location:berlin'}), [(2, 3), (4, 2), (5, 1)])
+
+    def test_copy(self):
+        index = self.index.copy()
+        index.set_rows([UserMatchFeatures(5, 0, self.now - DAY, {'location:berlin'})], removed_user_ids=[1])
+        # the original index is unchanged
+        self.assertEqual(len(self.index), 4)
+        self.assertNotIn('location:berlin', self.index.vocabulary)
+        self.assertEqual(self._ranked({'topic:3'}), [(1, 3), (4, 2), (2, 1)])
+        self.assertEqual(len(index), 4)
+
+
+class UserMatchIndexStorageTest(SimpleTestCase):
+    # the number of profiles of the `benchmark_user_match` command
+    PROFILE_COUNT = 50000
+    FEATURES_PER_PROFILE = 10
+    # memcached's default item size limit
+    CACHE_ITEM_SIZE_LIMIT = 1024 * 1024
+
+    def setUp(self):
+        self.now = time.time()
+        self.index = UserMatchIndex()
+        self.index.set_rows(
+            [
+                UserMatchFeatures(
+                    user_id,
+                    user_id % 7,
+                    self.now - (user_id % 400) * DAY,
+                    {'tag:%d' % ((user_id * 31 + feature * 97) % 5000) for feature in range(self.FEATURES_PER_PROFILE)},
+                )
+                for user_id in range(1, self.PROFILE_COUNT + 1)
+            ]
+        )
+
+    def test_chunks_fit_into_the_cache(self):
+        chunks = dump_user_match_index(self.index)
+        self.assertLess(USER_MATCH_INDEX_CHUNK_SIZE, self.CACHE_ITEM_SIZE_LIMIT)
+        self.assertTrue(all([len(chunk) <= USER_MATCH_INDEX_CHUNK_SIZE for chunk in chunks]))
+        # the pickled index contains the stored arrays and the vocabulary, but not the derived entry rows
+        stored_array_size = sum(
+            [
+                array.nbytes
+                for array in (
+                    self.index.user_ids,
+                    self.index.static_scores,
+                    self.index.last_logins,
+                    self.index.indptr,
+                    self.index.indices,
+                )
+            ]
+        )
+        self.assertLess(sum([len(chunk) for chunk in chunks]), stored_array_size + 256 * 1024)
+
+    def test_loaded_index_scores_like_the_original(self):
+        index = load_user_match_index(dump_user_match_index(self.index))
+        feature_ids = self.index.get_feature_ids({'tag:1', 'tag:128', 'tag:4999'})
+        for expected, loaded in zip(
+            self.index.get_ranked_user_ids(feature_ids, at_time=self.now),
+            index.get_ranked_user_ids(feature_ids, at_time=self.now),
+        ):
+            self.assertEqual(expected.tolist(), loaded.tolist())
+
+
+@patch('cosinnus.tasks.rebuild_user_match_index_task.delay')
+class UserMatchIndexRebuildTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        user_match._local_indexes.clear()
+        self.portal = CosinnusPortal.get_current()
+
+    def tearDown(self):
+        cache.clear()
+        user_match._local_indexes.clear()
+
+    def test_index_is_built_in_background(self, delay_patch):
+        self.assertIsNone(get_user_match_index())
+        self.assertIsNone(get_user_match_index())
+        delay_patch.assert_called_once_with()
+
+        index = rebuild_user_match_index()
+        self.assertEqual(get_user_match_index().sequence, index.sequence)
+
+    def test_outdated_index_is_used_during_rebuild(self, delay_patch):
+        # the changelog of the index is no longer complete
+        outdated_index = UserMatchIndex()
+        outdated_index.sequence = 5
+        user_match._local_indexes[self.portal.id] = (outdated_index, time.time())
+        self.assertIs(get_user_match_index(), outdated_index)
+        delay_patch.assert_called_once_with()
+
+        rebuild_user_match_index()
+        index = get_user_match_index()
+        self.assertIsNot(index, outdated_index)
+        self.assertEqual(index.sequence, 0)
+
+    def test_failed_storage_does_not_restart_the_rebuild(self, delay_patch):
+        self.assertIsNone(get_user_match_index())
+        delay_patch.assert_called_once_with()
+
+        with patch.object(user_match.cache, 'set_many', return_value=['failed']):
+            with self.assertRaises(UserMatchIndexStorageError):
+                rebuild_user_match_index()
+        # the rebuild lock is kept until it expires
+        self.assertIsNone(get_user_match_index())
+        delay_patch.assert_called_once_with()
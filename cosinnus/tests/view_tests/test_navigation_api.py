@@ -6,6 +6,7 @@ from django.contrib.auth import get_user_model
 from django.core.cache import cache
 from django.template.defaultfilters import date
 from django.urls import reverse
+from django.utils.timezone import now
 from rest_framework.test import APITestCase, override_settings
 
 from cosinnus.api_frontend.views.navigation import AlertsView
@@ -26,6 +27,7 @@ from cosinnus.tests.utils import reload_urlconf
 from cosinnus.trans.group import CosinnusProjectTrans, CosinnusSocietyTrans
 from cosinnus.utils.dates import timestamp_from_datetime
 from cosinnus_notifications.models import NotificationAlert
+from postman.models import STATUS_ACCEPTED, Message
 
 User = get_user_model()
 
@@ -322,6 +324,72 @@ class UnreadAlertsViewTest(TestAlertsMixin, TestMembershipAlertsMixin, APITestCa
         self.assertDictEqual(response.data, {'count': 0, 'membership_alert_count': 1})
 
 
+@override_settings(COSINNUS_UNREAD_COUNTS_WEBSOCKET_ENABLED=True)
+@patch('cosinnus.utils.unread_counts._send_unread_count_deltas')
+class UnreadCountsPushTest(TestAlertsMixin, TestMembershipAlertsMixin, APITestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.test_user = User.objects.create(**TEST_USER_DATA)
+        cls.portal = CosinnusPortal.get_current()
+
+    def test_membership_request_pushes_membership_alert_count(self, send_patch):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_membership_request()
+        send_patch.assert_called_once_with([self.test_user.id], {'membership_alerts': 1}, self.portal)
+
+        send_patch.reset_mock()
+        membership = self.group.memberships.get(status=MEMBERSHIP_PENDING)
+        membership.status = MEMBERSHIP_MEMBER
+        with self.captureOnCommitCallbacks(execute=True):
+            membership.save()
+        send_patch.assert_called_once_with([self.test_user.id], {'membership_alerts': -1}, self.portal)
+
+    def test_mark_as_read_pushes_alert_count(self, send_patch):
+        self.create_test_alert(seen=False)
+        self.create_test_alert(seen=True)
+        self.client.force_login(self.test_user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(reverse('cosinnus:frontend-api:api-navigation-alerts') + '?mark_as_read=true')
+        send_patch.assert_called_once_with([self.test_user.id], {'alerts': -1}, self.portal)
+
+    def create_unread_message(self):
+        sender, __ = User.objects.get_or_create(username='sender', defaults={'email': 'sender@example.com'})
+        with self.captureOnCommitCallbacks(execute=True):
+            message = Message.objects.create(
+                sender=sender, recipient=self.test_user, subject='Subject', moderation_status=STATUS_ACCEPTED
+            )
+        return message
+
+    def test_new_message_pushes_message_count(self, send_patch):
+        self.create_unread_message()
+        send_patch.assert_called_once_with([self.test_user.id], {'messages': 1}, self.portal)
+
+    def test_bulk_updates_push_message_count(self, send_patch):
+        unread_message = self.create_unread_message()
+        read_message = self.create_unread_message()
+        read_message.read_at = now()
+        read_message.save()
+        self.client.force_login(self.test_user)
+        for url_name, delta in (('postman:archive', -1), ('postman:markasread', None)):
+            send_patch.reset_mock()
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(
+                    reverse(url_name),
+                    {'delete_pk__%d' % unread_message.pk: 'true', 'delete_pk__%d' % read_message.pk: 'true'},
+                )
+            if delta:
+                send_patch.assert_called_once_with([self.test_user.id], {'messages': delta}, self.portal)
+            else:
+                # the archived message is no longer counted
+                send_patch.assert_not_called()
+
+    @override_settings(COSINNUS_ROCKET_ENABLED=True)
+    def test_messages_are_not_pushed_with_rocket_chat(self, send_patch):
+        self.create_unread_message()
+        send_patch.assert_not_called()
+
+
 class AlertsViewTest(TestAlertsMixin, APITestCase):
     @classmethod
     def setUpClass(cls):
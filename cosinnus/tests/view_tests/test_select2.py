@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.core.cache import cache
+from django.http import Http404
+from django.test import RequestFactory, TestCase, override_settings
+
+from cosinnus.models.group import CosinnusPortal
+from cosinnus.models.managed_tags import CosinnusManagedTag, CosinnusManagedTagAssignment
+from cosinnus.tests.util_tests.test_user_autocomplete import create_active_portal_member
+from cosinnus.utils import user_autocomplete
+from cosinnus.utils.user_autocomplete import build_user_autocomplete_index
+from cosinnus.views.select2 import AllMembersView, ManagedTagsMembersView
+
+
+@override_settings(COSINNUS_USER_AUTOCOMPLETE_INDEX_ENABLED=True)
+class UserAutocompleteViewsTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.portal = CosinnusPortal.get_current()
+        self.users = [create_active_portal_member('anna%d' % i, 'Anna', 'User %02d' % i) for i in range(12)]
+        self.other_user = create_active_portal_member('bert', 'Bert', 'Other')
+        user_autocomplete._local_indexes[self.portal.id] = build_user_autocomplete_index(portal=self.portal)
+        self.request = RequestFactory().get('/')
+        self.request.user = self.other_user
+
+    def tearDown(self):
+        cache.clear()
+        user_autocomplete._local_indexes.clear()
+
+    def get_results(self, view, term, page):
+        __, has_more, results = view.get_results(self.request, term, page, None)
+        return has_more, [result_id for result_id, __ in results]
+
+    def test_all_members_paging(self):
+        view = AllMembersView()
+        has_more, result_ids = self.get_results(view, 'ann', 1)
+        self.assertTrue(has_more)
+        # results are ordered by name
+        self.assertEqual(result_ids, ['user:%d' % user.id for user in self.users[:10]])
+
+        has_more, result_ids = self.get_results(view, 'ann', 2)
+        self.assertFalse(has_more)
+        self.assertEqual(result_ids, ['user:%d' % user.id for user in self.users[10:]])
+
+        self.assertRaises(Http404, view.get_results, self.request, 'ann', 3, None)
+
+    def test_all_members_search_terms(self):
+        has_more, result_ids = self.get_results(AllMembersView(), 'anna 07', 1)
+        self.assertFalse(has_more)
+        self.assertEqual(result_ids, ['user:%d' % self.users[7].id])
+
+    def test_managed_tag_members(self):
+        CosinnusManagedTag.objects.create(slug='tag')
+        for user in self.users[:2] + [self.other_user]:
+            CosinnusManagedTagAssignment.assign_managed_tag_to_object(user.cosinnus_profile, 'tag')
+        view = ManagedTagsMembersView()
+        view.managed_tag_slug = 'tag'
+        has_more, result_ids = self.get_results(view, 'ann', 1)
+        self.assertFalse(has_more)
+        self.assertEqual(result_ids, ['user:%d' % user.id for user in self.users[:2]])
+
+    def test_database_is_used_while_index_is_built(self):
+        user_autocomplete._local_indexes.clear()
+        user_autocomplete._building_portal_ids.add(self.portal.id)
+        try:
+            has_more, result_ids = self.get_results(AllMembersView(), 'bert', 1)
+        finally:
+            user_autocomplete._building_portal_ids.discard(self.portal.id)
+        self.assertFalse(has_more)
+        self.assertEqual(result_ids, ['user:%d' % self.other_user.id])
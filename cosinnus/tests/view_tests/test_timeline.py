@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase, override_settings
+
+from cosinnus.models.group import CosinnusGroupMembership
+from cosinnus.models.group_extra import CosinnusSociety
+from cosinnus.models.membership import MEMBERSHIP_MEMBER
+from cosinnus.models.tagged import BaseTagObject, LikeObject
+from cosinnus.models.timeline import TimelineEntry
+from cosinnus.utils.timeline import add_group_to_user_timeline, rebuild_timeline, remove_group_from_user_timeline
+from cosinnus.utils.timeline_cache import CSRF_TOKEN_PLACEHOLDER, TimelineFragmentCache, timeline_fragment_cache
+from cosinnus.views.user_dashboard import TimelineView
+from cosinnus_event.models import Event, EventAttendance
+from cosinnus_note.models import Note
+
+User = get_user_model()
+
+
+class MaterializedTimelineTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='member', email='member@example.com', password='secret')
+        self.other_user = User.objects.create_user(username='other', email='other@example.com', password='secret')
+        self.group = CosinnusSociety.objects.create(name='Timeline Group')
+        self.other_group = CosinnusSociety.objects.create(name='Other Group')
+        CosinnusGroupMembership.objects.create(group=self.group, user=self.user, status=MEMBERSHIP_MEMBER)
+        CosinnusGroupMembership.objects.create(group=self.other_group, user=self.other_user, status=MEMBERSHIP_MEMBER)
+        self.notes = [
+            Note.objects.create(group=self.group, creator=self.user, title='Note %d' % i, text='Text') for i in range(5)
+        ]
+        self.other_note = Note.objects.create(
+            group=self.other_group, creator=self.other_user, title='Other note', text='Text'
+        )
+        self.public_note = Note.objects.create(
+            group=self.other_group, creator=self.other_user, title='Public note', text='Text'
+        )
+        self.public_note.media_tag.visibility = BaseTagObject.VISIBILITY_ALL
+        self.public_note.media_tag.save()
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def get_view(self, page_size=20, **flags):
+        view = TimelineView()
+        view.request = RequestFactory().get('/')
+        view.request.user = self.user
+        view.user = self.user
+        view.page_size = page_size
+        view.offset_timestamp = None
+        view.only_mine = flags.get('only_mine', True)
+        view.only_forum = flags.get('only_forum', True)
+        view.only_public = flags.get('only_public', True)
+        return view
+
+    def test_rebuild(self):
+        rebuild_timeline()
+        user_entries = TimelineEntry.objects.filter(user=self.user)
+        self.assertEqual(user_entries.count(), len(self.notes))
+        portal_entries = TimelineEntry.objects.filter(user__isnull=True)
+        self.assertEqual(list(portal_entries.values_list('object_id', flat=True)), [self.public_note.id])
+
+    @override_settings(NEWW_DEFAULT_USER_GROUPS=['timeline-forum'])
+    def test_materialized_timeline_matches_querysets(self):
+        forum_group = CosinnusSociety.objects.create(name='Timeline Forum', slug='timeline-forum')
+        CosinnusGroupMembership.objects.create(group=forum_group, user=self.user, status=MEMBERSHIP_MEMBER)
+        forum_note = Note.objects.create(group=forum_group, creator=self.other_user, title='Forum note', text='Text')
+        rebuild_timeline()
+        # the forum note has a single portal-wide entry instead of one for each member
+        self.assertEqual(
+            list(TimelineEntry.objects.filter(object_id=forum_note.id).values_list('user_id', 'is_forum')),
+            [(None, True)],
+        )
+        for flags in [
+            {},
+            {'only_public': False},
+            {'only_mine': False, 'only_public': False},
+            {'only_mine': False, 'only_forum': False},
+        ]:
+            with override_settings(COSINNUS_V2_DASHBOARD_USE_MATERIALIZED_TIMELINE=False):
+                expected = self.get_view(**flags).get_items()
+            # read the entries directly, as `get_items` falls back to the querysets on errors
+            items = self.get_view(**flags)._get_items_from_timeline_entries()
+            self.assertEqual(items, expected)
+            self.assertEqual(forum_note in items, flags.get('only_forum', True))
+
+    def test_materialized_timeline_paging(self):
+        rebuild_timeline()
+        with override_settings(COSINNUS_V2_DASHBOARD_USE_MATERIALIZED_TIMELINE=True):
+            view = self.get_view(page_size=2, only_public=False)
+            items = view._get_items_from_timeline_entries()
+        self.assertEqual(len(items), 2)
+        self.assertEqual(items, sorted(items, key=lambda item: item.last_action, reverse=True))
+
+    def test_membership_changes(self):
+        rebuild_timeline()
+        add_group_to_user_timeline(self.user.id, self.other_group.id)
+        self.assertEqual(TimelineEntry.objects.filter(user=self.user, group=self.other_group).count(), 2)
+        remove_group_from_user_timeline(self.user.id, self.other_group.id)
+        self.assertFalse(TimelineEntry.objects.filter(user=self.user, group=self.other_group).exists())
+        # the portal-wide entry of the public note is kept
+        self.assertTrue(TimelineEntry.objects.filter(user__isnull=True, object_id=self.public_note.id).exists())
+
+
+@override_settings(COSINNUS_TIMELINE_FRAGMENT_CACHE_ENABLED=True)
+class TimelineFragmentCacheTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='member', email='member@example.com', password='secret')
+        self.other_user = User.objects.create_user(username='other', email='other@example.com', password='secret')
+        self.group = CosinnusSociety.objects.create(name='Timeline Group')
+        for user in [self.user, self.other_user]:
+            CosinnusGroupMembership.objects.create(group=self.group, user=user, status=MEMBERSHIP_MEMBER)
+        self.creator = User.objects.create_user(username='creator', email='creator@example.com', password='secret')
+        self.note = Note.objects.create(group=self.group, creator=self.creator, title='Note', text='Text')
+        self.fragment_cache = TimelineFragmentCache()
+        self.rendered = []
+        cache.clear()
+
+    def tearDown(self):
+        cache.clear()
+
+    def render_func(self, item):
+        self.rendered.append(item)
+        return '<form><input type="hidden" name="csrfmiddlewaretoken" value="token-%d"></form>' % len(self.rendered)
+
+    def render(self, user):
+        request = RequestFactory().get('/')
+        request.user = user
+        return self.fragment_cache.render_items([self.note], request, self.render_func)[0]
+
+    def test_fragments_are_shared_between_users(self):
+        self.render(self.user)
+        html = self.render(self.other_user)
+        self.assertEqual(len(self.rendered), 1)
+        self.assertEqual(self.fragment_cache.get_stats()['hits'], 1)
+        # the CSRF token is never shared
+        self.assertNotIn('token-1', html)
+        self.assertNotIn(CSRF_TOKEN_PLACEHOLDER, html)
+
+    def test_user_variants(self):
+        self.render(self.user)
+        LikeObject.objects.create(
+            content_type=ContentType.objects.get_for_model(Note), object_id=self.note.id, user=self.user, liked=True
+        )
+        self.note.clear_likes_cache()
+        self.render(self.user)
+        self.render(self.creator)
+        self.assertEqual(len(self.rendered), 3)
+
+    def test_invalidation(self):
+        self.render(self.user)
+        self.fragment_cache.invalidate_for_instance(self.note)
+        self.render(self.user)
+        self.assertEqual(len(self.rendered), 2)
+        self.assertEqual(self.fragment_cache.get_stats()['misses'], 2)
+
+    def test_invalidation_by_dependency(self):
+        event = Event.objects.create(group=self.group, creator=self.creator, title='Event')
+        request = RequestFactory().get('/')
+        request.user = self.user
+        timeline_fragment_cache.render_items([event], request, self.render_func)
+        # the attendance count of the event is part of its rendering
+        EventAttendance.objects.create(event=event, user=self.user, state=EventAttendance.ATTENDANCE_GOING)
+        timeline_fragment_cache.render_items([event], request, self.render_func)
+        self.assertEqual(len(self.rendered), 2)
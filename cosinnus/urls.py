@@ -275,6 +275,16 @@ urlpatterns = [
     path('housekeeping/fillcache/<str:number>/', housekeeping.fillcache, name='housekeeping-fillcache'),
     path('housekeeping/getcache', housekeeping.getcache, name='housekeeping-getcache'),
     path('housekeeping/deletecache', housekeeping.deletecache, name='housekeeping-deletecache'),
+    path(
+        'housekeeping/elastic_index_queue/',
+        housekeeping.elastic_index_queue_stats,
+        name='housekeeping-elastic-index-queue',
+    ),
+    path(
+        'housekeeping/timeline_fragment_cache/',
+        housekeeping.timeline_fragment_cache_stats,
+        name='housekeeping-timeline-fragment-cache',
+    ),
     path('housekeeping/users_online_today/', housekeeping.users_online_today, name='housekeeping-users_online_today'),
     path('housekeeping/test_logging/', housekeeping.test_logging, name='housekeeping-test-logging'),
     path(
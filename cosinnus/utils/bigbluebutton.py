@@ -1,7 +1,15 @@
+import logging
 import random
 import string
 import xml.etree.ElementTree as ET
 
+from cosinnus.conf import settings
+
+logger = logging.getLogger('cosinnus')
+
+BBB_QUEUE_CHANNEL_GROUP = 'bbb_queue_%d'  # media tag id
+BBB_QUEUE_ROOM_READY_COMMAND = 'bbb_room_ready'
+
 
 def xml_to_json(xml_data):
     """converts a xml representation of a response to json"""
@@ -53,3 +61,32 @@ def random_voice_bridge():
     #         break
 
     return random.randint(10000, 99999)
+
+
+def get_bbb_queue_channel_group(media_tag_id):
+    return BBB_QUEUE_CHANNEL_GROUP % int(media_tag_id)
+
+
+def get_bbb_queue_websocket_path(media_tag_id):
+    """Returns the path of the `BBBRoomQueueConsumer` websocket for the BBB room of a media tag,
+    or None if the BBB queue websocket is disabled"""
+    if not settings.COSINNUS_BBB_QUEUE_WEBSOCKET_ENABLED:
+        return None
+    return settings.COSINNUS_BBB_QUEUE_WEBSOCKET_PATH % {'media_tag_id': media_tag_id}
+
+
+def notify_bbb_room_ready(media_tag_id):
+    """Notifies all clients waiting in the BBB room queue of a media tag that its room has been created,
+    so they can retrieve their room URL from the queue API"""
+    if not settings.COSINNUS_BBB_QUEUE_WEBSOCKET_ENABLED:
+        return
+    from cosinnus.consumers import emit_socket_message  # noqa
+
+    try:
+        emit_socket_message(BBB_QUEUE_ROOM_READY_COMMAND, {}, channel_group=get_bbb_queue_channel_group(media_tag_id))
+    except Exception as e:
+        # the clients' fallback polling will pick up the room
+        logger.warning(
+            'Could not notify the BBB queue websocket of a media tag.',
+            extra={'media_tag_id': media_tag_id, 'exception': str(e)},
+        )
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+A log of changed users shared between processes via the cache, for keeping process-local indexes up to date.
+
+A process that keeps an index of per-user data remembers the sequence number of the last change it has applied,
+and on its next use updates only the users changed since then (see `UserChangelog.get_changes`). If changes have
+expired from the cache before being applied, the index has to be rebuilt.
+"""
+
+from __future__ import unicode_literals
+
+from django.core.cache import cache
+
+from cosinnus.models.group import CosinnusPortal
+
+USER_CHANGELOG_SEQUENCE_CACHE_KEY = 'cosinnus/core/portal/%d/%s/changelog/'
+USER_CHANGELOG_ENTRY_CACHE_KEY = 'cosinnus/core/portal/%d/%s/changelog/%d/'
+
+
+class UserChangelog(object):
+    """A per-portal log of the ids of changed users.
+    @param name: The name of the log, used in its cache keys
+    @param timeout: The time in seconds for which changes are kept"""
+
+    def __init__(self, name, timeout):
+        self.name = name
+        self.timeout = timeout
+
+    def get_sequence(self, portal=None):
+        """Returns the sequence number of the last change"""
+        portal = portal or CosinnusPortal.get_current()
+        return cache.get(USER_CHANGELOG_SEQUENCE_CACHE_KEY % (portal.id, self.name)) or 0
+
+    def add(self, user_id, portal=None):
+        """Records that the data of a user has changed"""
+        portal = portal or CosinnusPortal.get_current()
+        sequence_key = USER_CHANGELOG_SEQUENCE_CACHE_KEY % (portal.id, self.name)
+        cache.add(sequence_key, 0, None)
+        try:
+            sequence = cache.incr(sequence_key)
+        except ValueError:
+            # the sequence has been evicted in the meantime, which resets the log
+            return
+        cache.set(USER_CHANGELOG_ENTRY_CACHE_KEY % (portal.id, self.name, sequence), user_id, self.timeout)
+
+    def get_changes(self, since_sequence, portal=None):
+        """Returns the ids of all users changed after the given sequence number.
+        @return: A tuple of (sequence number of the last change, set of user ids). The set is None if
+            the changes are no longer complete, e.g. because they have expired or the log has been reset"""
+        portal = portal or CosinnusPortal.get_current()
+        sequence = self.get_sequence(portal=portal)
+        if sequence < since_sequence:
+            return sequence, None
+        keys = [
+            USER_CHANGELOG_ENTRY_CACHE_KEY % (portal.id, self.name, entry)
+            for entry in range(since_sequence + 1, sequence + 1)
+        ]
+        changes = cache.get_many(keys) if keys else {}
+        if len(changes) < len(keys):
+            return sequence, None
+        return sequence, set(changes.values())
@@ -3,8 +3,8 @@ from __future__ import unicode_literals
 
 import hashlib
 import os
-import tempfile
 import zipfile
+from datetime import datetime
 from io import BytesIO
 from os import path
 from uuid import uuid4
@@ -43,6 +43,17 @@ def get_cosinnus_media_file_folder():
         return get_cosinnus_all_portals_folder()
 
 
+def get_private_file_storage():
+    """Returns the storage for private files like data exports. Its files are located outside of MEDIA_ROOT, so that
+    they are never served by the web server, and must only be served by views that check permissions."""
+    from django.core.files.storage import FileSystemStorage
+
+    location = settings.COSINNUS_PRIVATE_FILES_ROOT
+    if not location:
+        location = path.join(path.dirname(path.normpath(settings.MEDIA_ROOT)), 'private-media')
+    return FileSystemStorage(location=location)
+
+
 def get_avatar_filename(instance, filename):
     return _get_avatar_filename(instance, filename, 'user')
 
@@ -113,36 +124,80 @@ def get_presentation_filename(instance, filename):
     return _get_all_portals_filename(instance, filename, 'presentations')
 
 
-def create_zip_file(files):
-    missing = []
-    with tempfile.NamedTemporaryFile(delete=False) as tf:
-        with zipfile.ZipFile(tf, 'w', zipfile.ZIP_DEFLATED) as zf:
-            for f in files:
-                if path.exists(f[0]):
-                    zf.write(*f)
+# files with these extensions are already compressed and are stored in zip files without compressing them again
+ZIP_STORED_FILE_EXTENSIONS = (
+    '.7z', '.avi', '.bz2', '.docx', '.gif', '.gz', '.jpeg', '.jpg', '.m4a', '.mkv', '.mov', '.mp3', '.mp4',
+    '.odp', '.ods', '.odt', '.ogg', '.png', '.pptx', '.rar', '.webm', '.webp', '.xlsx', '.xz', '.zip',
+)  # fmt: skip
+# the size of the chunks in which files are read and the zip data is emitted while streaming a zip file
+ZIP_STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class _ZipStreamBuffer(object):
+    """A write-only, unseekable file object collecting the data written by a `ZipFile` until it is emitted"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _get_zip_info(source, zip_path):
+    if isinstance(source, bytes):
+        zip_info = zipfile.ZipInfo(zip_path, date_time=datetime.now().timetuple()[:6])
+        zip_info.file_size = len(source)
+    else:
+        zip_info = zipfile.ZipInfo.from_file(source, zip_path)
+    if zip_path.lower().endswith(ZIP_STORED_FILE_EXTENSIONS):
+        zip_info.compress_type = zipfile.ZIP_STORED
+    else:
+        zip_info.compress_type = zipfile.ZIP_DEFLATED
+    return zip_info
+
+
+def stream_zip_from_files(file_list):
+    """Generates a Zip-File from files on the disk as a stream of chunks, e.g. for a `StreamingHttpResponse`.
+    Each file is read and compressed in chunks as the zip is consumed, so memory use does not depend on the
+    size of the files. Missing files are skipped.
+    @param file_list: A list of tuples: [(local_file_path, relative_zip_path)]. Instead of a file path,
+        the file content can also be given as bytes.
+        Example: [('/tmp/file1.txt', 'file1.txt'), (b'content', 'sub/file2.txt')]
+    @return: A generator of bytes chunks of the zip file"""
+    buffer = _ZipStreamBuffer()
+    with zipfile.ZipFile(buffer, 'w') as zip_file:
+        for source, zip_path in file_list:
+            if not isinstance(source, bytes) and not path.isfile(source):
+                continue
+            with zip_file.open(_get_zip_info(source, zip_path), 'w') as zip_entry:
+                if isinstance(source, bytes):
+                    zip_entry.write(source)
                 else:
-                    missing.append(f[1])
-    return tf, missing
+                    with open(source, 'rb') as source_file:
+                        for chunk in iter(lambda: source_file.read(ZIP_STREAM_CHUNK_SIZE), b''):
+                            zip_entry.write(chunk)
+                            yield buffer.pop()
+            yield buffer.pop()
+    # the central directory is written on closing the zip file
+    yield buffer.pop()
 
 
 def create_zip_from_files(file_list):
     """Will create an in-memory (BytesIO) Zip-File from files on the disk.
+    Use `stream_zip_from_files` for files of arbitrary size.
     @param file_list: A list of string tuples: [(local_file_path, relative_zip_path)]
         Example: [('/tmp/file1.txt', 'file1.txt'), ('/tmp/sub/file2.txt', 'sub/file2.txt')]
     @return: A BytesIO instance containing the zip in memory"""
-
-    # Open BytesIO to grab in-memory ZIP contents
-    io = BytesIO()
-    # The zip compressor
-    zip_file = zipfile.ZipFile(io, 'w', zipfile.ZIP_DEFLATED)
-    # add files to zip with custom path
-    for file_path, zip_path in file_list:
-        if path.exists(file_path):
-            zip_file.write(file_path, zip_path)
-    # Must close zip for all contents to be written
-    zip_file.close()
-
-    return io
+    return BytesIO(b''.join(stream_zip_from_files(file_list)))
 
 
 def append_string_to_filename(file_path, string_to_append):
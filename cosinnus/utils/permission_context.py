@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+A request-scoped permission context for the current user.
+
+Permission checks like `check_ug_membership` or `check_object_read_access` are often run for every object
+rendered on a page, and each of them goes back to the membership cache. The `PermissionContextMiddleware`
+activates a `PermissionContext` for each request, which loads the user's group roles, blocked users and
+superuser flag once, on first use, and answers the checks for the requesting user from sets.
+
+The permission functions in `cosinnus.utils.permissions` consult the active context automatically whenever
+they are called for the context's user, so no calling code needs to be changed.
+"""
+
+from __future__ import unicode_literals
+
+from asgiref.local import Local
+
+from cosinnus.conf import settings
+from cosinnus.models.group import CosinnusGroupMembership, CosinnusPortal
+from cosinnus.models.membership import MEMBER_STATUS, MEMBERSHIP_ADMIN, MEMBERSHIP_INVITED_PENDING, MEMBERSHIP_PENDING
+from cosinnus.models.profile import UserBlock
+from cosinnus.utils.group import get_cosinnus_group_model
+
+_active = Local()
+
+
+class PermissionContext(object):
+    """Holds the permission-relevant data of a single user for the duration of a request.
+    All data is loaded lazily on first access."""
+
+    def __init__(self, user, portal=None):
+        self.user = user
+        self.portal = portal
+        self.reset()
+
+    def reset(self):
+        """Discards all loaded data, e.g. after the user's memberships changed during the request"""
+        self._group_statuses = None
+        self._member_group_ids = None
+        self._active_member_group_ids = None
+        self._blocked_user_ids = None
+        self._is_superuser = None
+
+    def applies_to(self, user):
+        """Returns ``True`` if this context can answer permission checks for the given user"""
+        if not self.user.is_authenticated:
+            return not user.is_authenticated
+        return user.is_authenticated and user.id == self.user.id
+
+    def applies_to_portal(self, portal):
+        return portal is None or portal == self.get_portal()
+
+    def get_portal(self):
+        if self.portal is None:
+            self.portal = CosinnusPortal.get_current()
+        return self.portal
+
+    @property
+    def group_statuses(self):
+        """A dict of group id --> membership status of all of the user's group memberships"""
+        if self._group_statuses is None:
+            self._group_statuses = {}
+            if self.user.is_authenticated:
+                self._group_statuses = CosinnusGroupMembership.objects.get_user_group_statuses(self.user.id)
+        return self._group_statuses
+
+    @property
+    def member_group_ids(self):
+        """A set of ids of the groups the user is a member or admin of"""
+        if self._member_group_ids is None:
+            self._member_group_ids = set(
+                [group_id for group_id, status in self.group_statuses.items() if status in MEMBER_STATUS]
+            )
+        return self._member_group_ids
+
+    @property
+    def active_member_group_ids(self):
+        """A set of ids of the active groups the user is a member or admin of"""
+        if self._active_member_group_ids is None:
+            self._active_member_group_ids = set()
+            if self.member_group_ids:
+                self._active_member_group_ids = set(
+                    get_cosinnus_group_model()
+                    .objects.filter(id__in=self.member_group_ids, is_active=True)
+                    .values_list('id', flat=True)
+                )
+        return self._active_member_group_ids
+
+    @property
+    def blocked_user_ids(self):
+        """A set of ids of the users that the user has opted to block"""
+        if self._blocked_user_ids is None:
+            self._blocked_user_ids = set()
+            if settings.COSINNUS_ENABLE_USER_BLOCK and self.user.is_authenticated:
+                self._blocked_user_ids = set(UserBlock.get_blocked_user_ids_for_user(self.user))
+        return self._blocked_user_ids
+
+    @property
+    def is_superuser(self):
+        """Whether the user is a superuser or an admin of the current portal.
+        Special internal and guest users are handled by `check_user_superuser` itself."""
+        if self._is_superuser is None:
+            self._is_superuser = bool(
+                self.user.is_authenticated and (self.user.is_superuser or self.get_portal().is_admin(self.user))
+            )
+        return self._is_superuser
+
+    def handles_group(self, group):
+        """Returns ``True`` if membership checks for the given object can be answered by this context"""
+        return isinstance(group, get_cosinnus_group_model())
+
+    def is_member(self, group):
+        return self.group_statuses.get(group.id, None) in MEMBER_STATUS
+
+    def is_admin(self, group):
+        return self.group_statuses.get(group.id, None) == MEMBERSHIP_ADMIN
+
+    def is_pending(self, group):
+        return self.group_statuses.get(group.id, None) == MEMBERSHIP_PENDING
+
+    def is_invited_pending(self, group):
+        return self.group_statuses.get(group.id, None) == MEMBERSHIP_INVITED_PENDING
+
+    def blocks_user(self, user_id):
+        return user_id in self.blocked_user_ids
+
+
+def activate_permission_context(user, portal=None):
+    """Activates a new permission context for the given user in the current thread or task.
+    @return: The activated context"""
+    context = PermissionContext(user, portal=portal)
+    set_permission_context(context)
+    return context
+
+
+def set_permission_context(context):
+    _active.context = context
+
+
+def deactivate_permission_context():
+    set_permission_context(None)
+
+
+def get_permission_context(user=None):
+    """Returns the active permission context.
+    @param user: If given, only returns the context if it applies to this user
+    @return: A `PermissionContext` or None"""
+    context = getattr(_active, 'context', None)
+    if context is None or user is None:
+        return context
+    return context if context.applies_to(user) else None
+
+
+def reset_permission_context(user_id=None):
+    """Discards the loaded data of the active permission context, if it belongs to the given user id"""
+    context = get_permission_context()
+    if context is not None and (user_id is None or context.user.id == user_id):
+        context.reset()
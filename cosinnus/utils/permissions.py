@@ -2,12 +2,13 @@
 from __future__ import unicode_literals
 
 from builtins import str
+from collections import defaultdict
 from uuid import uuid1
 
 from annoying.functions import get_object_or_None
 from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
-from django.db.models import Q
+from django.db.models import Q, prefetch_related_objects
 from rest_framework.authentication import get_authorization_header
 from rest_framework.permissions import BasePermission, IsAdminUser
 
@@ -17,6 +18,12 @@ from cosinnus.models.idea import CosinnusIdea
 from cosinnus.models.profile import BaseUserProfile, GlobalBlacklistedEmail, GlobalUserNotificationSetting, UserBlock
 from cosinnus.models.tagged import BaseHierarchicalTaggableObjectModel, BaseTaggableObjectModel, BaseTagObject
 from cosinnus.utils.group import get_cosinnus_group_model, get_default_user_group_ids
+from cosinnus.utils.permission_context import (
+    activate_permission_context,
+    deactivate_permission_context,
+    get_permission_context,
+    set_permission_context,
+)
 from cosinnus_organization.models import CosinnusOrganization
 
 
@@ -28,6 +35,9 @@ def check_ug_admin(user, group):
     :param Group group: The group object to check
     :returns: True if the user is a member of the given group.
     """
+    context = get_permission_context(user)
+    if context is not None and context.handles_group(group):
+        return context.is_admin(group)
     return group.is_admin(user)
 
 
@@ -39,6 +49,9 @@ def check_ug_membership(user, group):
     :param Group group: The group object to check
     :returns: True if the user is a member of the group.
     """
+    context = get_permission_context(user)
+    if context is not None and context.handles_group(group):
+        return context.is_member(group)
     return group.is_member(user)
 
 
@@ -50,6 +63,9 @@ def check_ug_pending(user, group):
     :param Group group: The group object to check
     :returns: True if the user is a member of the group.
     """
+    context = get_permission_context(user)
+    if context is not None and context.handles_group(group):
+        return context.is_pending(group)
     return group.is_pending(user)
 
 
@@ -61,6 +77,9 @@ def check_ug_invited_pending(user, group):
     :param Group group: The group object to check
     :returns: True if the user is a member of the group.
     """
+    context = get_permission_context(user)
+    if context is not None and context.handles_group(group):
+        return context.is_invited_pending(group)
     return group.is_invited_pending(user)
 
 
@@ -84,7 +103,7 @@ def check_object_read_access(obj, user):
         # is accessing the item, or the item's creator is accessing it
         if obj.media_tag:
             obj_is_visible = (
-                obj.creator == user
+                (user.is_authenticated and obj.creator_id == user.id)
                 or obj.media_tag.visibility == BaseTagObject.VISIBILITY_ALL
                 or (obj.media_tag.visibility == BaseTagObject.VISIBILITY_GROUP and (is_member or is_admin))
             )
@@ -263,6 +282,9 @@ def check_user_blocks_user(blocking_user, blocked_user):
     If `COSINNUS_ENABLE_USER_BLOCK` is False, this always returns False."""
     if settings.COSINNUS_ENABLE_USER_BLOCK:
         if blocking_user.id and blocked_user.id:
+            context = get_permission_context(blocking_user)
+            if context is not None:
+                return context.blocks_user(blocked_user.id)
             if UserBlock.objects.filter(user=blocking_user, blocked_user=blocked_user).count() > 0:
                 return True
     return False
@@ -279,6 +301,9 @@ def check_user_superuser(user, portal=None):
         return True
     if not user.is_authenticated or user.is_guest:
         return False
+    context = get_permission_context(user)
+    if context is not None and context.applies_to_portal(portal):
+        return context.is_superuser
     return user.is_superuser or check_user_portal_admin(user, portal)
 
 
@@ -289,7 +314,7 @@ def check_user_portal_admin(user, portal=None):
     if not user.is_authenticated or user.is_guest:
         return False
     portal = portal or CosinnusPortal.get_current()
-    return user.id in portal.admins
+    return portal.is_admin(user)
 
 
 def check_user_portal_manager(user, portal=None):
@@ -299,7 +324,7 @@ def check_user_portal_manager(user, portal=None):
     if not user.is_authenticated or user.is_guest:
         return False
     portal = portal or CosinnusPortal.get_current()
-    return user.id in portal.managers
+    return portal.is_manager(user)
 
 
 def check_user_portal_moderator(user, portal=None):
@@ -320,7 +345,7 @@ def check_user_integrated_portal_member(user):
     return any([portal_id in settings.COSINNUS_INTEGRATED_PORTAL_IDS for portal_id in portal_memberships])
 
 
-def check_user_can_receive_emails(user, ignore_user_notification_settings=False):
+def check_user_can_receive_emails(user, ignore_user_notification_settings=False, global_notification_setting=None):
     """Checks if a user can receive emails *at all*, ignoring any frequency settings.
     This checks the global notification setting for authenticated users,
     and the email blacklist for anonymous users and whether a user is a guest account.
@@ -329,6 +354,8 @@ def check_user_can_receive_emails(user, ignore_user_notification_settings=False)
     @param: ignore_user_notification_settings: an optional parameter which serves to bring more
             flexibility in case if `GlobalUserNotificationSetting.SETTING_NEVER` setting has to be
             get ingnored somehow
+    @param: global_notification_setting: the user's `GlobalUserNotificationSetting` setting value, if it
+            is already known (e.g. from a bulk-loaded preference snapshot). Will be looked up if None.
     """
     if not user.is_authenticated:
         return not GlobalBlacklistedEmail.is_email_blacklisted(user.email)
@@ -337,9 +364,9 @@ def check_user_can_receive_emails(user, ignore_user_notification_settings=False)
     else:
         # check if notification settings forbid
         if not ignore_user_notification_settings:
-            notification_setting_check = (
-                GlobalUserNotificationSetting.objects.get_for_user(user) > GlobalUserNotificationSetting.SETTING_NEVER
-            )
+            if global_notification_setting is None:
+                global_notification_setting = GlobalUserNotificationSetting.objects.get_for_user(user)
+            notification_setting_check = global_notification_setting > GlobalUserNotificationSetting.SETTING_NEVER
             if not notification_setting_check:
                 return False
 
@@ -393,7 +420,11 @@ def filter_tagged_object_queryset_for_user(qs, user):
     q = Q(media_tag__isnull=True)  # get all objects that don't have a media_tag (folders for example)
     q |= Q(media_tag__visibility=BaseTagObject.VISIBILITY_ALL)  # All public tagged objects
     if user.is_authenticated:
-        gids = get_cosinnus_group_model().objects.get_for_user_pks(user)
+        context = get_permission_context(user)
+        if context is not None:
+            gids = list(context.active_member_group_ids)
+        else:
+            gids = get_cosinnus_group_model().objects.get_for_user_pks(user)
         q |= Q(  # all tagged objects in groups the user is a member of
             media_tag__visibility=BaseTagObject.VISIBILITY_GROUP, group_id__in=gids
         )
@@ -417,12 +448,44 @@ def filter_base_taggable_qs_for_blocked_user_content(qs, source_user):
 
     if settings.COSINNUS_ENABLE_USER_BLOCK:
         if source_user.is_authenticated:
-            blocked_user_ids = UserBlock.get_blocked_user_ids_for_user(source_user)
+            context = get_permission_context(source_user)
+            if context is not None:
+                blocked_user_ids = list(context.blocked_user_ids)
+            else:
+                blocked_user_ids = UserBlock.get_blocked_user_ids_for_user(source_user)
             if blocked_user_ids:
                 qs = qs.exclude(creator__id__in=blocked_user_ids)
     return qs
 
 
+def filter_readable(objects, user):
+    """Filters a list of objects down to the ones the user has read access to, see `check_object_read_access`.
+    Use this instead of checking each object separately in list views and serializers: the user's
+    memberships and flags are loaded only once, and the groups and media tags of all taggable objects
+    are fetched in bulk.
+    @return: A list of the readable objects, in their original order"""
+    objects = list(objects)
+    taggable_by_model = defaultdict(list)
+    for obj in objects:
+        if isinstance(obj, BaseTaggableObjectModel):
+            taggable_by_model[obj.__class__].append(obj)
+    for model_objects in taggable_by_model.values():
+        prefetch_related_objects(model_objects, 'group', 'media_tag')
+
+    if get_permission_context(user) is not None:
+        return [obj for obj in objects if check_object_read_access(obj, user)]
+    # outside of a request (or for another user), use a temporary context for the duration of the filtering
+    previous_context = get_permission_context()
+    activate_permission_context(user)
+    try:
+        return [obj for obj in objects if check_object_read_access(obj, user)]
+    finally:
+        if previous_context is None:
+            deactivate_permission_context()
+        else:
+            set_permission_context(previous_context)
+
+
 def get_user_token(user, token_name):
     """Retrieves or generates a permanent token for a user and
     a given token identifier. Use these tokens only for one
@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+"""
+Daily rollups of the portal statistics metrics shown in the `SimpleStatisticsView`.
+
+The value of each metric is stored per day in `StatisticsRollup` by the `RollupStatistics` cronjob, which only
+computes the days since its last run (plus a few days before that, to pick up late changes of the data).
+Metrics counting distinct entries, like active users, are additionally stored for each completed week, month
+and year, because their daily values can not be summed up for longer periods.
+
+Once a metric has been rolled up, its rollups cover all days from the first day with data up to the last
+rolled-up day. If no rollups exist yet for a metric, the next run rolls it up completely. The
+`rollup_statistics` management command can be used to recompute all rollups.
+"""
+
+from __future__ import unicode_literals
+
+from datetime import datetime, time, timedelta
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Count, DateField, Max
+from django.db.models.functions import TruncDay, TruncMonth, TruncWeek, TruncYear
+from django.utils import timezone
+
+from cosinnus.conf import settings
+from cosinnus.models.group import CosinnusPortal
+from cosinnus.models.group_extra import CosinnusConference, CosinnusProject, CosinnusSociety
+from cosinnus.models.statistics import StatisticsRollup, UserOnlineOnDay
+from cosinnus.utils.user import get_portal_member_ids_query
+
+STATISTICS_METRIC_ACTIVE_USERS = 'active_users'
+STATISTICS_METRIC_NEW_USER_ACCOUNTS = 'new_user_accounts'
+STATISTICS_METRIC_CREATED_PROJECTS = 'created_projects'
+STATISTICS_METRIC_CREATED_GROUPS = 'created_groups'
+STATISTICS_METRIC_CREATED_CONFERENCES = 'created_conferences'
+STATISTICS_METRIC_CREATED_EVENTS = 'created_events'
+
+PERIOD_TRUNC_FUNCTIONS = {
+    StatisticsRollup.PERIOD_DAY: TruncDay,
+    StatisticsRollup.PERIOD_WEEK: TruncWeek,
+    StatisticsRollup.PERIOD_MONTH: TruncMonth,
+    StatisticsRollup.PERIOD_YEAR: TruncYear,
+}
+
+
+def get_period_start(period, day):
+    """Returns the first day of the period of the given type that contains the given day"""
+    if period == StatisticsRollup.PERIOD_WEEK:
+        return day - timedelta(days=day.weekday())
+    if period == StatisticsRollup.PERIOD_MONTH:
+        return day.replace(day=1)
+    if period == StatisticsRollup.PERIOD_YEAR:
+        return day.replace(month=1, day=1)
+    return day
+
+
+def get_next_period_start(period, period_start):
+    """Returns the first day of the period following the period starting at the given day"""
+    if period == StatisticsRollup.PERIOD_WEEK:
+        return period_start + timedelta(weeks=1)
+    if period == StatisticsRollup.PERIOD_MONTH:
+        year = period_start.year + (period_start.month // 12)
+        month = (period_start.month % 12) + 1
+        return period_start.replace(year=year, month=month, day=1)
+    if period == StatisticsRollup.PERIOD_YEAR:
+        return period_start.replace(year=period_start.year + 1, month=1, day=1)
+    return period_start + timedelta(days=1)
+
+
+def _start_of_day(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+class StatisticsMetric(object):
+    """A metric counting the distinct entries of a queryset by the days of a date field.
+    @param is_distinct: If True, entries can appear on multiple days (e.g. the online days of a user),
+        so that the daily counts of the metric can not be summed up."""
+
+    def __init__(self, name, data, unique_field, date_field, is_distinct=False):
+        self.name = name
+        self.data = data
+        self.unique_field = unique_field
+        self.date_field = date_field
+        self.is_distinct = is_distinct
+
+    def filter_by_dates(self, date_from, date_to):
+        """Returns the entries of all days from `date_from` to `date_to` (including both)"""
+        return self.data.filter(
+            **{
+                f'{self.date_field}__gte': _start_of_day(date_from),
+                f'{self.date_field}__lt': _start_of_day(date_to + timedelta(days=1)),
+            }
+        )
+
+    def get_count(self, date_from, date_to):
+        return self.filter_by_dates(date_from, date_to).values(self.unique_field).distinct().count()
+
+    def get_counts_by_period(self, period, date_from, date_to):
+        """Returns the counts of all periods of the given type between `date_from` and `date_to`,
+        in a single query.
+        @return: A dict of period start date --> count. Periods without entries are missing"""
+        trunc_function = PERIOD_TRUNC_FUNCTIONS[period]
+        buckets = (
+            self.filter_by_dates(date_from, date_to)
+            .values(_bucket_date=trunc_function(self.date_field, output_field=DateField()))
+            .annotate(_bucket_count=Count(self.unique_field, distinct=True))
+            .values_list('_bucket_date', '_bucket_count')
+        )
+        return dict(buckets)
+
+    def get_first_date(self):
+        """Returns the date of the earliest entry, or None if there are no entries"""
+        first = self.data.order_by(self.date_field).values_list(self.date_field, flat=True).first()
+        if isinstance(first, datetime):
+            first = timezone.localtime(first).date()
+        return first
+
+
+def get_used_user_accounts_queryset(portal=None):
+    """Returns a QS of all user accounts of the given or current portal that have been in use, including deactivated
+    accounts. Unlike `filter_active_users`, this does not exclude inactive users."""
+    return (
+        get_user_model()
+        .objects.filter(id__in=get_portal_member_ids_query(portal))
+        .exclude(last_login__exact=None)
+        .exclude(email__icontains='__unverified__')
+        .filter(cosinnus_profile__tos_accepted=True)
+        .exclude(cosinnus_profile___is_guest=True)
+    )
+
+
+def get_statistics_metrics(portal=None):
+    """Returns all statistics metrics available in the current portal.
+    @return: A dict of metric name --> `StatisticsMetric`"""
+    portal = portal or CosinnusPortal.get_current()
+    metrics = [
+        StatisticsMetric(
+            STATISTICS_METRIC_ACTIVE_USERS,
+            UserOnlineOnDay.objects.filter(user_id__in=get_portal_member_ids_query(portal)),
+            'user__id',
+            'date',
+            is_distinct=True,
+        ),
+        StatisticsMetric(
+            STATISTICS_METRIC_NEW_USER_ACCOUNTS, get_used_user_accounts_queryset(portal), 'pk', 'date_joined'
+        ),
+        StatisticsMetric(
+            STATISTICS_METRIC_CREATED_PROJECTS, CosinnusProject.objects.filter(portal=portal), 'pk', 'created'
+        ),
+        StatisticsMetric(
+            STATISTICS_METRIC_CREATED_GROUPS, CosinnusSociety.objects.filter(portal=portal), 'pk', 'created'
+        ),
+    ]
+    if settings.COSINNUS_CONFERENCES_ENABLED:
+        metrics.append(
+            StatisticsMetric(
+                STATISTICS_METRIC_CREATED_CONFERENCES, CosinnusConference.objects.filter(portal=portal), 'pk', 'created'
+            )
+        )
+    try:
+        from cosinnus_event.models import Event
+
+        metrics.append(
+            StatisticsMetric(
+                STATISTICS_METRIC_CREATED_EVENTS, Event.objects.filter(group__portal=portal), 'pk', 'created'
+            )
+        )
+    except ImportError:
+        pass
+    return dict([(metric.name, metric) for metric in metrics])
+
+
+def get_last_rollup_day(metric, portal=None):
+    """Returns the last day up to which the metric has been rolled up, or None if it has not been rolled up"""
+    portal = portal or CosinnusPortal.get_current()
+    rollups = StatisticsRollup.objects.filter(portal=portal, metric=metric.name, period=StatisticsRollup.PERIOD_DAY)
+    return rollups.aggregate(Max('period_start'))['period_start__max']
+
+
+def get_rollup_values(metric, period, date_from, date_to, portal=None):
+    """Returns the rolled-up values of all periods of the given type starting between `date_from` and `date_to`.
+    @return: A dict of period start date --> value"""
+    portal = portal or CosinnusPortal.get_current()
+    rollups = StatisticsRollup.objects.filter(
+        portal=portal,
+        metric=metric.name,
+        period=period,
+        period_start__gte=date_from,
+        period_start__lte=date_to,
+    )
+    return dict(rollups.values_list('period_start', 'value'))
+
+
+def get_daily_values(metric, date_from, date_to, portal=None):
+    """Returns the values of the metric for all days from `date_from` to `date_to` (including both). Rolled-up
+    days are read from the rollups, the days after the last rolled-up day are counted from the raw data in a
+    single query.
+    @return: A dict of date --> value. Days without entries may be missing"""
+    portal = portal or CosinnusPortal.get_current()
+    last_day = get_last_rollup_day(metric, portal=portal)
+    if last_day is None:
+        return metric.get_counts_by_period(StatisticsRollup.PERIOD_DAY, date_from, date_to)
+    daily_values = get_rollup_values(metric, StatisticsRollup.PERIOD_DAY, date_from, date_to, portal=portal)
+    raw_from = max(date_from, last_day + timedelta(days=1))
+    if raw_from <= date_to:
+        daily_values.update(metric.get_counts_by_period(StatisticsRollup.PERIOD_DAY, raw_from, date_to))
+    return daily_values
+
+
+def rollup_metric(metric, until, portal=None, recompute=False):
+    """Rolls up a metric for all days up to and including `until`, and for distinct metrics also all periods
+    completed until then. Only the days after the last rolled-up day (and the days of the recompute window
+    before it) are computed, unless no rollups exist yet or `recompute` is set.
+    @return: The number of stored rollups"""
+    portal = portal or CosinnusPortal.get_current()
+    last_day = None if recompute else get_last_rollup_day(metric, portal=portal)
+    if last_day is None:
+        start = min(metric.get_first_date() or until, until)
+    else:
+        start = last_day + timedelta(days=1 - settings.COSINNUS_STATISTICS_ROLLUP_RECOMPUTE_DAYS)
+    if start > until:
+        return 0
+
+    periods = [StatisticsRollup.PERIOD_DAY]
+    if metric.is_distinct:
+        periods += [StatisticsRollup.PERIOD_WEEK, StatisticsRollup.PERIOD_MONTH, StatisticsRollup.PERIOD_YEAR]
+    rollups = []
+    for period in periods:
+        # only completed periods are rolled up
+        period_starts = []
+        period_start = get_period_start(period, start)
+        while get_next_period_start(period, period_start) <= until + timedelta(days=1):
+            period_starts.append(period_start)
+            period_start = get_next_period_start(period, period_start)
+        if not period_starts:
+            continue
+        counts = metric.get_counts_by_period(
+            period, period_starts[0], get_next_period_start(period, period_starts[-1]) - timedelta(days=1)
+        )
+        rollups.extend(
+            [
+                StatisticsRollup(
+                    portal=portal,
+                    metric=metric.name,
+                    period=period,
+                    period_start=period_start,
+                    value=counts.get(period_start, 0),
+                )
+                for period_start in period_starts
+            ]
+        )
+
+    with transaction.atomic():
+        existing = StatisticsRollup.objects.filter(portal=portal, metric=metric.name)
+        if recompute:
+            existing.delete()
+        else:
+            for period in periods:
+                existing.filter(period=period, period_start__gte=get_period_start(period, start)).delete()
+        StatisticsRollup.objects.bulk_create(rollups)
+    return len(rollups)
+
+
+def rollup_statistics(portal=None, recompute=False):
+    """Rolls up all statistics metrics of the portal up to and including yesterday.
+    @return: The number of stored rollups"""
+    portal = portal or CosinnusPortal.get_current()
+    yesterday = timezone.localdate() - timedelta(days=1)
+    count = 0
+    for metric in get_statistics_metrics(portal=portal).values():
+        count += rollup_metric(metric, yesterday, portal=portal, recompute=recompute)
+    return count
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Background generation of image thumbnails after an image is uploaded.
+
+Without this, thumbnails are generated on the first display of an image, inside the request, which makes pages
+listing many new images slow. After an object with an image is saved, `generate_thumbnails_task` generates all
+sizes in which the image is displayed in the background:
+- for models using `ThumbnailableImageMixin`, all its static image copies (see `generate_thumbnails`)
+- for objects with an icon image (like user and group avatars), the avatar and map result icon sizes
+- for objects with a background image (like group wallpapers), the map result sizes
+
+After a save, the icon and background thumbnails are only generated if an image of the object changed since it
+was loaded (see `remember_image_names`), so that saving an object without uploading an image queues no task.
+
+The `generate_image_thumbnails` management command generates the thumbnails of all existing images.
+"""
+
+from __future__ import unicode_literals
+
+from django.db.models import FileField
+from django.db.models.fields.files import FieldFile
+
+from cosinnus.conf import settings
+from cosinnus.models.mixins.images import ThumbnailableImageMixin
+from cosinnus.utils.files import image_thumbnail
+
+
+def get_icon_thumbnail_sizes():
+    sizes = list(settings.COSINNUS_IMAGE_PREGENERATED_ICON_THUMBNAIL_SIZES)
+    sizes += [size for size in settings.COSINNUS_USER_PROFILE_AVATAR_THUMBNAIL_SIZES if size not in sizes]
+    return sizes
+
+
+def get_image_fields_with_thumbnail_sizes(obj):
+    """Returns the image fields of an object for which thumbnails are displayed, with their sizes.
+    @return: A list of tuples: [(image_field_file, list_of_sizes)]"""
+    images = []
+    if hasattr(obj, 'get_image_field_for_icon'):
+        images.append((obj.get_image_field_for_icon(), get_icon_thumbnail_sizes()))
+    if hasattr(obj, 'get_image_field_for_background'):
+        background_sizes = list(settings.COSINNUS_IMAGE_PREGENERATED_BACKGROUND_THUMBNAIL_SIZES)
+        images.append((obj.get_image_field_for_background(), background_sizes))
+    # the image getters may return static image URLs instead of image fields
+    return [(image, sizes) for image, sizes in images if image and isinstance(image, FieldFile)]
+
+
+def has_icon_or_background_image(obj):
+    return hasattr(obj, 'get_image_field_for_icon') or hasattr(obj, 'get_image_field_for_background')
+
+
+def get_image_names(obj):
+    """Returns the names of the files in all file fields of an object, without accessing deferred fields.
+    @return: A dict of {field_name: file_name}"""
+    names = {}
+    for field in obj._meta.concrete_fields:
+        if isinstance(field, FileField):
+            value = obj.__dict__.get(field.attname)
+            names[field.attname] = getattr(value, 'name', value) or ''
+    return names
+
+
+def remember_image_names(obj):
+    """Records the current image names of an object with an icon or background image, so that `needs_thumbnails`
+    can tell whether one of its images changed when it is saved"""
+    if has_icon_or_background_image(obj):
+        obj._thumbnail_image_names = get_image_names(obj)
+
+
+def needs_thumbnails(obj, only_changed=False):
+    """Returns True if the given object has images for which thumbnails have not been generated yet.
+    For images handled by easy-thumbnails, this can not be checked without accessing the storage, so
+    True is returned for all objects with images.
+    @param only_changed: If True, images handled by easy-thumbnails are only considered if any image of the
+        object changed since `remember_image_names` was called, or if it was never called for the object"""
+    if isinstance(obj, ThumbnailableImageMixin):
+        image = getattr(obj, obj.image_attr_name)
+        if image and obj.is_image and not obj.has_generated_thumbnails:
+            return True
+    if not get_image_fields_with_thumbnail_sizes(obj):
+        return False
+    return not only_changed or getattr(obj, '_thumbnail_image_names', None) != get_image_names(obj)
+
+
+def generate_thumbnails(obj):
+    """Generates all thumbnails of the images of the given object"""
+    if isinstance(obj, ThumbnailableImageMixin) and not obj.has_generated_thumbnails:
+        obj.generate_thumbnails()
+    for image, sizes in get_image_fields_with_thumbnail_sizes(obj):
+        for size in sizes:
+            image_thumbnail(image, size)
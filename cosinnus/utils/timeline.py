@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""
+Fan-out-on-write materialized timeline for the v2 dashboard `TimelineView`.
+
+Instead of combining several filtered querysets on each timeline request, every object that can appear in a
+timeline gets `TimelineEntry` rows sorted by its `last_action`:
+- one entry for each member of the object's group, kept up to date when the object is saved
+  and when memberships change,
+- and one portal-wide entry (without a user) for public objects and for forum objects, i.e. ideas and objects
+  of the default user groups, which every user joins.
+
+A timeline page is then read from the entries as a single indexed range. The entries are only candidates:
+the items of each page are loaded with the regular permission-filtered querysets, restricted to the
+candidate ids, so entries that are stale or too broad never leak content.
+
+The materialized timeline is used if `COSINNUS_V2_DASHBOARD_USE_MATERIALIZED_TIMELINE` is enabled. The
+`rebuild_timeline` management command needs to be run once after enabling it, and can be used to repair
+the entries at any time.
+"""
+
+from __future__ import unicode_literals
+
+import inspect
+from functools import reduce
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Q
+
+from cosinnus.models.group import CosinnusGroupMembership, CosinnusPortal
+from cosinnus.models.group_extra import CosinnusProject, CosinnusSociety
+from cosinnus.models.idea import CosinnusIdea
+from cosinnus.models.membership import MEMBER_STATUS
+from cosinnus.models.tagged import BaseHierarchicalTaggableObjectModel, BaseTagObject
+from cosinnus.models.timeline import TimelineEntry
+from cosinnus.utils.group import get_cosinnus_group_model, get_default_user_group_slugs
+
+# number of entries that are written at once
+TIMELINE_ENTRY_BATCH_SIZE = 1000
+
+# only content from these group types is shown in the timeline (no conference contents!)
+TIMELINE_GROUP_TYPES = (
+    CosinnusProject.GROUP_MODEL_TYPE,
+    CosinnusSociety.GROUP_MODEL_TYPE,
+)
+
+_timeline_models = None
+
+
+def get_timeline_models():
+    """Returns a list of all models that can be displayed in the v2 dashboard timeline"""
+    global _timeline_models
+    if _timeline_models is None:
+        from cosinnus.models.map import SEARCH_MODEL_NAMES_REVERSE
+        from cosinnus.views.user_dashboard import TimelineView
+
+        models = [SEARCH_MODEL_NAMES_REVERSE.get(content_type, None) for content_type in TimelineView.content_types]
+        _timeline_models = [model for model in models if model is not None]
+    return _timeline_models
+
+
+def is_timeline_object(obj):
+    return obj.__class__ in get_timeline_models()
+
+
+def get_timeline_queryset(model, portal=None):
+    """Returns a QS of all objects of a timeline model that can appear in any timeline of the portal"""
+    portal = portal or CosinnusPortal.get_current()
+    if model is CosinnusIdea:
+        return model._default_manager.filter(portal=portal).select_related('media_tag')
+    queryset = model._default_manager.filter(
+        group__portal=portal, group__is_active=True, group__type__in=TIMELINE_GROUP_TYPES
+    ).select_related('media_tag', 'group')
+    if BaseHierarchicalTaggableObjectModel in inspect.getmro(model):
+        queryset = queryset.filter(is_container=False)
+    if hasattr(model, 'is_hidden_group_proxy'):
+        queryset = queryset.exclude(is_hidden_group_proxy=True)
+    return queryset
+
+
+def _get_entry_fields(obj):
+    """Returns the field values shared by all timeline entries of an object,
+    or None if the object can not appear in any timeline."""
+    if getattr(obj, 'is_container', False) or getattr(obj, 'is_hidden_group_proxy', False):
+        return None
+    media_tag = obj.media_tag if obj.media_tag_id else None
+    fields = {
+        'content_type': ContentType.objects.get_for_model(obj.__class__),
+        'object_id': obj.pk,
+        'last_action': obj.last_action,
+        'is_public': bool(media_tag and media_tag.visibility == BaseTagObject.VISIBILITY_ALL),
+    }
+    if isinstance(obj, CosinnusIdea):
+        # ideas are platform-wide and appear along with the forum content
+        fields.update({'portal_id': obj.portal_id, 'group_id': None, 'is_forum': True})
+    else:
+        group = obj.group
+        if not group.is_active or group.type not in TIMELINE_GROUP_TYPES:
+            return None
+        fields.update(
+            {
+                'portal_id': group.portal_id,
+                'group_id': group.id,
+                'is_forum': group.slug in get_default_user_group_slugs(),
+            }
+        )
+    return fields
+
+
+def build_timeline_entries(obj, member_ids=None):
+    """Returns a list of all (unsaved) timeline entries for an object.
+    @param member_ids: The ids of the members of the object's group. Will be taken from the
+        membership cache if not given"""
+    fields = _get_entry_fields(obj)
+    if fields is None:
+        return []
+    entries = []
+    if fields['is_forum'] or fields['is_public']:
+        entries.append(TimelineEntry(user_id=None, **fields))
+    if not fields['is_forum']:
+        # forum objects are not fanned out to the members of the forum, which are all users of the portal
+        if member_ids is None:
+            member_ids = CosinnusGroupMembership.objects.get_members(group=fields['group_id'])
+        entries.extend([TimelineEntry(user_id=user_id, **fields) for user_id in member_ids])
+    return entries
+
+
+def update_timeline_for_object(obj):
+    """Replaces all timeline entries of an object with ones reflecting its current state"""
+    content_type = ContentType.objects.get_for_model(obj.__class__)
+    entries = build_timeline_entries(obj)
+    with transaction.atomic():
+        TimelineEntry.objects.filter(content_type=content_type, object_id=obj.pk).delete()
+        TimelineEntry.objects.bulk_create(entries, batch_size=TIMELINE_ENTRY_BATCH_SIZE)
+
+
+def remove_timeline_for_object(obj):
+    content_type = ContentType.objects.get_for_model(obj.__class__)
+    TimelineEntry.objects.filter(content_type=content_type, object_id=obj.pk).delete()
+
+
+def add_group_to_user_timeline(user_id, group_id):
+    """Adds entries for all of a group's timeline objects to a user's timeline, e.g. after joining the group"""
+    group = get_cosinnus_group_model().objects.filter(id=group_id).first()
+    if group is None or group.slug in get_default_user_group_slugs():
+        # the forum objects only have portal-wide entries
+        return
+    entries = []
+    for model in get_timeline_models():
+        if model is CosinnusIdea:
+            continue
+        queryset = get_timeline_queryset(model, portal=group.portal_id).filter(group=group)
+        for obj in queryset.iterator(chunk_size=TIMELINE_ENTRY_BATCH_SIZE):
+            entries.extend(build_timeline_entries(obj, member_ids=[user_id]))
+    with transaction.atomic():
+        # portal-wide entries of the group's objects are kept
+        TimelineEntry.objects.filter(user_id=user_id, group_id=group_id).delete()
+        TimelineEntry.objects.bulk_create(
+            [entry for entry in entries if entry.user_id], batch_size=TIMELINE_ENTRY_BATCH_SIZE
+        )
+
+
+def remove_group_from_user_timeline(user_id, group_id):
+    TimelineEntry.objects.filter(user_id=user_id, group_id=group_id).delete()
+
+
+def rebuild_timeline(portal=None):
+    """Deletes and recreates all timeline entries of a portal.
+    @return: The number of created entries"""
+    portal = portal or CosinnusPortal.get_current()
+    TimelineEntry.objects.filter(portal=portal).delete()
+    member_ids_by_group = {}
+    forum_slugs = get_default_user_group_slugs()
+    count = 0
+    for model in get_timeline_models():
+        entries = []
+        for obj in get_timeline_queryset(model, portal=portal).iterator(chunk_size=TIMELINE_ENTRY_BATCH_SIZE):
+            member_ids = None
+            if getattr(obj, 'group_id', None) and obj.group.slug not in forum_slugs:
+                if obj.group_id not in member_ids_by_group:
+                    member_ids_by_group[obj.group_id] = list(
+                        CosinnusGroupMembership.objects.filter(
+                            group_id=obj.group_id, status__in=MEMBER_STATUS
+                        ).values_list('user_id', flat=True)
+                    )
+                member_ids = member_ids_by_group[obj.group_id]
+            entries.extend(build_timeline_entries(obj, member_ids=member_ids))
+            if len(entries) >= TIMELINE_ENTRY_BATCH_SIZE:
+                TimelineEntry.objects.bulk_create(entries, batch_size=TIMELINE_ENTRY_BATCH_SIZE)
+                count += len(entries)
+                entries = []
+        TimelineEntry.objects.bulk_create(entries, batch_size=TIMELINE_ENTRY_BATCH_SIZE)
+        count += len(entries)
+    return count
+
+
+def get_timeline_entry_filter(user, only_mine=True, only_forum=True, only_public=True):
+    """Returns a Q filter for the timeline entries of a user, for the filter flags of the `TimelineView`.
+    The filter selects candidates only, the items still have to be filtered for the flags and permissions.
+    @return: A Q object, or None if no flags are set"""
+    if only_mine and only_forum and only_public:
+        return Q(user=user) | Q(user__isnull=True)
+    filters = []
+    if only_mine:
+        filters.append(Q(user=user, is_forum=False))
+    if only_forum:
+        filters.append(Q(user__isnull=True, is_forum=True))
+    if only_public:
+        filters.append(Q(user__isnull=True, is_public=True))
+    if not filters:
+        return None
+    return reduce(lambda combined, q: combined | q, filters)
+
+
+def get_timeline_entries(user, content_types, only_mine=True, only_forum=True, only_public=True, before=None):
+    """Returns an ordered values QS of (content_type_id, object_id) of the timeline candidates of a user.
+    @param content_types: A list of content types to include
+    @param before: If given, only returns entries with a `last_action` before this datetime
+    @return: A values QS, or None if no flags are set"""
+    entry_filter = get_timeline_entry_filter(user, only_mine=only_mine, only_forum=only_forum, only_public=only_public)
+    if entry_filter is None:
+        return None
+    entries = TimelineEntry.objects.filter(
+        entry_filter,
+        portal=CosinnusPortal.get_current(),
+        content_type__in=content_types,
+    )
+    if before:
+        entries = entries.filter(last_action__lt=before)
+    return entries.order_by('-last_action', 'id').values_list('content_type_id', 'object_id')
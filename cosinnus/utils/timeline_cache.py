@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+A fragment cache for the rendered HTML of v2 dashboard timeline items.
+
+The same items are rendered for every member of a group, so their HTML is cached and shared between all users
+that would see the same rendering of an item. The cache key consists of:
+- the object's content type and id,
+- a per-object version that is bumped whenever the object, one of its comments or any other object rendered as
+  part of it (see `TimelineFragmentCache.register_dependency`) is saved or deleted,
+- the object's `last_action` and `last_modified` timestamps,
+- the current language,
+- and a hash of all user-dependent state of the rendering (creator, write access, liked/followed/starred
+  state, like count, own comments and blocked users).
+
+CSRF tokens contained in the HTML are replaced with a placeholder before storing, and filled in with the
+requesting user's token when serving a cached fragment.
+"""
+
+from __future__ import unicode_literals
+
+import hashlib
+import re
+import threading
+import time
+from collections import defaultdict
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.exceptions import FieldDoesNotExist
+from django.middleware.csrf import get_token
+from django.utils.translation import get_language
+
+from cosinnus.conf import settings
+from cosinnus.models.profile import UserBlock
+from cosinnus.utils.dates import timestamp_from_datetime
+from cosinnus.utils.permissions import check_object_write_access, check_user_superuser
+
+TIMELINE_FRAGMENT_CACHE_KEY = 'cosinnus/core/timeline_fragment/%d/%d/v%d/%s/%s/%s/%s'
+# content type id, object id --> version
+TIMELINE_FRAGMENT_VERSION_CACHE_KEY = 'cosinnus/core/timeline_fragment_version/%d/%d'
+
+CSRF_TOKEN_PLACEHOLDER = '__cosinnus_csrf_token__'
+CSRF_TOKEN_VALUE_RE = re.compile(r'(name="csrfmiddlewaretoken" value=")[^"]*(")')
+
+
+class TimelineFragmentCache(object):
+    """Renders timeline items, serving their HTML from the cache where possible. Keeps hit/miss counters
+    for the current process."""
+
+    def __init__(self):
+        self._stats_lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'invalidations': 0}
+        # model --> (comment model, name of the comment model's FK field)
+        self._comment_relations = {}
+        # model --> list of (timeline model, name of the model's FK field pointing to it)
+        self._dependencies = defaultdict(list)
+
+    def render_items(self, items, request, render_func):
+        """Returns the rendered HTML for a list of timeline items.
+        @param render_func: A function rendering the HTML for a single item, used on cache misses
+        @return: A list of HTML strings, in the order of `items`"""
+        if not settings.COSINNUS_TIMELINE_FRAGMENT_CACHE_ENABLED or not items:
+            return [render_func(item) for item in items]
+
+        content_types = ContentType.objects.get_for_models(*set([item.__class__ for item in items]))
+        version_keys = [
+            TIMELINE_FRAGMENT_VERSION_CACHE_KEY % (content_types[item.__class__].id, item.id) for item in items
+        ]
+        versions = cache.get_many(version_keys)
+        user_context = self._get_user_context(items, request.user)
+        keys = [
+            self._get_fragment_key(item, content_types[item.__class__], versions.get(version_key, 0), user_context)
+            for item, version_key in zip(items, version_keys)
+        ]
+        fragments = cache.get_many(keys)
+
+        rendered = []
+        new_fragments = {}
+        for item, key in zip(items, keys):
+            html = fragments.get(key, None)
+            if html is None:
+                html = render_func(item)
+                new_fragments[key] = CSRF_TOKEN_VALUE_RE.sub(r'\g<1>%s\g<2>' % CSRF_TOKEN_PLACEHOLDER, html)
+            else:
+                html = html.replace(CSRF_TOKEN_PLACEHOLDER, get_token(request))
+            rendered.append(html)
+        if new_fragments:
+            cache.set_many(new_fragments, settings.COSINNUS_TIMELINE_FRAGMENT_CACHE_TIMEOUT)
+        self._count(hits=len(items) - len(new_fragments), misses=len(new_fragments))
+        return rendered
+
+    def invalidate(self, model, object_id):
+        """Invalidates all cached fragments of a timeline object"""
+        content_type = ContentType.objects.get_for_model(model)
+        # a timestamp-based version never repeats a previous one, even if the version key was evicted
+        version = int(time.time() * 1000)
+        cache.set(TIMELINE_FRAGMENT_VERSION_CACHE_KEY % (content_type.id, object_id), version, None)
+        self._count(invalidations=1)
+
+    def register_dependency(self, model, timeline_model, field_name):
+        """Registers a model whose data is rendered in the timeline items of `timeline_model`, like the
+        attendance count of events. Saving or deleting an instance of the model invalidates the cached fragments
+        of the timeline object it points to.
+        @param field_name: The name of the model's FK field pointing to the timeline object"""
+        self._dependencies[model].append((timeline_model, field_name))
+
+    def invalidate_for_instance(self, instance):
+        """Invalidates the cached fragments of a saved or deleted timeline object, or of the object
+        a saved or deleted comment or registered dependency belongs to"""
+        from cosinnus.utils.timeline import get_timeline_models
+
+        timeline_models = get_timeline_models()
+        if instance.__class__ in timeline_models:
+            self.invalidate(instance.__class__, instance.pk)
+            return
+        dependencies = self._dependencies.get(instance.__class__)
+        if dependencies:
+            for timeline_model, field_name in dependencies:
+                self.invalidate(timeline_model, getattr(instance, '%s_id' % field_name))
+            return
+        for model in timeline_models:
+            comment_model, comment_field = self.get_comment_relation(model)
+            if comment_model is not None and isinstance(instance, comment_model):
+                self.invalidate(model, getattr(instance, '%s_id' % comment_field))
+                return
+
+    def get_comment_relation(self, model):
+        """Returns a tuple of the model's comment model and the name of its FK field pointing to the model,
+        or (None, None) if the model has no comments"""
+        if model not in self._comment_relations:
+            try:
+                relation = model._meta.get_field('comments')
+                self._comment_relations[model] = (relation.related_model, relation.field.name)
+            except (FieldDoesNotExist, AttributeError):
+                self._comment_relations[model] = (None, None)
+        return self._comment_relations[model]
+
+    def get_stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else None
+        return stats
+
+    def _count(self, **counts):
+        with self._stats_lock:
+            for key, count in counts.items():
+                self._stats[key] += count
+
+    def _get_user_context(self, items, user):
+        """Loads the user-dependent data needed for all items of the page at once"""
+        context = {
+            'user': user,
+            'is_superuser': check_user_superuser(user),
+            'blocked_user_ids': [],
+            'own_comment_ids': defaultdict(list),
+        }
+        if not user.is_authenticated:
+            return context
+        if settings.COSINNUS_ENABLE_USER_BLOCK:
+            context['blocked_user_ids'] = sorted(UserBlock.get_blocked_user_ids_for_user(user))
+        # the user's own comments on the items can be deleted by them
+        pks_by_model = defaultdict(list)
+        for item in items:
+            pks_by_model[item.__class__].append(item.pk)
+        for model, pks in pks_by_model.items():
+            comment_model, comment_field = self.get_comment_relation(model)
+            if comment_model is None:
+                continue
+            comments = comment_model._default_manager.filter(**{'%s__in' % comment_field: pks, 'creator': user})
+            for item_id, comment_id in comments.values_list('%s_id' % comment_field, 'id'):
+                context['own_comment_ids'][(model, item_id)].append(comment_id)
+        return context
+
+    def _get_user_variant(self, item, user_context):
+        """Returns a hash of all user-dependent state that the rendering of the item depends on"""
+        user = user_context['user']
+        variant = [
+            user.is_authenticated,
+            user.is_authenticated and user.is_guest,
+            user_context['is_superuser'],
+            user.is_authenticated and item.creator_id == user.id,
+            user.is_authenticated and check_object_write_access(item, user),
+            user_context['blocked_user_ids'],
+            sorted(user_context['own_comment_ids'].get((item.__class__, item.pk), [])),
+        ]
+        if getattr(item, 'IS_LIKEABLE_OBJECT', False):
+            variant += [
+                user.id in item.get_liked_user_ids(),
+                user.id in item.get_followed_user_ids(),
+                user.id in item.get_starred_user_ids(),
+                item.like_count,
+            ]
+        return hashlib.md5(repr(variant).encode('utf-8')).hexdigest()
+
+    def _get_fragment_key(self, item, content_type, version, user_context):
+        last_modified = getattr(item, 'last_modified', None)
+        return TIMELINE_FRAGMENT_CACHE_KEY % (
+            content_type.id,
+            item.id,
+            version,
+            timestamp_from_datetime(item.last_action),
+            timestamp_from_datetime(last_modified) if last_modified else '',
+            get_language(),
+            self._get_user_variant(item, user_context),
+        )
+
+
+timeline_fragment_cache = TimelineFragmentCache()
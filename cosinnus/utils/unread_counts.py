@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Websocket push of changes of the unread counters shown as badges in the main navigation.
+
+Without this, the v3 frontend polls the unread counts views in `cosinnus.api_frontend.views.navigation` for every
+open tab, even if nothing changed. If `COSINNUS_UNREAD_COUNTS_WEBSOCKET_ENABLED` is set, the counter deltas are
+pushed to the `UnreadCountsConsumer` websockets of the affected users whenever:
+- a `NotificationAlert` is created, becomes unseen again or is marked as seen (`alerts`)
+- a membership request or invitation is created, accepted, declined or withdrawn (`membership_alerts`)
+- a postman message is received or read (`messages`)
+The frontend then only needs to poll the views in the slow `COSINNUS_UNREAD_COUNTS_FALLBACK_POLLING_INTERVAL`
+to correct any drift of the counters, e.g. from alerts of users that have been blocked in the meantime.
+Rocket.Chat unread messages are not pushed, as they are not known to the portal. If Rocket.Chat is enabled, postman
+message changes are not pushed either, and the frontend polls the messages count in the shorter
+`COSINNUS_UNREAD_COUNTS_ROCKET_CHAT_POLLING_INTERVAL` instead.
+"""
+
+from __future__ import unicode_literals
+
+import logging
+
+from django.core.cache import cache
+from django.db import transaction
+
+from cosinnus.conf import settings
+from cosinnus.models.group import CosinnusPortal
+
+logger = logging.getLogger('cosinnus')
+
+UNREAD_ALERTS_USER_CACHE_KEY = 'cosinnus/core/portal/%d/user_unread_alerts/%s/'
+UNREAD_ALERTS_USER_CACHE_TIMEOUT = 55
+
+UNREAD_COUNTS_CHANNEL_GROUP = 'unread_counts_%d_%d'  # portal id, user id
+UNREAD_COUNTS_COMMAND = 'unread_counts'
+
+
+def get_unread_counts_channel_group(user_id, portal=None):
+    portal = portal or CosinnusPortal.get_current()
+    return UNREAD_COUNTS_CHANNEL_GROUP % (portal.id, user_id)
+
+
+def push_unread_count_deltas(user_ids, alerts=0, membership_alerts=0, messages=0):
+    """Pushes changes of the unread counters to the websockets of the given users, after the current transaction
+    has been committed. Does nothing unless `COSINNUS_UNREAD_COUNTS_WEBSOCKET_ENABLED` is set.
+    @param user_ids: A list of ids of the users whose counters changed
+    @param alerts: The change of the unseen alerts count
+    @param membership_alerts: The change of the membership alerts count (invitations and membership requests)
+    @param messages: The change of the unread messages count"""
+    if not settings.COSINNUS_UNREAD_COUNTS_WEBSOCKET_ENABLED:
+        return
+    deltas = dict(
+        [
+            (counter, delta)
+            for counter, delta in (('alerts', alerts), ('membership_alerts', membership_alerts), ('messages', messages))
+            if delta
+        ]
+    )
+    user_ids = [user_id for user_id in set(user_ids) if user_id]
+    if not deltas or not user_ids:
+        return
+    portal = CosinnusPortal.get_current()
+    if alerts or membership_alerts:
+        # the cached counts would undo the pushed change on the next fallback poll
+        cache.delete_many([UNREAD_ALERTS_USER_CACHE_KEY % (portal.id, user_id) for user_id in user_ids])
+    transaction.on_commit(lambda: _send_unread_count_deltas(user_ids, deltas, portal))
+
+
+def _send_unread_count_deltas(user_ids, deltas, portal):
+    from cosinnus.consumers import emit_socket_message  # noqa
+
+    for user_id in user_ids:
+        try:
+            emit_socket_message(
+                UNREAD_COUNTS_COMMAND,
+                {'deltas': dict(deltas)},
+                channel_group=get_unread_counts_channel_group(user_id, portal=portal),
+            )
+        except Exception as e:
+            # the frontend's fallback polling will pick up the change
+            logger.warning(
+                'Could not push unread counts to the websocket of a user.',
+                extra={'user_id': user_id, 'exception': str(e)},
+            )
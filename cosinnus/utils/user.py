@@ -14,7 +14,7 @@ from django.contrib.auth import get_user_model, login
 from django.core.cache import cache
 from django.core.exceptions import MultipleObjectsReturned
 from django.db import transaction
-from django.db.models import Q
+from django.db.models import Exists, OuterRef, Q
 from django.template.loader import render_to_string
 from django.urls import reverse
 from django.utils.crypto import get_random_string
@@ -179,14 +179,26 @@ def filter_active_users(user_model_qs, filter_on_user_profile_model=False, filte
         return filtered_qs
 
 
-def filter_portal_users(user_model_qs, portal=None):
-    """Filters a QS of ``get_user_model()`` so that only users of this portal remain."""
+def get_portal_member_ids_query(portal=None):
+    """Returns a lazy values QS of the ids of all members of the given or current portal.
+    Use this in ``__in`` lookups (e.g. ``filter(user_id__in=get_portal_member_ids_query())``) instead of
+    ``portal.members``, so that the lookup is run as an SQL subquery, instead of sending one bound
+    parameter per portal member to the database."""
+    from cosinnus.models.membership import MEMBER_STATUS
+
     if portal is None:
         global _CosinnusPortal
         if _CosinnusPortal is None:
             _CosinnusPortal = apps.get_model('cosinnus', 'CosinnusPortal')
         portal = _CosinnusPortal.get_current()
-    return user_model_qs.filter(id__in=portal.members)
+    portal_membership_model = apps.get_model('cosinnus', 'CosinnusPortalMembership')
+    return portal_membership_model.objects.filter(group=portal, status__in=MEMBER_STATUS).values('user_id')
+
+
+def filter_portal_users(user_model_qs, portal=None):
+    """Filters a QS of ``get_user_model()`` so that only users of this portal remain.
+    The portal memberships are checked in an SQL ``EXISTS`` subquery."""
+    return user_model_qs.filter(Exists(get_portal_member_ids_query(portal).filter(user_id=OuterRef('pk'))))
 
 
 def get_user_query_filter_for_search_terms(terms):
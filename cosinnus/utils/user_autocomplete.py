@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+"""
+An in-memory index of the names of all active portal members, for the user autocomplete views in
+`cosinnus.views.select2`.
+
+Without this, each keystroke in a user select field runs several `icontains` lookups on the user and profile
+tables of all portal members, which can not use an index. The `UserAutocompleteIndex` keeps the normalized name
+fields of each member (first name, last name and the profile's `ADDITIONAL_USERNAME_FIELDS`) together with:
+- a trigram index, used for search terms with at least 3 characters, which match anywhere in a name field
+- a prefix index of the first characters of each word, used for shorter search terms, which match the beginnings
+    of words (matching single characters anywhere in a name is not useful for an autocomplete)
+so that the matching users are found by intersecting a few small sets, and only the users shown on the result page
+are loaded from the database.
+
+The index is built in a background thread of each process on the first search, and the autocomplete views query the
+database until it is available. Changes of users, profiles and portal memberships are recorded in a `UserChangelog`
+and applied to a copy of the index of each process before its next search. The updated copy then replaces the index,
+so that concurrent searches always use a consistent index. If the changelog is incomplete, the index is rebuilt in
+the background and the outdated index is used until the new one is available.
+"""
+
+from __future__ import unicode_literals
+
+import heapq
+import logging
+import threading
+import unicodedata
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+
+from cosinnus.conf import settings
+from cosinnus.models.group import CosinnusPortal
+from cosinnus.models.profile import get_user_profile_model
+from cosinnus.utils.changelog import UserChangelog
+from cosinnus.utils.user import filter_active_users, get_portal_member_ids_query
+
+logger = logging.getLogger('cosinnus')
+
+# search terms shorter than this are matched against the beginnings of words instead of trigrams
+USER_AUTOCOMPLETE_TRIGRAM_LENGTH = 3
+
+user_autocomplete_changelog = UserChangelog(
+    'user_autocomplete', settings.COSINNUS_USER_AUTOCOMPLETE_INDEX_CHANGELOG_TIMEOUT
+)
+
+# the index of each process, by portal id. an index stored here is never modified, as other request threads may be
+# searching it, but replaced by an updated copy
+_local_indexes = {}
+# only one thread of each process updates the index at a time, the others keep using the current one meanwhile
+_local_indexes_lock = threading.Lock()
+# the ids of the portals whose index is being built by a background thread of this process
+_building_portal_ids = set()
+_building_portal_ids_lock = threading.Lock()
+
+
+def normalize_name(value):
+    """Returns the lowercased name without accents, so that e.g. "jose" matches "José" """
+    value = unicodedata.normalize('NFKD', value or '')
+    return ''.join([char for char in value if not unicodedata.combining(char)]).casefold()
+
+
+def _get_trigrams(value):
+    return set([value[i : i + USER_AUTOCOMPLETE_TRIGRAM_LENGTH] for i in range(len(value) - 2)])
+
+
+def _get_word_prefixes(value):
+    prefixes = set()
+    for word in value.split():
+        prefixes.update([word[:length] for length in range(1, USER_AUTOCOMPLETE_TRIGRAM_LENGTH)])
+    return prefixes
+
+
+class UserAutocompleteIndex(object):
+    """The names of a set of users with trigram and word prefix indexes on them."""
+
+    def __init__(self):
+        # user id --> tuple of normalized name fields
+        self.names = {}
+        # user id --> sort key of the user
+        self.sort_keys = {}
+        # trigram --> set of user ids
+        self.trigrams = {}
+        # word prefix shorter than a trigram --> set of user ids
+        self.prefixes = {}
+        # the last changelog entry applied to this index
+        self.sequence = 0
+        # the (index name, key) pairs of the trigram and prefix sets that belong to this index. a copied index shares
+        # the sets with the original index, until they are changed. None if all sets belong to this index
+        self._own_keys = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def copy(self):
+        """Returns a copy of the index that can be updated without affecting this one"""
+        index = UserAutocompleteIndex()
+        index.names = dict(self.names)
+        index.sort_keys = dict(self.sort_keys)
+        index.trigrams = dict(self.trigrams)
+        index.prefixes = dict(self.prefixes)
+        index.sequence = self.sequence
+        index._own_keys = set()
+        return index
+
+    def _get_user_ids(self, index_name, key):
+        """Returns the set of user ids of a key of the trigram or prefix index, which may be modified in place"""
+        index = getattr(self, index_name)
+        user_ids = index.get(key)
+        if self._own_keys is not None and (index_name, key) not in self._own_keys:
+            # the set may be shared with the index this one was copied from
+            user_ids = index[key] = set(user_ids or ())
+            self._own_keys.add((index_name, key))
+        elif user_ids is None:
+            user_ids = index[key] = set()
+        return user_ids
+
+    def _get_keys(self, names):
+        trigrams, prefixes = set(), set()
+        for name in names:
+            trigrams.update(_get_trigrams(name))
+            prefixes.update(_get_word_prefixes(name))
+        return trigrams, prefixes
+
+    def remove_user(self, user_id):
+        names = self.names.pop(user_id, None)
+        if names is None:
+            return
+        del self.sort_keys[user_id]
+        trigrams, prefixes = self._get_keys(names)
+        for keys, index_name in ((trigrams, 'trigrams'), (prefixes, 'prefixes')):
+            for key in keys:
+                user_ids = self._get_user_ids(index_name, key)
+                user_ids.discard(user_id)
+                if not user_ids:
+                    del getattr(self, index_name)[key]
+
+    def set_user(self, user_id, names):
+        """Adds the user with the given name fields to the index, replacing previous names of the user.
+        @param names: A list of the user's name fields, with the first and last name first"""
+        self.remove_user(user_id)
+        names = tuple([normalize_name(name) for name in names if name])
+        self.names[user_id] = names
+        self.sort_keys[user_id] = (' '.join(names), user_id)
+        trigrams, prefixes = self._get_keys(names)
+        for keys, index_name in ((trigrams, 'trigrams'), (prefixes, 'prefixes')):
+            for key in keys:
+                self._get_user_ids(index_name, key).add(user_id)
+
+    def _get_term_matches(self, term):
+        if len(term) < USER_AUTOCOMPLETE_TRIGRAM_LENGTH:
+            return set(self.prefixes.get(term, ()))
+        # intersect the smallest sets first, then check that the trigrams are adjacent
+        trigram_sets = sorted([self.trigrams.get(trigram, set()) for trigram in _get_trigrams(term)], key=len)
+        candidates = set(trigram_sets[0])
+        for trigram_set in trigram_sets[1:]:
+            candidates &= trigram_set
+            if not candidates:
+                break
+        return set([user_id for user_id in candidates if any([term in name for name in self.names[user_id]])])
+
+    def search(self, terms):
+        """Returns the ids of all users that match all of the given search terms, each in any of their name fields.
+        @return: A set of user ids"""
+        terms = [normalize_name(term) for term in terms]
+        terms = sorted([term for term in terms if term], key=len, reverse=True)
+        if not terms:
+            return set(self.names)
+        matches = self._get_term_matches(terms[0])
+        for term in terms[1:]:
+            if not matches:
+                break
+            matches &= self._get_term_matches(term)
+        return matches
+
+    def get_sorted(self, user_ids, limit=None):
+        """Returns the given user ids ordered by the users' names.
+        @param limit: If given, only the first `limit` user ids are returned"""
+        sort_keys = [self.sort_keys[user_id] for user_id in user_ids if user_id in self.sort_keys]
+        sort_keys = heapq.nsmallest(limit, sort_keys) if limit is not None else sorted(sort_keys)
+        return [user_id for __, user_id in sort_keys]
+
+
+def _get_indexed_users(portal, user_ids=None):
+    """Returns the ids and name fields of all active members of the portal, or of the given users if they are.
+    @return: A values_list QS of (user id, first name, last name, additional name fields...)"""
+    name_fields = ['first_name', 'last_name']
+    name_fields += ['cosinnus_profile__%s' % field for field in get_user_profile_model().ADDITIONAL_USERNAME_FIELDS]
+    users = get_user_model().objects.filter(id__in=get_portal_member_ids_query(portal))
+    if user_ids is not None:
+        users = users.filter(id__in=user_ids)
+    return filter_active_users(users).values_list('id', *name_fields)
+
+
+def build_user_autocomplete_index(portal=None):
+    """Builds the index of all active members of the portal from scratch"""
+    portal = portal or CosinnusPortal.get_current()
+    index = UserAutocompleteIndex()
+    index.sequence = user_autocomplete_changelog.get_sequence(portal=portal)
+    for user in _get_indexed_users(portal).iterator(chunk_size=5000):
+        index.set_user(user[0], user[1:])
+    return index
+
+
+def mark_user_autocomplete_changed(user_id, portal=None):
+    """Records that the name or membership of a user has changed, so that all processes update their index"""
+    user_autocomplete_changelog.add(user_id, portal=portal)
+
+
+def _start_build(portal):
+    """Builds the index of the portal in a background thread of this process, unless one is already building it"""
+    with _building_portal_ids_lock:
+        if portal.id in _building_portal_ids:
+            return
+        _building_portal_ids.add(portal.id)
+
+    class BuildUserAutocompleteIndexThread(threading.Thread):
+        def run(self):
+            try:
+                index = build_user_autocomplete_index(portal=portal)
+                with _local_indexes_lock:
+                    _local_indexes[portal.id] = index
+            except Exception as e:
+                logger.exception('Could not build the user autocomplete index.', extra={'exception': str(e)})
+            finally:
+                _building_portal_ids.discard(portal.id)
+                connection.close()
+
+    BuildUserAutocompleteIndexThread(daemon=True).start()
+
+
+def update_user_autocomplete_index(index, portal=None):
+    """Applies the changes of all users that changed since the index was built or last updated to a copy of the index.
+    @return: The updated index, or None if the changelog is incomplete and the index needs to be rebuilt"""
+    portal = portal or CosinnusPortal.get_current()
+    sequence, changed_user_ids = user_autocomplete_changelog.get_changes(index.sequence, portal=portal)
+    if changed_user_ids is None:
+        return None
+    if sequence == index.sequence:
+        return index
+    index = index.copy()
+    for user_id in changed_user_ids:
+        index.remove_user(user_id)
+    if changed_user_ids:
+        for user in _get_indexed_users(portal, user_ids=changed_user_ids):
+            index.set_user(user[0], user[1:])
+    index.sequence = sequence
+    return index
+
+
+def get_user_autocomplete_index(portal=None):
+    """Returns the up-to-date index of the active members of the portal. If there is no index yet, or if it can not
+    be brought up to date, the index is built in a background thread, and the outdated index is returned meanwhile.
+    @return: The index, or None if it has not been built yet"""
+    portal = portal or CosinnusPortal.get_current()
+    index = _local_indexes.get(portal.id)
+    if index is None:
+        _start_build(portal)
+        return None
+    if not _local_indexes_lock.acquire(blocking=False):
+        # another thread is updating the index
+        return index
+    try:
+        index = _local_indexes[portal.id]
+        updated_index = update_user_autocomplete_index(index, portal=portal)
+        if updated_index is None:
+            _start_build(portal)
+            return index
+        _local_indexes[portal.id] = updated_index
+        return updated_index
+    finally:
+        _local_indexes_lock.release()
@@ -0,0 +1,440 @@
+# -*- coding: utf-8 -*-
+"""
+A precomputed feature index for scoring user profiles in the user match view.
+
+Each active user profile is stored as a row of a sparse feature matrix (in CSR form, as NumPy arrays), with
+one column per shared-able feature: tags, topics, managed tags, the location, dynamic field values and liked
+objects. The number of features two profiles have in common is the number of matching columns in their rows,
+so all profiles can be scored against the viewing user at once with a few vectorized operations.
+The profile's own completeness score (description, avatar, website, etc.) is precomputed per row.
+
+The index is built once by `rebuild_user_match_index_task` and shared between processes via the cache, split into
+chunks below the cache's item size limit. Changes are
+recorded by `mark_user_match_features_changed` (on profile saves, likes and logins) in a changelog in the cache,
+which every process applies to a copy of its index before scoring, by recomputing only the changed rows. The
+updated copy then replaces the index, so that request threads scoring at the same time keep using a consistent
+index. If the changelog is incomplete, the index is rebuilt in the background and the outdated index is used
+until the new one is available.
+Use the `benchmark_user_match` management command to measure the scoring latency for large portals.
+"""
+
+from __future__ import unicode_literals
+
+import copy
+import logging
+import pickle
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+import numpy
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+
+from cosinnus.conf import settings
+from cosinnus.models.group import CosinnusPortal
+from cosinnus.models.managed_tags import CosinnusManagedTagAssignment
+from cosinnus.models.profile import get_user_profile_model
+from cosinnus.models.tagged import LikeObject
+from cosinnus.utils.changelog import UserChangelog
+from cosinnus.utils.user import filter_active_users
+
+logger = logging.getLogger('cosinnus')
+
+USER_MATCH_INDEX_CACHE_KEY = 'cosinnus/core/portal/%d/user_match/index/'
+USER_MATCH_INDEX_CHUNK_CACHE_KEY = 'cosinnus/core/portal/%d/user_match/index/%s/chunk/%d/'
+# the size of the chunks the pickled index is stored in, below the 1 MB item size limit of memcached
+USER_MATCH_INDEX_CHUNK_SIZE = 1024 * 900
+USER_MATCH_INDEX_REBUILD_CACHE_KEY = 'cosinnus/core/portal/%d/user_match/index/rebuilding/'
+# the longest time a rebuild of the index is expected to take, after which another one may be started
+USER_MATCH_INDEX_REBUILD_TIMEOUT = 60 * 30
+
+# changes are kept longer than the index, so that a cached index can always be brought up to date
+user_match_changelog = UserChangelog('user_match', settings.COSINNUS_USER_MATCH_INDEX_CACHE_TIMEOUT * 2)
+
+# a profile is scored higher if its user has logged in within this time
+USER_MATCH_RECENTLY_ACTIVE_DAYS = 31
+# only users who have logged in within this time are suggested
+USER_MATCH_MAX_INACTIVE_DAYS = 365
+
+# the index copy of each process, by portal id, with the time it was loaded. an index stored here is never
+# modified, as request threads may be scoring with it, but replaced by an updated copy
+_local_indexes = {}
+# only one thread of each process updates the index at a time, the others keep using the current one meanwhile
+_local_indexes_lock = threading.Lock()
+
+
+class UserMatchIndexStorageError(Exception):
+    """Raised if the cache did not accept the user match index"""
+
+    pass
+
+
+class UserMatchFeatures(object):
+    """The precomputed data of a single user profile.
+    @param static_score: The score of the profile independent of the viewing user
+    @param features: A set of feature strings, e.g. "tag:12" """
+
+    def __init__(self, user_id, static_score, last_login, features):
+        self.user_id = user_id
+        self.static_score = static_score
+        self.last_login = last_login
+        self.features = features
+
+
+def _get_dynamic_field_features(dynamic_fields):
+    features = set()
+    for field, value in (dynamic_fields or {}).items():
+        if not value:
+            continue
+        if isinstance(value, list):
+            try:
+                features.update([f'dfl:{field}:{element!r}' for element in set(value)])
+            except TypeError:
+                # Could not convert list to set. Just ignore the field.
+                pass
+        else:
+            features.add(f'dfs:{field}:{value!r}')
+    return features
+
+
+def get_user_match_features(profiles):
+    """Computes the features of the given user profiles, with a constant number of queries.
+    @param profiles: A QS of user profiles
+    @return: A list of `UserMatchFeatures`"""
+    profiles = list(profiles.select_related('user', 'media_tag').prefetch_related('media_tag__tags'))
+    user_ids = [profile.user_id for profile in profiles]
+
+    likes_by_user = {}
+    for user_id, content_type_id, object_id in LikeObject.objects.filter(liked=True, user_id__in=user_ids).values_list(
+        'user_id', 'content_type_id', 'object_id'
+    ):
+        likes_by_user.setdefault(user_id, set()).add(f'like:{content_type_id}:{object_id}')
+
+    managed_tags_by_profile = {}
+    for profile_id, managed_tag_id in CosinnusManagedTagAssignment.objects.filter(
+        content_type=ContentType.objects.get_for_model(get_user_profile_model()),
+        object_id__in=[profile.id for profile in profiles],
+        approved=True,
+    ).values_list('object_id', 'managed_tag_id'):
+        managed_tags_by_profile.setdefault(profile_id, set()).add(f'managed_tag:{managed_tag_id}')
+
+    rows = []
+    for profile in profiles:
+        media_tag = profile.media_tag
+        tag_ids = [tag.id for tag in media_tag.tags.all()] if media_tag else []
+        topic_ids = [topic for topic in (media_tag.topics or '').split(',') if topic] if media_tag else []
+
+        static_score = sum(
+            [
+                bool(profile.description and len(profile.description) > 10),
+                bool(profile.avatar),
+                bool(profile.website),
+                bool(profile.email_verified),
+                len([value for value in (profile.dynamic_fields or {}).values() if value]),
+                bool(topic_ids),
+                bool(tag_ids),
+            ]
+        )
+
+        features = set(
+            [f'tag:{tag_id}' for tag_id in tag_ids] + [f'topic:{topic_id.strip()}' for topic_id in topic_ids]
+        )
+        if media_tag and media_tag.location:
+            features.add(f'location:{media_tag.location.strip().lower()}')
+        features.update(_get_dynamic_field_features(profile.dynamic_fields))
+        features.update(managed_tags_by_profile.get(profile.id, set()))
+        features.update(likes_by_user.get(profile.user_id, set()))
+
+        last_login = profile.user.last_login.timestamp() if profile.user.last_login else 0.0
+        rows.append(UserMatchFeatures(profile.user_id, static_score, last_login, features))
+    return rows
+
+
+def get_user_match_candidate_profiles():
+    """Returns a QS of all user profiles that can be suggested in the user match"""
+    return filter_active_users(get_user_profile_model().objects.all(), filter_on_user_profile_model=True)
+
+
+class UserMatchIndex(object):
+    """A sparse matrix of the features of all user profiles, with one row per user.
+    `indptr` and `indices` are the CSR representation of the matrix: the feature ids of row `i` are
+    `indices[indptr[i]:indptr[i + 1]]`."""
+
+    def __init__(self):
+        self.vocabulary = {}
+        self.user_ids = numpy.zeros(0, dtype=numpy.int64)
+        self.static_scores = numpy.zeros(0, dtype=numpy.int32)
+        self.last_logins = numpy.zeros(0, dtype=numpy.float64)
+        self.indptr = numpy.zeros(1, dtype=numpy.int64)
+        self.indices = numpy.zeros(0, dtype=numpy.int32)
+        self._entry_rows = None
+        # the last changelog entry applied to this index, and the last one included in the cached index
+        self.sequence = 0
+        self.persisted_sequence = 0
+
+    def __len__(self):
+        return len(self.user_ids)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # derived from `indptr`, so it is left out of the cached index
+        state['_entry_rows'] = None
+        return state
+
+    @property
+    def entry_rows(self):
+        """The row of each entry in `indices`"""
+        if self._entry_rows is None:
+            self._entry_rows = numpy.repeat(
+                numpy.arange(len(self.user_ids), dtype=numpy.int64), numpy.diff(self.indptr)
+            )
+        return self._entry_rows
+
+    def copy(self):
+        """Returns a copy of the index that can be updated with `set_rows` without affecting this one"""
+        index = copy.copy(self)
+        # all arrays are replaced on updates, only the vocabulary is modified in place
+        index.vocabulary = dict(self.vocabulary)
+        return index
+
+    def get_feature_ids(self, features, add=False):
+        """Returns the ids of the given feature strings.
+        @param add: If True, unknown features are added to the vocabulary, else they are left out"""
+        if add:
+            for feature in features:
+                if feature not in self.vocabulary:
+                    self.vocabulary[feature] = len(self.vocabulary)
+        return [self.vocabulary[feature] for feature in features if feature in self.vocabulary]
+
+    def set_rows(self, rows, removed_user_ids=None):
+        """Replaces the rows of the users of the given features and appends the rows of new users.
+        @param rows: A list of `UserMatchFeatures`
+        @param removed_user_ids: A list of ids of users whose rows are removed"""
+        replaced_user_ids = [row.user_id for row in rows] + list(removed_user_ids or [])
+        kept_rows = ~numpy.isin(self.user_ids, replaced_user_ids)
+        kept_entries = kept_rows[self.entry_rows]
+
+        row_features = [self.get_feature_ids(row.features, add=True) for row in rows]
+        counts = numpy.concatenate(
+            [
+                numpy.diff(self.indptr)[kept_rows],
+                numpy.array([len(features) for features in row_features], dtype=numpy.int64),
+            ]
+        )
+        self.user_ids = numpy.concatenate(
+            [self.user_ids[kept_rows], numpy.array([row.user_id for row in rows], dtype=numpy.int64)]
+        )
+        self.static_scores = numpy.concatenate(
+            [self.static_scores[kept_rows], numpy.array([row.static_score for row in rows], dtype=numpy.int32)]
+        )
+        self.last_logins = numpy.concatenate(
+            [self.last_logins[kept_rows], numpy.array([row.last_login for row in rows], dtype=numpy.float64)]
+        )
+        self.indices = numpy.concatenate(
+            [
+                self.indices[kept_entries],
+                numpy.array([feature_id for features in row_features for feature_id in features], dtype=numpy.int32),
+            ]
+        )
+        self.indptr = numpy.concatenate([numpy.zeros(1, dtype=numpy.int64), numpy.cumsum(counts)])
+        self._entry_rows = numpy.repeat(numpy.arange(len(self.user_ids), dtype=numpy.int64), counts)
+
+    def score(self, feature_ids, at_time=None):
+        """Scores all profiles against the given features of the viewing user.
+        For each profile, the score is its static score, plus the number of shared features,
+        plus one if its user has recently been active.
+        @param feature_ids: The feature ids of the viewing user
+        @return: An array of scores, aligned with `user_ids`"""
+        at_time = at_time or time.time()
+        viewer_features = numpy.zeros(len(self.vocabulary), dtype=bool)
+        viewer_features[numpy.asarray(feature_ids, dtype=numpy.int64)] = True
+        shared_counts = numpy.bincount(
+            self.entry_rows[viewer_features[self.indices]], minlength=len(self.user_ids)
+        ).astype(numpy.int32)
+        recently_active = self.last_logins > at_time - timedelta(days=USER_MATCH_RECENTLY_ACTIVE_DAYS).total_seconds()
+        return self.static_scores + shared_counts + recently_active
+
+    def get_ranked_user_ids(self, feature_ids, exclude_user_ids=None, at_time=None):
+        """Returns the ids of all users that have been active within `USER_MATCH_MAX_INACTIVE_DAYS`,
+        ordered by their score against the given features of the viewing user.
+        @return: A tuple of (array of user ids, array of their scores)"""
+        at_time = at_time or time.time()
+        scores = self.score(feature_ids, at_time=at_time)
+        candidates = self.last_logins >= at_time - timedelta(days=USER_MATCH_MAX_INACTIVE_DAYS).total_seconds()
+        if exclude_user_ids:
+            candidates &= ~numpy.isin(self.user_ids, list(exclude_user_ids))
+        candidate_rows = numpy.flatnonzero(candidates)
+        order = candidate_rows[numpy.argsort(-scores[candidate_rows], kind='stable')]
+        return self.user_ids[order], scores[order]
+
+
+def build_user_match_index(batch_size=5000):
+    """Builds the index of all candidate profiles from scratch"""
+    index = UserMatchIndex()
+    profile_ids = list(get_user_match_candidate_profiles().order_by('id').values_list('id', flat=True))
+    for offset in range(0, len(profile_ids), batch_size):
+        profiles = get_user_profile_model().objects.filter(id__in=profile_ids[offset : offset + batch_size])
+        index.set_rows(get_user_match_features(profiles))
+    return index
+
+
+def mark_user_match_features_changed(user_id, portal=None):
+    """Records that the features of a user have changed, so that all processes update their index"""
+    user_match_changelog.add(user_id, portal=portal)
+
+
+def dump_user_match_index(index):
+    """Pickles the index into chunks of at most `USER_MATCH_INDEX_CHUNK_SIZE` bytes.
+    @return: A list of byte strings"""
+    data = pickle.dumps(index, protocol=pickle.HIGHEST_PROTOCOL)
+    return [
+        data[offset : offset + USER_MATCH_INDEX_CHUNK_SIZE]
+        for offset in range(0, len(data), USER_MATCH_INDEX_CHUNK_SIZE)
+    ]
+
+
+def load_user_match_index(chunks):
+    """Loads an index from the chunks returned by `dump_user_match_index`"""
+    return pickle.loads(b''.join(chunks))
+
+
+def _store_index(index, portal):
+    """Stores the index in the cache. Its chunks are stored under a new version, and the entry under
+    `USER_MATCH_INDEX_CACHE_KEY` only points to that version once all chunks are stored, so that a process loading
+    the index never combines the chunks of different versions.
+    @raise UserMatchIndexStorageError: If the cache did not accept the index"""
+    timeout = settings.COSINNUS_USER_MATCH_INDEX_CACHE_TIMEOUT
+    version = uuid.uuid4().hex
+    chunks = dump_user_match_index(index)
+    failed_keys = cache.set_many(
+        {USER_MATCH_INDEX_CHUNK_CACHE_KEY % (portal.id, version, number): chunk for number, chunk in enumerate(chunks)},
+        timeout,
+    )
+    if not failed_keys:
+        failed_keys = cache.set_many({USER_MATCH_INDEX_CACHE_KEY % portal.id: (version, len(chunks))}, timeout)
+    if failed_keys:
+        raise UserMatchIndexStorageError(
+            'The cache did not accept the user match index of portal %d (%d chunks, %d bytes).'
+            % (portal.id, len(chunks), sum([len(chunk) for chunk in chunks]))
+        )
+
+
+def rebuild_user_match_index(portal=None):
+    """Builds a new index and shares it with all processes via the cache.
+    If the rebuild fails, the rebuild lock is kept until it expires, so that the processes do not start a new
+    rebuild on every request.
+    @raise UserMatchIndexStorageError: If the cache did not accept the index"""
+    portal = portal or CosinnusPortal.get_current()
+    sequence = user_match_changelog.get_sequence(portal=portal)
+    index = build_user_match_index()
+    index.sequence = index.persisted_sequence = sequence
+    try:
+        _store_index(index, portal)
+    except UserMatchIndexStorageError as e:
+        logger.error(
+            'The rebuilt user match index could not be stored in the cache. No rebuild will be started until the '
+            'rebuild lock expires.',
+            extra={'exception': str(e), 'rebuild_lock_timeout': USER_MATCH_INDEX_REBUILD_TIMEOUT},
+        )
+        raise
+    cache.delete(USER_MATCH_INDEX_REBUILD_CACHE_KEY % portal.id)
+    return index
+
+
+def _start_rebuild(portal):
+    """Starts a rebuild of the index in the background, unless one is already running"""
+    from cosinnus.tasks import rebuild_user_match_index_task
+
+    if cache.add(USER_MATCH_INDEX_REBUILD_CACHE_KEY % portal.id, True, USER_MATCH_INDEX_REBUILD_TIMEOUT):
+        rebuild_user_match_index_task.delay()
+
+
+def _get_cached_index(portal):
+    """Loads the index from the cache.
+    @return: The index, or None if it or any of its chunks is not in the cache"""
+    stored = cache.get(USER_MATCH_INDEX_CACHE_KEY % portal.id)
+    if stored is None:
+        return None
+    version, chunk_count = stored
+    keys = [USER_MATCH_INDEX_CHUNK_CACHE_KEY % (portal.id, version, number) for number in range(chunk_count)]
+    chunks = cache.get_many(keys)
+    if len(chunks) < chunk_count:
+        return None
+    index = load_user_match_index([chunks[key] for key in keys])
+    index.persisted_sequence = index.sequence
+    return index
+
+
+def _apply_changelog(index, portal):
+    """Updates the rows of all users that changed since the index was built or last updated, in a copy of the index.
+    @return: The updated index, or None if the changelog is incomplete and the index needs to be rebuilt"""
+    sequence, changed_user_ids = user_match_changelog.get_changes(index.sequence, portal=portal)
+    if changed_user_ids is None:
+        return None
+    if sequence == index.sequence:
+        return index
+    index = index.copy()
+    if changed_user_ids:
+        rows = get_user_match_features(get_user_match_candidate_profiles().filter(user_id__in=changed_user_ids))
+        # users that are no longer candidates are removed
+        index.set_rows(rows, removed_user_ids=changed_user_ids - set([row.user_id for row in rows]))
+    index.sequence = sequence
+    return index
+
+
+def get_user_match_index(portal=None):
+    """Returns the up-to-date index of all candidate profiles of the portal, loading it from the cache if necessary.
+    If the index can not be brought up to date, a rebuild is started in the background and the outdated index
+    is returned until the new one is available.
+    @return: The index, or None if no index has been built yet"""
+    portal = portal or CosinnusPortal.get_current()
+    index, loaded_at = _local_indexes.get(portal.id, (None, 0))
+    # without an index, wait for the thread that is loading it
+    if not _local_indexes_lock.acquire(blocking=index is None):
+        return index
+    try:
+        index, loaded_at = _local_indexes.get(portal.id, (None, 0))
+        timeout = settings.COSINNUS_USER_MATCH_INDEX_CACHE_TIMEOUT
+        loaded_from_cache = False
+        if index is None or time.time() - loaded_at > timeout:
+            cached_index = _get_cached_index(portal)
+            if cached_index is not None:
+                index, loaded_at, loaded_from_cache = cached_index, time.time(), True
+            else:
+                _start_rebuild(portal)
+        if index is None:
+            return None
+
+        updated_index = _apply_changelog(index, portal)
+        if (
+            updated_index is None
+            and not loaded_from_cache
+            and cache.get(USER_MATCH_INDEX_REBUILD_CACHE_KEY % portal.id) is None
+        ):
+            # the index may have been rebuilt in the meantime
+            cached_index = _get_cached_index(portal)
+            if cached_index is not None:
+                index, loaded_at = cached_index, time.time()
+                updated_index = _apply_changelog(index, portal)
+        if updated_index is None:
+            # keep using the outdated index until the rebuilt one is available
+            _start_rebuild(portal)
+            updated_index = index
+        elif (
+            updated_index.sequence - updated_index.persisted_sequence
+            >= settings.COSINNUS_USER_MATCH_INDEX_PERSIST_CHANGES
+        ):
+            # share the applied changes with the other processes
+            updated_index.persisted_sequence = updated_index.sequence
+            try:
+                _store_index(updated_index, portal)
+            except UserMatchIndexStorageError as e:
+                logger.error(
+                    'The updated user match index could not be stored in the cache.', extra={'exception': str(e)}
+                )
+        _local_indexes[portal.id] = (updated_index, loaded_at)
+        return updated_index
+    finally:
+        _local_indexes_lock.release()
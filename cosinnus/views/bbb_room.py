@@ -23,6 +23,7 @@ from cosinnus.core.decorators.views import redirect_to_403, redirect_to_error_pa
 from cosinnus.models.bbb_room import BBBRoom
 from cosinnus.models.group import CosinnusPortal
 from cosinnus.models.tagged import get_tag_object_model
+from cosinnus.utils.bigbluebutton import get_bbb_queue_websocket_path
 from cosinnus.utils.group import get_cosinnus_group_model
 from cosinnus.utils.permissions import check_user_superuser
 from cosinnus.utils.urls import group_aware_reverse
@@ -49,7 +50,7 @@ class BBBRoomMeetingView(RedirectView):
         room = get_object_or_None(BBBRoom, id=int(room_id))
         if room is None:
             return HttpResponseNotFound('Room does not exist.')
-        if user not in room.attendees.all() and user not in room.moderators.all() and not check_user_superuser(user):
+        if not room.is_attendee(user) and not room.is_moderator(user) and not check_user_superuser(user):
             return redirect_to_403(self.request, view=self)
 
         self.room = room
@@ -118,7 +119,7 @@ class BBBRoomMeetingQueueAPIView(View):
             return HttpResponseBadRequest('Anonymous access is not permitted without a guest token.')
 
         media_tag_id = kwargs.get('mt_id')
-        media_tag = get_object_or_404(get_tag_object_model(), id=media_tag_id)
+        media_tag = get_object_or_404(get_tag_object_model().objects.select_related('bbb_room'), id=media_tag_id)
 
         data = {
             'status': 'WAITING',
@@ -144,8 +145,8 @@ class BBBRoomMeetingQueueAPIView(View):
                     setattr(user, BBBRoom.BBB_USER_GUEST_TOKEN_ATTR, guest_token)
                     setattr(user, 'bbb_user_name', username)
             elif (
-                user not in bbb_room.attendees.all()
-                and user not in bbb_room.moderators.all()
+                not bbb_room.is_attendee(user)
+                and not bbb_room.is_moderator(user)
                 and not check_user_superuser(user)
                 and not bbb_room.is_publicly_visible
             ):
@@ -188,19 +189,29 @@ class BBBRoomMeetingQueueAPIView(View):
                 'url': room_url,
                 'recorded_meeting': bbb_room.is_recorded_meeting,
             }
-        elif bbb_room is None and settings.COSINNUS_TRIGGER_BBB_ROOM_CREATION_IN_QUEUE:
-            # if the media_tag is attached to a conference event, but no room has been created yet,
-            # create one
-            from cosinnus_event.models import ConferenceEvent, Event  # noqa
-
-            parent_event = get_object_or_None(ConferenceEvent, media_tag__id=media_tag_id)
-            if not parent_event:
-                parent_event = get_object_or_None(Event, media_tag__id=media_tag_id)
-            if not parent_event:
-                parent_event = get_object_or_None(get_cosinnus_group_model(), media_tag__id=media_tag_id)
-
-            if parent_event and parent_event.can_have_bbb_room() and not parent_event.media_tag.bbb_room:
-                parent_event.check_and_create_bbb_room(threaded=True)
+        else:
+            websocket_path = get_bbb_queue_websocket_path(media_tag.id)
+            if websocket_path:
+                # waiting clients are notified on the websocket once the room has been created
+                data.update(
+                    {
+                        'websocket_path': websocket_path,
+                        'fallback_polling_interval': settings.COSINNUS_BBB_QUEUE_FALLBACK_POLLING_INTERVAL,
+                    }
+                )
+            if settings.COSINNUS_TRIGGER_BBB_ROOM_CREATION_IN_QUEUE:
+                # if the media_tag is attached to a conference event, but no room has been created yet,
+                # create one
+                from cosinnus_event.models import ConferenceEvent, Event  # noqa
+
+                parent_event = get_object_or_None(ConferenceEvent, media_tag__id=media_tag_id)
+                if not parent_event:
+                    parent_event = get_object_or_None(Event, media_tag__id=media_tag_id)
+                if not parent_event:
+                    parent_event = get_object_or_None(get_cosinnus_group_model(), media_tag__id=media_tag_id)
+
+                if parent_event and parent_event.can_have_bbb_room() and not parent_event.media_tag.bbb_room:
+                    parent_event.check_and_create_bbb_room(threaded=True)
         return JsonResponse(data)
 
 
@@ -24,6 +24,7 @@ from django.utils.html import escape
 from django.utils.safestring import mark_safe
 from django.utils.timezone import now
 
+from cosinnus.backends import elastic_index_queue
 from cosinnus.core.mail import (
     get_common_mail_context,
     render_notification_item_html_mail,
@@ -53,9 +54,11 @@ from cosinnus.utils.group import move_group_content as move_group_content_utils
 from cosinnus.utils.http import make_csv_response, make_xlsx_response
 from cosinnus.utils.permissions import check_user_can_receive_emails, check_user_superuser
 from cosinnus.utils.settings import get_obfuscated_settings_strings
+from cosinnus.utils.timeline_cache import timeline_fragment_cache
 from cosinnus.utils.user import (
     accept_user_tos_for_portal,
     filter_active_users,
+    get_portal_member_ids_query,
     is_user_active,
 )
 from cosinnus.views.profile import delete_userprofile
@@ -212,6 +215,24 @@ def deletecache(request):
     return HttpResponse("The cache entry '%s' was deleted." % cache_key)
 
 
+def elastic_index_queue_stats(request):
+    """Shows the counters of the elasticsearch index update queue for this process"""
+    if not request.user.is_superuser:
+        return HttpResponseForbidden('Not authenticated')
+
+    stats = elastic_index_queue.get_stats()
+    return HttpResponse('<br/>'.join(['%s: %s' % (key, value) for key, value in sorted(stats.items())]))
+
+
+def timeline_fragment_cache_stats(request):
+    """Shows the hit/miss counters of the timeline item fragment cache for this process"""
+    if not request.user.is_superuser:
+        return HttpResponseForbidden('Not authenticated')
+
+    stats = timeline_fragment_cache.get_stats()
+    return HttpResponse('<br/>'.join(['%s: %s' % (key, value) for key, value in sorted(stats.items())]))
+
+
 def test_logging(request, level='error'):
     harmless = 'my value'
     bic = 'shouldnotbeshown!bic'
@@ -262,7 +283,7 @@ def add_members_to_forum(request=None):
     str = 'Added these users:<br/><br/>\n'
 
     for portal in CosinnusPortal.objects.all():
-        users = get_user_model().objects.filter(id__in=portal.members)
+        users = get_user_model().objects.filter(id__in=get_portal_member_ids_query(portal))
         for group_slug in get_default_user_group_slugs():
             try:
                 group = CosinnusGroup.objects.get(slug=group_slug, portal_id=portal.id)
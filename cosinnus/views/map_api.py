@@ -25,14 +25,17 @@ from cosinnus.forms.search import filter_searchqueryset_for_portal, filter_searc
 from cosinnus.models.group import CosinnusPortal
 from cosinnus.models.map import (
     EXCHANGE_SEARCH_MODEL_NAMES,
+    MAP_GROUP_MODELS,
     SEARCH_MODEL_NAMES,
     SEARCH_MODEL_NAMES_REVERSE,
     SEARCH_MODEL_TYPES_ALWAYS_READ_PERMISSIONS,
     SEARCH_RESULT_DETAIL_TYPE_MAP,
     HaystackMapResult,
     build_date_time,
+    build_map_results,
     filter_event_or_conference_happening_during,
     filter_event_searchqueryset_by_upcoming,
+    itemid_from_searchresult,
 )
 from cosinnus.models.profile import get_user_profile_model
 from cosinnus.utils.functions import ensure_list_of_ints, is_number
@@ -334,7 +337,8 @@ class SearchQuerySetMixin:
         # sort results into one list per model
         total_count = len(sqs)
         sqs = sqs[limit * page : limit * (page + 1)]
-        results = []
+        current_portal_id = CosinnusPortal.get_current().id
+        raw_results = []
         for i, result in enumerate(sqs):
             if self.skip_score_sorting:
                 # if we skip score sorting and only rely on the natural ordering, we make up fake high scores
@@ -343,22 +347,21 @@ class SearchQuerySetMixin:
             elif not query:
                 # if we hae no query-boosted results, use *only* our custom sorting (haystack's is very random)
                 result.score = result.local_boost
-                if (
-                    prefer_own_portal
-                    and is_number(result.portal)
-                    and int(result.portal) == CosinnusPortal.get_current().id
-                ):
+                if prefer_own_portal and is_number(result.portal) and int(result.portal) == current_portal_id:
                     result.score += 100.0
-            results.append(HaystackMapResult(result, user=self.request.user))
+            raw_results.append(result)
 
         # if the requested item (direct select) is not in the queryset snippet
         # (might happen because of an old URL), then mix it in as first item and drop the last
         if item_id:
             item_id = str(item_id)
-            if not any([res['id'] == item_id for res in results]):
+            if not any([itemid_from_searchresult(res) == item_id for res in raw_results]):
                 item_result = get_searchresult_by_itemid(item_id, self.request.user)
                 if item_result:
-                    results = [HaystackMapResult(item_result, user=self.request.user)] + results[:-1]
+                    raw_results = [item_result] + raw_results[:-1]
+
+        # resolve all per-user data for the whole page at once
+        results = build_map_results(raw_results, user=self.request.user)
 
         page_obj = None
         if results:
@@ -518,8 +521,13 @@ class MapDetailView(SearchQuerySetMixin, APIView):
             if model is None:
                 return HttpResponseBadRequest('``type`` param indicated an invalid data model type!')
 
-            # TODO: for groups/projects we should really use the cache here.
-            if model_type == 'people':
+            if model in MAP_GROUP_MODELS:
+                # groups are retrieved from the group cache
+                try:
+                    obj = model.objects.get_cached(slugs=slug, portal_id=portal)
+                except model.DoesNotExist:
+                    obj = None
+            elif model_type == 'people':
                 # UserProfiles are retrieved independent of the portal
                 obj = get_object_or_None(get_user_profile_model(), user__username=slug)
             elif model_type == 'events':
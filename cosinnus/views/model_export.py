@@ -7,11 +7,12 @@ from typing import Optional
 from django.conf import settings
 from django.contrib import messages
 from django.core.exceptions import ImproperlyConfigured
-from django.http import Http404
+from django.http import FileResponse, Http404
 from django.shortcuts import redirect
 from django.urls import reverse_lazy
 from django.utils import translation
 from django.utils.text import slugify
+from django.utils.timezone import now
 from django.utils.translation import gettext_lazy as _
 from django.views.generic.base import TemplateView, View
 
@@ -97,6 +98,7 @@ class CosinnusModelExportView(RequireSuperuserMixin, TemplateView):
                 'export_title': self.export_title,
                 'export_state': self.export_state,
                 'export_timestamp': self.export_processor.get_current_export_timestamp(),
+                'export_progress': self.export_processor.get_current_export_progress(),
             }
         )
         return context
@@ -109,6 +111,7 @@ class CosinnusModelExportDownloadBaseView(RequireSuperuserMixin, View):
     http_method_names = ['get']
     export_processor = None
     export_response_function = None
+    export_file_format = None
     filename = None
 
     def setup(self, request, *args, **kwargs):
@@ -126,6 +129,14 @@ class CosinnusModelExportDownloadBaseView(RequireSuperuserMixin, View):
             self.filename = str(slugify(config['title']))
 
     def get(self, request, *args, **kwargs):
+        if self.export_processor.STREAMING_EXPORT:
+            export_file = self.export_processor.get_current_export_file(self.export_file_format)
+            if not export_file:
+                raise Http404
+            # stream the stored file instead of loading it into memory
+            filename = '%s - %s.%s' % (self.filename, now().strftime('%Y%m%d %H%M%S'), self.export_file_format)
+            return FileResponse(export_file.open('rb'), as_attachment=True, filename=filename)
+
         data = self.export_processor.get_current_export_csv()
         if not data:
             raise Http404
@@ -136,6 +147,7 @@ class CosinnusModelExportDownloadBaseView(RequireSuperuserMixin, View):
 
 class CosinnusModelExportCSVDownloadView(CosinnusModelExportDownloadBaseView):
     export_response_function = make_csv_response
+    export_file_format = 'csv'
 
 
 model_export_csv_download_view = CosinnusModelExportCSVDownloadView.as_view()
@@ -143,6 +155,7 @@ model_export_csv_download_view = CosinnusModelExportCSVDownloadView.as_view()
 
 class CosinnusModelExportXLSXDownloadView(CosinnusModelExportDownloadBaseView):
     export_response_function = make_xlsx_response
+    export_file_format = 'xlsx'
 
 
 model_export_xlsx_download_view = CosinnusModelExportXLSXDownloadView.as_view()
@@ -119,13 +119,10 @@ def delete_userprofile(user):
     signals.pre_userprofile_delete.send(sender=None, profile=profile)
 
     # delete user widgets
-    widgets = WidgetConfig.objects.filter(user_id__exact=user.pk)
-    for widget in widgets:
-        widget.delete()
+    WidgetConfig.objects.filter(user_id__exact=user.pk).delete()
 
-    # leave all groups
-    for membership in CosinnusGroupMembership.objects.filter(user=user):
-        membership.delete()
+    # leave all groups. the profile is not updated, as it is deleted below
+    CosinnusGroupMembership.delete_all_for_user(user, update_profile=False)
 
     # delete user media_tag
     try:
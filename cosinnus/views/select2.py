@@ -9,15 +9,29 @@ from django.http import Http404
 from django_select2 import NO_ERR_RESP, Select2View
 from taggit.models import Tag
 
+from cosinnus.conf import settings
 from cosinnus.models.group import CosinnusPortal
 from cosinnus.models.managed_tags import CosinnusManagedTagAssignment
 from cosinnus.models.profile import get_user_profile_model
 from cosinnus.utils.group import get_cosinnus_group_model, prioritize_suggestions_output
 from cosinnus.utils.permissions import check_user_superuser
-from cosinnus.utils.user import filter_active_users, get_user_query_filter_for_search_terms, get_user_select2_pills
+from cosinnus.utils.user import (
+    filter_active_users,
+    get_portal_member_ids_query,
+    get_user_query_filter_for_search_terms,
+    get_user_select2_pills,
+)
+from cosinnus.utils.user_autocomplete import get_user_autocomplete_index
 from cosinnus.views.mixins.select2 import RequireGroupMember, RequireLoggedIn
 
 
+def get_users_in_order(user_ids):
+    """Returns the users with the given ids, in the order of the ids"""
+    users = get_user_model().objects.filter(id__in=user_ids).select_related('cosinnus_profile')
+    users_by_id = dict([(user.id, user) for user in users])
+    return [users_by_id[user_id] for user_id in user_ids if user_id in users_by_id]
+
+
 class GroupMembersView(RequireGroupMember, Select2View):
     def get_results(self, request, term, page, context):
         term = term.lower()
@@ -34,9 +48,14 @@ class GroupMembersView(RequireGroupMember, Select2View):
         #    uids = list(set(uids + self.group.parent.members))
 
         terms = term.strip().lower().split(' ')
-        q = get_user_query_filter_for_search_terms(terms)
-
-        user_qs = filter_active_users(User.objects.filter(id__in=uids).filter(q))
+        index = get_user_autocomplete_index() if settings.COSINNUS_USER_AUTOCOMPLETE_INDEX_ENABLED else None
+        if index is not None:
+            # the index only contains active users
+            matching_user_ids = index.search(terms).intersection(uids)
+            user_qs = User.objects.filter(id__in=matching_user_ids)
+        else:
+            q = get_user_query_filter_for_search_terms(terms)
+            user_qs = filter_active_users(User.objects.filter(id__in=uids).filter(q))
 
         user_qs = prioritize_suggestions_output(request, user_qs)
 
@@ -55,9 +74,13 @@ class GroupMembersView(RequireGroupMember, Select2View):
 class AllMembersView(RequireLoggedIn, Select2View):
     def filter_user_qs(self, user_qs, terms):
         q = get_user_query_filter_for_search_terms(terms)
-        user_qs = filter_active_users(user_qs.filter(id__in=CosinnusPortal.get_current().members).filter(q))
+        user_qs = filter_active_users(user_qs.filter(id__in=get_portal_member_ids_query()).filter(q))
         return user_qs
 
+    def filter_user_ids(self, user_ids):
+        """Filters the set of ids of the users found in the autocomplete index"""
+        return user_ids
+
     def get_results(self, request, term, page, context):
         start = (page - 1) * 10
         end = page * 10
@@ -66,6 +89,17 @@ class AllMembersView(RequireLoggedIn, Select2View):
 
         terms = term.strip().lower().split(' ')
 
+        # the index is not available while it is being built
+        index = get_user_autocomplete_index() if settings.COSINNUS_USER_AUTOCOMPLETE_INDEX_ENABLED else None
+        if index is not None:
+            user_ids = self.filter_user_ids(index.search(terms))
+            count = len(user_ids)
+            if count < start:
+                raise Http404
+            has_more = count > end
+            users = get_users_in_order(index.get_sorted(user_ids, limit=end)[start:end])
+            return (NO_ERR_RESP, has_more, get_user_select2_pills(users))
+
         user_qs = User.objects.all()
         user_qs = self.filter_user_qs(user_qs, terms)
 
@@ -88,16 +122,25 @@ class ManagedTagsMembersView(AllMembersView):
         self.managed_tag_slug = kwargs.pop('tag_slug', None)
         return super(ManagedTagsMembersView, self).dispatch(request, *args, **kwargs)
 
+    def get_assigned_profile_ids(self):
+        profile_assignments_qs = CosinnusManagedTagAssignment.objects.get_for_model(get_user_profile_model())
+        return profile_assignments_qs.filter(managed_tag__slug=self.managed_tag_slug).values_list(
+            'object_id', flat=True
+        )
+
     def filter_user_qs(self, user_qs, terms):
         user_qs = super(ManagedTagsMembersView, self).filter_user_qs(user_qs, terms)
         if self.managed_tag_slug:
-            profile_assignments_qs = CosinnusManagedTagAssignment.objects.get_for_model(get_user_profile_model())
-            assigned_profile_ids = profile_assignments_qs.filter(managed_tag__slug=self.managed_tag_slug).values_list(
-                'object_id', flat=True
-            )
-            user_qs = user_qs.filter(cosinnus_profile__id__in=assigned_profile_ids)
+            user_qs = user_qs.filter(cosinnus_profile__id__in=self.get_assigned_profile_ids())
         return user_qs
 
+    def filter_user_ids(self, user_ids):
+        user_ids = super(ManagedTagsMembersView, self).filter_user_ids(user_ids)
+        if self.managed_tag_slug:
+            assigned_user_ids = get_user_profile_model().objects.filter(id__in=self.get_assigned_profile_ids())
+            user_ids = user_ids.intersection(assigned_user_ids.values_list('user_id', flat=True))
+        return user_ids
+
 
 class TagsView(Select2View):
     def get_results(self, request, term, page, context):
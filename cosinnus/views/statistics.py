@@ -2,6 +2,7 @@
 from __future__ import unicode_literals
 
 from abc import ABC, abstractmethod
+from collections import defaultdict
 from datetime import date, datetime, timedelta
 from typing import Dict, List, Optional, Tuple, Type, Union
 
@@ -12,6 +13,7 @@ from django.db.models.fields import DateField
 from django.db.models.functions.datetime import TruncBase, TruncDay, TruncMonth, TruncWeek, TruncYear
 from django.http import HttpResponseRedirect
 from django.utils.formats import localize
+from django.utils.timezone import localdate
 from django.utils.translation import gettext as _
 from django.views.generic.edit import FormView
 
@@ -19,7 +21,21 @@ from cosinnus.forms.statistics import SimpleStatisticsForm
 from cosinnus.models import UserOnlineOnDay
 from cosinnus.models.group import CosinnusPortal
 from cosinnus.models.group_extra import CosinnusConference, CosinnusProject, CosinnusSociety
-from cosinnus.utils.user import filter_active_users
+from cosinnus.models.statistics import StatisticsRollup
+from cosinnus.utils.statistics import (
+    STATISTICS_METRIC_ACTIVE_USERS,
+    STATISTICS_METRIC_CREATED_CONFERENCES,
+    STATISTICS_METRIC_CREATED_EVENTS,
+    STATISTICS_METRIC_CREATED_GROUPS,
+    STATISTICS_METRIC_CREATED_PROJECTS,
+    STATISTICS_METRIC_NEW_USER_ACCOUNTS,
+    StatisticsMetric,
+    get_daily_values,
+    get_last_rollup_day,
+    get_rollup_values,
+    get_statistics_metrics,
+)
+from cosinnus.utils.user import filter_active_users, get_portal_member_ids_query
 from cosinnus.views.mixins.group import RequirePortalManagerMixin
 
 # how many past days to show by default
@@ -30,6 +46,8 @@ class _BaseInterval(ABC):
     """encapsulates interval_type specific logic"""
 
     trunc_function: Type[TruncBase]
+    # the `StatisticsRollup` period matching the interval
+    period: str
 
     @classmethod
     @abstractmethod
@@ -76,6 +94,7 @@ class _BaseInterval(ABC):
 
 class _DayInterval(_BaseInterval):
     trunc_function = TruncDay
+    period = StatisticsRollup.PERIOD_DAY
 
     @classmethod
     def format_label(cls, reference_date: date) -> str:
@@ -92,6 +111,7 @@ class _DayInterval(_BaseInterval):
 
 class _WeekInterval(_BaseInterval):
     trunc_function = TruncWeek
+    period = StatisticsRollup.PERIOD_WEEK
 
     @classmethod
     def format_label(cls, reference_date: date) -> str:
@@ -110,6 +130,7 @@ class _WeekInterval(_BaseInterval):
 
 class _MonthInterval(_BaseInterval):
     trunc_function = TruncMonth
+    period = StatisticsRollup.PERIOD_MONTH
 
     @classmethod
     def format_label(cls, reference_date: date) -> str:
@@ -128,6 +149,7 @@ class _MonthInterval(_BaseInterval):
 
 class _YearInterval(_BaseInterval):
     trunc_function = TruncYear
+    period = StatisticsRollup.PERIOD_YEAR
 
     @classmethod
     def format_label(cls, reference_date: date) -> str:
@@ -167,8 +189,21 @@ def _get_formatted_interval_data(
         .values_list('_temp_bucket_date', '_temp_bucket_count')
     )
 
+    return _format_interval_buckets(dict(data_buckets_list), date_from, date_to)
+
+
+def _format_interval_buckets(
+    data_buckets_lookup: Dict[date, int], date_from: date, date_to: date
+) -> List[Tuple[str, int]]:
+    """
+    formats interval-data aggregated in buckets to be displayed as chart, see `_get_formatted_interval_data`
+
+    :param data_buckets_lookup: dict of interval start date to the bucket value
+    :return: continuous range of aligned interval data as '(date,value)'
+    """
+    interval_type = _BaseInterval.get_interval_type_from_date_range(date_from, date_to)
+
     # walk the date range by interval, insert bucket values or 0 if missing
-    data_buckets_lookup: Dict[date, int] = dict(data_buckets_list)
     result = []
     # begin at start of first interval
     interval_current: date = interval_type.get_current_start(date_from)
@@ -257,6 +292,61 @@ def _get_statistics_for_metric(
     return {'title': title, 'total': total, 'buckets': {'labels': bucket_labels, 'values': bucket_values}}
 
 
+def _get_rollup_statistics_for_metric(
+    title: str,
+    metric: StatisticsMetric,
+    datetime_from: datetime,
+    datetime_to: datetime,
+) -> Dict[str, Union[str, int, Dict[Optional[List[str]], Optional[List[int]]]]]:
+    """
+    Computes the same statistics as `_get_statistics_for_metric` with buckets, but reads the values of all
+    completed days from the `StatisticsRollup` store
+
+    notes:
+    - only whole days are considered, the times of the date-slice are ignored
+    - the current, partial day is counted from the raw data
+    - for metrics counting distinct entries, the total and the buckets of incomplete intervals at the edges
+      of the date-slice are counted from the raw data, as they can not be derived from the rollups
+    - falls back to `_get_statistics_for_metric` if the metric has not been rolled up up to yesterday
+
+    :param metric: the metric, see `cosinnus.utils.statistics.get_statistics_metrics`
+    :returns: a dict with title, labels and values for display via `chart.js`.
+    """
+    date_from = datetime_from.date()
+    date_to = datetime_to.date()
+    last_rollup_day = get_last_rollup_day(metric)
+    if last_rollup_day is None or last_rollup_day < min(date_to, localdate() - timedelta(days=1)):
+        return _get_statistics_for_metric(
+            title, metric.data, metric.unique_field, metric.date_field, datetime_from, datetime_to
+        )
+
+    interval_type = _BaseInterval.get_interval_type_from_date_range(date_from, date_to)
+    data_buckets_lookup: Dict[date, int] = defaultdict(int)
+    if metric.is_distinct:
+        total = metric.get_count(date_from, date_to)
+        interval_start = interval_type.get_current_start(date_from)
+        rollup_values = get_rollup_values(metric, interval_type.period, interval_start, date_to)
+        while interval_start <= date_to:
+            interval_end = interval_type.get_next_start(interval_start) - timedelta(days=1)
+            if interval_start >= date_from and interval_end <= date_to and interval_start in rollup_values:
+                data_buckets_lookup[interval_start] = rollup_values[interval_start]
+            else:
+                data_buckets_lookup[interval_start] = metric.get_count(
+                    max(interval_start, date_from), min(interval_end, date_to)
+                )
+            interval_start = interval_type.get_next_start(interval_start)
+    else:
+        daily_values = get_daily_values(metric, date_from, date_to)
+        for day, value in daily_values.items():
+            data_buckets_lookup[interval_type.get_current_start(day)] += value
+        total = sum(daily_values.values())
+
+    buckets_formatted = _format_interval_buckets(data_buckets_lookup, date_from, date_to)
+    bucket_labels = [entry[0].splitlines() for entry in buckets_formatted]
+    bucket_values = [entry[1] for entry in buckets_formatted]
+    return {'title': title, 'total': total, 'buckets': {'labels': bucket_labels, 'values': bucket_values}}
+
+
 def _get_statistics(from_date: datetime, to_date: datetime) -> list:
     """
     define metrics to be gathered as list items using helper functions
@@ -265,6 +355,7 @@ def _get_statistics(from_date: datetime, to_date: datetime) -> list:
     """
 
     statistics: list = []
+    metrics = get_statistics_metrics()
 
     # active users
     # the first recorded user online date (when the feature went live)
@@ -280,12 +371,10 @@ def _get_statistics(from_date: datetime, to_date: datetime) -> list:
         else ''
     )
     statistics.append(
-        _get_statistics_for_metric(
+        _get_rollup_statistics_for_metric(
             # Translators: no punctuation at the end
             title=_('Unique, registered users that were active in this period') + first_online_str,
-            data=UserOnlineOnDay.objects.filter(user_id__in=CosinnusPortal.get_current().members),
-            unique_field='user__id',
-            date_field='date',
+            metric=metrics[STATISTICS_METRIC_ACTIVE_USERS],
             datetime_from=from_date,
             datetime_to=to_date,
         )
@@ -293,20 +382,10 @@ def _get_statistics(from_date: datetime, to_date: datetime) -> list:
 
     # registered users
     # not using cosinnus.utils.user.filter_active_users because we want to deactivated accounts
-    used_user_accounts = (
-        get_user_model()
-        .objects.filter(id__in=CosinnusPortal.get_current().members)
-        .exclude(last_login__exact=None)
-        .exclude(email__icontains='__unverified__')
-        .filter(cosinnus_profile__tos_accepted=True)
-        .exclude(cosinnus_profile___is_guest=True)
-    )
     statistics.append(
-        _get_statistics_for_metric(
+        _get_rollup_statistics_for_metric(
             title=_('New Registered User Accounts in this period'),
-            data=used_user_accounts,
-            unique_field='pk',
-            date_field='date_joined',
+            metric=metrics[STATISTICS_METRIC_NEW_USER_ACCOUNTS],
             datetime_from=from_date,
             datetime_to=to_date,
         )
@@ -316,7 +395,7 @@ def _get_statistics(from_date: datetime, to_date: datetime) -> list:
     statistics.append(
         _get_statistics_for_metric(
             title=_('Total Enabled User Accounts (at least 1x logged in)'),
-            data=filter_active_users(get_user_model().objects.filter(id__in=CosinnusPortal.get_current().members)),
+            data=filter_active_users(get_user_model().objects.filter(id__in=get_portal_member_ids_query())),
             unique_field='pk',
             date_field='date_joined',
             datetime_from=None,
@@ -327,11 +406,9 @@ def _get_statistics(from_date: datetime, to_date: datetime) -> list:
 
     # created projects
     statistics.append(
-        _get_statistics_for_metric(
+        _get_rollup_statistics_for_metric(
             title=_('Newly Created Projects in this period'),
-            data=CosinnusProject.objects.filter(portal=CosinnusPortal.get_current()),
-            unique_field='pk',
-            date_field='created',
+            metric=metrics[STATISTICS_METRIC_CREATED_PROJECTS],
             datetime_from=from_date,
             datetime_to=to_date,
         )
@@ -352,11 +429,9 @@ def _get_statistics(from_date: datetime, to_date: datetime) -> list:
 
     # created groups
     statistics.append(
-        _get_statistics_for_metric(
+        _get_rollup_statistics_for_metric(
             title=_('Newly Created Groups in this period'),
-            data=CosinnusSociety.objects.filter(portal=CosinnusPortal.get_current()),
-            unique_field='pk',
-            date_field='created',
+            metric=metrics[STATISTICS_METRIC_CREATED_GROUPS],
             datetime_from=from_date,
             datetime_to=to_date,
         )
@@ -378,11 +453,9 @@ def _get_statistics(from_date: datetime, to_date: datetime) -> list:
     if settings.COSINNUS_CONFERENCES_ENABLED:
         # created conferences
         statistics.append(
-            _get_statistics_for_metric(
+            _get_rollup_statistics_for_metric(
                 title=_('Newly Created Conferences in this period'),
-                data=CosinnusConference.objects.filter(portal=CosinnusPortal.get_current()),
-                unique_field='pk',
-                date_field='created',
+                metric=metrics[STATISTICS_METRIC_CREATED_CONFERENCES],
                 datetime_from=from_date,
                 datetime_to=to_date,
             )
@@ -424,14 +497,10 @@ def _get_statistics(from_date: datetime, to_date: datetime) -> list:
 
     # optional: 11. Newly Created Events in this period
     try:
-        from cosinnus_event.models import Event
-
         statistics.append(
-            _get_statistics_for_metric(
+            _get_rollup_statistics_for_metric(
                 title=_('Newly Created Events in this period'),
-                data=Event.objects.filter(group__portal=CosinnusPortal.get_current()),
-                unique_field='pk',
-                date_field='created',
+                metric=metrics[STATISTICS_METRIC_CREATED_EVENTS],
                 datetime_from=from_date,
                 datetime_to=to_date,
             )
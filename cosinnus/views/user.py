@@ -106,6 +106,7 @@ from cosinnus.utils.user import (
     get_group_select2_pills,
     get_locked_profile_visibility_setting_for_user,
     get_newly_registered_user_email,
+    get_portal_member_ids_query,
     get_user_by_email_safe,
     get_user_from_set_password_token,
     get_user_query_filter_for_search_terms,
@@ -154,7 +155,7 @@ class UserListView(EndlessPaginationMixin, ListView):
         # get all users from this portal only
         # we also exclude users who have never logged in
         all_users = filter_active_users(
-            super(UserListView, self).get_queryset().filter(id__in=CosinnusPortal.get_current().members)
+            super(UserListView, self).get_queryset().filter(id__in=get_portal_member_ids_query())
         )
 
         if self.request.user.is_authenticated:
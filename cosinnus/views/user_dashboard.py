@@ -6,6 +6,7 @@ import itertools
 import json
 import logging
 import math
+from collections import defaultdict
 from datetime import timedelta
 
 import six
@@ -13,6 +14,7 @@ from annoying.functions import get_object_or_None
 from dateutil.relativedelta import relativedelta
 from django.contrib.contenttypes.models import ContentType
 from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
 from django.db.models import Q
 from django.http.response import HttpResponseBadRequest, HttpResponseForbidden, JsonResponse
 from django.shortcuts import redirect
@@ -46,6 +48,8 @@ from cosinnus.utils.permissions import (
     filter_base_taggable_qs_for_blocked_user_content,
     filter_tagged_object_queryset_for_user,
 )
+from cosinnus.utils.timeline import get_timeline_entries
+from cosinnus.utils.timeline_cache import timeline_fragment_cache
 from cosinnus.utils.urls import group_aware_reverse
 from cosinnus.views.mixins.group import RequireLoggedInMixin
 from cosinnus.views.mixins.reflected_objects import MixReflectedObjectsMixin
@@ -190,6 +194,8 @@ class MyGroupsClusteredMixin(object):
         # collect and sort user projects and societies lists
         projects = list(CosinnusProject.objects.get_for_user(user))
         societies = list(CosinnusSociety.objects.get_for_user(user))
+        # fill the membership caches of all listed groups in one go instead of one query per group and status
+        CosinnusGroupMembership.objects.prefetch_membership_caches(projects + societies)
         # sort sub items by last_visited or name
         if sort_by_activity:
             projects = sorted(
@@ -744,7 +750,7 @@ class TimelineView(ModelRetrievalMixin, View):
                 used as offset for the next paginated request. Will be None
                 if 0 items were returned.
         """
-        rendered_items = [self.render_item(item) for item in items]
+        rendered_items = timeline_fragment_cache.render_items(items, self.request, self.render_item)
         last_timestamp = None
         if len(items) > 0:
             last_timestamp = timestamp_from_datetime(getattr(items[-1], self.sort_key_natural))
@@ -758,24 +764,82 @@ class TimelineView(ModelRetrievalMixin, View):
 
     def get_items(self):
         """Returns a paginated list of items as mixture of different models, in sorted order"""
-        if self.filter_model:
-            single_querysets = [self._get_queryset_for_model(self.filter_model)]
-        else:
-            single_querysets = []
-            for content_type in self.content_types:
-                content_model = SEARCH_MODEL_NAMES_REVERSE.get(content_type, None)
-                if content_model is None:
-                    if settings.DEBUG:
-                        logger.warn('Could not find content model for timeline content type "%s"' % content_type)
-                    continue
-                qs = self._get_queryset_for_model(content_model)
-                single_querysets.append(qs)
+        if settings.COSINNUS_V2_DASHBOARD_USE_MATERIALIZED_TIMELINE:
+            try:
+                with transaction.atomic():
+                    return self._get_items_from_timeline_entries()
+            except Exception as e:
+                logger.exception(
+                    'Error while reading the materialized timeline, falling back to the querysets.',
+                    extra={'exception': e},
+                )
 
+        single_querysets = [self._get_queryset_for_model(content_model) for content_model in self._get_models()]
         # filter empty return values and mix the querysets
         single_querysets = [qs for qs in single_querysets if qs is not None]
         items = self._mix_items_from_querysets(*single_querysets)
         return items
 
+    def _get_models(self):
+        """Returns the list of models displayed in this timeline"""
+        if self.filter_model:
+            return [self.filter_model]
+        models = []
+        for content_type in self.content_types:
+            content_model = SEARCH_MODEL_NAMES_REVERSE.get(content_type, None)
+            if content_model is None:
+                if settings.DEBUG:
+                    logger.warn('Could not find content model for timeline content type "%s"' % content_type)
+                continue
+            models.append(content_model)
+        return models
+
+    def _get_items_from_timeline_entries(self):
+        """Returns a paginated list of items read from the user's materialized timeline (see
+        `cosinnus.utils.timeline`). The candidate entries are read in order in batches, and each batch's
+        items are loaded with the regular filtered querysets, so that only items are returned
+        the user may currently see."""
+        content_types = ContentType.objects.get_for_models(*self._get_models())
+        models_by_content_type_id = {content_type.id: model for model, content_type in content_types.items()}
+        offset_datetime = datetime_from_timestamp(self.offset_timestamp) if self.offset_timestamp else None
+        entries = get_timeline_entries(
+            self.user,
+            list(content_types.values()),
+            only_mine=self.only_mine,
+            only_forum=self.only_forum,
+            only_public=self.only_public,
+            before=offset_datetime,
+        )
+        if entries is None:
+            return []
+
+        items = []
+        seen = set()
+        offset = 0
+        batch_size = self.page_size * 2
+        while len(items) < self.page_size:
+            batch = list(entries[offset : offset + batch_size])
+            if not batch:
+                break
+            offset += len(batch)
+            # users have their own entry along with the portal-wide entry for public objects in their groups
+            candidates = [key for key in dict.fromkeys(batch) if key not in seen]
+            seen.update(candidates)
+            pks_by_content_type_id = defaultdict(list)
+            for content_type_id, object_id in candidates:
+                pks_by_content_type_id[content_type_id].append(object_id)
+            loaded = {}
+            for content_type_id, pks in pks_by_content_type_id.items():
+                queryset = self._get_queryset_for_model(models_by_content_type_id[content_type_id])
+                if queryset is None:
+                    continue
+                for obj in queryset.filter(pk__in=pks):
+                    loaded[(content_type_id, obj.pk)] = obj
+            items.extend([loaded[key] for key in candidates if key in loaded])
+            # read larger batches if many candidates were filtered out
+            batch_size *= 2
+        return items[: self.page_size]
+
     def render_item(self, item):
         """Renders an item using the template defined in its model's `timeline_template` attribute"""
         template = getattr(item, 'timeline_template', None)
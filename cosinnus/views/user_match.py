@@ -2,8 +2,8 @@ import logging
 import random
 from datetime import timedelta
 
+import numpy
 from django.contrib.auth import get_user_model
-from django.core.cache import cache
 from django.core.exceptions import ObjectDoesNotExist, ValidationError
 from django.http.response import HttpResponseForbidden, HttpResponseNotAllowed
 from django.shortcuts import redirect
@@ -14,19 +14,18 @@ from django.views.generic.list import ListView
 from cosinnus import cosinnus_notifications
 from cosinnus.conf import settings
 from cosinnus.default_settings import LOGIN_URL
-from cosinnus.models.group import CosinnusPortal
 from cosinnus.models.profile import UserMatchObject, get_user_profile_model
-from cosinnus.models.tagged import LikeObject
 from cosinnus.utils.functions import is_number
 from cosinnus.utils.permissions import check_user_can_see_user
 from cosinnus.utils.user import filter_active_users
+from cosinnus.utils.user_match import USER_MATCH_MAX_INACTIVE_DAYS, get_user_match_features, get_user_match_index
 from cosinnus.views.mixins.group import RequireLoggedInMixin
 
 logger = logging.getLogger('cosinnus')
 
 
-USER_MATCH_LIKES_CACHE_KEY = 'cosinnus/core/portal/%d/user_match/likes/'
-USER_MATCH_LIKES_CACHE_TIMEOUT = 60 * 5  # 5 minutes
+# number of the best scored users that are checked for their visibility at once
+USER_MATCH_CANDIDATE_BATCH_SIZE = 50
 
 
 class UserMatchListView(RequireLoggedInMixin, ListView):
@@ -48,142 +47,73 @@ class UserMatchListView(RequireLoggedInMixin, ListView):
                 return redirect(like_from.get_absolute_url())
         return super().get(request, *args, **kwargs)
 
-    def get_hashed_likes(self):
-        """Returns a dict with all likes by all users. The likes are stored in a hashed string format."""
-        cache_key = USER_MATCH_LIKES_CACHE_KEY % (CosinnusPortal.get_current().id)
-        likes_by_user = cache.get(cache_key)
-        if not likes_by_user:
-            likes_by_user = {}
-            values_liked = LikeObject.objects.filter(liked=True).values_list('user', 'content_type', 'object_id')
-            for user, content_type, object_id in values_liked:
-                if user not in likes_by_user:
-                    likes_by_user[user] = set()
-                likes_by_user[user].add(f'{content_type}::{object_id}')
-            cache.set(cache_key, likes_by_user, USER_MATCH_LIKES_CACHE_TIMEOUT)
-        return likes_by_user
-
-    # TODO: cache after!
-    def get_scored_user_profiles(self):
-        # exclude self
-        user_profiles = self.model.objects.exclude(user=self.request.user)
-
-        # filter only users I haven't liked or disliked yet
+    def get_visible_candidate_profiles(self, user_ids):
+        """Returns the profiles of the given users that can currently be suggested to the request user.
+        @return: A dict of user id --> profile"""
+        user_profiles = self.model.objects.filter(user_id__in=user_ids)
+        user_profiles = filter_active_users(user_profiles, filter_on_user_profile_model=True)
+        user_profiles = user_profiles.filter(user__last_login__gte=now() - timedelta(days=USER_MATCH_MAX_INACTIVE_DAYS))
+        user_profiles = user_profiles.select_related('user', 'media_tag')
+        return dict(
+            [
+                (profile.user_id, profile)
+                for profile in user_profiles
+                if check_user_can_see_user(self.request.user, profile.user)
+            ]
+        )
+
+    def get_scored_user_profiles(self, count=3):
+        """Returns the `count` profiles with the highest score for the request user, with one user that liked
+        the request user included at a random position. The scores are computed for all profiles at once
+        using the precomputed `UserMatchIndex`."""
+        # exclude self, users I have already liked or disliked and users that did not like me
         already_liked_users = UserMatchObject.objects.filter(
             from_user=self.request.user, type__in=[UserMatchObject.LIKE, UserMatchObject.DISLIKE]
         ).values_list('to_user_id', flat=True)
-        user_profiles = user_profiles.exclude(user_id__in=already_liked_users)
-
-        # prefetch related
-        user_profiles = user_profiles.prefetch_related('user', 'media_tag', 'media_tag__tags')
-
-        # filter out users that did not like me
         disliked_by_users = UserMatchObject.objects.filter(
             to_user=self.request.user, type=UserMatchObject.DISLIKE
         ).values_list('from_user_id', flat=True)
-        user_profiles = user_profiles.exclude(user_id__in=disliked_by_users)
-
-        # filter active users
-        user_profiles = filter_active_users(user_profiles, filter_on_user_profile_model=True)
-
-        # filter user to be active within the last year
-        last_year = now() - timedelta(
-            days=365
-        )  # timedelta to pass users who have logged in at least once within the last year;
-        user_profiles = user_profiles.filter(user__last_login__gte=last_year)
-
-        # filter users for their profile visibility
-        users = get_user_model().objects.filter(cosinnus_profile__in=user_profiles)
-        users = users.prefetch_related('cosinnus_profile', 'cosinnus_profile__media_tag')
-        checked_for_visibility_users = [user for user in users if check_user_can_see_user(self.request.user, user)]
-        user_profiles = user_profiles.filter(user_id__in=checked_for_visibility_users)
-
-        # get likes for all users to avoid queries per user.
-        user_likes = self.get_hashed_likes()
-
-        # get request user likes and tags
-        request_user_likes = user_likes.get(self.request.user.id, set())
-        request_user_tags = list(self.request.user.cosinnus_profile.media_tag.tags.all())
-
-        score_dict = {}
-
-        for profile in user_profiles:
-            score = 0
-            # profile fields score
-            if profile.description and len(profile.description) > 10:
-                score += 1
-            if profile.avatar:
-                score += 1
-            if profile.website:
-                score += 1
-            if profile.email_verified:
-                score += 1
-
-            # Score dynamic fields
-            if profile.dynamic_fields:
-                for field, value in profile.dynamic_fields.items():
-                    if value:
-                        score += 1
-                        user_value = self.request.user.cosinnus_profile.dynamic_fields.get(field)
-                        if user_value:
-                            if isinstance(value, list):
-                                try:
-                                    score += len(set(user_value).intersection(set(value)))
-                                except TypeError:
-                                    # Could not convert list to set. Just ignore the field.
-                                    pass
-                            elif user_value == value:
-                                score += 1
-
-            # Score topics
-            if profile.media_tag.topics:
-                score += 1
-                user_topics = self.request.user.cosinnus_profile.media_tag.get_topics()
-                score += len(set(profile.media_tag.get_topics()).intersection(set(user_topics)))
-
-            # Score tags
-            if profile.media_tag.tags.exists():
-                score += 1
-                score += len(set(profile.media_tag.tags.all()).intersection(set(request_user_tags)))
-
-            # score users active in the last month
-            last_month = now() - timedelta(days=31)
-            if profile.user.last_login > last_month:
-                score += 1
-
-            # mutual likes score
-            if request_user_likes:
-                this_user_liked_set = user_likes.get(profile.user_id, set())
-                set_intersection = this_user_liked_set.intersection(request_user_likes)
-                shared_like_count = len(set_intersection)
-                score += shared_like_count
-
-            score_dict[profile.id] = score
-
-        score_dict = sorted(score_dict.items(), key=lambda score: score[1], reverse=True)
-        result_score = {k: v for k, v in score_dict}
-
-        # get first 3 user profiles with the highest counted score
-        selected_user_profiles = list(result_score.keys())[:3]
-
-        # all active users related to the selected user profiles
-        scored_user_profiles = list(self.model.objects.select_related('user').filter(id__in=selected_user_profiles))
-        scored_user_profiles = sorted(scored_user_profiles, key=lambda p: result_score[p.id], reverse=True)
+        exclude_user_ids = set(already_liked_users) | set(disliked_by_users) | set([self.request.user.id])
+
+        index = get_user_match_index()
+        if index is None:
+            # the index is being built in the background
+            return []
+        request_user_features = get_user_match_features(self.model.objects.filter(user=self.request.user))
+        feature_ids = index.get_feature_ids(request_user_features[0].features) if request_user_features else []
+        ranked_user_ids, scores = index.get_ranked_user_ids(feature_ids, exclude_user_ids=exclude_user_ids)
+
+        # the index may be slightly outdated and does not know about the profile visibility,
+        # so the best candidates are checked until enough have been found
+        scored_user_profiles = []
+        for offset in range(0, len(ranked_user_ids), USER_MATCH_CANDIDATE_BATCH_SIZE):
+            batch = [int(user_id) for user_id in ranked_user_ids[offset : offset + USER_MATCH_CANDIDATE_BATCH_SIZE]]
+            visible_profiles = self.get_visible_candidate_profiles(batch)
+            scored_user_profiles += [visible_profiles[user_id] for user_id in batch if user_id in visible_profiles]
+            if len(scored_user_profiles) >= count:
+                break
+        scored_user_profiles = scored_user_profiles[:count]
 
         # Include one user that liked me in the selection
-        liked_by_users = UserMatchObject.objects.filter(
-            to_user=self.request.user, type=UserMatchObject.LIKE
-        ).values_list('from_user_id', flat=True)
-        selected_include_liked = set(liked_by_users).intersection(set(selected_user_profiles))
-        if not selected_include_liked:
+        liked_by_users = set(
+            UserMatchObject.objects.filter(to_user=self.request.user, type=UserMatchObject.LIKE).values_list(
+                'from_user_id', flat=True
+            )
+        )
+        if liked_by_users and not liked_by_users.intersection([profile.user_id for profile in scored_user_profiles]):
             # Get the user that liked me with the best matching score
-            liked_by_user_profiles = user_profiles.filter(user_id__in=liked_by_users).all()
-            liked_by_user_profiles = sorted(liked_by_user_profiles, key=lambda p: result_score[p.id], reverse=True)
-            liked_by_user_profile = liked_by_user_profiles[0] if liked_by_user_profiles else None
+            liked_by_mask = numpy.isin(ranked_user_ids, list(liked_by_users))
+            liked_by_ranked_user_ids = [int(user_id) for user_id in ranked_user_ids[liked_by_mask]]
+            visible_profiles = self.get_visible_candidate_profiles(liked_by_ranked_user_ids)
+            liked_by_user_profile = next(
+                (visible_profiles[user_id] for user_id in liked_by_ranked_user_ids if user_id in visible_profiles),
+                None,
+            )
             if liked_by_user_profile:
                 # Add the user at a random position
-                scored_user_profiles = scored_user_profiles[:2]
+                scored_user_profiles = scored_user_profiles[: count - 1]
                 random.seed()
-                random_pos = random.randrange(3)
+                random_pos = random.randrange(count)
                 scored_user_profiles.insert(random_pos, liked_by_user_profile)
         return scored_user_profiles
 
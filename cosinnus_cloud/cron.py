@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django_cron import Schedule
+
+from cosinnus.conf import settings
+from cosinnus.cron import CosinnusCronJobBase
+from cosinnus_cloud.sync_queue import process_nextcloud_sync_jobs
+
+
+class ProcessNextcloudSyncJobs(CosinnusCronJobBase):
+    """Processes all due jobs of the Nextcloud sync queue. Picks up jobs that are waiting for a retry
+    and jobs that were abandoned by a restarted process."""
+
+    RUN_EVERY_MINS = 1
+    schedule = Schedule(run_every_mins=RUN_EVERY_MINS)
+
+    cosinnus_code = 'cosinnus_cloud.process_nextcloud_sync_jobs'
+
+    def do(self):
+        if not settings.COSINNUS_CLOUD_ENABLED:
+            return
+        succeeded, failed = process_nextcloud_sync_jobs()
+        return 'Processed Nextcloud sync jobs: %d succeeded, %d failed.' % (succeeded, failed)
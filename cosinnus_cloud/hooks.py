@@ -4,10 +4,6 @@ from __future__ import unicode_literals
 import logging
 import re
 from base64 import b64encode
-from concurrent.futures import Future, ThreadPoolExecutor
-from contextlib import wraps
-from threading import Thread
-from time import sleep
 
 from django.contrib.auth import get_user_model
 from django.contrib.staticfiles.storage import staticfiles_storage
@@ -22,6 +18,7 @@ from cosinnus.models.group_extra import CosinnusConference, CosinnusProject, Cos
 from cosinnus.utils.functions import is_number
 from cosinnus.utils.group import get_cosinnus_group_model
 from cosinnus.utils.user import is_user_active
+from cosinnus_cloud.sync_queue import enqueue_nextcloud_job
 from cosinnus_cloud.utils.cosinnus import is_cloud_enabled_for_group, is_cloud_group_required_for_group
 from cosinnus_cloud.utils.nextcloud import rename_group_folder, set_group_display_name
 
@@ -30,48 +27,10 @@ from .utils import nextcloud
 logger = logging.getLogger('cosinnus')
 
 
-executor = ThreadPoolExecutor(max_workers=64, thread_name_prefix='nextcloud-req-')
-
-
 def get_user_display_name(user):
     return user and hasattr(user, 'cosinnus_profile') and user.cosinnus_profile.get_external_full_name() or '(UNK)'
 
 
-def submit_with_retry(fn, *args, **kwargs):
-    @wraps(fn)
-    def exec_with_retry():
-        # seconds to wait before retrying.
-        retry_wait = [2, 5, 10, 30, 60, 300]
-        while True:
-            try:
-                return fn(*args, **kwargs)
-            except Exception as e:
-                try:
-                    delay = retry_wait.pop(0)
-                    logger.warning(
-                        'Nextcloud call %s(%s, %s) failed. Retrying in %ds (%d tries left)',
-                        fn.__name__,
-                        args,
-                        kwargs,
-                        delay,
-                        len(retry_wait),
-                        exc_info=True,
-                    )
-                    sleep(delay)
-                    continue
-                except IndexError:
-                    logger.warning(
-                        'Nextcloud call %s(%s, %s) failed. Giving up',
-                        fn.__name__,
-                        args,
-                        kwargs,
-                        exc_info=True,
-                    )
-                    raise e
-
-    executor.submit(exec_with_retry).add_done_callback(nc_req_callback)
-
-
 def get_nc_user_id(user):
     """Get the NextCloud user id for a user."""
     return f'wechange-{user.id}'
@@ -86,22 +45,16 @@ def get_user_by_nc_user_id(nc_user_id):
     return user
 
 
-def nc_req_callback(future: Future):
-    try:
-        res = future.result()
-    except Exception:
-        logger.exception('Nextcloud remote call resulted in an exception')
-    else:
-        logger.debug('Nextcloud call finished with result %r', res)
-
-
 def disable_group_folder_for_group(group):
     """For lack of a better way through the API, this
     'disables' a group folder for a CosinnusGroup by removing the nextcloud group's access
     to the group folder, when a CosinnusGroup is deactivated"""
     if group.nextcloud_group_id and group.nextcloud_groupfolder_id:
-        submit_with_retry(
-            nextcloud.remove_group_access_for_folder, group.nextcloud_group_id, group.nextcloud_groupfolder_id
+        enqueue_nextcloud_job(
+            'remove_group_access_for_folder',
+            group.nextcloud_group_id,
+            group.nextcloud_groupfolder_id,
+            ordering_key=get_group_ordering_key(group),
         )
 
 
@@ -110,8 +63,11 @@ def enable_group_folder_for_group(group):
     'enables' a group folder for a CosinnusGroup by removing the nextcloud group's access
     to the group folder, when a CosinnusGroup is deactivated"""
     if group.nextcloud_group_id and group.nextcloud_groupfolder_id:
-        submit_with_retry(
-            nextcloud.add_group_access_for_folder, group.nextcloud_group_id, group.nextcloud_groupfolder_id
+        enqueue_nextcloud_job(
+            'add_group_access_for_folder',
+            group.nextcloud_group_id,
+            group.nextcloud_groupfolder_id,
+            ordering_key=get_group_ordering_key(group),
         )
 
 
@@ -138,7 +94,12 @@ def update_user_from_obj(user):
 
 
 def update_user_profile_avatar(profile, retry=False):
-    """Update user avatar"""
+    """Update user avatar.
+    @param retry: If True, the update is done through the sync queue, which retries it on failure"""
+    if retry:
+        enqueue_nextcloud_job('update_user_avatar', profile.user_id, ordering_key=get_user_ordering_key(profile.user))
+        return
+
     avatar_content = None
     try:
         if profile.avatar:
@@ -155,10 +116,7 @@ def update_user_profile_avatar(profile, retry=False):
     if avatar_content:
         nc_user_id = get_nc_user_id(profile.user)
         avatar_encoded = b64encode(avatar_content)
-        if retry:
-            submit_with_retry(nextcloud.update_user_avatar, nc_user_id, avatar_encoded)
-        else:
-            nextcloud.update_user_avatar(nc_user_id, avatar_encoded)
+        nextcloud.update_user_avatar(nc_user_id, avatar_encoded)
 
 
 def get_email_for_user(user):
@@ -296,6 +254,85 @@ def initialize_nextcloud_for_group(group, send_initialized_signal=True, check_re
         )
 
 
+def get_user_ordering_key(user):
+    """The sync queue ordering key for all operations on a user and their memberships"""
+    return f'user:{user.id}'
+
+
+def get_group_ordering_key(group):
+    """The sync queue ordering key for all operations on a group and its folder"""
+    return f'group:{group.id}'
+
+
+def _get_user(user_id):
+    return get_user_model().objects.filter(id=user_id).select_related('cosinnus_profile').first()
+
+
+def _get_group(group_id):
+    return get_cosinnus_group_model().objects.filter(id=group_id).first()
+
+
+def sync_create_user(user_id):
+    user = _get_user(user_id)
+    if user:
+        return create_user_from_obj(user)
+
+
+def sync_update_user_name(user_id):
+    user = _get_user(user_id)
+    if user and is_user_active(user):
+        return nextcloud.update_user_name(get_nc_user_id(user), get_user_display_name(user))
+
+
+def sync_update_user_avatar(user_id):
+    user = _get_user(user_id)
+    if user and hasattr(user, 'cosinnus_profile'):
+        update_user_profile_avatar(user.cosinnus_profile)
+
+
+def sync_initialize_group(group_id):
+    group = _get_group(group_id)
+    if group and is_cloud_group_required_for_group(group):
+        initialize_nextcloud_for_group(group)
+
+
+def sync_initialize_group_with_members(group_id):
+    """Initializes the group and queues adding all of its members. We don't need to remove users who
+    have left the group while the app was deactivated here, because that listener is always active"""
+    group = _get_group(group_id)
+    if group and is_cloud_group_required_for_group(group):
+        initialize_nextcloud_for_group(group)
+        for user in group.actual_members:
+            enqueue_nextcloud_job(
+                'add_user_to_group',
+                get_nc_user_id(user),
+                group.nextcloud_group_id,
+                ordering_key=get_user_ordering_key(user),
+            )
+
+
+# all operations that can be queued using `cosinnus_cloud.sync_queue.enqueue_nextcloud_job`.
+# all arguments must be JSON-serializable, so objects are passed by id and re-fetched on execution
+NEXTCLOUD_SYNC_OPERATIONS = {
+    'create_user': sync_create_user,
+    'update_user_name': sync_update_user_name,
+    'update_user_avatar': sync_update_user_avatar,
+    'disable_user': nextcloud.disable_user,
+    'enable_user': nextcloud.enable_user,
+    'delete_user': nextcloud.delete_user,
+    'add_user_to_admin_group': nextcloud.add_user_to_admin_group,
+    'remove_user_from_admin_group': nextcloud.remove_user_from_admin_group,
+    'add_user_to_group': nextcloud.add_user_to_group,
+    'remove_user_from_group': nextcloud.remove_user_from_group,
+    'initialize_group': sync_initialize_group,
+    'initialize_group_with_members': sync_initialize_group_with_members,
+    'add_group_access_for_folder': nextcloud.add_group_access_for_folder,
+    'remove_group_access_for_folder': nextcloud.remove_group_access_for_folder,
+    'delete_groupfolder': nextcloud.delete_groupfolder,
+    'delete_group': nextcloud.delete_group,
+}
+
+
 # only activate these hooks when the cloud is enabled
 if settings.COSINNUS_CLOUD_ENABLED:
 
@@ -312,7 +349,12 @@ if settings.COSINNUS_CLOUD_ENABLED:
                     get_user_display_name(user),
                     group.name,
                 )
-                submit_with_retry(nextcloud.add_user_to_group, get_nc_user_id(user), group.nextcloud_group_id)
+                enqueue_nextcloud_job(
+                    'add_user_to_group',
+                    get_nc_user_id(user),
+                    group.nextcloud_group_id,
+                    ordering_key=get_user_ordering_key(user),
+                )
 
     @receiver(signals.user_left_group)
     def user_left_group_receiver_sub(sender, user, group, **kwargs):
@@ -328,10 +370,11 @@ if settings.COSINNUS_CLOUD_ENABLED:
                 get_user_display_name(user),
                 group.name,
             )
-            submit_with_retry(
-                nextcloud.remove_user_from_group,
+            enqueue_nextcloud_job(
+                'remove_user_from_group',
                 get_nc_user_id(user),
                 group.nextcloud_group_id,
+                ordering_key=get_user_ordering_key(user),
             )
 
     @receiver(signals.userprofile_created)
@@ -340,14 +383,14 @@ if settings.COSINNUS_CLOUD_ENABLED:
         if user.is_guest:
             return
         logger.debug('User profile created, adding user [%s] to nextcloud ', get_user_display_name(user))
-        submit_with_retry(create_user_from_obj, user)
+        enqueue_nextcloud_job('create_user', user.id, ordering_key=get_user_ordering_key(user))
 
     @receiver(post_save, sender=UserProfile)
     def handle_profile_updated(sender, instance, created, **kwargs):
         """
         # TODO: add a check which field should be updated (should only be the name, and only if it changed)
 
-        # IMPORTANT: Needs to be threaded, because the endpoint is slooooow!
+        # IMPORTANT: Needs to be queued, because the endpoint is slooooow!
         """
         # only update active profiles
         if created or not instance.id:
@@ -357,24 +400,10 @@ if settings.COSINNUS_CLOUD_ENABLED:
             return
         if not is_user_active(user):
             return
-
-        # run the update threaded because it is a very slow endpoint
-        class UpdateNCUserThread(Thread):
-            def run(self):
-                try:
-                    # we should actually use `update_user_from_obj`, but since
-                    # the only field really updateable is the username (email is empty for now),
-                    # we just use the direct method. and we don't submit_with_retry either,
-                    # because if we fail this, we fail it
-                    # submit_with_retry(update_user_from_obj, instance.user)
-                    nextcloud.update_user_name(
-                        get_nc_user_id(user),
-                        get_user_display_name(user),
-                    )
-                except Exception as e:
-                    logger.warning('Could not update Nextcloud user on profile update.', extra={'exc': e})
-
-        UpdateNCUserThread().start()
+        # we should actually use `update_user_from_obj`, but since the only field really updateable
+        # is the username (email is empty for now), we just update the name.
+        # repeated saves of a profile are coalesced into a single update by the queue
+        enqueue_nextcloud_job('update_user_name', user.id, ordering_key=get_user_ordering_key(user))
 
     @receiver(signals.userprofile_avatar_updated)
     def handle_profile_avatar_updated(sender, profile, **kwargs):
@@ -385,22 +414,16 @@ if settings.COSINNUS_CLOUD_ENABLED:
     def group_created_sub(sender, group, **kwargs):
         # only initialize if the cosinnus-app is actually activated
         if is_cloud_group_required_for_group(group):
-            submit_with_retry(initialize_nextcloud_for_group, group)
+            enqueue_nextcloud_job('initialize_group', group.id, ordering_key=get_group_ordering_key(group))
 
     @receiver(signals.group_apps_activated)
     def group_cloud_or_deck_app_activated_sub(sender, group, apps, **kwargs):
         """Listen for the cloud app or deck app being activated"""
         if 'cosinnus_cloud' in apps or 'cosinnus_deck' in apps:
             if is_cloud_group_required_for_group(group):
-
-                def _conurrent_wrap():
-                    initialize_nextcloud_for_group(group)
-                    for user in group.actual_members:
-                        submit_with_retry(nextcloud.add_user_to_group, get_nc_user_id(user), group.nextcloud_group_id)
-                        # we don't need to remove users who have left the group while the app was deactivated here,
-                        # because that listener is always active
-
-                submit_with_retry(_conurrent_wrap)
+                enqueue_nextcloud_job(
+                    'initialize_group_with_members', group.id, ordering_key=get_group_ordering_key(group)
+                )
 
     @receiver(signals.group_apps_deactivated)
     def group_cloud_app_deactivated_sub(sender, group, apps, **kwargs):
@@ -479,25 +502,27 @@ if settings.COSINNUS_CLOUD_ENABLED:
     def user_deactivated(sender, user, **kwargs):
         if user.is_guest:
             return
-        submit_with_retry(nextcloud.disable_user, get_nc_user_id(user))
+        enqueue_nextcloud_job('disable_user', get_nc_user_id(user), ordering_key=get_user_ordering_key(user))
 
     @receiver(signals.user_activated)
     def user_activated(sender, user, **kwargs):
         if user.is_guest:
             return
-        submit_with_retry(nextcloud.enable_user, get_nc_user_id(user))
+        enqueue_nextcloud_job('enable_user', get_nc_user_id(user), ordering_key=get_user_ordering_key(user))
 
     @receiver(signals.user_promoted_to_superuser)
     def user_promoted_to_superuser(sender, user, **kwargs):
         if user.is_guest:
             return
-        submit_with_retry(nextcloud.add_user_to_admin_group, get_nc_user_id(user))
+        enqueue_nextcloud_job('add_user_to_admin_group', get_nc_user_id(user), ordering_key=get_user_ordering_key(user))
 
     @receiver(signals.user_demoted_from_superuser)
     def user_demoted_from_superuser(sender, user, **kwargs):
         if user.is_guest:
             return
-        submit_with_retry(nextcloud.remove_user_from_admin_group, get_nc_user_id(user))
+        enqueue_nextcloud_job(
+            'remove_user_from_admin_group', get_nc_user_id(user), ordering_key=get_user_ordering_key(user)
+        )
 
     @receiver(signals.pre_userprofile_delete)
     def user_deleted(sender, profile, **kwargs):
@@ -505,7 +530,7 @@ if settings.COSINNUS_CLOUD_ENABLED:
         user = profile.user
         if user.is_guest:
             return
-        submit_with_retry(nextcloud.delete_user, get_nc_user_id(profile.user))
+        enqueue_nextcloud_job('delete_user', get_nc_user_id(user), ordering_key=get_user_ordering_key(user))
 
     """
         TODO: we're missing an update-user hook to `nextcloud.update_user`!
@@ -542,6 +567,8 @@ if settings.COSINNUS_CLOUD_ENABLED:
                 'nc_groupfolder_name': group.nextcloud_groupfolder_name,
             }
             logger.info('Nextcloud: Log: Deleting a groupfolder on group deletion.', extra=extra)
-            submit_with_retry(nextcloud.delete_groupfolder, group.nextcloud_groupfolder_id)
-            submit_with_retry(nextcloud.delete_group, group.nextcloud_group_id)
-            logger.info('Nextcloud: Log: Deleted a groupfolder on group deletion.', extra=extra)
+            enqueue_nextcloud_job(
+                'delete_groupfolder', group.nextcloud_groupfolder_id, ordering_key=get_group_ordering_key(group)
+            )
+            enqueue_nextcloud_job('delete_group', group.nextcloud_group_id, ordering_key=get_group_ordering_key(group))
+            logger.info('Nextcloud: Log: Queued deleting a groupfolder on group deletion.', extra=extra)
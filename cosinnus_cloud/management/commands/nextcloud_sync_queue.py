@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Min
+from django.utils.timezone import now
+
+from cosinnus.core.middleware.cosinnus_middleware import initialize_cosinnus_after_startup
+from cosinnus.models.group import CosinnusPortal
+from cosinnus_cloud.models import NextcloudSyncJob
+from cosinnus_cloud.sync_queue import process_nextcloud_sync_jobs
+
+
+class Command(BaseCommand):
+    help = (
+        'Shows the state of the Nextcloud sync job queue for the current portal. '
+        'Can also process all due jobs and retry or delete failed jobs.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--drain', action='store_true', help='Process all due jobs synchronously.')
+        parser.add_argument(
+            '--retry-failed', action='store_true', help='Reschedule all failed jobs for immediate processing.'
+        )
+        parser.add_argument('--delete-failed', action='store_true', help='Delete all failed jobs.')
+        parser.add_argument('--list', action='store_true', help='List all jobs in the queue.')
+
+    def handle(self, *args, **options):
+        initialize_cosinnus_after_startup()
+        jobs = NextcloudSyncJob.objects.filter(portal=CosinnusPortal.get_current())
+
+        if options['retry_failed']:
+            count = jobs.filter(status=NextcloudSyncJob.STATUS_FAILED).update(
+                status=NextcloudSyncJob.STATUS_PENDING, attempts=0, next_attempt_at=now()
+            )
+            self.stdout.write(f'Rescheduled {count} failed jobs.')
+        if options['delete_failed']:
+            count, __ = jobs.filter(status=NextcloudSyncJob.STATUS_FAILED).delete()
+            self.stdout.write(f'Deleted {count} failed jobs.')
+        if options['drain']:
+            self.stdout.write('Processing all due jobs...')
+            succeeded, failed = process_nextcloud_sync_jobs()
+            self.stdout.write(f'Done. {succeeded} jobs succeeded, {failed} jobs failed and were rescheduled.')
+
+        status_labels = dict(NextcloudSyncJob.STATUS_CHOICES)
+        stats = jobs.values('status', 'operation').annotate(count=Count('id')).order_by('status', 'operation')
+        if not stats:
+            self.stdout.write('The queue is empty.')
+        for row in stats:
+            self.stdout.write(f'{status_labels[row["status"]]}: {row["operation"]}: {row["count"]}')
+        oldest = jobs.filter(status=NextcloudSyncJob.STATUS_PENDING).aggregate(oldest=Min('created'))['oldest']
+        if oldest:
+            self.stdout.write(f'Oldest pending job was created at {oldest}.')
+
+        if options['list']:
+            for job in jobs:
+                self.stdout.write(f'{job.id}: {job} next attempt: {job.next_attempt_at} error: {job.last_error}')
@@ -0,0 +1,63 @@
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('cosinnus', '0159_mitwirkomatsettings_add_dynamicfields'),
+        ('cosinnus_cloud', '0003_auto_20210327_1728'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NextcloudSyncJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('operation', models.CharField(max_length=100, verbose_name='Operation')),
+                ('args', models.JSONField(blank=True, default=list, verbose_name='Arguments')),
+                (
+                    'ordering_key',
+                    models.CharField(
+                        help_text='Jobs with the same ordering key are executed strictly in order (e.g. "user:12", "group:3")',
+                        max_length=100,
+                        verbose_name='Ordering key',
+                    ),
+                ),
+                (
+                    'status',
+                    models.PositiveSmallIntegerField(
+                        choices=[(0, 'Pending'), (1, 'Running'), (2, 'Failed')], default=0, verbose_name='Status'
+                    ),
+                ),
+                ('attempts', models.PositiveSmallIntegerField(default=0, verbose_name='Attempts')),
+                (
+                    'next_attempt_at',
+                    models.DateTimeField(default=django.utils.timezone.now, verbose_name='Next attempt at'),
+                ),
+                ('claimed_until', models.DateTimeField(blank=True, null=True, verbose_name='Claimed until')),
+                ('last_error', models.TextField(blank=True, verbose_name='Last error')),
+                ('created', models.DateTimeField(auto_now_add=True, verbose_name='Created')),
+                (
+                    'portal',
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name='nextcloud_sync_jobs',
+                        to='cosinnus.cosinnusportal',
+                        verbose_name='Portal',
+                    ),
+                ),
+            ],
+            options={
+                'verbose_name': 'Nextcloud Sync Job',
+                'verbose_name_plural': 'Nextcloud Sync Jobs',
+                'ordering': ('id',),
+                'indexes': [
+                    models.Index(
+                        fields=['portal', 'status', 'next_attempt_at'], name='cosinnus_cl_portal__eba006_idx'
+                    ),
+                    models.Index(fields=['ordering_key', 'status'], name='cosinnus_cl_orderin_45dfd9_idx'),
+                ],
+            },
+        ),
+    ]
@@ -5,6 +5,7 @@ from dataclasses import dataclass
 import six
 from annoying.functions import get_object_or_None
 from django.db import models
+from django.utils.timezone import now
 from django.utils.translation import gettext_lazy as _
 
 from cosinnus.conf import settings
@@ -170,3 +171,50 @@ class LinkedCloudFile(BaseTaggableObjectModel):
         that belongs to that ID (usually an external object's ID is given, and
         we return the local DB object that is attachable and is pointing to it)"""
         return cls.get_for_nextcloud_file_id_data_str(object_id, group)
+
+
+class NextcloudSyncJob(models.Model):
+    """A persisted Nextcloud API operation, processed by the queue in `cosinnus_cloud.sync_queue`.
+    Jobs with the same `ordering_key` are always executed in the order they were created."""
+
+    STATUS_PENDING = 0
+    STATUS_RUNNING = 1
+    STATUS_FAILED = 2
+
+    STATUS_CHOICES = (
+        (STATUS_PENDING, _('Pending')),
+        (STATUS_RUNNING, _('Running')),
+        (STATUS_FAILED, _('Failed')),
+    )
+
+    portal = models.ForeignKey(
+        'cosinnus.CosinnusPortal',
+        verbose_name=_('Portal'),
+        related_name='nextcloud_sync_jobs',
+        on_delete=models.CASCADE,
+    )
+    operation = models.CharField(_('Operation'), max_length=100)
+    args = models.JSONField(_('Arguments'), default=list, blank=True)
+    ordering_key = models.CharField(
+        _('Ordering key'),
+        max_length=100,
+        help_text='Jobs with the same ordering key are executed strictly in order (e.g. "user:12", "group:3")',
+    )
+    status = models.PositiveSmallIntegerField(_('Status'), choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveSmallIntegerField(_('Attempts'), default=0)
+    next_attempt_at = models.DateTimeField(_('Next attempt at'), default=now)
+    claimed_until = models.DateTimeField(_('Claimed until'), null=True, blank=True)
+    last_error = models.TextField(_('Last error'), blank=True)
+    created = models.DateTimeField(_('Created'), auto_now_add=True)
+
+    class Meta(object):
+        ordering = ('id',)
+        verbose_name = _('Nextcloud Sync Job')
+        verbose_name_plural = _('Nextcloud Sync Jobs')
+        indexes = [
+            models.Index(fields=['portal', 'status', 'next_attempt_at']),
+            models.Index(fields=['ordering_key', 'status']),
+        ]
+
+    def __str__(self):
+        return f'NextcloudSyncJob {self.operation}({self.args}) [{self.get_status_display()}, {self.attempts} attempts]'
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+A persistent job queue for all Nextcloud API calls that are triggered by changes on the portal.
+
+Jobs are stored in the DB as `NextcloudSyncJob`s, so that no syncs are lost on a process restart.
+- Each job refers to one of the operations registered in `cosinnus_cloud.hooks.NEXTCLOUD_SYNC_OPERATIONS`
+  by name and stores its JSON-serializable arguments.
+- Jobs with the same ordering key (e.g. "user:12") are executed strictly in the order they were enqueued.
+  Dependencies between different keys (e.g. a user must exist before being added to a group) are resolved
+  by retrying.
+- An enqueued job is dropped if the latest pending job for the same ordering key is identical to it,
+  so that repeated operations like updating a user's name are only executed once.
+- Failed jobs are rescheduled with an exponential backoff instead of blocking a worker while waiting,
+  and are marked as failed after `COSINNUS_CLOUD_SYNC_QUEUE_MAX_ATTEMPTS` attempts.
+
+The queue is processed by celery tasks if `COSINNUS_USE_CELERY` is enabled, and otherwise by a small number
+of worker threads in the enqueueing process. The `ProcessNextcloudSyncJobs` cronjob picks up rescheduled
+and abandoned jobs, and the `nextcloud_sync_queue` management command can be used to inspect and drain the queue.
+"""
+
+from __future__ import unicode_literals
+
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.db import close_old_connections, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils.encoding import force_str
+from django.utils.timezone import now
+
+from cosinnus.conf import settings
+from cosinnus.models.group import CosinnusPortal
+from cosinnus_cloud.models import NextcloudSyncJob
+
+logger = logging.getLogger('cosinnus')
+
+
+_local_workers = 0
+_local_workers_lock = threading.Lock()
+_local_timer = None
+_local_timer_due = None
+
+
+def get_nextcloud_sync_operations():
+    from cosinnus_cloud.hooks import NEXTCLOUD_SYNC_OPERATIONS
+
+    return NEXTCLOUD_SYNC_OPERATIONS
+
+
+def enqueue_nextcloud_job(operation, *args, ordering_key):
+    """Adds a Nextcloud operation to the sync queue. Processing of the queue is triggered
+    once the current transaction is committed.
+    @param operation: The name of an operation in `NEXTCLOUD_SYNC_OPERATIONS`
+    @param args: JSON-serializable arguments for the operation
+    @param ordering_key: Jobs with the same key are executed in order. Usually "user:<id>" or "group:<id>"
+    @return: The created job, or None if the job was coalesced with an identical pending one
+    """
+    if operation not in get_nextcloud_sync_operations():
+        raise ValueError('Unknown Nextcloud sync operation "%s"!' % operation)
+    args = list(args)
+    portal = CosinnusPortal.get_current()
+    latest_pending_job = (
+        NextcloudSyncJob.objects.filter(
+            portal=portal, ordering_key=ordering_key, status=NextcloudSyncJob.STATUS_PENDING
+        )
+        .order_by('-id')
+        .first()
+    )
+    if latest_pending_job and latest_pending_job.operation == operation and latest_pending_job.args == args:
+        return None
+    job = NextcloudSyncJob.objects.create(portal=portal, operation=operation, args=args, ordering_key=ordering_key)
+    transaction.on_commit(trigger_nextcloud_sync_queue)
+    return job
+
+
+def trigger_nextcloud_sync_queue(delay=None):
+    """Starts processing the queue, in a celery task or in local worker threads.
+    @param delay: If given, processing is started after this many seconds"""
+    if settings.COSINNUS_USE_CELERY:
+        from cosinnus_cloud.tasks import process_nextcloud_sync_jobs_task
+
+        process_nextcloud_sync_jobs_task.apply_async(countdown=delay or 0)
+    elif delay:
+        _schedule_local_trigger(delay)
+    else:
+        _start_local_worker()
+
+
+def _schedule_local_trigger(delay):
+    """Schedules starting a local worker after `delay` seconds. Only a single timer is kept per process,
+    so that many failing jobs do not each keep a waiting thread."""
+    global _local_timer, _local_timer_due
+    due = time.monotonic() + delay
+    with _local_workers_lock:
+        if _local_timer is not None and _local_timer.is_alive() and _local_timer_due <= due:
+            # the scheduled worker will also pick up this job, or reschedule itself for it
+            return
+        if _local_timer is not None:
+            _local_timer.cancel()
+        _local_timer = threading.Timer(delay, _start_local_worker)
+        _local_timer.daemon = True
+        _local_timer_due = due
+        _local_timer.start()
+
+
+def _start_local_worker():
+    global _local_workers
+    with _local_workers_lock:
+        if _local_workers >= settings.COSINNUS_CLOUD_SYNC_QUEUE_WORKERS:
+            # the running workers will pick up the new jobs
+            return
+        _local_workers += 1
+    threading.Thread(target=_run_local_worker, name='nextcloud-sync-queue', daemon=True).start()
+
+
+def _run_local_worker():
+    global _local_workers
+    try:
+        process_nextcloud_sync_jobs()
+        # make sure jobs that are waiting for a retry are picked up when they are due. jobs that are
+        # due, but blocked by a running job, will be picked up by the worker running that job.
+        next_attempt_at = (
+            NextcloudSyncJob.objects.filter(
+                portal=CosinnusPortal.get_current(),
+                status=NextcloudSyncJob.STATUS_PENDING,
+                next_attempt_at__gt=now(),
+            )
+            .order_by('next_attempt_at')
+            .values_list('next_attempt_at', flat=True)
+            .first()
+        )
+        if next_attempt_at is not None:
+            _schedule_local_trigger(max((next_attempt_at - now()).total_seconds(), 1))
+    except Exception as e:
+        logger.exception('Nextcloud sync queue worker crashed.', extra={'exception': force_str(e)})
+    finally:
+        with _local_workers_lock:
+            _local_workers -= 1
+        close_old_connections()
+
+
+def get_claimable_jobs(portal=None):
+    """Returns a QS of all jobs that are due and not blocked by an earlier unfinished job with the same
+    ordering key. Jobs that have been claimed but not finished within the claim timeout count as abandoned
+    and are claimable again."""
+    portal = portal or CosinnusPortal.get_current()
+    current_time = now()
+    earlier_unfinished_jobs = NextcloudSyncJob.objects.filter(
+        ordering_key=OuterRef('ordering_key'),
+        id__lt=OuterRef('id'),
+        status__in=[NextcloudSyncJob.STATUS_PENDING, NextcloudSyncJob.STATUS_RUNNING],
+    )
+    return (
+        NextcloudSyncJob.objects.filter(portal=portal, next_attempt_at__lte=current_time)
+        .filter(
+            Q(status=NextcloudSyncJob.STATUS_PENDING)
+            | Q(status=NextcloudSyncJob.STATUS_RUNNING, claimed_until__lt=current_time)
+        )
+        .exclude(Exists(earlier_unfinished_jobs))
+        .order_by('id')
+    )
+
+
+def claim_next_job(portal=None):
+    """Locks and returns the next claimable job, or None if there is none"""
+    with transaction.atomic():
+        job = get_claimable_jobs(portal=portal).select_for_update(skip_locked=True).first()
+        if job is None:
+            return None
+        job.status = NextcloudSyncJob.STATUS_RUNNING
+        job.claimed_until = now() + timedelta(seconds=settings.COSINNUS_CLOUD_SYNC_QUEUE_CLAIM_TIMEOUT_SECONDS)
+        job.attempts += 1
+        job.save(update_fields=['status', 'claimed_until', 'attempts'])
+    return job
+
+
+def get_backoff_seconds(attempts):
+    """Returns the delay before the next attempt of a job that has failed `attempts` times"""
+    delay = settings.COSINNUS_CLOUD_SYNC_QUEUE_BACKOFF_BASE_SECONDS * (2 ** (attempts - 1))
+    return min(delay, settings.COSINNUS_CLOUD_SYNC_QUEUE_BACKOFF_MAX_SECONDS)
+
+
+def run_job(job):
+    """Executes a claimed job. Deletes it on success, or reschedules it on failure.
+    @return: True if the job succeeded, False otherwise"""
+    try:
+        operation = get_nextcloud_sync_operations()[job.operation]
+        operation(*job.args)
+    except Exception as e:
+        job.last_error = force_str(e)[:2000]
+        job.claimed_until = None
+        if job.attempts >= settings.COSINNUS_CLOUD_SYNC_QUEUE_MAX_ATTEMPTS:
+            job.status = NextcloudSyncJob.STATUS_FAILED
+            logger.warning(
+                'Nextcloud call %s(%s) failed. Giving up after %d tries.',
+                job.operation,
+                job.args,
+                job.attempts,
+                exc_info=True,
+            )
+        else:
+            delay = get_backoff_seconds(job.attempts)
+            job.status = NextcloudSyncJob.STATUS_PENDING
+            job.next_attempt_at = now() + timedelta(seconds=delay)
+            logger.warning(
+                'Nextcloud call %s(%s) failed. Retrying in %ds (%d tries left)',
+                job.operation,
+                job.args,
+                delay,
+                settings.COSINNUS_CLOUD_SYNC_QUEUE_MAX_ATTEMPTS - job.attempts,
+                exc_info=True,
+            )
+            transaction.on_commit(lambda: trigger_nextcloud_sync_queue(delay=delay))
+        job.save(update_fields=['status', 'claimed_until', 'next_attempt_at', 'last_error'])
+        return False
+    job.delete()
+    return True
+
+
+def process_nextcloud_sync_jobs(portal=None, max_jobs=None):
+    """Processes claimable jobs until none are left.
+    @param max_jobs: If given, stops after this many jobs
+    @return: A tuple of (number of succeeded jobs, number of failed attempts)"""
+    succeeded = failed = 0
+    while max_jobs is None or succeeded + failed < max_jobs:
+        job = claim_next_job(portal=portal)
+        if job is None:
+            break
+        if run_job(job):
+            succeeded += 1
+        else:
+            failed += 1
+    return succeeded, failed
@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from cosinnus.celery import app as celery_app
+
+
+@celery_app.task
+def process_nextcloud_sync_jobs_task():
+    """Processes all due jobs of the Nextcloud sync queue. See `cosinnus_cloud.sync_queue`."""
+    from cosinnus_cloud.sync_queue import process_nextcloud_sync_jobs
+
+    process_nextcloud_sync_jobs()
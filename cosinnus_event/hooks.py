@@ -13,10 +13,14 @@ from cosinnus.core import signals
 from cosinnus.models.group import MEMBER_STATUS
 from cosinnus.models.tagged import BaseTaggableObjectReflection, BaseTagObject
 from cosinnus.utils.functions import unique_aware_slugify
-from cosinnus_event.models import Event
+from cosinnus.utils.timeline_cache import timeline_fragment_cache
+from cosinnus_event.models import Event, EventAttendance
 
 logger = logging.getLogger('cosinnus')
 
+# the attendance count is shown in the event's timeline item
+timeline_fragment_cache.register_dependency(EventAttendance, Event, 'event')
+
 
 def update_bbb_room_memberships(group_membership, deleted):
     """Apply membership permission changes to BBBRoom of all events and
@@ -6,6 +6,7 @@ from django.contrib.contenttypes.fields import GenericRelation
 from django.db import models, transaction
 from django.urls import reverse
 
+from cosinnus.utils.bigbluebutton import notify_bbb_room_ready
 from cosinnus_event.conf import settings
 
 logger = logging.getLogger('cosinnus')
@@ -144,6 +145,8 @@ class BBBRoomMixin(models.Model):
                 source_obj.media_tag.save()
                 # sync all bb users
                 source_obj.sync_bbb_members()
+                # the queued users may only retrieve the room URL once they are members of the room
+                notify_bbb_room_ready(source_obj.media_tag.id)
 
             if threaded:
 
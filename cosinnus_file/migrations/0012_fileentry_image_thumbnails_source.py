@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('cosinnus_file', '0011_auto_20191217_1745'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fileentry',
+            name='image_thumbnails_source',
+            field=models.CharField(blank=True, default='', editable=False, max_length=250),
+        ),
+    ]
@@ -91,6 +91,8 @@ class FileEntry(
     _filesize = models.IntegerField(blank=True, null=True, default='0')
 
     mimetype = models.CharField(_('Path'), blank=True, null=True, default='', max_length=50)
+    # the image name for which all thumbnails have been generated, see `ThumbnailableImageMixin.generate_thumbnails`
+    image_thumbnails_source = models.CharField(max_length=250, blank=True, default='', editable=False)
 
     objects = FileEntryManager()
 
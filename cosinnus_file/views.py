@@ -5,7 +5,6 @@ import json
 import logging
 import mimetypes
 import os
-import tempfile
 from builtins import map
 from os.path import basename
 
@@ -27,7 +26,7 @@ from cosinnus.conf import settings
 from cosinnus.core.decorators.views import get_group_for_request
 from cosinnus.models.tagged import BaseTagObject
 from cosinnus.templatetags.cosinnus_tags import add_current_params
-from cosinnus.utils.files import append_string_to_filename, create_zip_file, create_zip_from_files
+from cosinnus.utils.files import append_string_to_filename, stream_zip_from_files
 from cosinnus.utils.functions import clean_single_line_text
 from cosinnus.utils.http import JSONResponse, is_ajax
 from cosinnus.utils.permissions import check_group_create_objects_access, check_object_read_access
@@ -208,7 +207,7 @@ class FileListView(RequireReadMixin, FilterGroupMixin, FormMixin, HierarchyTreeM
                 return HttpResponseRedirect(self.request.path)
 
             filenames = [(f.file.path, f.file.name) for f in files]
-            zf, missing = create_zip_file(filenames)
+            missing = [zip_path for file_path, zip_path in filenames if not os.path.exists(file_path)]
             download_fn = '_'.join([basename(f.file.name) for f in files])[:50]
             if missing:
                 messages.warning(
@@ -221,7 +220,7 @@ class FileListView(RequireReadMixin, FilterGroupMixin, FormMixin, HierarchyTreeM
                     % {'filename': ', '.join(map(basename, missing))},
                 )
                 return HttpResponseRedirect(self.request.path)
-            response = StreamingHttpResponse(open(zf.name, 'rb'), content_type='application/zip')
+            response = StreamingHttpResponse(stream_zip_from_files(filenames), content_type='application/zip')
             response['Content-Disposition'] = 'attachment; filename=' + download_fn + '.zip'
             return response
 
@@ -422,7 +421,6 @@ class FolderDownloadView(RequireReadMixin, RedirectIfSoftDisabledMixin, FilterGr
         files = []
 
         file_filter_ids = [int(fileid) for fileid in self.request.GET.getlist('files')]
-        temp_file_paths = []
         # for all files below this folder collect tuples of (filepath on disc, relative file path, )
         for sub_file in FileEntry.objects.filter(group=self.group, path__startswith=base_path, is_container=False):
             # filter for specific files
@@ -438,15 +436,11 @@ class FolderDownloadView(RequireReadMixin, RedirectIfSoftDisabledMixin, FilterGr
             if not check_object_read_access(sub_file, self.request.user):
                 continue
 
-            # for urls, write the url to a temp file
+            # for urls, add an url shortcut file
             if sub_file.is_url:
-                fd, temp_path = tempfile.mkstemp()
-                with os.fdopen(fd, 'w') as tmp:
-                    tmp.write('[InternetShortcut]\nURL=%s' % sub_file.url)
-                temp_file_paths.append(temp_path)
-                # attach temp file path
+                url_content = ('[InternetShortcut]\nURL=%s' % sub_file.url).encode('utf-8')
                 zip_path = sub_file.path.replace(folder.path, '', 1) + clean_filename(slugify(sub_file.title)) + '.url'
-                files.append([temp_path, zip_path])
+                files.append([url_content, zip_path])
                 continue
 
             # we have a real file, check if it exists and add its path
@@ -468,22 +462,11 @@ class FolderDownloadView(RequireReadMixin, RedirectIfSoftDisabledMixin, FilterGr
                 # more than one path like this found, append random string
                 sub_file[1] = append_string_to_filename(sub_file[1], get_random_string(7))
 
-        # Grab ZIP file from in-memory, make response with correct MIME-type and correct content-disposition
-        zip_content = create_zip_from_files(files).getvalue()
+        # stream the ZIP file while it is being generated, make response with correct MIME-type and content-disposition
         zip_filename = clean_filename(folder.title if folder.slug != '_root_' else self.group.name)
-        response = HttpResponse(zip_content)
-        response['Content-Type'] = 'application/x-zip-compressed'
+        response = StreamingHttpResponse(stream_zip_from_files(files), content_type='application/x-zip-compressed')
         response['Content-Disposition'] = 'attachment; filename=%s.zip' % zip_filename
         # fixme: root folder title!
-        response['Content-Length'] = len(zip_content)
-
-        # clean up temp files
-        try:
-            for temp_file_path in temp_file_paths:
-                os.remove(temp_file_path)
-        except Exception:
-            pass
-
         return response
 
 
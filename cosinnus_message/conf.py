@@ -44,6 +44,12 @@ class CosinnusMessageDefaultSettings(AppConf):
     # timeout to retry accessing rocketchat after a connection error occurred
     COSINNUS_CHAT_CONSIDER_DOWN_TIMEOUT = 60 * 5  # 5 minutes
 
+    # number of parallel worker threads making the API calls of the rocketchat user and group sync commands
+    COSINNUS_CHAT_SYNC_WORKERS = 4
+
+    # maximum number of API calls per second made by the rocketchat user and group sync commands (None to disable)
+    COSINNUS_CHAT_SYNC_RATE_LIMIT = 20
+
     # the keys for the CosinnusGroup.setting object to save the room's id in.
     # will be prefixed as such: "{cosinnus.models.profile.PROFILE_SETTING_ROCKET_CHAT_ID}_{room_key}"
     # Do not change this setting value for portals unless you know exactly what youre doing!
@@ -20,7 +20,8 @@ class Command(BaseCommand):
     @param --force-group-membership-sync: if given, will also re-do and sync all group
         memberships, for all users. (default: only sync memberships for users created
         during this run)
-
+    @param --check-all: if given, will check each user's account with an API call, instead of
+        only the users missing in the rocketchat user list
     """
 
     def add_arguments(self, parser):
@@ -28,6 +29,9 @@ class Command(BaseCommand):
         parser.add_argument(
             '-f', '--force-group-membership-sync', action='store_true', help="Sync ALL users' group memberships"
         )
+        parser.add_argument(
+            '--check-all', action='store_true', help='Check all user accounts, not only the ones missing in Rocket.Chat'
+        )
 
     def handle(self, *args, **options):
         if not settings.COSINNUS_CHAT_USER:
@@ -38,5 +42,7 @@ class Command(BaseCommand):
 
         rocket = RocketChatConnection(stdout=self.stdout, stderr=self.stderr)
         rocket.create_missing_users(
-            skip_inactive=skip_inactive, force_group_membership_sync=force_group_membership_sync
+            skip_inactive=skip_inactive,
+            force_group_membership_sync=force_group_membership_sync,
+            force=options['check_all'],
         )
@@ -11,12 +11,17 @@ logging.basicConfig(level=logging.INFO)
 
 class Command(BaseCommand):
     """
-    Sync groups with Rocket.Chat
+    Sync groups with Rocket.Chat. Groups that have not changed since their last sync are skipped.
     """
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force', action='store_true', help='Also sync groups that have not changed since their last sync'
+        )
+
     def handle(self, *args, **options):
         if not settings.COSINNUS_CHAT_USER:
             return
 
         rocket = RocketChatConnection(stdout=self.stdout, stderr=self.stderr)
-        rocket.groups_sync()
+        rocket.groups_sync(force=options['force'])
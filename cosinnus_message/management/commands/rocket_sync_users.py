@@ -11,11 +11,14 @@ logging.basicConfig(level=logging.INFO)
 
 class Command(BaseCommand):
     """
-    Sync users with Rocket.Chat
+    Sync users with Rocket.Chat. Users that have not changed since their last sync are skipped.
     """
 
     def add_arguments(self, parser):
         parser.add_argument('-s', '--skip-update', action='store_true', help='Skip updating existing users')
+        parser.add_argument(
+            '--force', action='store_true', help='Also sync users that have not changed since their last sync'
+        )
 
     def handle(self, *args, **options):
         skip_update = options['skip_update']
@@ -23,4 +26,4 @@ class Command(BaseCommand):
         if not settings.COSINNUS_CHAT_USER:
             return
         rocket = RocketChatConnection(stdout=self.stdout, stderr=self.stderr)
-        rocket.users_sync(skip_update=skip_update)
+        rocket.users_sync(skip_update=skip_update, force=options['force'])
@@ -8,7 +8,6 @@ import traceback
 import requests
 import six
 from annoying.functions import get_object_or_None
-from django.contrib.auth import get_user_model
 from django.core.cache import cache
 from django.utils.crypto import get_random_string
 from django.utils.translation import gettext_lazy as _
@@ -20,7 +19,6 @@ from rocketchat_API.rocketchat import RocketChat as RocketChatAPI
 from cosinnus.conf import settings
 from cosinnus.models import MEMBERSHIP_ADMIN, BaseTagObject
 from cosinnus.models.group import CosinnusGroupMembership, CosinnusPortal
-from cosinnus.models.group_extra import CosinnusConference, CosinnusProject, CosinnusSociety
 from cosinnus.models.membership import MEMBER_STATUS, MEMBERSHIP_INVITED_PENDING, MEMBERSHIP_PENDING
 from cosinnus.models.profile import (
     PROFILE_SETTING_ROCKET_CHAT_CONTACT_GROUP_ROOM,
@@ -29,7 +27,7 @@ from cosinnus.models.profile import (
     get_user_profile_model,
 )
 from cosinnus.templatetags.cosinnus_tags import full_name
-from cosinnus.utils.user import filter_active_users, filter_portal_users
+from cosinnus_message.rocket_chat_sync import RocketChatSync
 from cosinnus_message.utils.utils import save_rocketchat_mail_notification_preference_for_user_setting
 
 logger = logging.getLogger(__name__)
@@ -253,7 +251,7 @@ class RocketChatConnection:
         )
         self.stderr.write("'authorization:removeRoleFromPermission': ['add-user-to-joined-room','moderator'],")
 
-    def create_missing_users(self, skip_inactive=False, force_group_membership_sync=False):
+    def create_missing_users(self, skip_inactive=False, force_group_membership_sync=False, force=False):
         """
         Create missing user accounts in rocketchat (and verify that ones with an existing
         connection still exist in rocketchat properly).
@@ -264,19 +262,12 @@ class RocketChatConnection:
         @param force_group_membership_sync: if True, will also re-do and sync all group
             memberships, for all users. (default: only sync memberships for users created
             during this run)
+        @param force: if True, checks each user's account with an API call, instead of only
+            the users missing in the rocketchat user list
         """
-        users = filter_portal_users(get_user_model().objects.all())
-        users = users.exclude(
-            email__startswith='__unverified__'
-        )  # accounts with a real mail but unverified flag will be created
-        if skip_inactive:
-            users = filter_active_users(users)
-        count = len(users)
-        for i, user in enumerate(users):
-            result = self.ensure_user_account_sanity(user, force_group_membership_sync=force_group_membership_sync)
-            self.stdout.write(
-                'User %i/%i. Success: %s \t %s' % (i, count, str(result), user.email),
-            )
+        RocketChatSync(self, force=force).create_missing_users(
+            skip_inactive=skip_inactive, force_group_membership_sync=force_group_membership_sync
+        )
 
     def _get_rocket_users_list(self):
         """
@@ -300,97 +291,23 @@ class RocketChatConnection:
             offset += response['count']
         return rocket_users
 
-    def users_sync(self, skip_update=False):
+    def users_sync(self, skip_update=False, force=False):
         """
-        Sync active users that have already been created in rocketchat.
-        Will not create new users.
+        Sync active users that have changed since their last sync.
+        Creates users that do not exist in rocketchat yet.
         @param skip_update: if True, skips updating existing users
+        @param force: if True, also syncs users that have not changed since their last sync
         :return:
         """
-        # Get existing rocket users
-        rocket_users_list = self._get_rocket_users_list()
-        if rocket_users_list is None:
-            # An error occurred fetching the user list.
-            return
-        rocket_users = {}
-        rocket_emails_usernames = {}
-        for rocket_user in rocket_users_list:
-            if 'username' not in rocket_user:
-                continue
-            rocket_users[rocket_user['username']] = rocket_user
-            for email in rocket_user.get('emails', []):
-                if not email.get('address'):
-                    continue
-                rocket_emails_usernames[email['address']] = rocket_user['username']
-
-        # Check active users in DB
-        users = filter_active_users(filter_portal_users(get_user_model().objects.all()))
-
-        count = len(users)
-        for i, user in enumerate(users):
-            self.stdout.write('User %i/%i' % (i, count), ending='\r')
-            self.stdout.flush()
+        RocketChatSync(self, force=force).users_sync(skip_update=skip_update)
 
-            if not hasattr(user, 'cosinnus_profile'):
-                return
-            profile = user.cosinnus_profile
-            rocket_username = profile.rocket_username
-
-            rocket_user = rocket_users.get(rocket_username)
-
-            # User with different username but same email address exists?
-            if not rocket_user and profile.rocket_user_email in rocket_emails_usernames.keys():
-                # Change username in DB
-                rocket_username = rocket_emails_usernames.get(profile.rocket_user_email)
-                rocket_user = rocket_users.get(rocket_username)
-
-                profile.settings[PROFILE_SETTING_ROCKET_CHAT_USERNAME] = rocket_username
-                profile.save(update_fields=['settings'])
-
-            # Username exists?
-            if rocket_user:
-                if skip_update:
-                    continue
-
-                changed = False
-                # TODO: Introducing User.updated_at would improve performance here
-                rocket_emails = (e['address'] for e in rocket_user.get('emails'))
-                # Email address changed?
-                if profile.rocket_user_email not in rocket_emails:
-                    changed = True
-                # Name changed?
-                elif profile.get_external_full_name() != rocket_user.get('name'):
-                    changed = True
-                elif rocket_username != rocket_user.get('username'):
-                    changed = True
-                # Avatar changed?
-                else:
-                    rocket_avatar_url = self.rocket.users_get_avatar(username=rocket_username)
-                    profile_avatar_url = user.cosinnus_profile.avatar.url if user.cosinnus_profile.avatar else ''
-                    if profile_avatar_url != rocket_avatar_url:
-                        changed = True
-                if changed:
-                    self.users_update(user)
-
-            else:
-                self.users_create(user)
-
-    def groups_sync(self):
+    def groups_sync(self, force=False):
         """
-        Sync groups
+        Sync groups that have changed since their last sync
+        @param force: if True, also syncs groups that have not changed since their last sync
         :return:
         """
-        portal = CosinnusPortal.get_current()
-
-        # Sync WECHANGE groups
-        for group_model in (CosinnusConference, CosinnusSociety, CosinnusProject):
-            groups = group_model.objects.filter(is_active=True, portal=portal)
-
-            count = len(groups)
-            for i, group in enumerate(groups):
-                self.stdout.write('%s %i/%i' % (str(group_model), i, count), ending='\r')
-                self.stdout.flush()
-                self.groups_create(group)
+        RocketChatSync(self, force=force).groups_sync()
 
     def get_user_id(self, user):
         """
@@ -754,6 +671,7 @@ class RocketChatConnection:
                 return
         email_changed = rocket_email != profile.rocket_user_email
         active_changed = user_data.get('active') != user.is_active
+        success = True
         if force_user_update or username_changed or email_changed or active_changed:
             data = {
                 'username': rocket_username,
@@ -791,6 +709,7 @@ class RocketChatConnection:
                     profile.settings[PROFILE_SETTING_ROCKET_CHAT_USERNAME] = rocket_username
                     type(profile).objects.filter(pk=profile.pk).update(settings=profile.settings)
             else:
+                success = False
                 logger.warning(
                     f'Rocketchat: users_update (force={force_user_update}) base user: '
                     + str(response.get('errorType', '<No Error Type>')),
@@ -807,6 +726,7 @@ class RocketChatConnection:
                 avatar_url = f'{portal_domain}{avatar_url}'
             response = self.rocket.users_set_avatar(avatar_url, userId=user_id).json()
             if not response.get('success'):
+                success = False
                 logger.warning(
                     f'Rocketchat: users_update (force={force_user_update}) avatar: '
                     + str(response.get('errorType', '<No Error Type>')),
@@ -815,11 +735,13 @@ class RocketChatConnection:
         else:
             response = self.rocket.users_reset_avatar(user_id=user_id).json()
             if not response.get('success'):
+                success = False
                 logger.warning(
                     f'Rocketchat: users_update (force={force_user_update}) reset_avatar: '
                     + str(response.get('errorType', '<No Error Type>')),
                     extra={'response': response, 'user_id': user.id},
                 )
+        return success
 
     def users_logout(self, user):
         """Logs out a user from RocketChat by resubmitting the password."""
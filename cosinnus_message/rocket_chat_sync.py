@@ -0,0 +1,278 @@
+"""
+Change-detecting, concurrent sync of the portal's users and groups to Rocket.Chat, used by the
+`RocketChatConnection.users_sync`, `create_missing_users` and `groups_sync` management command functions.
+
+After a user or group has been synced successfully, a hash of its synced data (see `get_user_sync_hash` and
+`get_group_sync_hash`) is stored in its settings. Following syncs skip all users and groups whose hash has not
+changed, unless they are forced. The API calls for the remaining users and groups are made by a bounded pool of
+`COSINNUS_CHAT_SYNC_WORKERS` worker threads, which together make at most `COSINNUS_CHAT_SYNC_RATE_LIMIT` API calls
+per second, to not trigger the Rocket.Chat API rate limiter.
+"""
+
+import copy
+import hashlib
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth import get_user_model
+from django.db import connection as db_connection
+
+from cosinnus.conf import settings
+from cosinnus.models.group import CosinnusPortal
+from cosinnus.models.group_extra import CosinnusConference, CosinnusProject, CosinnusSociety
+from cosinnus.models.profile import (
+    PROFILE_SETTING_ROCKET_CHAT_ID,
+    PROFILE_SETTING_ROCKET_CHAT_SYNC_HASH,
+    PROFILE_SETTING_ROCKET_CHAT_USERNAME,
+)
+from cosinnus.utils.user import filter_active_users, filter_portal_users
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter(object):
+    """Spaces out the calls of any number of threads to at most `rate` calls per second.
+    @param rate: The number of calls per second, or None to disable the limit"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self._next_slot = 0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """Blocks until the next call is allowed"""
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class RateLimitedRocketChat(object):
+    """Wraps a `RocketChat` API connection, so that each call of an API method waits for the rate limiter"""
+
+    def __init__(self, rocket, rate_limiter):
+        self._rocket = rocket
+        self._rate_limiter = rate_limiter
+
+    def __getattr__(self, name):
+        attr = getattr(self._rocket, name)
+        if not callable(attr):
+            return attr
+
+        def rate_limited_call(*args, **kwargs):
+            self._rate_limiter.wait()
+            return attr(*args, **kwargs)
+
+        return rate_limited_call
+
+
+def _get_hash(values):
+    return hashlib.sha256(json.dumps(values, default=str).encode('utf-8')).hexdigest()
+
+
+def get_user_sync_hash(user):
+    """Returns a hash of all data of a user that is synced to Rocket.Chat"""
+    profile = user.cosinnus_profile
+    return _get_hash(
+        [
+            profile.settings.get(PROFILE_SETTING_ROCKET_CHAT_ID),
+            profile.rocket_username,
+            profile.rocket_user_email,
+            profile.get_external_full_name(),
+            profile.get_absolute_url(),
+            profile.avatar.name if profile.avatar else '',
+            user.is_active,
+        ]
+    )
+
+
+def get_group_room_ids(group):
+    return [
+        group.settings.get(f'{PROFILE_SETTING_ROCKET_CHAT_ID}_{room_key}')
+        for room_key in settings.COSINNUS_ROCKET_GROUP_ROOM_NAMES_MAP
+    ]
+
+
+def get_group_sync_hash(group):
+    """Returns a hash of all data of a group that is synced to Rocket.Chat, including the ids of its rooms"""
+    return _get_hash([group.slug, group.name, get_group_room_ids(group)])
+
+
+def save_sync_hash(obj, sync_hash):
+    """Stores the sync hash in the settings of a user profile or group"""
+    obj.settings[PROFILE_SETTING_ROCKET_CHAT_SYNC_HASH] = sync_hash
+    # Update settings without triggering signals to prevent cycles
+    type(obj).objects.filter(pk=obj.pk).update(settings=obj.settings)
+
+
+class RocketChatSync(object):
+    """Syncs the users and groups of the current portal using the API functions of a `RocketChatConnection`.
+    @param force: If True, also syncs users and groups that have not changed since their last sync
+    @param workers: The number of worker threads making the API calls. With 1, all calls are made in the
+        calling thread
+    @param rate_limit: The maximum number of API calls per second"""
+
+    def __init__(self, rocket_connection, force=False, workers=None, rate_limit=None):
+        self.force = force
+        self.workers = workers or settings.COSINNUS_CHAT_SYNC_WORKERS
+        if rate_limit is None:
+            rate_limit = settings.COSINNUS_CHAT_SYNC_RATE_LIMIT
+        # the connection's functions are used with a rate-limited API connection shared by all workers
+        self.connection = copy.copy(rocket_connection)
+        self.connection.rocket = RateLimitedRocketChat(rocket_connection.rocket, RateLimiter(rate_limit))
+
+    def write(self, message, ending=None):
+        if self.connection.stdout:
+            self.connection.stdout.write(message, ending=ending)
+            self.connection.stdout.flush()
+
+    def _run_item(self, function, item):
+        try:
+            return function(item)
+        except Exception as e:
+            logger.exception('RocketChat: sync of an item failed.', extra={'item': str(item), 'exception': e})
+            return None
+        finally:
+            if self.workers > 1:
+                # each worker thread uses its own database connection
+                db_connection.close()
+
+    def run(self, function, items, label):
+        """Calls the function for each item, in the worker pool.
+        @return: A list of the results of the calls, aligned with the items"""
+        count = len(items)
+        results = []
+        if self.workers > 1 and count > 1:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='rocketchat-sync') as executor:
+                for result in executor.map(lambda item: self._run_item(function, item), items):
+                    results.append(result)
+                    self.write('%s %i/%i' % (label, len(results), count), ending='\r')
+        else:
+            for item in items:
+                results.append(self._run_item(function, item))
+                self.write('%s %i/%i' % (label, len(results), count), ending='\r')
+        succeeded = len([result for result in results if result])
+        self.write('%s: synced %i/%i, failed or skipped %i.' % (label, succeeded, count, count - succeeded))
+        return results
+
+    def _user_needs_sync(self, user):
+        profile = user.cosinnus_profile
+        return self.force or profile.settings.get(PROFILE_SETTING_ROCKET_CHAT_SYNC_HASH) != get_user_sync_hash(user)
+
+    def users_sync(self, skip_update=False):
+        """Syncs active users that have changed since their last sync. Creates missing Rocket.Chat accounts
+        for them, and updates existing ones unless `skip_update` is set."""
+        users = filter_active_users(filter_portal_users(get_user_model().objects.all()))
+        users = [user for user in users.select_related('cosinnus_profile') if hasattr(user, 'cosinnus_profile')]
+        changed_users = [user for user in users if self._user_needs_sync(user)]
+        self.write('%i of %i users have changed since their last sync.' % (len(changed_users), len(users)))
+        if not changed_users:
+            return
+
+        # Get existing rocket users
+        rocket_users_list = self.connection._get_rocket_users_list()
+        if rocket_users_list is None:
+            # An error occurred fetching the user list.
+            return
+        rocket_users = {}
+        rocket_emails_usernames = {}
+        for rocket_user in rocket_users_list:
+            if 'username' not in rocket_user:
+                continue
+            rocket_users[rocket_user['username']] = rocket_user
+            for email in rocket_user.get('emails', []):
+                if not email.get('address'):
+                    continue
+                rocket_emails_usernames[email['address']] = rocket_user['username']
+
+        def sync_user(user):
+            profile = user.cosinnus_profile
+            rocket_user = rocket_users.get(profile.rocket_username)
+            # User with different username but same email address exists?
+            if not rocket_user and profile.rocket_user_email in rocket_emails_usernames:
+                # Change username in DB
+                rocket_username = rocket_emails_usernames.get(profile.rocket_user_email)
+                rocket_user = rocket_users.get(rocket_username)
+                profile.settings[PROFILE_SETTING_ROCKET_CHAT_USERNAME] = rocket_username
+                profile.save(update_fields=['settings'])
+
+            if not rocket_user:
+                synced = bool(self.connection.users_create(user))
+            elif skip_update:
+                return False
+            else:
+                # the hash has changed, or the user has never been synced before, so the synced data (like the
+                # name) differs even if the username, email and active state are the same
+                synced = self.connection.users_update(user, force_user_update=True)
+            if synced:
+                save_sync_hash(profile, get_user_sync_hash(user))
+            return synced
+
+        self.run(sync_user, changed_users, 'User')
+
+    def create_missing_users(self, skip_inactive=False, force_group_membership_sync=False):
+        """Creates missing Rocket.Chat accounts for all users. Users whose account id is contained in the
+        Rocket.Chat user list are skipped, unless the sync is forced or `force_group_membership_sync` is set.
+        See `RocketChatConnection.create_missing_users`."""
+        users = filter_portal_users(get_user_model().objects.all())
+        # accounts with a real mail but unverified flag will be created
+        users = users.exclude(email__startswith='__unverified__')
+        if skip_inactive:
+            users = filter_active_users(users)
+        users = list(users.select_related('cosinnus_profile'))
+
+        if not self.force and not force_group_membership_sync:
+            rocket_users_list = self.connection._get_rocket_users_list()
+            if rocket_users_list is None:
+                # An error occurred fetching the user list.
+                return
+            rocket_user_ids = set([rocket_user.get('_id') for rocket_user in rocket_users_list])
+            users = [
+                user
+                for user in users
+                if not hasattr(user, 'cosinnus_profile')
+                or user.cosinnus_profile.settings.get(PROFILE_SETTING_ROCKET_CHAT_ID) not in rocket_user_ids
+            ]
+        self.write('%i users need to be checked.' % len(users))
+
+        def ensure_user(user):
+            return self.connection.ensure_user_account_sanity(
+                user, force_group_membership_sync=force_group_membership_sync
+            )
+
+        results = self.run(ensure_user, users, 'User')
+        for user, result in zip(users, results):
+            if not result:
+                self.write('Failed: %s' % user.email)
+
+    def _group_needs_sync(self, group):
+        if self.force or not all(get_group_room_ids(group)):
+            return True
+        return group.settings.get(PROFILE_SETTING_ROCKET_CHAT_SYNC_HASH) != get_group_sync_hash(group)
+
+    def groups_sync(self):
+        """Creates the missing rooms of all active groups that have changed since their last sync"""
+        portal = CosinnusPortal.get_current()
+
+        def sync_group(group):
+            self.connection.groups_create(group)
+            if not all(get_group_room_ids(group)):
+                return False
+            save_sync_hash(group, get_group_sync_hash(group))
+            return True
+
+        for group_model in (CosinnusConference, CosinnusSociety, CosinnusProject):
+            groups = list(group_model.objects.filter(is_active=True, portal=portal))
+            changed_groups = [group for group in groups if self._group_needs_sync(group)]
+            self.write(
+                '%i of %i %s have changed since their last sync.'
+                % (len(changed_groups), len(groups), group_model._meta.verbose_name_plural)
+            )
+            self.run(sync_group, changed_groups, str(group_model._meta.verbose_name_plural))
@@ -18,6 +18,7 @@ from django.views.generic.edit import FormView
 from cosinnus.core.decorators.views import redirect_to_error_page
 from cosinnus.models.group import CosinnusGroup
 from cosinnus.utils.permissions import check_user_can_see_user
+from cosinnus.utils.unread_counts import push_unread_count_deltas
 from cosinnus.utils.urls import group_aware_reverse, safe_redirect
 from cosinnus.views.mixins.filters import DisallowBlockedUserViewMixin
 from cosinnus_message.rocket_chat import RocketChatConnection, RocketChatDownException, is_rocket_down
@@ -100,6 +101,10 @@ class UpdateMessageMixin(object):
         if pks or tpks:
             user = request.user
             filter = Q(pk__in=pks) | Q(thread__in=tpks)
+            # reading, archiving, deleting and undeleting messages change the unread message count
+            push_counts = settings.COSINNUS_UNREAD_COUNTS_WEBSOCKET_ENABLED and not settings.COSINNUS_ROCKET_ENABLED
+            if push_counts:
+                unread_count = Message.objects.inbox_unread_count(user, filter)
             if self.recipient_only_field_bit:
                 recipient_rows = Message.objects.as_recipient(user, filter).update(
                     **{self.recipient_only_field_bit: self.field_value}
@@ -113,6 +118,10 @@ class UpdateMessageMixin(object):
                 )
             if not (recipient_rows or sender_rows):
                 raise Http404  # abnormal enough, like forged ids
+            if push_counts:
+                push_unread_count_deltas(
+                    [user.id], messages=Message.objects.inbox_unread_count(user, filter) - unread_count
+                )
             messages.success(request, self.success_msg, fail_silently=True)
             next_url = request.GET.get('next', None)
             next_url = safe_redirect(next_url, request) if next_url else None
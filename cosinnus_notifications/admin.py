@@ -3,7 +3,12 @@ from __future__ import unicode_literals
 
 from django.contrib import admin
 
-from cosinnus_notifications.models import NotificationAlert, NotificationEvent, UserNotificationPreference
+from cosinnus_notifications.models import (
+    NotificationAlert,
+    NotificationDigestProgress,
+    NotificationEvent,
+    UserNotificationPreference,
+)
 
 
 class UserNotificationPreferenceAdmin(admin.ModelAdmin):
@@ -51,3 +56,22 @@ class NotificationAlertAdmin(admin.ModelAdmin):
 
 
 admin.site.register(NotificationAlert, NotificationAlertAdmin)
+
+
+class NotificationDigestProgressAdmin(admin.ModelAdmin):
+    list_display = (
+        'period_end',
+        'digest_setting',
+        'shard',
+        'shards',
+        'users_processed',
+        'users_emailed',
+        'started',
+        'finished',
+        'duration_seconds',
+    )
+    list_filter = ('digest_setting', 'portal')
+    readonly_fields = ('started', 'run_id', 'last_checkpoint')
+
+
+admin.site.register(NotificationDigestProgress, NotificationDigestProgressAdmin)
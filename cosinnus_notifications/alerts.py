@@ -10,6 +10,7 @@ from django.utils.translation import gettext_lazy as _
 
 from cosinnus.conf import settings
 from cosinnus.models.group import CosinnusPortal
+from cosinnus.utils.unread_counts import push_unread_count_deltas
 from cosinnus_notifications.models import NotificationAlert
 
 logger = logging.getLogger('cosinnus')
@@ -91,6 +92,7 @@ def create_user_alert(obj, group, receiver, action_user, notification_id, reason
     # Case C: if the event caused neither a multi user alert or bundle alert, save alert as a new alert
     alert.generate_label()
     alert.save()
+    push_unread_count_deltas([alert.user_id], alerts=1)
 
     # delete user-entry cache to be fresh instantly alerts on refresh
     cache_key = ALERTS_USER_DATA_CACHE_KEY % {'user_id': receiver.id}
@@ -122,6 +124,7 @@ def merge_new_alert_into_multi_alert(new_alert, multi_alert):
         multi_alert.counter = 1
 
     # re-fill the cached data (so the most recent user and object is always the target)
+    was_seen = multi_alert.seen
     multi_alert.last_event_at = now()
     multi_alert.seen = False
     multi_alert.action_user = new_alert.action_user
@@ -139,6 +142,8 @@ def merge_new_alert_into_multi_alert(new_alert, multi_alert):
         multi_alert.add_new_multi_action_user(new_alert.action_user)
 
     multi_alert.save()
+    if was_seen:
+        push_unread_count_deltas([multi_alert.user_id], alerts=1)
 
 
 def merge_new_alert_into_bundle_alert(new_alert, bundle_alert):
@@ -159,6 +164,7 @@ def merge_new_alert_into_bundle_alert(new_alert, bundle_alert):
     if new_alert.target_object == bundle_alert.target_object or any(
         [bundle_item['object_id'] == new_alert.object_id for bundle_item in bundle_alert.bundle_list]
     ):
+        was_seen = bundle_alert.seen
         bundle_alert.last_event_at = now()
         bundle_alert.seen = False
         bundle_alert.target_object = new_alert.target_object
@@ -166,6 +172,8 @@ def merge_new_alert_into_bundle_alert(new_alert, bundle_alert):
         bundle_alert.target_url = new_alert.target_url
         bundle_alert.icon_or_image_url = new_alert.icon_or_image_url
         bundle_alert.save()
+        if was_seen:
+            push_unread_count_deltas([bundle_alert.user_id], alerts=1)
         return
 
     # make the old alert a bundle alert, add the new alert to the bundle and reset it to be current
@@ -173,6 +181,7 @@ def merge_new_alert_into_bundle_alert(new_alert, bundle_alert):
         bundle_alert.type = NotificationAlert.TYPE_BUNDLE_ALERT
         bundle_alert.add_new_bundle_item(bundle_alert)
         bundle_alert.counter = 1
+    was_seen = bundle_alert.seen
     bundle_alert.last_event_at = now()
     bundle_alert.seen = False
     bundle_alert.counter += 1
@@ -180,3 +189,5 @@ def merge_new_alert_into_bundle_alert(new_alert, bundle_alert):
     bundle_alert.add_new_bundle_item(new_alert)
     bundle_alert.generate_label()
     bundle_alert.save()
+    if was_seen:
+        push_unread_count_deltas([bundle_alert.user_id], alerts=1)
@@ -4,14 +4,17 @@ from __future__ import print_function, unicode_literals
 import copy
 import datetime
 import logging
+import time
 import traceback
+from collections import defaultdict
 
 from django.contrib.auth import get_user_model
-from django.db.models import Q
+from django.db.models.functions import Mod
 from django.template.loader import render_to_string
 from django.templatetags.static import static
 from django.urls import reverse
 from django.utils import timezone, translation
+from django.utils.dateparse import parse_datetime
 from django.utils.encoding import force_str
 from django.utils.html import strip_tags
 from django.utils.safestring import mark_safe
@@ -25,8 +28,13 @@ from cosinnus.models.profile import GlobalUserNotificationSetting
 from cosinnus.utils.files import get_image_url_for_icon
 from cosinnus.utils.functions import resolve_attributes
 from cosinnus.utils.permissions import check_object_read_access, check_user_can_receive_emails
-from cosinnus.utils.user import is_user_active
-from cosinnus_notifications.models import NotificationEvent, UserMultiNotificationPreference, UserNotificationPreference
+from cosinnus.utils.user import filter_portal_users, is_user_active
+from cosinnus_notifications.models import (
+    NotificationDigestProgress,
+    NotificationEvent,
+    NotificationEventRecipient,
+    UserNotificationPreference,
+)
 from cosinnus_notifications.notifications import (
     ALL_NOTIFICATIONS_ID,
     NO_NOTIFICATIONS_ID,
@@ -37,6 +45,10 @@ from cosinnus_notifications.notifications import (
     is_notification_multipref,
     render_digest_item_for_notification_event,
 )
+from cosinnus_notifications.preferences import (
+    NotificationPreferenceSnapshot,
+    iterate_users_with_preference_snapshots,
+)
 
 logger = logging.getLogger('cosinnus')
 
@@ -47,30 +59,60 @@ DEFAULT_DIGEST_CATEGORY = [
 ]
 
 
-def send_digest_for_current_portal(digest_setting, debug_run_for_user=None, debug_force_show_all=False):
+def send_digest_for_current_portal(
+    digest_setting, debug_run_for_user=None, debug_force_show_all=False, shards=1, shard=0
+):
     """Sends out a daily/weekly digest email to all users *IN THE CURRENT PORTAL*
          who have any notification preferences set to that frequency.
     We will send all events that happened within this
 
     Will not use an own thread because it is assumend that this is run from a management command.
-    TODO: We may want to split up the user-loop into 4 independent threads covering 1/4th of the users each
-          to balance loads better.
+    To balance loads, the users can be split into `shards` parts by their id, each of which can be processed
+    by an independent process (e.g. `send_daily_digest --shards 4 --shard 0`). The progress of each shard is
+    checkpointed per user in `NotificationDigestProgress`, so an interrupted run will be resumed at the next
+    user when started again. A shard is only processed by one run at a time; the shard of a failed or hung run
+    is taken over once its run has not saved a checkpoint for `COSINNUS_NOTIFICATIONS_DIGEST_SHARD_CLAIM_TIMEOUT`
+    seconds. The digest period is only marked as sent once all shards have finished.
 
     @param digest_setting: UserNotificationPreference.SETTING_DAILY or UserNotificationPreference.SETTING_WEEKLY
     @param debug_run_for_user: if set to a User object, this will only generate a test digest for the given user
         and return it as html string. no portal modifications will be made
+    @param shards: the number of shards the portal's users are split into
+    @param shard: the shard (0 to `shards`-1) of users to process in this run
     """
     portal = CosinnusPortal.get_current()
     portal_group_ids = portal.groups.all().filter(is_active=True).values_list('id', flat=True)
 
-    # read the time for the last sent digest of this time
-    # (its saved as a string, but django QS will auto-box it when filtering on datetime fields)
-    TIME_DIGEST_START = portal.saved_infos.get(CosinnusPortal.SAVED_INFO_LAST_DIGEST_SENT % digest_setting, None)
-    if not TIME_DIGEST_START:
-        TIME_DIGEST_START = now() - datetime.timedelta(
-            days=UserNotificationPreference.SETTINGS_DAYS_DURATIONS[digest_setting]
-        )
-    TIME_DIGEST_END = now()
+    progress = None
+    if debug_run_for_user:
+        # read the time for the last sent digest of this time
+        TIME_DIGEST_START = _get_last_digest_sent_time(portal, digest_setting)
+        if not TIME_DIGEST_START:
+            TIME_DIGEST_START = now() - datetime.timedelta(
+                days=UserNotificationPreference.SETTINGS_DAYS_DURATIONS[digest_setting]
+            )
+        TIME_DIGEST_END = now()
+    else:
+        progress = _get_or_create_digest_progress(portal, digest_setting, shards, shard)
+        if progress.finished:
+            # this shard has already been completed for the current digest period
+            logger.info(
+                'Digest shard %d/%d of SETTING=%s in Portal "%s" has already finished for this period.'
+                % (shard, shards, UserNotificationPreference.SETTING_CHOICES[digest_setting][1], portal.slug)
+            )
+            if progress.is_run_complete:
+                _finish_digest_run(portal, progress)
+            return
+        if not progress.claim():
+            # another run is processing this shard and has saved a checkpoint within the claim timeout
+            logger.info(
+                'Digest shard %d/%d of SETTING=%s in Portal "%s" is being processed by another run.'
+                % (shard, shards, UserNotificationPreference.SETTING_CHOICES[digest_setting][1], portal.slug)
+            )
+            return
+        TIME_DIGEST_START = progress.period_start
+        TIME_DIGEST_END = progress.period_end
+    run_started = time.time()
 
     # the main Notification Events QS. anything not in here did not happen in the digest's time span
     timescope_notification_events = NotificationEvent.objects.filter(
@@ -78,11 +120,20 @@ def send_digest_for_current_portal(digest_setting, debug_run_for_user=None, debu
     )
     if debug_run_for_user:
         users = [debug_run_for_user]
+        user_ids = [debug_run_for_user.id]
     else:
-        users = get_user_model().objects.all().filter(id__in=portal.members)
+        users = filter_portal_users(get_user_model().objects.all(), portal=portal)
+        if shards > 1:
+            users = users.annotate(digest_shard=Mod('id', shards)).filter(digest_shard=shard)
+        # resume after the last user processed in an interrupted run of this shard
+        users = users.filter(id__gt=progress.last_user_id).order_by('id')
+        user_ids = users.values('id')
         extra_info = {
             'notification_event_count': timescope_notification_events.count(),
             'potential_user_count': users.count(),
+            'shard': shard,
+            'shards': shards,
+            'resumed_after_user_id': progress.last_user_id,
         }
         logger.info(
             'Now starting to sending out digests of SETTING=%s in Portal "%s". Data in extra.'
@@ -92,31 +143,45 @@ def send_digest_for_current_portal(digest_setting, debug_run_for_user=None, debu
         if settings.DEBUG:
             print(('>> ', extra_info))
 
-    emailed = 0
-    for user in users:
+    # group all event ids in the time span by their recipients in a single pass over the audience index
+    recipient_event_ids = get_notification_event_ids_by_recipient(timescope_notification_events, user_ids=user_ids)
+
+    emailed_user_ids = set()
+
+    def checkpointed(users):
+        """Yields each user with the bulk-loaded notification preferences of their chunk of users,
+        and saves the progress for each user after the loop body has fully processed them"""
+        if debug_run_for_user:
+            users_with_preferences = [
+                (user, NotificationPreferenceSnapshot(users, portal=portal, group_ids=portal_group_ids))
+                for user in users
+            ]
+        else:
+            users_with_preferences = iterate_users_with_preference_snapshots(
+                users, portal=portal, group_ids=portal_group_ids
+            )
+        for user, preferences in users_with_preferences:
+            yield user, preferences
+            if progress is not None and not progress.checkpoint(user, user.id in emailed_user_ids):
+                # the shard has been taken over by another run, which will resume it
+                return
+
+    for user, preferences in checkpointed(users):
         if debug_run_for_user and debug_force_show_all:
             global_wanted = True
-            multi_prefs = list(
-                UserMultiNotificationPreference.objects.filter(
-                    user=user, portal=CosinnusPortal.get_current(), setting=digest_setting
-                ).values_list('multi_notification_id', flat=True)
-            )
+            multi_prefs = preferences.get_multi_preference_ids(user, digest_setting)
         else:
             if getattr(settings, 'COSINNUS_DIGEST_ONLY_FOR_ADMINS', False) and not user.is_superuser:
                 continue
-            if not check_user_can_receive_emails(user):
+            # check global blanket settings
+            global_setting = preferences.get_global_setting(user)
+            if not check_user_can_receive_emails(user, global_notification_setting=global_setting):
                 continue
 
             # get all of user's multi prefs for this digest setting
             only_multi_prefs_wanted = False
-            multi_prefs = list(
-                UserMultiNotificationPreference.objects.filter(
-                    user=user, portal=CosinnusPortal.get_current(), setting=digest_setting
-                ).values_list('multi_notification_id', flat=True)
-            )
-            # check global blanket settings
+            multi_prefs = preferences.get_multi_preference_ids(user, digest_setting)
             global_wanted = False  # flag to allow all events
-            global_setting = GlobalUserNotificationSetting.objects.get_for_user(user)
 
             # check if global blanketing settings allow for sending this digest to the user
             if (
@@ -155,7 +220,7 @@ def send_digest_for_current_portal(digest_setting, debug_run_for_user=None, debu
             timezone.activate(user_time_zone)
 
             # get all notification events where the user is in the intended audience
-            events = timescope_notification_events.filter(audience__contains=',%d,' % user.id)
+            events = timescope_notification_events.filter(id__in=recipient_event_ids.get(user.id, []))
 
             # if we have a blanket YES for this digest, filter events only by portal affiliance,
             # otherwise filter events by group notification settings
@@ -174,28 +239,33 @@ def send_digest_for_current_portal(digest_setting, debug_run_for_user=None, debu
                     for key in list(dict(UserNotificationPreference.SETTING_CHOICES).keys())
                     if key != digest_setting
                 ]
-                exclude_digest_groups = UserNotificationPreference.objects.filter(
-                    user=user, group_id__in=portal_group_ids
+                # (the snapshot only contains preferences for groups in this portal)
+                user_prefs = preferences.get_preferences(user)
+                exclude_digest_groups = set(
+                    [
+                        pref.group_id
+                        for pref in user_prefs
+                        if (pref.notification_id == ALL_NOTIFICATIONS_ID and pref.setting in unwanted_digest_settings)
+                        or pref.notification_id == NO_NOTIFICATIONS_ID
+                    ]
                 )
-                exclude_digest_groups = exclude_digest_groups.filter(
-                    Q(notification_id=ALL_NOTIFICATIONS_ID, setting__in=unwanted_digest_settings)
-                    | Q(notification_id=NO_NOTIFICATIONS_ID)
-                )
-                exclude_digest_groups = exclude_digest_groups.values_list('group_id', flat=True)
 
                 # find out any notification preferences the user has for groups in this portal with the daily/weekly
                 # setting
                 # if he doesn't have any, we will not send a mail for them
-                prefs = UserNotificationPreference.objects.filter(
-                    user=user, group_id__in=portal_group_ids, setting=digest_setting
-                )
-                prefs = prefs.exclude(notification_id=NO_NOTIFICATIONS_ID).exclude(group_id__in=exclude_digest_groups)
+                prefs = [
+                    pref
+                    for pref in user_prefs
+                    if pref.setting == digest_setting
+                    and pref.notification_id != NO_NOTIFICATIONS_ID
+                    and pref.group_id not in exclude_digest_groups
+                ]
 
                 if len(prefs) == 0:
                     continue
 
                 # only for these groups does the user get any digest news at all
-                pref_group_ids = list(set([pref.group for pref in prefs]))
+                pref_group_ids = list(set([pref.group_id for pref in prefs]))
                 # so filter for these groups
                 events = events.filter(group_id__in=pref_group_ids)
 
@@ -358,7 +428,7 @@ def send_digest_for_current_portal(digest_setting, debug_run_for_user=None, debu
             # send actual email with full frame template
             if body_html:
                 _send_digest_email(user, mark_safe(body_html), TIME_DIGEST_END, digest_setting)
-                emailed += 1
+                emailed_user_ids.add(user.id)
 
         except Exception as e:
             # we never want this subroutine to just die, we need the final saves at the end to ensure
@@ -383,27 +453,123 @@ def send_digest_for_current_portal(digest_setting, debug_run_for_user=None, debu
     if debug_run_for_user:
         return ''
 
+    # mark this shard as finished and record its timing
+    if not progress.finish(time.time() - run_started):
+        logger.warning(
+            'Digest shard %d/%d of SETTING=%s in Portal "%s" has been taken over by another run after its claim '
+            'expired. Stopped this run.'
+            % (shard, shards, UserNotificationPreference.SETTING_CHOICES[digest_setting][1], portal.slug),
+            extra={'resumed_after_user_id': progress.last_user_id},
+        )
+        return
+
+    extra_log = {
+        'users_emailed': progress.users_emailed,
+        'total_users': progress.users_processed,
+        'shard': shard,
+        'shards': shards,
+        'duration_seconds': round(progress.duration_seconds, 2),
+        'users_per_second': round(progress.users_processed / max(progress.duration_seconds, 0.001), 2),
+    }
+    logger.info(
+        'Finished sending out digests of SETTING=%s in Portal "%s" for shard %d/%d. Data in extra.'
+        % (UserNotificationPreference.SETTING_CHOICES[digest_setting][1], portal.slug, shard, shards),
+        extra=extra_log,
+    )
+    if settings.DEBUG:
+        print(extra_log)
+
+    if progress.is_run_complete:
+        _finish_digest_run(portal, progress)
+
+
+def _get_last_digest_sent_time(portal, digest_setting):
+    """Returns the end of the last fully sent digest period for the given digest setting, or None"""
+    last_sent = portal.saved_infos.get(CosinnusPortal.SAVED_INFO_LAST_DIGEST_SENT % digest_setting, None)
+    if isinstance(last_sent, str):
+        # it is saved as a string in the JSON field
+        last_sent = parse_datetime(last_sent)
+    return last_sent
+
+
+def _get_or_create_digest_progress(portal, digest_setting, shards, shard):
+    """Returns the `NotificationDigestProgress` for the given shard of the current digest run.
+    An unfinished progress of the shard is resumed. Otherwise, if other shards have already started on
+    a digest period that hasn't been marked as sent, the same period is used for this shard, so that
+    all shards send out the same time span of events. Else, a new period is started.
+    """
+    progresses = NotificationDigestProgress.objects.filter(portal=portal, digest_setting=digest_setting, shards=shards)
+    unfinished = progresses.filter(shard=shard, finished__isnull=True).order_by('period_end').first()
+    if unfinished:
+        return unfinished
+
+    last_sent = _get_last_digest_sent_time(portal, digest_setting)
+    current_run = progresses.filter(period_end__gt=last_sent) if last_sent else progresses
+    sibling = current_run.order_by('period_end').first()
+    if sibling:
+        own = current_run.filter(shard=shard, period_end=sibling.period_end).first()
+        if own:
+            return own
+        period_start, period_end = sibling.period_start, sibling.period_end
+    else:
+        period_start = last_sent or now() - datetime.timedelta(
+            days=UserNotificationPreference.SETTINGS_DAYS_DURATIONS[digest_setting]
+        )
+        period_end = now()
+    return NotificationDigestProgress.objects.create(
+        portal=portal,
+        digest_setting=digest_setting,
+        period_start=period_start,
+        period_end=period_end,
+        shards=shards,
+        shard=shard,
+    )
+
+
+def _finish_digest_run(portal, progress):
+    """Called once all shards of a digest run have finished. Marks the digest period as sent."""
     # save the end time of the digest period as last digest time for this type
-    portal.saved_infos[CosinnusPortal.SAVED_INFO_LAST_DIGEST_SENT % digest_setting] = TIME_DIGEST_END
+    portal.saved_infos[CosinnusPortal.SAVED_INFO_LAST_DIGEST_SENT % progress.digest_setting] = progress.period_end
     portal.save()
 
     deleted = cleanup_stale_notifications()
 
+    run_progresses = NotificationDigestProgress.objects.filter(
+        portal=portal, digest_setting=progress.digest_setting, period_end=progress.period_end, shards=progress.shards
+    )
+    durations = [shard_progress.duration_seconds or 0.0 for shard_progress in run_progresses]
     extra_log = {
-        'users_emailed': emailed,
-        'total_users': len(users),
+        'users_emailed': sum([shard_progress.users_emailed for shard_progress in run_progresses]),
+        'total_users': sum([shard_progress.users_processed for shard_progress in run_progresses]),
+        'shards': progress.shards,
+        'max_shard_duration_seconds': round(max(durations), 2) if durations else 0,
         'deleted_stale_notifications': deleted,
         'remaining_past_and_future_notifications': NotificationEvent.objects.all().count(),
     }
     logger.info(
-        'Finished sending out digests of SETTING=%s in Portal "%s". Data in extra.'
-        % (UserNotificationPreference.SETTING_CHOICES[digest_setting][1], portal.slug),
+        'Finished sending out digests of SETTING=%s in Portal "%s" for all shards. Data in extra.'
+        % (UserNotificationPreference.SETTING_CHOICES[progress.digest_setting][1], portal.slug),
         extra=extra_log,
     )
     if settings.DEBUG:
         print(extra_log)
 
 
+def get_notification_event_ids_by_recipient(notification_events, user_ids=None):
+    """Groups the ids of the given notification events by the users in their audience,
+    using a single query on the `NotificationEventRecipient` index.
+    @param notification_events: A QS of `NotificationEvent`s
+    @param user_ids: If given, only recipients with these user ids are considered
+    @return: A dict of user id -> list of notification event ids"""
+    recipients = NotificationEventRecipient.objects.filter(event__in=notification_events)
+    if user_ids is not None:
+        recipients = recipients.filter(user_id__in=user_ids)
+    event_ids_by_recipient = defaultdict(list)
+    for user_id, event_id in recipients.values_list('user_id', 'event_id').iterator():
+        event_ids_by_recipient[user_id].append(event_id)
+    return event_ids_by_recipient
+
+
 def _get_digest_email_context(receiver, body_html, digest_generation_time, digest_setting):
     """Gets the context for rendering the template for the actual digest mail.
     Used for `_send_digest_email()`"""
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import close_old_connections, models, transaction
+from django.utils import translation
+
+from cosinnus.conf import settings
+from cosinnus.models.group import CosinnusPortal
+
+logger = logging.getLogger('cosinnus')
+
+DISPATCH_BACKEND_POOL = 'pool'
+DISPATCH_BACKEND_CELERY = 'celery'
+
+# instance attributes patched onto notification objects by the signalling code,
+# which would get lost when serializing the object for a celery task
+NOTIFICATION_PATCHED_OBJECT_ATTRIBUTES = (
+    'notification_target_group',
+    'render_additional_notification_content_rows',
+)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_notification_executor():
+    """Returns the process-wide, bounded thread pool used to process notification sessions"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=settings.COSINNUS_NOTIFICATIONS_DISPATCH_POOL_SIZE,
+                    thread_name_prefix='cosinnus-notifications',
+                )
+    return _executor
+
+
+def _run_notification_thread(notification_thread):
+    """Runs a `NotificationsThread`'s session synchronously within a pool worker"""
+    try:
+        notification_thread.run()
+    except Exception as e:
+        logger.exception('An error occured while processing a notification session.', extra={'exception': e})
+    finally:
+        # the pool's worker threads are long-lived, so make sure they do not keep stale DB connections
+        close_old_connections()
+
+
+def serialize_notification_request(request):
+    """Serializes the parts of a signal sender's request used by the notification mail templates.
+    See `cosinnus_notifications.tasks.deserialize_notification_request`.
+    @return: A dict, or None if there is no request"""
+    if request is None:
+        return None
+    return {
+        'user_id': request.user.id if request.user.is_authenticated else None,
+        'path': request.path,
+        'language': translation.get_language(),
+        'v3_api_content_active': getattr(request, 'v3_api_content_active', None) is True,
+    }
+
+
+def serialize_notification_thread(notification_thread):
+    """Serializes all session frames of a `NotificationsThread` into a JSON-compatible list of frames
+    that can be passed to a celery task, together with the request of each frame's sender.
+    @return: A list of frame dicts, or None if any of the frames cannot be serialized"""
+    from cosinnus_notifications.notifications import notifications
+
+    thread = notification_thread
+    frames = [(thread.sender, thread.user, thread.obj, thread.audience, thread.notification_id, thread.options)]
+    frames += [frame[:6] for frame in thread.next_session_args]
+    serialized = []
+    for sender, user, obj, audience, notification_id, options in frames:
+        if options is not notifications.get(notification_id):
+            return None  # options were modified with extra kwargs
+        if not user.is_authenticated or not isinstance(obj, models.Model) or not obj.pk:
+            return None
+        if any([attr in obj.__dict__ for attr in NOTIFICATION_PATCHED_OBJECT_ATTRIBUTES]):
+            return None
+        if any([not receiver.is_authenticated for receiver in audience]):
+            return None  # virtual users only exist in memory
+        serialized.append(
+            {
+                'user_id': user.id,
+                'content_type_id': ContentType.objects.get_for_model(obj.__class__).id,
+                'object_id': obj.pk,
+                'audience_ids': [receiver.id for receiver in audience],
+                'notification_id': notification_id,
+                'request': serialize_notification_request(getattr(sender, 'request', None)),
+            }
+        )
+    return serialized
+
+
+def dispatch_notification_thread(notification_thread):
+    """Processes a fully assembled `NotificationsThread` session using the configured dispatch backend,
+    instead of starting an own thread for each session."""
+    if settings.COSINNUS_NOTIFICATIONS_DISPATCH_BACKEND == DISPATCH_BACKEND_CELERY and settings.COSINNUS_USE_CELERY:
+        frames = serialize_notification_thread(notification_thread)
+        if frames is not None:
+            from cosinnus_notifications.tasks import run_notification_session_task
+
+            # the session is processed in the language and portal it has been started in
+            language = translation.get_language()
+            portal_id = CosinnusPortal.get_current().id
+            transaction.on_commit(
+                lambda: run_notification_session_task.delay(frames, language=language, portal_id=portal_id)
+            )
+            return
+    get_notification_executor().submit(_run_notification_thread, notification_thread)
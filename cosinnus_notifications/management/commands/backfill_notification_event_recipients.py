@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import logging
+
+from django.core.management.base import BaseCommand
+
+from cosinnus_notifications.models import NotificationEvent, NotificationEventRecipient
+
+logger = logging.getLogger('cosinnus')
+
+
+class Command(BaseCommand):
+    help = (
+        'Creates the per-recipient audience index (`NotificationEventRecipient`) for all existing '
+        'notification events. Already indexed recipients are skipped.'
+    )
+
+    def handle(self, *args, **options):
+        count = NotificationEventRecipient.backfill_for_events(NotificationEvent.objects.all())
+        self.stdout.write('Processed %d notification event recipient entries.' % count)
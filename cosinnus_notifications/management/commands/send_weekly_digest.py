@@ -4,7 +4,7 @@ from __future__ import unicode_literals
 import logging
 import traceback
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from django.utils.encoding import force_str
 
 from cosinnus.conf import settings
@@ -16,12 +16,22 @@ logger = logging.getLogger('cosinnus')
 
 
 class Command(BaseCommand):
-    help = 'Closes the specified poll for voting'
+    help = (
+        'Sends out the weekly digest for the current portal. Use `--shards` and `--shard` to split the users '
+        'into parts processed by independent processes. Interrupted runs are resumed when started again.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--shards', type=int, default=1, help='Number of shards to split the users into')
+        parser.add_argument('--shard', type=int, default=0, help='The shard (0 to shards-1) processed by this run')
 
     def handle(self, *args, **options):
+        shards, shard = options['shards'], options['shard']
+        if shards < 1 or not 0 <= shard < shards:
+            raise CommandError('--shard must be between 0 and --shards - 1!')
         try:
             initialize_cosinnus_after_startup()
-            send_digest_for_current_portal(UserNotificationPreference.SETTING_WEEKLY)
+            send_digest_for_current_portal(UserNotificationPreference.SETTING_WEEKLY, shards=shards, shard=shard)
         except Exception as e:
             logger.error(
                 'An critical error occured during weekly digest generation and bubbled up completely! Exception was: %s'
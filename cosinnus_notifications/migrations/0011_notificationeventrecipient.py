@@ -0,0 +1,47 @@
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_notification_event_recipients(apps, schema_editor):
+    """Creates the recipient index for all existing notification events from their `audience` field"""
+    NotificationEvent = apps.get_model('cosinnus_notifications', 'NotificationEvent')
+    NotificationEventRecipient = apps.get_model('cosinnus_notifications', 'NotificationEventRecipient')
+    User = apps.get_model(*settings.AUTH_USER_MODEL.split('.'))
+    existing_user_ids = set(User.objects.values_list('id', flat=True))
+
+    recipients = []
+    for event_id, audience in NotificationEvent.objects.values_list('id', 'audience').iterator():
+        user_ids = set(int(uid) for uid in audience.split(',') if uid.isdigit())
+        recipients.extend(
+            NotificationEventRecipient(event_id=event_id, user_id=user_id)
+            for user_id in user_ids
+            if user_id in existing_user_ids
+        )
+        if len(recipients) >= 5000:
+            NotificationEventRecipient.objects.bulk_create(recipients, ignore_conflicts=True)
+            recipients = []
+    NotificationEventRecipient.objects.bulk_create(recipients, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('cosinnus_notifications', '0010_auto_20220117_1735'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationEventRecipient',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='recipients', to='cosinnus_notifications.notificationevent')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('user', 'event')},
+            },
+        ),
+        migrations.RunPython(backfill_notification_event_recipients, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,35 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cosinnus_notifications', '0011_notificationeventrecipient'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationDigestProgress',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest_setting', models.PositiveSmallIntegerField(choices=[(0, 'Never'), (1, 'Immediately'), (2, 'Daily'), (3, 'Weekly')])),
+                ('period_start', models.DateTimeField()),
+                ('period_end', models.DateTimeField()),
+                ('shards', models.PositiveSmallIntegerField(default=1)),
+                ('shard', models.PositiveSmallIntegerField(default=0)),
+                ('last_user_id', models.PositiveIntegerField(default=0, help_text='The id of the last user that has been fully processed in this shard')),
+                ('users_processed', models.PositiveIntegerField(default=0)),
+                ('users_emailed', models.PositiveIntegerField(default=0)),
+                ('started', models.DateTimeField(auto_now_add=True)),
+                ('last_checkpoint', models.DateTimeField(blank=True, null=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('duration_seconds', models.FloatField(blank=True, help_text='Processing time of the (possibly resumed) run that completed this shard', null=True)),
+                ('portal', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notification_digest_progresses', to='cosinnus.cosinnusportal')),
+            ],
+            options={
+                'ordering': ('-started',),
+                'unique_together': {('portal', 'digest_setting', 'period_end', 'shards', 'shard')},
+            },
+        ),
+    ]
@@ -0,0 +1,16 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cosinnus_notifications', '0012_notificationdigestprogress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notificationdigestprogress',
+            name='run_id',
+            field=models.CharField(blank=True, default='', help_text='The id of the run that currently processes this shard', max_length=32),
+        ),
+    ]
@@ -2,7 +2,9 @@
 from __future__ import unicode_literals
 
 import logging
+import uuid
 from builtins import object, str
+from datetime import timedelta
 
 import six
 from annoying.functions import get_object_or_None
@@ -10,6 +12,7 @@ from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.db.models import Q
 from django.template.defaultfilters import date
 from django.templatetags.static import static
 from django.utils.html import escape
@@ -197,6 +200,155 @@ class NotificationEvent(models.Model):
         )
 
 
+class NotificationEventRecipient(models.Model):
+    """A normalized, indexed entry of the audience of a `NotificationEvent`, one row per receiving user.
+    Used for digest generation to look up all events for a user without scanning the `audience`
+    pseudo-list field of every event."""
+
+    event = models.ForeignKey(NotificationEvent, related_name='recipients', on_delete=models.CASCADE)
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+
+    class Meta(object):
+        app_label = 'cosinnus_notifications'
+        unique_together = (('user', 'event'),)
+
+    @classmethod
+    def create_for_event(cls, event, user_ids):
+        """Creates the recipient entries for the given event and user ids in a single bulk query"""
+        recipients = [cls(event=event, user_id=user_id) for user_id in set(user_ids) if user_id]
+        cls.objects.bulk_create(recipients, ignore_conflicts=True)
+        return len(recipients)
+
+    @classmethod
+    def backfill_for_events(cls, events, batch_size=5000):
+        """Creates the recipient entries for existing notification events from their `audience` field.
+        Entries that already exist are skipped.
+        @param events: A QS of `NotificationEvent`s
+        @return: The number of recipient entries processed"""
+        from django.contrib.auth import get_user_model
+
+        existing_user_ids = set(get_user_model().objects.values_list('id', flat=True))
+        count = 0
+        recipients = []
+        for event_id, audience in events.values_list('id', 'audience').iterator():
+            user_ids = set(int(uid) for uid in audience.split(',') if uid.isdigit())
+            recipients.extend(
+                [cls(event_id=event_id, user_id=user_id) for user_id in user_ids if user_id in existing_user_ids]
+            )
+            if len(recipients) >= batch_size:
+                cls.objects.bulk_create(recipients, ignore_conflicts=True)
+                count += len(recipients)
+                recipients = []
+        cls.objects.bulk_create(recipients, ignore_conflicts=True)
+        return count + len(recipients)
+
+
+@six.python_2_unicode_compatible
+class NotificationDigestProgress(models.Model):
+    """Progress and timing of a single shard of a daily/weekly digest run.
+    Users of a shard are processed in order of their ids, so `last_user_id` serves as
+    checkpoint from which an interrupted run is resumed.
+    All shards of the same run share the same digest period (`period_start` to `period_end`).
+    A shard is processed by one run at a time, which claims it with its `run_id`. Each checkpoint renews
+    the claim, so that the shard of a failed or hung run can be taken over by a new run once the claim
+    has not been renewed for `COSINNUS_NOTIFICATIONS_DIGEST_SHARD_CLAIM_TIMEOUT` seconds."""
+
+    portal = models.ForeignKey(
+        'cosinnus.CosinnusPortal', related_name='notification_digest_progresses', on_delete=models.CASCADE
+    )
+    digest_setting = models.PositiveSmallIntegerField(choices=BaseUserNotificationPreference.SETTING_CHOICES)
+    period_start = models.DateTimeField()
+    period_end = models.DateTimeField()
+    shards = models.PositiveSmallIntegerField(default=1)
+    shard = models.PositiveSmallIntegerField(default=0)
+
+    last_user_id = models.PositiveIntegerField(
+        default=0, help_text='The id of the last user that has been fully processed in this shard'
+    )
+    users_processed = models.PositiveIntegerField(default=0)
+    users_emailed = models.PositiveIntegerField(default=0)
+
+    run_id = models.CharField(
+        max_length=32, blank=True, default='', help_text='The id of the run that currently processes this shard'
+    )
+    started = models.DateTimeField(auto_now_add=True)
+    last_checkpoint = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    duration_seconds = models.FloatField(
+        null=True, blank=True, help_text='Processing time of the (possibly resumed) run that completed this shard'
+    )
+
+    class Meta(object):
+        app_label = 'cosinnus_notifications'
+        ordering = ('-started',)
+        unique_together = (('portal', 'digest_setting', 'period_end', 'shards', 'shard'),)
+
+    def __str__(self):
+        return '<NotificationDigestProgress: setting %(setting)d, shard %(shard)d/%(shards)d, period_end: %(end)s>' % {
+            'setting': self.digest_setting,
+            'shard': self.shard,
+            'shards': self.shards,
+            'end': str(self.period_end),
+        }
+
+    def _claimed(self):
+        """Returns a QS of this shard, if it is still claimed by this instance's run"""
+        return NotificationDigestProgress.objects.filter(pk=self.pk, run_id=self.run_id, finished__isnull=True)
+
+    def claim(self):
+        """Claims this unfinished shard for a new run, unless another run has renewed its claim on it within
+        the claim timeout.
+        @return: True if the shard has been claimed"""
+        claim_expired = now() - timedelta(seconds=settings.COSINNUS_NOTIFICATIONS_DIGEST_SHARD_CLAIM_TIMEOUT)
+        run_id = uuid.uuid4().hex
+        claimed_time = now()
+        claimed = (
+            NotificationDigestProgress.objects.filter(pk=self.pk, finished__isnull=True)
+            .filter(Q(run_id='') | Q(last_checkpoint__lt=claim_expired))
+            .update(run_id=run_id, last_checkpoint=claimed_time)
+        )
+        if not claimed:
+            return False
+        self.refresh_from_db()
+        return True
+
+    def checkpoint(self, user, emailed):
+        """Saves the given user as fully processed and renews the claim of the run on this shard.
+        @return: False if the shard has been taken over by another run, and the user has not been saved"""
+        self.last_user_id = user.id
+        self.users_processed += 1
+        if emailed:
+            self.users_emailed += 1
+        self.last_checkpoint = now()
+        return bool(
+            self._claimed().update(
+                last_user_id=self.last_user_id,
+                users_processed=self.users_processed,
+                users_emailed=self.users_emailed,
+                last_checkpoint=self.last_checkpoint,
+            )
+        )
+
+    def finish(self, duration_seconds):
+        """Marks this shard as finished by the run that claimed it.
+        @return: False if the shard has been taken over by another run"""
+        self.finished = now()
+        self.duration_seconds = duration_seconds
+        return bool(self._claimed().update(finished=self.finished, duration_seconds=self.duration_seconds))
+
+    @property
+    def is_run_complete(self):
+        """True if all shards of this digest run have finished"""
+        finished_shards = NotificationDigestProgress.objects.filter(
+            portal=self.portal,
+            digest_setting=self.digest_setting,
+            period_end=self.period_end,
+            shards=self.shards,
+            finished__isnull=False,
+        ).count()
+        return finished_shards >= self.shards
+
+
 @six.python_2_unicode_compatible
 class NotificationAlert(models.Model):
     """An instant notification alert for something relevant that happened for a user, shown in the navbar dropdown.
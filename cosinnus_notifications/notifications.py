@@ -47,12 +47,15 @@ from cosinnus.utils.permissions import (
     check_user_portal_moderator,
 )
 from cosinnus_notifications.alerts import create_user_alert
+from cosinnus_notifications.dispatch import dispatch_notification_thread
 from cosinnus_notifications.models import (
     NotificationAlert,
     NotificationEvent,
+    NotificationEventRecipient,
     UserMultiNotificationPreference,
     UserNotificationPreference,
 )
+from cosinnus_notifications.preferences import NotificationPreferenceSnapshot
 
 logger = logging.getLogger('cosinnus')
 
@@ -428,6 +431,8 @@ class NotificationsThread(Thread):
     very similar event notifications and only send out 1 mail for each actual event.
     Example: If I follow my own News Post and somebody comments on it, I will only receive the
         'somebody commented on your post', and not also the 'a comment on a post you follow' notification.
+    Note: Sessions are not started as own threads, but run by `dispatch_notification_thread()` in a bounded
+        worker pool or a celery task, depending on `COSINNUS_NOTIFICATIONS_DISPATCH_BACKEND`.
     """
 
     NOTIFICATION_CONTENT_GROUP_TYPES = [
@@ -437,10 +442,10 @@ class NotificationsThread(Thread):
 
     # a complete set of arguments for a next run of this thread. not cleared during sessions
     next_session_args = []
-    # list of user ids that already have been emailed for this session. not cleared during sessions
-    already_emailed_user_emails = []
-    # list of user ids that have already gotten alerts for this session. not cleared during sessions
-    already_alerted_user_ids = []
+    # set of user emails that already have been emailed for this session. not cleared during sessions
+    already_emailed_user_emails = set()
+    # set of user ids that have already gotten alerts for this session. not cleared during sessions
+    already_alerted_user_ids = set()
 
     def _debug_threading(self, state):
         """Log thread state in sentry."""
@@ -456,8 +461,8 @@ class NotificationsThread(Thread):
         if first_init:
             super(NotificationsThread, self).__init__()
             self.next_session_args = []
-            self.already_emailed_user_emails = []
-            self.already_alerted_user_ids = []
+            self.already_emailed_user_emails = set()
+            self.already_alerted_user_ids = set()
         self.sender = sender
         self.user = user
         self.obj = obj
@@ -469,6 +474,8 @@ class NotificationsThread(Thread):
         self.notification_preference_triggered = None
         # will be set at runtime
         self.group = None
+        # bulk-loaded notification settings of the audience, will be set at runtime
+        self.preferences = None
 
     def add_session_frame(self, sender, user, obj, audience, notification_id, options):
         """Add a set of init variables to the queue of params,
@@ -487,7 +494,14 @@ class NotificationsThread(Thread):
     def is_notification_active(self, notification_id, user, group, alternate_settings_compare=[]):
         """Checks against the DB if a user notifcation preference exists, and if so, if it is set to active"""
         try:
-            preference = UserNotificationPreference.objects.get(user=user, group=group, notification_id=notification_id)
+            if self.preferences is not None:
+                preference = self.preferences.get_preference(user, group.id, notification_id)
+                if preference is None:
+                    raise UserNotificationPreference.DoesNotExist()
+            else:
+                preference = UserNotificationPreference.objects.get(
+                    user=user, group=group, notification_id=notification_id
+                )
             self.notification_preference_triggered = preference
             if len(alternate_settings_compare) == 0:
                 return preference.setting == UserNotificationPreference.SETTING_NOW
@@ -521,7 +535,13 @@ class NotificationsThread(Thread):
         #   as well as
         # check if user receives an instant email notification of being invited to a group even if his/her notification
         # settings say otherwise (never)
-        if not check_user_can_receive_emails(user) and not notification_invite_special:
+        global_setting = None
+        if user.is_authenticated:
+            global_setting = self._get_global_setting(user)
+        if (
+            not check_user_can_receive_emails(user, global_notification_setting=global_setting)
+            and not notification_invite_special
+        ):
             return False
         # anonymous authors count as YES, used for recruiting users
         if not user.is_authenticated:
@@ -568,10 +588,11 @@ class NotificationsThread(Thread):
         # check the specific multi-preference if this notification belongs to it
         multi_preference_set = notifications[notification_id].get('multi_preference_set', None)
         if multi_preference_set:
-            if (
-                UserMultiNotificationPreference.get_setting_for_user(user, multi_preference_set)
-                == UserMultiNotificationPreference.SETTING_NOW
-            ):
+            if self.preferences is not None:
+                multi_setting = self.preferences.get_multi_setting(user, multi_preference_set)
+            else:
+                multi_setting = UserMultiNotificationPreference.get_setting_for_user(user, multi_preference_set)
+            if multi_setting == UserMultiNotificationPreference.SETTING_NOW:
                 return True
             else:
                 # we actually return False here, because this setting is on a different category than the other
@@ -579,7 +600,6 @@ class NotificationsThread(Thread):
                 return False
 
         # global settings check, blanketing the finer grained checks
-        global_setting = GlobalUserNotificationSetting.objects.get_for_user(user)
         if global_setting in [
             GlobalUserNotificationSetting.SETTING_NEVER,
             GlobalUserNotificationSetting.SETTING_DAILY,
@@ -626,6 +646,12 @@ class NotificationsThread(Thread):
             # the individual setting for this notification type and group is in effect:
             return self.is_notification_active(notification_id, user, self.group)
 
+    def _get_global_setting(self, user):
+        """Returns the user's global notification setting, from the bulk-loaded preferences if available"""
+        if self.preferences is not None:
+            return self.preferences.get_global_setting(user)
+        return GlobalUserNotificationSetting.objects.get_for_user(user)
+
     def check_user_wants_alert(self, user, notification_id, obj):
         """Do multiple pre-checks and a DB check to find out if the user would like to receive an alert for this
         notification event.
@@ -858,34 +884,41 @@ class NotificationsThread(Thread):
         )  # this helps reduce lookups by local caching the generic foreign key object
 
         options = notifications[self.notification_id]
-        for receiver in self.audience:
-            # check for alerts if this notification type can be an alert,
-            # that the user is not a temporary email one, and that we do not alert a user for this session twice
-            if (
-                getattr(settings, 'COSINNUS_NOTIFICATION_ALERTS_ENABLED', False)
-                and options['can_be_alert']
-                and receiver.id
-                and receiver.id not in self.already_alerted_user_ids
-            ):
-                try:
-                    alert_reason = self.check_user_wants_alert(receiver, self.notification_id, self.obj)
-                    if alert_reason:
-                        # create a new NotificationAlert
-                        self.create_new_user_alert(notification_event, receiver, reason_key=alert_reason)
-                        self.already_alerted_user_ids.append(receiver.id)
-                except Exception as e:
-                    logger.exception(
-                        'An unknown error occured during NotificationAlert check/creation! Exception in extra.',
-                        extra={'exception': force_str(e)},
-                    )
-                    if settings.DEBUG:
-                        raise
-
-            # check for notifications and that we do not email a user for this session twice
-            if options['can_be_email'] and receiver.email not in self.already_emailed_user_emails:
-                if self.check_user_wants_notification(receiver, self.notification_id, self.obj):
-                    self.send_instant_notification(notification_event, receiver)
-                    self.already_emailed_user_emails.append(receiver.email)
+        # process the audience in chunks, evaluating the notification settings of each chunk in bulk
+        chunk_size = settings.COSINNUS_NOTIFICATIONS_AUDIENCE_CHUNK_SIZE
+        for chunk_start in range(0, len(self.audience), chunk_size):
+            audience_chunk = self.audience[chunk_start : chunk_start + chunk_size]
+            if options['can_be_email']:
+                # load the notification settings and profiles of the audience chunk with a few bulk queries
+                self.preferences = NotificationPreferenceSnapshot(audience_chunk, group_ids=[self.group.id])
+            for receiver in audience_chunk:
+                # check for alerts if this notification type can be an alert,
+                # that the user is not a temporary email one, and that we do not alert a user for this session twice
+                if (
+                    getattr(settings, 'COSINNUS_NOTIFICATION_ALERTS_ENABLED', False)
+                    and options['can_be_alert']
+                    and receiver.id
+                    and receiver.id not in self.already_alerted_user_ids
+                ):
+                    try:
+                        alert_reason = self.check_user_wants_alert(receiver, self.notification_id, self.obj)
+                        if alert_reason:
+                            # create a new NotificationAlert
+                            self.create_new_user_alert(notification_event, receiver, reason_key=alert_reason)
+                            self.already_alerted_user_ids.add(receiver.id)
+                    except Exception as e:
+                        logger.exception(
+                            'An unknown error occured during NotificationAlert check/creation! Exception in extra.',
+                            extra={'exception': force_str(e)},
+                        )
+                        if settings.DEBUG:
+                            raise
+
+                # check for notifications and that we do not email a user for this session twice
+                if options['can_be_email'] and receiver.email not in self.already_emailed_user_emails:
+                    if self.check_user_wants_notification(receiver, self.notification_id, self.obj):
+                        self.send_instant_notification(notification_event, receiver)
+                        self.already_emailed_user_emails.add(receiver.email)
 
         # for moderatable notifications, also always mix in portal admins into audience, because they might be portal
         # moderators
@@ -902,7 +935,7 @@ class NotificationsThread(Thread):
             # create a new NotificationEvent that saves this event for digest re-generation
             # no need to worry about de-duplicating events here, the digest generation handles it
             content_type = ContentType.objects.get_for_model(self.obj.__class__)
-            NotificationEvent.objects.create(
+            event = NotificationEvent.objects.create(
                 content_type=content_type,
                 object_id=self.obj.id,
                 group=self.group,
@@ -910,6 +943,8 @@ class NotificationsThread(Thread):
                 notification_id=self.notification_id,
                 audience=',%s,' % ','.join([str(receiver.id) for receiver in self.audience]),
             )
+            # index the audience so the digest can look up events per user
+            NotificationEventRecipient.create_for_event(event, [receiver.id for receiver in self.audience])
 
         if len(self.next_session_args) > 0:
             # we have more session frames, start the next one
@@ -921,7 +956,9 @@ class NotificationsThread(Thread):
 
             # if any users were notified during this session, trigger a signal with their ids
             if self.already_alerted_user_ids:
-                signals.users_received_notification_alert.send(sender=self.user, user_ids=self.already_alerted_user_ids)
+                signals.users_received_notification_alert.send(
+                    sender=self.user, user_ids=list(self.already_alerted_user_ids)
+                )
         return
 
 
@@ -1257,7 +1294,7 @@ def notification_receiver(sender, user, obj, audience, session_id=None, end_sess
     if not session_id:
         # we start this notification thread instantly and alone
         notification_thread = NotificationsThread(sender, user, obj, audience, notification_id, options)
-        notification_thread.start()
+        dispatch_notification_thread(notification_thread)
     elif session_id and session_id not in notification_sessions:
         # we are starting a new session and waiting for more events to be pooled into the thread
         notification_thread = NotificationsThread(sender, user, obj, audience, notification_id, options)
@@ -1270,7 +1307,7 @@ def notification_receiver(sender, user, obj, audience, session_id=None, end_sess
     if session_id and end_session and session_id in notification_sessions:
         # we also end the session here, so we start the thread
         notification_thread = notification_sessions.pop(session_id)
-        notification_thread.start()
+        dispatch_notification_thread(notification_thread)
 
 
 def _unescape(text):
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from collections import defaultdict
+
+from django.contrib.auth import get_user_model
+from django.db.models import prefetch_related_objects
+
+from cosinnus.conf import settings
+from cosinnus.models.group import CosinnusPortal
+from cosinnus.models.profile import GlobalUserNotificationSetting
+from cosinnus_notifications.models import UserMultiNotificationPreference, UserNotificationPreference
+
+# number of users for which the preferences are loaded at once when iterating over many users
+PREFERENCE_SNAPSHOT_CHUNK_SIZE = 500
+
+
+class NotificationPreferenceSnapshot(object):
+    """An in-memory snapshot of the notification settings of a set of users, loaded with a handful of
+    bulk queries instead of several queries per user. Holds the global notification settings,
+    multi-notification preferences and group notification preferences for the given users in the given portal.
+    Also makes sure the users' `cosinnus_profile`s are loaded.
+
+    Users that are not part of the snapshot can still be looked up, falling back to the regular single queries.
+    """
+
+    def __init__(self, users, portal=None, group_ids=None):
+        """
+        @param users: A list or QS of user objects
+        @param portal: The portal to load the settings for. Default: the current portal
+        @param group_ids: If given, group notification preferences will only be loaded for these group ids
+            (can be a list or a values QS). Default: all groups
+        """
+        self.portal = portal or CosinnusPortal.get_current()
+        users = [user for user in users if user.pk]
+        profile_descriptor = getattr(get_user_model(), 'cosinnus_profile')
+        unloaded_profile_users = [user for user in users if not profile_descriptor.is_cached(user)]
+        if unloaded_profile_users:
+            prefetch_related_objects(unloaded_profile_users, 'cosinnus_profile')
+        self.user_ids = set([user.pk for user in users])
+
+        # user_id --> global setting
+        self.global_settings = dict(
+            GlobalUserNotificationSetting.objects.filter(user_id__in=self.user_ids, portal=self.portal).values_list(
+                'user_id', 'setting'
+            )
+        )
+        # user_id --> {multi_notification_id: setting}
+        self.multi_preferences = defaultdict(dict)
+        multi_prefs = UserMultiNotificationPreference.objects.filter(user_id__in=self.user_ids, portal=self.portal)
+        for user_id, multi_notification_id, setting in multi_prefs.values_list(
+            'user_id', 'multi_notification_id', 'setting'
+        ):
+            self.multi_preferences[user_id][multi_notification_id] = setting
+        # user_id --> {(group_id, notification_id): preference}
+        self.group_preferences = defaultdict(dict)
+        prefs = UserNotificationPreference.objects.filter(user_id__in=self.user_ids)
+        if group_ids is not None:
+            prefs = prefs.filter(group_id__in=group_ids)
+        for pref in prefs.only('id', 'user_id', 'group_id', 'notification_id', 'setting'):
+            self.group_preferences[pref.user_id][(pref.group_id, pref.notification_id)] = pref
+
+    def has_user(self, user):
+        return user.pk in self.user_ids
+
+    def get_global_setting(self, user):
+        """Returns the user's `GlobalUserNotificationSetting` setting value"""
+        if not self.has_user(user):
+            return GlobalUserNotificationSetting.objects.get_for_user(user)
+        return self.global_settings.get(user.pk, settings.COSINNUS_DEFAULT_GLOBAL_NOTIFICATION_SETTING)
+
+    def get_multi_setting(self, user, multi_notification_id):
+        """Returns the user's setting for a multi-preference, or its default value"""
+        if not self.has_user(user):
+            return UserMultiNotificationPreference.get_setting_for_user(user, multi_notification_id, self.portal)
+        setting = self.multi_preferences[user.pk].get(multi_notification_id, None)
+        if setting is None:
+            from cosinnus_notifications.notifications import MULTI_NOTIFICATION_IDS
+
+            setting = MULTI_NOTIFICATION_IDS[multi_notification_id]
+        return setting
+
+    def get_multi_preference_ids(self, user, setting):
+        """Returns the ids of all multi-preferences the user has explicitly set to the given setting"""
+        return [
+            multi_notification_id
+            for multi_notification_id, multi_setting in self.multi_preferences[user.pk].items()
+            if multi_setting == setting
+        ]
+
+    def get_preference(self, user, group_id, notification_id):
+        """Returns the user's `UserNotificationPreference` for the given group and notification id, or None"""
+        if not self.has_user(user):
+            return UserNotificationPreference.objects.filter(
+                user=user, group_id=group_id, notification_id=notification_id
+            ).first()
+        return self.group_preferences[user.pk].get((group_id, notification_id), None)
+
+    def get_preferences(self, user):
+        """Returns a list of all of the user's loaded `UserNotificationPreference`s"""
+        return list(self.group_preferences[user.pk].values())
+
+
+def iterate_users_with_preference_snapshots(users, portal=None, group_ids=None, chunk_size=None):
+    """Iterates over the given users, loading a `NotificationPreferenceSnapshot` for each chunk of users.
+    @param users: An ordered QS of users
+    @return: A generator yielding tuples of (user, snapshot)"""
+    chunk_size = chunk_size or PREFERENCE_SNAPSHOT_CHUNK_SIZE
+    chunk = []
+    for user in users.select_related('cosinnus_profile').iterator(chunk_size=chunk_size):
+        chunk.append(user)
+        if len(chunk) >= chunk_size:
+            snapshot = NotificationPreferenceSnapshot(chunk, portal=portal, group_ids=group_ids)
+            for chunk_user in chunk:
+                yield chunk_user, snapshot
+            chunk = []
+    if chunk:
+        snapshot = NotificationPreferenceSnapshot(chunk, portal=portal, group_ids=group_ids)
+        for chunk_user in chunk:
+            yield chunk_user, snapshot
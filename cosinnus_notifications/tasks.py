@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import logging
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.contenttypes.models import ContentType
+from django.http import HttpRequest
+from django.utils import translation
+
+from cosinnus.celery import app as celery_app
+from cosinnus.models.group import CosinnusPortal
+
+logger = logging.getLogger('cosinnus')
+
+
+class SerializedNotificationSender(object):
+    """Stand-in for the original signal sender of a notification processed in a celery task.
+    @param request: The sender's request, recreated by `deserialize_notification_request`, or None"""
+
+    def __init__(self, request=None):
+        self.request = request
+
+
+def deserialize_notification_request(data):
+    """Recreates the request of a notification's signal sender with the user, path and language of the original
+    request, which is all that the notification mail contexts use of it.
+    See `cosinnus_notifications.dispatch.serialize_notification_request`.
+    @return: A `HttpRequest`, or None if the sender had no request"""
+    if data is None:
+        return None
+    request = HttpRequest()
+    request.method = 'GET'
+    request.path = request.path_info = data['path']
+    request.LANGUAGE_CODE = data['language']
+    request.user = AnonymousUser()
+    if data['user_id'] is not None:
+        request.user = get_user_model().objects.filter(id=data['user_id']).first() or AnonymousUser()
+    if data['v3_api_content_active']:
+        request.v3_api_content_active = True
+    return request
+
+
+@celery_app.task
+def run_notification_session_task(frames, language=None, portal_id=None):
+    """Processes the serialized session frames of a `NotificationsThread`.
+    See `cosinnus_notifications.dispatch.serialize_notification_thread`.
+    @param language: The language that was active when the session was dispatched
+    @param portal_id: The id of the portal the session was dispatched in"""
+    from cosinnus_notifications.notifications import NotificationsThread, init_notifications, notifications
+
+    if portal_id is not None and portal_id != CosinnusPortal.get_current().id:
+        # all links and portal names in the notifications would point to the wrong portal
+        logger.error(
+            'A notification session was processed by a celery worker of another portal. Skipping it.',
+            extra={'portal_id': portal_id, 'worker_portal_id': CosinnusPortal.get_current().id},
+        )
+        return
+    if not notifications:
+        # the worker process may not have initialized the notification registry yet
+        init_notifications()
+    user_model = get_user_model()
+    notification_thread = None
+    for frame in frames:
+        content_type = ContentType.objects.get_for_id(frame['content_type_id'])
+        obj = content_type.get_object_for_this_type(pk=frame['object_id'])
+        user = user_model.objects.get(id=frame['user_id'])
+        audience = list(user_model.objects.filter(id__in=frame['audience_ids']))
+        notification_id = frame['notification_id']
+        sender = SerializedNotificationSender(request=deserialize_notification_request(frame.get('request')))
+        args = (sender, user, obj, audience, notification_id, notifications[notification_id])
+        if notification_thread is None:
+            notification_thread = NotificationsThread(*args)
+        else:
+            notification_thread.add_session_frame(*args)
+    if notification_thread is not None:
+        with translation.override(language):
+            notification_thread.run()
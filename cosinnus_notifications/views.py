@@ -32,6 +32,7 @@ from cosinnus.models.profile import GlobalUserNotificationSetting, UserBlock
 from cosinnus.utils.dates import datetime_from_timestamp, timestamp_from_datetime
 from cosinnus.utils.functions import is_number
 from cosinnus.utils.permissions import check_user_portal_admin, check_user_portal_moderator
+from cosinnus.utils.unread_counts import push_unread_count_deltas
 from cosinnus.utils.user import get_unread_message_count_for_user
 from cosinnus.views.user_dashboard import BasePagedOffsetWidgetView
 from cosinnus_notifications.alerts import ALERTS_USER_DATA_CACHE_KEY
@@ -473,7 +474,8 @@ def alerts_mark_seen(request, before_timestamp=None):
     unseen_alerts = NotificationAlert.objects.filter(
         portal=CosinnusPortal.get_current(), user=request.user, last_event_at__lte=before_dt, seen=False
     )
-    unseen_alerts.update(seen=True)
+    marked_seen = unseen_alerts.update(seen=True)
+    push_unread_count_deltas([request.user.id], alerts=-marked_seen)
 
     # delete user-entry cache to be fresh instantly alerts on refresh
     cache_key = ALERTS_USER_DATA_CACHE_KEY % {'user_id': request.user.id}
@@ -0,0 +1,15 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('cosinnus_poll', '0008_auto_20191017_2138'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='option',
+            name='image_thumbnails_source',
+            field=models.CharField(blank=True, default='', editable=False, max_length=250),
+        ),
+    ]
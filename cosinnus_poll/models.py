@@ -214,6 +214,8 @@ class Option(ThumbnailableImageMixin, models.Model):
 
     description = models.TextField(_('Description'), blank=False, null=False)
     image = models.ImageField(_('Image'), upload_to=get_poll_image_filename, blank=True, null=True)
+    # the image name for which all thumbnails have been generated, see `ThumbnailableImageMixin.generate_thumbnails`
+    image_thumbnails_source = models.CharField(max_length=250, blank=True, default='', editable=False)
 
     count = models.PositiveIntegerField(pgettext_lazy('the subject', 'Votes'), default=0, editable=False)
 
@@ -242,14 +242,17 @@ class MessageManager(models.Manager):
         }
         return self._folder(related, filters, user, **kwargs)
 
-    def inbox_unread_count(self, user):
+    def inbox_unread_count(self, user, filter=None):
         """
-        Return the number of unread messages for a user.
+        Return the number of unread messages for a user, optionally only of the messages matching a filter.
 
         Designed for context_processors.py and templatetags/postman_tags.py
 
         """
-        return self.inbox(user, related=False, option=OPTION_MESSAGES).filter(read_at__isnull=True).count()
+        qs = self.inbox(user, related=False, option=OPTION_MESSAGES).filter(read_at__isnull=True)
+        if filter is not None:
+            qs = qs.filter(filter)
+        return qs.count()
 
     def sent(self, user, **kwargs):
         """
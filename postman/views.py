@@ -23,6 +23,7 @@ from six.moves.urllib.parse import urlsplit, urlunsplit
 
 from cosinnus.conf import settings
 from cosinnus.utils.permissions import check_user_can_see_user, check_user_superuser
+from cosinnus.utils.unread_counts import push_unread_count_deltas
 from cosinnus.views.attached_object import AttachableViewMixin
 
 from . import OPTION_MESSAGES
@@ -407,7 +408,13 @@ class DisplayMixin(NamespaceMixin, RestrictRecipientMixin, object):
         self.msgs = Message.objects.thread(user, self.filter)
         if not self.msgs:
             raise Http404
+        push_counts = settings.COSINNUS_UNREAD_COUNTS_WEBSOCKET_ENABLED and not settings.COSINNUS_ROCKET_ENABLED
+        if push_counts:
+            # only count the messages shown in the unread badge, not archived or deleted ones
+            unread_count = Message.objects.inbox_unread_count(user, self.filter)
         Message.objects.set_read(user, self.filter)
+        if push_counts:
+            push_unread_count_deltas([user.id], messages=-unread_count)
         # Mark root message as LastVisited
         self.msgs[0].mark_visited(user)
         return super(DisplayMixin, self).get(request, *args, **kwargs)